@@ -0,0 +1,276 @@
+# admin_digest.py
+"""
+Сводка закрытых смен для чата администраторов.
+
+Отчёты закрытых смен копятся ADMIN_DIGEST_WINDOW_SECONDS и уходят одним
+сообщением: компактная таблица по всем заведениям, подробный отчёт каждого —
+по кнопке. Длинная сводка делится на страницы под лимит Telegram.
+
+Сводка собирается из уже готовых текстов и цифр shift_close, ничего не
+пересчитывает. Ожидающие записи и отправленные сводки лежат на диске, поэтому
+ни одна запись не теряется при перезапуске, а кнопки работают и после него.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from typing import Optional
+
+from telebot import types
+
+import clock
+from callback_router import pack_callback
+from config import VOLUME_PATH, ADMIN_REPORT_CHAT_ID, ADMIN_DIGEST_WINDOW_SECONDS, ADMIN_DIGEST_PAGE_SIZE, ADMIN_DIGEST_HISTORY
+
+DIGEST_DIR = os.path.join(VOLUME_PATH, 'admin_digests')
+PENDING_FILE = 'pending.json'
+# Лимит Telegram 4096 символов, с запасом на разметку
+MESSAGE_LIMIT = 4000
+TITLE_WIDTH = 16
+
+
+def _write_json(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def _read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        logging.error(f"Ошибка чтения {path}: {e}")
+        return default
+
+
+def _cell(text: str, width: int) -> str:
+    # Обратные кавычки закрыли бы блок кода
+    text = str(text).replace('`', "'")
+    return text[:width - 1] + '…' if len(text) > width else text.ljust(width)
+
+
+def _escape(text: str) -> str:
+    """Экранирует спецсимволы Markdown (legacy) вне сущностей."""
+    return str(text).replace('_', r'\_').replace('*', r'\*').replace('[', r'\[').replace('`', r'\`')
+
+
+def _truncate_lines(text: str, limit: int = MESSAGE_LIMIT) -> str:
+    """Обрезает текст по границе строки, чтобы не разорвать разметку посреди сущности."""
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit - 1)
+    return text[:cut if cut > 0 else limit - 2] + "\n…"
+
+
+def _table_row(number: int, entry: dict) -> str:
+    return (f"{number:>2} {_cell(entry['title'], TITLE_WIDTH)} {entry['count']:>3}/{entry['goal']:<3}"
+            f"{entry['percent']:>4}% {entry['lates']:>2} {entry['verdict']}")
+
+
+def paginate(entries: list, page_size: int = ADMIN_DIGEST_PAGE_SIZE, limit: int = MESSAGE_LIMIT) -> list:
+    """Делит записи на страницы: не больше page_size строк и не длиннее limit символов."""
+    pages, current, length = [], [], 0
+    # Запас на заголовок, итоги и обрамление таблицы
+    budget = limit - 400
+    for index, entry in enumerate(entries):
+        row_length = len(_table_row(index + 1, entry)) + 1
+        if current and (len(current) >= page_size or length + row_length > budget):
+            pages.append(current)
+            current, length = [], 0
+        current.append(index)
+        length += row_length
+    if current:
+        pages.append(current)
+    return pages or [[]]
+
+
+class AdminDigest:
+    """Собирает отчёты закрытых смен в окне и отправляет их одной сводкой."""
+
+    def __init__(self, path: str = DIGEST_DIR, window: float = ADMIN_DIGEST_WINDOW_SECONDS,
+                 page_size: int = ADMIN_DIGEST_PAGE_SIZE, history: int = ADMIN_DIGEST_HISTORY):
+        self.path = path
+        self.window = window
+        self.page_size = page_size
+        self.history = history
+        self._lock = threading.RLock()
+        self._pending = None
+        self._timer: Optional[threading.Timer] = None
+        # Сводки, которые сейчас отправляются: flush() шлёт без блокировки, и send_unsent их не трогает
+        self._sending = set()
+
+    @property
+    def pending(self) -> list:
+        with self._lock:
+            if self._pending is None:
+                self._pending = _read_json(os.path.join(self.path, PENDING_FILE), [])
+            return self._pending
+
+    def _digest_file(self, digest_id: str) -> str:
+        return os.path.join(self.path, re.sub(r'[^0-9A-Za-z_-]', '_', digest_id) + '.json')
+
+    def add(self, bot, entry: dict):
+        """Добавляет отчёт смены; сводка уйдёт по окончании окна.
+
+        entry: job_id, chat_id, title, host, count, goal, percent, lates, verdict, report.
+        Повторное добавление той же смены игнорируется.
+        """
+        with self._lock:
+            if any(item['job_id'] == entry['job_id'] for item in self.pending):
+                return
+            self.pending.append(entry)
+            _write_json(os.path.join(self.path, PENDING_FILE), self.pending)
+            self._arm(bot)
+
+    def _arm(self, bot):
+        if self._timer is None and self.pending:
+            self._timer = threading.Timer(self.window, self.flush, args=(bot,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self, bot) -> Optional[dict]:
+        """Отправляет накопленное одной сводкой, не дожидаясь конца окна."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            entries = list(self.pending)
+            if not entries:
+                return None
+            now = clock.moscow_now()
+            digest = {
+                'id': f"{now:%y%m%d%H%M}{uuid.uuid4().hex[:4]}",
+                'created_at': now.isoformat(),
+                'entries': entries,
+                'message_id': None,
+            }
+            # Сначала сводка на диск, потом очистка очереди: запись не теряется ни на каком шаге
+            _write_json(self._digest_file(digest['id']), digest)
+            self._pending = []
+            _write_json(os.path.join(self.path, PENDING_FILE), [])
+            self._sending.add(digest['id'])
+        self._send(bot, digest)
+        self._prune()
+        return digest
+
+    def _claim(self, digest_id: str) -> Optional[dict]:
+        """Помечает сводку отправляемой; None — она уже отправлена или её отправляет другой поток."""
+        with self._lock:
+            if digest_id in self._sending:
+                return None
+            # Читаем заново: message_id мог появиться, пока файл читался без блокировки
+            digest = self.load(digest_id)
+            if not digest or digest.get('message_id'):
+                return None
+            self._sending.add(digest_id)
+            return digest
+
+    def _send(self, bot, digest: dict) -> bool:
+        """Отправляет сводку, помеченную в _sending, и снимает пометку."""
+        try:
+            text, markup = self.render_page(digest, 0)
+            try:
+                sent = bot.send_message(ADMIN_REPORT_CHAT_ID, text, parse_mode="Markdown", reply_markup=markup)
+            except Exception as e:
+                logging.error(f"Не удалось отправить сводку закрытых смен {digest['id']}: {e}")
+                return False
+            digest['message_id'] = getattr(sent, 'message_id', True)
+            _write_json(self._digest_file(digest['id']), digest)
+            logging.info(f"Сводка закрытых смен ({len(digest['entries'])}) отправлена администратору")
+            return True
+        finally:
+            with self._lock:
+                self._sending.discard(digest['id'])
+
+    def send_unsent(self, bot) -> int:
+        """Досылает сводки, отправка которых не удалась. Возвращает число оставшихся неотправленными."""
+        failed = 0
+        if os.path.isdir(self.path):
+            for filename in sorted(os.listdir(self.path)):
+                if filename.endswith('.json') and filename != PENDING_FILE:
+                    digest = _read_json(os.path.join(self.path, filename), None)
+                    if not digest or digest.get('message_id'):
+                        continue
+                    digest = self._claim(digest['id'])
+                    if digest and not self._send(bot, digest):
+                        failed += 1
+        return failed
+
+    def resume(self, bot):
+        """После перезапуска: досылает неотправленные сводки и заново взводит окно."""
+        self.send_unsent(bot)
+        with self._lock:
+            self._arm(bot)
+
+    def _prune(self):
+        """Удаляет старые отправленные сводки сверх ADMIN_DIGEST_HISTORY; неотправленные ждут send_unsent."""
+        files = []
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith('.json') and name != PENDING_FILE:
+                digest = _read_json(os.path.join(self.path, name), None)
+                if digest is None or digest.get('message_id'):
+                    files.append(name)
+        for name in files[:max(0, len(files) - self.history)]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+    def load(self, digest_id: str) -> Optional[dict]:
+        return _read_json(self._digest_file(digest_id), None)
+
+    # --- Отображение ---
+
+    def render_page(self, digest: dict, page: int) -> tuple:
+        """Текст страницы сводки и клавиатура: кнопки заведений и листание."""
+        entries = digest['entries']
+        pages = paginate(entries, self.page_size)
+        page = max(0, min(page, len(pages) - 1))
+        done = sum(1 for entry in entries if entry['count'] >= entry['goal'])
+        lates = sum(entry['lates'] for entry in entries)
+        created = digest['created_at'][:16].replace('T', ' ')
+
+        lines = [f"🏁 *Закрытые смены: {len(entries)}* · {created}",
+                 f"План выполнен: {done} из {len(entries)}, опозданий: {lates}"]
+        if len(pages) > 1:
+            lines.append(f"Страница {page + 1}/{len(pages)}")
+        lines.append("```")
+        lines.append(f" # {_cell('Заведение', TITLE_WIDTH)}  ГС/план    % Оп")
+        lines.extend(_table_row(index + 1, entries[index]) for index in pages[page])
+        lines.append("```")
+        lines.append("Подробный отчёт — по кнопке.")
+
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(*[types.InlineKeyboardButton(f"{index + 1}. {entries[index]['title'][:24]}",
+                                                callback_data=pack_callback("digest_venue", digest['id'], index))
+                     for index in pages[page]])
+        if len(pages) > 1:
+            nav = []
+            if page > 0:
+                nav.append(types.InlineKeyboardButton("◀️", callback_data=pack_callback("digest_page", digest['id'], page - 1)))
+            if page < len(pages) - 1:
+                nav.append(types.InlineKeyboardButton("▶️", callback_data=pack_callback("digest_page", digest['id'], page + 1)))
+            markup.row(*nav)
+        return "\n".join(lines), markup
+
+    def render_detail(self, digest: dict, index: int) -> tuple:
+        """Полный отчёт заведения и кнопка назад к его странице сводки."""
+        entry = digest['entries'][index]
+        # Название чата вне жирного: внутри сущности legacy Markdown экранирование не работает
+        text = _truncate_lines(f"📍 *Отчет из чата:* {_escape(entry['title'])}\n" + entry['report'])
+        page = next((number for number, indexes in enumerate(paginate(digest['entries'], self.page_size))
+                     if index in indexes), 0)
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("« К сводке", callback_data=pack_callback("digest_page", digest['id'], page)))
+        return text, markup
+
+
+# Общая сводка для shift_close и обработчиков кнопок
+admin_digest = AdminDigest()
@@ -10,6 +10,10 @@ from typing import Optional
 from utils import is_admin, get_username, safe_reply
 from config import BOSS_ID
 from database_manager import db  # Единый database manager
+from callback_router import router, pack_callback
+from live_status import live_status
+from snapshots import shift_snapshot
+from history_export import export_shift_log, send_export
 from roles import (
     get_current_day_type, get_roles_for_day_type, get_goals_for_day_type,
     DayType, UserRole, ROLE_EMOJIS, ROLE_DESCRIPTIONS, DAY_TYPE_MAPPING
@@ -146,7 +150,7 @@ class AdminPanel:
             markup.add(
                 types.InlineKeyboardButton(
                     f"{status} {emoji} {ROLE_DESCRIPTIONS[role]}", 
-                    callback_data=f"admin_toggle_role_{day_type.value}_{role}"
+                    callback_data=pack_callback("admin_toggle_role", day_type.value, role)
                 )
             )
         
@@ -216,8 +220,9 @@ def register_admin_panel_handlers(bot):
             parse_mode="Markdown"
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('admin_'))
-    def handle_admin_callbacks(call: types.CallbackQuery):
+    @router.route("admin_toggle_role")
+    @router.route('admin_', 'separator', prefix=True)
+    def handle_admin_callbacks(call: types.CallbackQuery, *_):
         """Обработчик колбэков админ-панели"""
         user_id = call.from_user.id
         chat_id = call.message.chat.id
@@ -287,8 +292,10 @@ def register_admin_panel_handlers(bot):
                 if not shift or not shift.main_id:
                     bot.answer_callback_query(call.id, "Смена не активна")
                     bot.send_message(chat_id, "⚪ Смена в этом чате еще не началась.")
+                elif live_status.show(bot, chat_id, point=False):
+                    bot.answer_callback_query(call.id, "📌 Статус обновлён в закреплённом сообщении")
                 else:
-                    report_lines = generate_detailed_report(chat_id, shift)
+                    report_lines = generate_detailed_report(chat_id, shift_snapshot(chat_id) or shift)
                     report_text = "\n".join(report_lines)
                     bot.send_message(chat_id, report_text, parse_mode="Markdown")
                     bot.answer_callback_query(call.id, "📊 Статус смены")
@@ -313,8 +320,7 @@ def register_admin_panel_handlers(bot):
                 try:
                     import pandas as pd
                     from g_sheets import get_sheet
-                    from config import VOICE_TIMEOUT_MINUTES
-                    from state import chat_configs
+                    from chat_config import chat_settings
                     worksheet = get_sheet()
                     if not worksheet:
                         bot.send_message(chat_id, "Не удалось подключиться к Google Таблице.")
@@ -323,7 +329,7 @@ def register_admin_panel_handlers(bot):
                         if df.empty:
                             bot.send_message(chat_id, "В таблице нет данных.")
                         else:
-                            chat_timeout = chat_configs.get(str(chat_id), {}).get('voice_timeout', VOICE_TIMEOUT_MINUTES)
+                            chat_timeout = chat_settings.get(chat_id).voice_timeout
                             numeric_cols = ['Выполнение (%)', 'Опозданий (шт)', 'Макс. пауза (мин)']
                             for col in numeric_cols:
                                 df[col] = df[col].astype(str).str.replace('%', '', regex=False)
@@ -377,28 +383,13 @@ def register_admin_panel_handlers(bot):
             
             elif call.data == "admin_log":
                 bot.answer_callback_query(call.id, "📜 Формирую лог...")
-                import datetime as dt
                 from state import user_history
                 history = user_history.get(chat_id)
                 if not history:
                     bot.send_message(chat_id, "История событий пуста.")
                 else:
                     try:
-                        filename = f"history_{chat_id}_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                        import os
-                        with open(filename, 'w', encoding='utf-8') as f:
-                            f.write(f"История событий для чата\n" + "="*40 + "\n")
-                            for event in history:
-                                if isinstance(event, dict):
-                                    ts = event.get('timestamp', '')
-                                    user = event.get('username', '')
-                                    desc = event.get('event', '')
-                                    f.write(f"[{ts}] {user}: {desc}\n")
-                                else:
-                                    f.write(f"{event}\n")
-                        with open(filename, 'rb') as f_rb:
-                            bot.send_document(chat_id, f_rb, caption="📜 Лог событий текущей смены.")
-                        os.remove(filename)
+                        send_export(bot, chat_id, export_shift_log(chat_id), "📜 Лог событий текущей смены.")
                     except Exception as e:
                         bot.send_message(chat_id, f"❌ Ошибка: {e}")
             
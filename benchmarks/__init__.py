@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+"""Скрипты нагрузочных замеров и сверки поведения бэкендов (запускаются вручную: python -m benchmarks.<имя>)."""
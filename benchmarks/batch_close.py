@@ -0,0 +1,230 @@
+# benchmarks/batch_close.py
+"""
+Закрытие смен во многих заведениях в одну минуту (07:00).
+
+Сравнивает два режима на одинаковых данных:
+  по одной  — каждая смена закрывается отдельным заданием, по очереди
+              (как раньше делал check_for_shift_end);
+  пакет     — check_for_shift_end закрывает все смены одним пакетом:
+              чаты параллельно, одна запись в таблицу, одна сводка админу.
+
+Bot API и Google-таблица имитируются с задержкой ответа, без сети. Главная
+цифра — через сколько секунд после дедлайна отчёт получил последний чат.
+
+Запуск:
+    python -m benchmarks.batch_close [--venues 40] [--api-latency-ms 150]
+                                     [--sheets-latency-ms 500] [--target-seconds 5]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_CHAT_ID = -1009999999999
+FIRST_CHAT_ID = -1001000000001
+
+
+class _Response:
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, payload: dict):
+        self.text = json.dumps(payload, ensure_ascii=False)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class SlowAPI:
+    """Bot API с задержкой ответа; запоминает время отправки отчётов."""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        self.started = time.perf_counter()
+        self.calls = Counter()
+        self.report_times = {}
+        self.admin_messages = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, params=None, **kwargs):
+        time.sleep(self.latency)
+        name = url.rsplit("/", 1)[-1]
+        params = params or {}
+        chat_id = int(params.get("chat_id", 0) or 0)
+        text = params.get("text", "")
+        with self._lock:
+            self.calls[name] += 1
+            if name == "sendMessage" and chat_id == ADMIN_CHAT_ID:
+                self.admin_messages += 1
+            elif name == "sendMessage" and text.startswith("🏁 Смена завершена"):
+                self.report_times[chat_id] = time.perf_counter() - self.started
+        chat = {"id": chat_id, "type": "supergroup", "title": f"Venue {chat_id}"}
+        result = chat if name == "getChat" else {"message_id": 1, "date": int(time.time()), "chat": chat, "text": text}
+        return _Response({"ok": True, "result": result})
+
+
+class SlowWorksheet:
+    """Лист Google-таблицы: каждая запись — один медленный запрос."""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        self.requests = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def _request(self, rows: int = 0):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            self.rows += rows
+
+    def acell(self, label):
+        self._request()
+        return type("Cell", (), {"value": "Дата"})()
+
+    def append_row(self, row, **kwargs):
+        self._request(1)
+
+    def append_rows(self, rows, **kwargs):
+        self._request(len(rows))
+
+
+def _install_shifts(venues: int, start: datetime.datetime):
+    from state import chat_data
+    from chat_config import chat_settings
+    from utils import init_shift_data, init_user_data
+    import clock
+    chat_data.clear()
+    chat_settings.load({FIRST_CHAT_ID - index: {"end_time": "07:00", "timezone": "Europe/Moscow",
+                                                "brand": "evgenich", "city": "spb"}
+                        for index in range(venues)})
+    with clock.use_clock(clock.SimulatedClock(start - datetime.timedelta(hours=12))):
+        for index in range(venues):
+            chat_id = FIRST_CHAT_ID - index
+            init_shift_data(chat_id)
+            shift = chat_data[chat_id]
+            host = init_user_data(10_000 + index, f"@host{index}")
+            host.count = 10 + index % 8
+            host.voice_deltas = [float(20 + (index + n) % 30) for n in range(host.count)]
+            host.voice_durations = [25] * host.count
+            shift.main_id, shift.main_username = host.user_id, host.username
+            shift.users[host.user_id] = host
+
+
+def _run(mode: str, args, start: datetime.datetime) -> dict:
+    import clock
+    import g_sheets
+    import scheduler
+    from telebot import apihelper
+    import telebot
+    from shift_close import ShiftCloseEngine, JobStore
+
+    _install_shifts(args.venues, start)
+    api = SlowAPI(args.api_latency_ms)
+    sheet = SlowWorksheet(args.sheets_latency_ms)
+    apihelper.CUSTOM_REQUEST_SENDER = api
+    g_sheets.open_sheet = lambda: sheet
+    bot = telebot.TeleBot("123456:BATCH", threaded=False)
+
+    store = JobStore(tempfile.mkdtemp(prefix=f"close-{mode}-"))
+    workers = 1 if mode == "sequential" else args.workers
+    engine = ShiftCloseEngine(store=store, workers=workers, retry_seconds=0.1)
+    scheduler.shift_closer = engine
+
+    with clock.use_clock(clock.SimulatedClock(start)):
+        api.started = time.perf_counter()
+        if mode == "sequential":
+            for chat_id in sorted(_active_chats(), reverse=True):
+                engine.enqueue(bot, chat_id)
+        else:
+            scheduler.check_for_shift_end(bot)
+        engine.wait_idle(600)
+        total = time.perf_counter() - api.started
+
+    delays = sorted(api.report_times.values())
+    return {
+        "mode": mode,
+        "venues": args.venues,
+        "reports": len(delays),
+        "first_s": delays[0] if delays else None,
+        "p50_s": delays[len(delays) // 2] if delays else None,
+        "last_s": delays[-1] if delays else None,
+        "total_s": total,
+        "admin_messages": api.admin_messages,
+        "api_calls": sum(api.calls.values()),
+        "sheets_requests": sheet.requests,
+        "sheets_rows": sheet.rows,
+        "jobs_failed": sum(1 for job in store.jobs.values() if job["status"] != "done"),
+    }
+
+
+def _active_chats():
+    from state import chat_data
+    return [chat_id for chat_id, shift in chat_data.items() if shift.main_id]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетное закрытие смен в 07:00")
+    parser.add_argument("--venues", type=int, default=40)
+    parser.add_argument("--api-latency-ms", type=float, default=150)
+    parser.add_argument("--sheets-latency-ms", type=float, default=500)
+    parser.add_argument("--workers", type=int, default=None, help="параллельность пакета (по умолчанию SHIFT_CLOSE_WORKERS)")
+    parser.add_argument("--target-seconds", type=float, default=5.0,
+                        help="цель: последний отчёт пакета не позже стольких секунд после дедлайна")
+    parser.add_argument("--skip-sequential", action="store_true", help="только пакетный режим")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="evgenich-batch-")
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = workdir
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["TRACING_ENABLED"] = "false"
+    os.environ["ADMIN_REPORT_CHAT_ID"] = str(ADMIN_CHAT_ID)
+    os.environ["GOOGLE_SHEET_KEY"] = ""
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.ERROR)
+
+    import clock
+    from config import SHIFT_CLOSE_WORKERS
+    args.workers = args.workers or SHIFT_CLOSE_WORKERS
+    start = clock.MOSCOW_TZ.localize(datetime.datetime(2026, 10, 17, 7, 0, 30))
+
+    modes = ["batch"] if args.skip_sequential else ["sequential", "batch"]
+    results = [_run(mode, args, start) for mode in modes]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        titles = {"sequential": "по одной", "batch": f"пакет ×{args.workers}"}
+        print(f"Заведений: {args.venues}, задержка Bot API {args.api_latency_ms:.0f} мс, "
+              f"таблицы {args.sheets_latency_ms:.0f} мс")
+        print(f"{'режим':<12} {'отчётов':>8} {'первый':>8} {'p50':>8} {'последний':>10} {'всё':>8} "
+              f"{'сводок':>7} {'API':>6} {'таблица':>8}")
+        for r in results:
+            print(f"{titles[r['mode']]:<12} {r['reports']:>8} {r['first_s'] or 0:>7.2f}с {r['p50_s'] or 0:>7.2f}с "
+                  f"{r['last_s'] or 0:>9.2f}с {r['total_s']:>7.2f}с {r['admin_messages']:>7} {r['api_calls']:>6} "
+                  f"{r['sheets_requests']:>8}")
+
+    batch = results[-1]
+    ok = (batch["reports"] == args.venues and batch["jobs_failed"] == 0 and batch["sheets_rows"] == args.venues
+          and (batch["last_s"] or 0) <= args.target_seconds)
+    if not ok:
+        print(f"❌ Цель не достигнута: отчётов {batch['reports']}/{args.venues}, "
+              f"строк в таблице {batch['sheets_rows']}/{args.venues}, "
+              f"последний через {batch['last_s'] or 0:.2f} с (цель {args.target_seconds:.1f} с)")
+        sys.exit(1)
+    print(f"✅ Все отчёты пакета отправлены за {batch['last_s']:.2f} с (цель {args.target_seconds:.1f} с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/bulk_ingest.py
+"""
+Скорость пакетной записи voice_stats при размере пакета 1, 100 и 10 000 строк
+и для сравнения — построчный save_voice_stat.
+
+Запуск:
+    python -m benchmarks.bulk_ingest
+    BENCH_POSTGRES_URL=postgresql://localhost/bench python -m benchmarks.bulk_ingest
+"""
+
+import datetime
+import os
+import tempfile
+import time
+import uuid
+
+BATCH_SIZES = (1, 100, 10_000)
+TOTAL_ROWS = 20_000
+# Построчные пути медленные: на них берём меньше строк
+ROW_AT_A_TIME_ROWS = 1_000
+
+
+def _rows(count: int):
+    now = datetime.datetime.utcnow()
+    return [
+        {"chat_id": -1001, "user_id": i % 7, "username": f"@u{i % 7}", "duration": 12.0,
+         "recognized_ad": "", "created_at": now, "idempotency_key": uuid.uuid4().hex}
+        for i in range(count)
+    ]
+
+
+def bench_backend(name: str, database):
+    started = time.perf_counter()
+    for _ in range(ROW_AT_A_TIME_ROWS):
+        database.save_voice_stat(-1001, 1, "@u1", 12.0, "")
+    elapsed = time.perf_counter() - started
+    print(f"{name:10} save_voice_stat  {'—':>6}  {ROW_AT_A_TIME_ROWS / elapsed:>10.0f} строк/с")
+
+    for batch_size in BATCH_SIZES:
+        total = ROW_AT_A_TIME_ROWS if batch_size == 1 else TOTAL_ROWS
+        rows = _rows(total)
+        started = time.perf_counter()
+        for i in range(0, total, batch_size):
+            database.bulk_insert_voice_stats(rows[i:i + batch_size])
+        elapsed = time.perf_counter() - started
+        print(f"{name:10} bulk_insert      {batch_size:>6}  {total / elapsed:>10.0f} строк/с")
+
+    # Повтор того же пакета (ретрай) не должен добавлять строк
+    rows = _rows(100)
+    database.bulk_insert_voice_stats(rows)
+    print(f"{name:10} повтор пакета: вставлено {database.bulk_insert_voice_stats(rows)} из {len(rows)}")
+
+
+def main():
+    from database import BotDatabase
+    tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    tmp.close()
+    print(f"{'бэкенд':10} {'метод':16} {'пакет':>6}  {'скорость':>16}")
+    bench_backend("sqlite", BotDatabase(tmp.name))
+
+    pg_url = os.getenv("BENCH_POSTGRES_URL")
+    if pg_url:
+        from database_manager import PostgreSQLDatabase
+        bench_backend("postgresql", PostgreSQLDatabase(pg_url))
+    else:
+        print("postgresql: пропущен (BENCH_POSTGRES_URL не задан)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# benchmarks/db_backends.py
+"""
+Сверка контракта BotDatabase (SQLite) и PostgreSQLDatabase и замер пропускной способности.
+
+Запуск:
+    python -m benchmarks.db_backends                       # только SQLite (временная база)
+    BENCH_POSTGRES_URL=postgresql://localhost/bench python -m benchmarks.db_backends
+
+Контракт проверяется одинаковым сценарием для каждого бэкенда; любое
+расхождение печатается и завершает скрипт с кодом 1.
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import ShiftData, UserData
+
+
+def _make_shift(main_id: int, users: dict) -> ShiftData:
+    shift = ShiftData(main_id=main_id, main_username=f"@u{main_id}", shift_goal=15)
+    for user_id, (count, role) in users.items():
+        shift.users[user_id] = UserData(
+            user_id=user_id, username=f"@u{user_id}", role=role, count=count,
+            breaks_count=1, late_returns=count % 2, recognized_ads=["ad1"], voice_deltas=[3.0, 5.0],
+        )
+    return shift
+
+
+def check_contract(database) -> list:
+    """Прогоняет общий сценарий по публичному API бэкенда. Возвращает список расхождений."""
+    failures = []
+
+    def expect(name, actual, expected):
+        if actual != expected:
+            failures.append(f"{name}: ожидалось {expected!r}, получено {actual!r}")
+
+    # ID как у супергрупп Telegram (-100XXXXXXXXXX): не помещаются в int4
+    chat_id = -random.randint(10**12, 2 * 10**12)
+    u1, u2 = random.randint(5 * 10**9, 9 * 10**9), random.randint(5 * 10**9, 9 * 10**9)
+
+    expect("is_bot_enabled(неизвестный чат)", database.is_bot_enabled(chat_id), True)
+    database.set_bot_enabled(chat_id, False, u1)
+    expect("is_bot_enabled после выключения", database.is_bot_enabled(chat_id), False)
+    database.set_bot_enabled(chat_id, True, u1)
+    expect("is_bot_enabled после включения", database.is_bot_enabled(chat_id), True)
+
+    expect("load_shift_data(неизвестный чат)", database.load_shift_data(chat_id), None)
+    database.save_shift_data(chat_id, _make_shift(u1, {u1: (7, "караоке_ведущий"), u2: (4, "МС")}))
+    loaded = database.load_shift_data(chat_id)
+    if loaded is None:
+        failures.append("load_shift_data вернул None после save_shift_data")
+    else:
+        expect("main_id", loaded.main_id, u1)
+        expect("users", sorted(loaded.users), sorted([u1, u2]))
+        expect("count", loaded.users[u1].count, 7)
+        expect("role", loaded.users[u2].role, "МС")
+        expect("recognized_ads", loaded.users[u1].recognized_ads, ["ad1"])
+
+    database.save_shift_data(chat_id, _make_shift(u1, {u1: (9, "караоке_ведущий")}))
+    loaded = database.load_shift_data(chat_id)
+    expect("users после пересохранения", sorted(loaded.users) if loaded else None, [u1])
+
+    # Пакетное восстановление при запуске: те же смены, что и по одной, и только сохранённые позже метки
+    active = database.load_active_shifts() or {}
+    expect("load_active_shifts: смена чата", chat_id in active, True)
+    if chat_id in active:
+        expect("load_active_shifts = load_shift_data", active[chat_id], database.load_shift_data(chat_id))
+        expect("load_active_shifts: voice_deltas", active[chat_id].users[u1].voice_deltas, [3.0, 5.0])
+    expect("load_active_shifts(позже сохранения)", chat_id in (database.load_active_shifts(time.time() + 1) or {}), False)
+    expect("load_active_shifts(раньше сохранения)", chat_id in (database.load_active_shifts(time.time() - 60) or {}), True)
+
+    expect("get_user_stats_from_db", database.get_user_stats_from_db(u1),
+           {'shifts_count': 1, 'total_voices': 9, 'total_breaks': 1, 'total_lates': 1})
+    expect("get_stats_by_role", database.get_stats_by_role(u1, "караоке_ведущий"),
+           {'role': "караоке_ведущий", 'shifts_count': 1, 'total_voices': 9, 'total_breaks': 1, 'total_lates': 1})
+
+    rating = database.get_user_rating(limit=50)
+    expect("get_user_rating отсортирован", [r[1] for r in rating], sorted((r[1] for r in rating), reverse=True))
+
+    expect("get_role_schedule(по умолчанию)", database.get_role_schedule(chat_id, 4),
+           (["караоке_ведущий"], {"караоке_ведущий": 15}))
+    database.set_role_schedule(chat_id, 4, ["караоке_ведущий"], {"караоке_ведущий": 10})
+    database.set_role_schedule(chat_id, 4, ["караоке_ведущий", "МС"], {"караоке_ведущий": 12, "МС": 8})
+    expect("get_role_schedule", database.get_role_schedule(chat_id, 4),
+           (["караоке_ведущий", "МС"], {"караоке_ведущий": 12, "МС": 8}))
+
+    shift = _make_shift(u1, {u1: (9, "караоке_ведущий")})
+    expect("record_shift_kpis", database.record_shift_kpis(chat_id, shift), True)
+    expect("record_shift_kpis (повтор)", database.record_shift_kpis(chat_id, shift), False)
+    expect("load_active_shifts после закрытия", chat_id in (database.load_active_shifts() or {}), False)
+    # Сброс смены (параллельный выгрузке) переписывает строку shifts — повтор выгрузки всё равно не удваивает KPI
+    database.save_shift_data(chat_id, ShiftData())
+    expect("record_shift_kpis (повтор после сброса)", database.record_shift_kpis(chat_id, shift), False)
+    analytics = database.get_marketing_analytics(chat_id, days=7)
+    expect("total_shifts", analytics.get('total_shifts'), 1)
+    expect("avg_rhythm", analytics.get('avg_rhythm'), 4.0)
+    expect("top_ads", analytics.get('top_ads'), [("ad1", 1)])
+
+    database.save_event(chat_id, u1, "@u1", "shift_event", "контракт")
+    database.save_voice_stat(chat_id, u1, "@u1", 12.5, "")
+
+    key = f"contract:{chat_id}"
+    now = datetime.datetime.utcnow()
+    voice_row = {"chat_id": chat_id, "user_id": u1, "username": "@u1", "duration": 9.0,
+                 "recognized_ad": "", "created_at": now, "idempotency_key": key}
+    event_row = {"chat_id": chat_id, "user_id": u1, "username": "@u1", "event_type": "shift_event",
+                 "event_data": "контракт", "created_at": now, "idempotency_key": key}
+    expect("bulk_insert_voice_stats", database.bulk_insert_voice_stats([voice_row]), 1)
+    expect("bulk_insert_voice_stats (повтор ключа)", database.bulk_insert_voice_stats([voice_row]), 0)
+    expect("bulk_insert_events", database.bulk_insert_events([event_row]), 1)
+    expect("bulk_insert_events (повтор ключа)", database.bulk_insert_events([event_row]), 0)
+
+    # Кэш чтений (db_cache): закрытие смены сбрасывает статистику её ведущих
+    database.get_user_stats_from_db(u1)
+    closed = _make_shift(u1, {u1: (11, "караоке_ведущий")})
+    database.save_shift_data(chat_id, closed)
+    database.record_shift_kpis(chat_id, closed)
+    expect("get_user_stats_from_db после закрытия смены", database.get_user_stats_from_db(u1)['total_voices'], 11)
+    database.save_shift_data(chat_id, ShiftData())
+    expect("load_active_shifts после сброса смены", chat_id in (database.load_active_shifts() or {}), False)
+
+    # Хранилище настроек (config_store): upsert строки, сквозная версия, удаление — value NULL
+    namespace = f"contract:{chat_id}"
+    expect("put_config_entry", database.put_config_entry(namespace, "a", '{"x": 1}'), True)
+    database.put_config_entry(namespace, "b", '{"x": 2}')
+    database.put_config_entry(namespace, "a", '{"x": 3}')
+    database.put_config_entry(namespace, "b", None)
+    rows = {key: (value, version) for key, value, version in database.load_config_entries(namespace)}
+    expect("load_config_entries (значения)", {key: value for key, (value, _) in rows.items()},
+           {"a": '{"x": 3}', "b": None})
+    expect("load_config_entries (версии растут)", rows["b"][1] > rows["a"][1], True)
+    return failures
+
+
+def measure_throughput(database, threads: int = 8, ops_per_thread: int = 200) -> dict:
+    """Смешанная нагрузка из нескольких потоков: запись событий, чтение флага, сохранение смены."""
+    chat_ids = [-random.randint(10**12, 2 * 10**12) for _ in range(threads)]
+
+    def worker(chat_id):
+        shift = _make_shift(1, {1: (3, "караоке_ведущий"), 2: (5, "МС")})
+        for i in range(ops_per_thread):
+            op = i % 4
+            if op == 0:
+                database.save_event(chat_id, 1, "@u1", "shift_event", "bench")
+            elif op == 1:
+                database.is_bot_enabled(chat_id)
+            elif op == 2:
+                database.save_voice_stat(chat_id, 1, "@u1", 10.0, "")
+            else:
+                database.save_shift_data(chat_id, shift)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, chat_ids))
+    elapsed = time.perf_counter() - started
+    total = threads * ops_per_thread
+    return {"ops": total, "seconds": round(elapsed, 3), "ops_per_sec": round(total / elapsed, 1)}
+
+
+def _backends():
+    from database import BotDatabase
+    tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    tmp.close()
+    yield "sqlite", BotDatabase(tmp.name)
+
+    pg_url = os.getenv("BENCH_POSTGRES_URL")
+    if pg_url:
+        from database_manager import PostgreSQLDatabase
+        yield "postgresql", PostgreSQLDatabase(pg_url)
+    else:
+        print("postgresql: пропущен (BENCH_POSTGRES_URL не задан)")
+
+
+def main():
+    ok = True
+    for name, database in _backends():
+        failures = check_contract(database)
+        if failures:
+            ok = False
+            print(f"{name}: контракт НАРУШЕН")
+            for failure in failures:
+                print(f"  - {failure}")
+        else:
+            print(f"{name}: контракт соблюдён")
+        print(f"{name}: {measure_throughput(database)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
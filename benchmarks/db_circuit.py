@@ -0,0 +1,96 @@
+# benchmarks/db_circuit.py
+"""
+Предохранитель _LazyDB при недоступной базе.
+
+Подключение подменяется функцией, которая «висит» --connect-ms и падает, пока
+база «лежит». Раньше эту цену платил каждый вызов db.*; теперь только первый,
+а остальные сразу уходят в заглушку или в очередь отложенных записей. После
+«подъёма» базы (SQLite во временном каталоге) проверяется, что отложенные
+записи воспроизведены по порядку, save_shift_data схлопнут до последнего, а
+/health показывает состояние цепи.
+
+Запуск:
+    python -m benchmarks.db_circuit [--calls 2000] [--connect-ms 500]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_ID = -1001000000001
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Вызовы db.* при недоступной базе")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--connect-ms", type=float, default=500)
+    args = parser.parse_args()
+
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = tempfile.mkdtemp(prefix="evgenich-circuit-")
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["TRACING_ENABLED"] = "false"
+    os.environ["DB_RECONNECT_MIN_SECONDS"] = "0.05"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.ERROR)
+
+    import database_manager
+    from database_manager import db
+    from models import ShiftData
+
+    database_up = False
+    real_connect = database_manager._LazyDB._connect
+
+    def connect():
+        if not database_up:
+            time.sleep(args.connect_ms / 1000)
+            raise ConnectionError("connection refused")
+        return real_connect()
+    db._connect = connect
+
+    started = time.perf_counter()
+    db.save_event(CHAT_ID, 1, "@host", "shift_event", "событие 0")
+    first_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    for n in range(1, args.calls):
+        db.save_event(CHAT_ID, 1, "@host", "shift_event", f"событие {n}")
+        db.is_bot_enabled(CHAT_ID)
+        db.save_shift_data(CHAT_ID, ShiftData(main_id=1, shift_goal=n))
+    per_call_us = (time.perf_counter() - started) / ((args.calls - 1) * 3) * 1e6
+    status_open = db.circuit_status()
+
+    database_up = True
+    deadline = time.time() + 30
+    while db.circuit_status()["circuit"] == "open" and time.time() < deadline:
+        time.sleep(0.05)
+    status_closed = db.circuit_status()
+
+    import sqlite3
+    database = db._get_db()
+    with sqlite3.connect(database.db_path) as conn:
+        events = [row[0] for row in conn.execute(
+            "SELECT event_description FROM event_history WHERE chat_id = ? ORDER BY id", (CHAT_ID,))]
+    shift = database.load_shift_data(CHAT_ID)
+
+    in_order = events == [f"событие {n}" for n in range(args.calls)]
+    coalesced = shift is not None and shift.shift_goal == args.calls - 1
+    old_estimate_s = args.calls * 3 * args.connect_ms / 1000
+    print(f"Вызовов db.* при лежащей базе: {(args.calls - 1) * 3 + 1}, подключение падает за {args.connect_ms:.0f} мс")
+    print(f"  первый вызов: {first_ms:.0f} мс; остальные: {per_call_us:.1f} мкс на вызов "
+          f"(без предохранителя ≈ {old_estimate_s:.0f} с на все)")
+    print(f"  цепь: {status_open['circuit']}, отложено записей: {status_open['spooled']} "
+          f"(save_shift_data схлопнут до одной)")
+    print(f"После подъёма базы: цепь {status_closed['circuit']}, осталось в очереди {status_closed['spooled']}")
+    print(f"События воспроизведены по порядку: {'да' if in_order else 'НЕТ'}; "
+          f"смена — последняя версия: {'да' if coalesced else 'НЕТ'}")
+    if not (in_order and coalesced and status_closed["circuit"] == "closed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
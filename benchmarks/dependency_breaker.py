@@ -0,0 +1,128 @@
+# benchmarks/dependency_breaker.py
+"""
+Предохранитель внешней зависимости при её деградации.
+
+Поток голосовых (--voices, по --threads параллельно) обращается к «OpenAI»,
+который висит --timeout-ms и падает по таймауту. Без предохранителя каждый
+вызов ждёт таймаут и шлёт BOSS_ID уведомление; с resilience.Dependency после
+failure_threshold сбоев вызовы сразу получают отказ, уведомление уходит одно,
+а после «восстановления» пробный вызов замыкает цепь. Отдельно проверяется,
+что текст уведомления, заданный функцией (как в handlers/voice.py), собирается
+в фоновом потоке и уходит.
+
+Запуск:
+    python -m benchmarks.dependency_breaker [--voices 300] [--threads 8] [--timeout-ms 200]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = 0
+        self.texts = []
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.sent += 1
+            self.texts.append(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Вызовы деградировавшей зависимости с предохранителем и без")
+    parser.add_argument("--voices", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--timeout-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = tempfile.mkdtemp(prefix="evgenich-breaker-")
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["TRACING_ENABLED"] = "false"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import resilience
+
+    healthy = False
+
+    def transcribe():
+        if not healthy:
+            time.sleep(args.timeout_ms / 1000)
+            raise TimeoutError("Request timed out")
+        return "текст"
+
+    def run(analyze) -> tuple:
+        bot = _Bot()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(lambda n: analyze(bot, n), range(args.voices)))
+        time.sleep(0.1)  # уведомления уходят в фоновых потоках
+        return time.perf_counter() - started, bot.sent
+
+    def analyze_plain(bot, n):
+        try:
+            transcribe()
+        except Exception as e:
+            bot.send_message(1, f"Ошибка OpenAI: {e}")
+
+    dependency = resilience.Dependency("openai_bench", args.timeout_ms / 1000, max_concurrent=4, max_wait=5.0,
+                                       reset_seconds=0.5)
+
+    def analyze_guarded(bot, n):
+        try:
+            dependency.call(transcribe)
+        except resilience.DependencyUnavailable:
+            pass
+        except Exception as e:
+            resilience.alert_boss(bot, f"openai:{type(e).__name__}", f"Ошибка OpenAI: {e}")
+
+    plain_s, plain_alerts = run(analyze_plain)
+    guarded_s, guarded_alerts = run(analyze_guarded)
+    state_down = dependency.status()["state"]
+
+    healthy = True
+    time.sleep(dependency.reset_seconds)
+    dependency.call(transcribe)
+    state_up = dependency.status()["state"]
+
+    print(f"Голосовых: {args.voices}, потоков: {args.threads}, OpenAI падает по таймауту за {args.timeout_ms:.0f} мс")
+    print(f"{'':<22} {'время':>8} {'уведомлений BOSS':>17}")
+    print(f"{'без предохранителя':<22} {plain_s:>6.2f} с {plain_alerts:>17}")
+    print(f"{'с предохранителем':<22} {guarded_s:>6.2f} с {guarded_alerts:>17}")
+    print(f"Цепь при сбоях: {state_down}; после восстановления и пробного вызова: {state_up}")
+
+    # Текст-функция: название чата запрашивается в фоне, ошибка к тому времени уже вне except
+    lazy_bot = _Bot()
+
+    def slow_title():
+        time.sleep(0.05)
+        return "Тестовый чат"
+
+    try:
+        raise TimeoutError("Request timed out")
+    except Exception as e:
+        error_text = str(e)
+        resilience.alert_boss(lazy_bot, "openai:lazy_text",
+                              lambda: f"Ошибка OpenAI в чате {slow_title()}:\n{error_text}")
+    deadline = time.time() + 5
+    while not lazy_bot.texts and time.time() < deadline:
+        time.sleep(0.01)
+    lazy_ok = lazy_bot.texts == ["Ошибка OpenAI в чате Тестовый чат:\nRequest timed out"]
+    print(f"Уведомление с текстом-функцией отправлено: {'да' if lazy_ok else 'НЕТ'}")
+    if not (state_down == "open" and state_up == "closed" and guarded_alerts <= 1 and lazy_ok):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# benchmarks/fake_bot_api.py
+"""
+Локальный фейковый Telegram Bot API для нагрузочных тестов.
+
+Отвечает на getUpdates (long polling из очереди апдейтов), sendMessage и прочие
+send*/edit*, getFile, скачивание файла и getChatAdministrators. Задержка ответа
+и доля ответов 429 настраиваются. Неизвестные методы отвечают {"ok": true}.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BOT_USER = {"id": 777000, "is_bot": True, "first_name": "Евгенич", "username": "evgenich_bot"}
+# Методы, которые можно "затроттлить" ответом 429
+RATE_LIMITED_PREFIXES = ("send", "edit")
+
+
+class FakeBotAPI:
+    """HTTP-сервер Bot API в отдельном потоке."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_limit_ratio: float = 0.0, seed: int = 0, host: str = "127.0.0.1", port: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._updates = deque()
+        self._updates_cond = threading.Condition()
+        self._next_update_id = 1
+        self._next_message_id = 1_000_000
+        self._ids_lock = threading.Lock()
+        # Администраторы по чатам: chat_id -> [user dict]
+        self.admins = {}
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def configure_telebot(self):
+        """Направляет telebot на этот сервер."""
+        from telebot import apihelper
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+
+    # --- Очередь апдейтов ---
+
+    def push_update(self, update: dict):
+        with self._updates_cond:
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._updates_cond.notify_all()
+
+    def pending_updates(self) -> int:
+        with self._updates_cond:
+            return len(self._updates)
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        timeout = float(params.get("timeout", 0) or 0)
+        deadline = time.monotonic() + min(timeout, 1.0)
+        with self._updates_cond:
+            # Апдейты с id < offset подтверждены клиентом
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._updates_cond.wait(remaining)
+            return list(self._updates)[:limit]
+
+    # --- Ответы ---
+
+    def _message_id(self) -> int:
+        with self._ids_lock:
+            self._next_message_id += 1
+            return self._next_message_id
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0) or 0)
+        return {
+            "message_id": int(params.get("message_id") or self._message_id()),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Venue {chat_id}"},
+            "from": BOT_USER,
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    def _result(self, method: str, params: dict):
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getMe":
+            return BOT_USER
+        if method == "getFile":
+            file_id = params.get("file_id", "file")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": 32_000,
+                    "file_path": f"voice/{file_id}.ogg"}
+        if method == "getChatAdministrators":
+            chat_id = int(params.get("chat_id", 0) or 0)
+            return [{"status": "creator", "user": user} for user in self.admins.get(chat_id, [])] + \
+                   [{"status": "administrator", "user": BOT_USER}]
+        if method == "getChat":
+            chat_id = int(params.get("chat_id", 0) or 0)
+            return {"id": chat_id, "type": "supergroup", "title": f"Venue {chat_id}"}
+        if method.startswith("send") or method in ("editMessageText", "editMessageCaption"):
+            return self._message(params)
+        return True
+
+    def _delay(self):
+        if self.latency_ms or self.jitter_ms:
+            with self._random_lock:
+                jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def _should_rate_limit(self, method: str) -> bool:
+        if not self.rate_limit_ratio or not method.startswith(RATE_LIMITED_PREFIXES):
+            return False
+        with self._random_lock:
+            return self._random.random() < self.rate_limit_ratio
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _params(self) -> dict:
+                parsed = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                        params.update({k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()})
+                return params
+
+            def _handle(self):
+                path = urlparse(self.path).path
+                params = self._params()
+                if path.startswith("/file/"):
+                    api.calls["download_file"] += 1
+                    api._delay()
+                    return self._send(200, b"OggS" + b"\0" * 1024, "application/octet-stream")
+                method = path.rsplit("/", 1)[-1]
+                api.calls[method] += 1
+                if method != "getUpdates":
+                    api._delay()
+                if api._should_rate_limit(method):
+                    api.rate_limited[method] += 1
+                    body = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                            "parameters": {"retry_after": 1}}
+                    return self._send(429, json.dumps(body).encode())
+                body = {"ok": True, "result": api._result(method, params)}
+                self._send(200, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
@@ -0,0 +1,106 @@
+# benchmarks/history_export.py
+"""
+Выгрузка истории за период: память и время против чтения периода целиком.
+
+В sqlite во временном каталоге пишется event_history чата за месяц. Прежний
+способ — один SELECT всего периода (fetchall) и CSV в строку; новый —
+history_export.export_history: порции по (время, id) в CSV.gz. Прежний
+способ не сжимает и не переводит время в московское, поэтому быстрее; цель
+выгрузки — память, не зависящая от длины периода. Пик памяти меряется
+tracemalloc. Проверяется, что выгрузка полная, без дублей и по
+порядку, и что в рабочем каталоге не появилось файлов.
+
+Запуск:
+    python -m benchmarks.history_export [--rows 200000]
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_ID = -1001000000001
+
+
+def _measure(func):
+    """Время — отдельным прогоном: tracemalloc замедляет код пропорционально числу выделений."""
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed * 1000, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковая выгрузка истории против чтения периода целиком")
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="evgenich-export-")
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = workdir
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["TRACING_ENABLED"] = "false"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.WARNING)
+
+    from database_manager import db
+    import history_export
+
+    db.save_event(CHAT_ID, 1, "@host", "shift_event", "инициализация")
+    start = datetime.datetime(2026, 9, 1)
+    step = datetime.timedelta(days=30) / args.rows
+    with sqlite3.connect(db.db_path) as conn:
+        conn.executemany(
+            "INSERT INTO event_history (chat_id, user_id, username, event_type, event_description, timestamp) "
+            "VALUES (?, ?, ?, 'shift_event', ?, ?)",
+            ((CHAT_ID, 10 + n % 5, f"@host{n % 5}", f"Событие смены номер {n}",
+              (start + step * n).strftime('%Y-%m-%d %H:%M:%S')) for n in range(args.rows)))
+    since, until = history_export.period_bounds(datetime.date(2026, 9, 1), datetime.date(2026, 9, 30))
+
+    def full_load():
+        with sqlite3.connect(db.db_path) as conn:
+            rows = conn.execute(
+                "SELECT id, timestamp, user_id, username, event_type, event_description FROM event_history "
+                "WHERE chat_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp, id",
+                (CHAT_ID, since.strftime('%Y-%m-%d %H:%M:%S'), until.strftime('%Y-%m-%d %H:%M:%S'))).fetchall()
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return len(rows)
+
+    cwd_before = set(os.listdir("."))
+    full_rows, full_ms, full_mb = _measure(full_load)
+    result, stream_ms, stream_mb = _measure(
+        lambda: history_export.export_history(CHAT_ID, 'events', since, until))
+    size_kb = result.file.seek(0, io.SEEK_END) / 1024
+    result.file.seek(0)
+    with gzip.GzipFile(fileobj=result.file, mode='rb') as gz:
+        ids = [int(row[0]) for row in list(csv.reader(io.TextIOWrapper(gz, encoding='utf-8-sig')))[1:]]
+    result.file.close()
+
+    complete = result.rows == full_rows == len(set(ids)) and ids == sorted(ids) and not result.truncated
+    clean = set(os.listdir(".")) == cwd_before
+    print(f"Строк за период: {full_rows}")
+    print(f"{'способ':<22} {'время':>10} {'пик памяти':>12}")
+    print(f"{'весь период (fetchall)':<22} {full_ms:>7.0f} мс {full_mb:>9.1f} МБ")
+    print(f"{'порциями в CSV.gz':<22} {stream_ms:>7.0f} мс {stream_mb:>9.1f} МБ   файл {size_kb:.0f} КБ")
+    print(f"Выгрузка полная и по порядку: {'да' if complete else 'НЕТ'}; "
+          f"рабочий каталог не тронут: {'да' if clean else 'НЕТ'}")
+    if not (complete and clean):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
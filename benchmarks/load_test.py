@@ -0,0 +1,339 @@
+# benchmarks/load_test.py
+"""
+Синтетическая нагрузка на несколько заведений через фейковый Bot API.
+
+Поднимает benchmarks.fake_bot_api, направляет на него бота из main.py с
+настоящими обработчиками и проигрывает сценарий смен: N чатов, голосовые
+каждые X минут, перерывы, паузы, передача смены и спам /check. Время
+сценария сжато в --time-scale раз (кулдаун голосовых сжимается так же).
+
+Отчёт: пропускная способность, p50/p95/p99 задержки обработчиков,
+конкуренция за data_lock, память и размер БД. Сценарий определяется --seed,
+поэтому прогоны воспроизводимы.
+
+Запуск:
+    python -m benchmarks.load_test --chats 50 --shift-minutes 120 --voice-every 4
+    python -m benchmarks.load_test --chats 200 --api-latency-ms 80 --rate-limit 0.02 --json result.json
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_CHAT_ID = -1001000000000
+BREAK_MINUTES = 15
+PAUSE_MINUTES = 10
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20, help="число заведений (чатов)")
+    parser.add_argument("--users-per-chat", type=int, default=2, help="ведущих в смене")
+    parser.add_argument("--shift-minutes", type=float, default=120, help="длина сценария в минутах сценария")
+    parser.add_argument("--voice-every", type=float, default=4, help="интервал голосовых на ведущего, мин")
+    parser.add_argument("--check-per-minute", type=float, default=0.5, help="частота /check на чат в минуту")
+    parser.add_argument("--time-scale", type=float, default=120, help="во сколько раз сжато время сценария")
+    parser.add_argument("--api-latency-ms", type=float, default=30, help="задержка ответа фейкового API")
+    parser.add_argument("--api-jitter-ms", type=float, default=10, help="разброс задержки API")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля send*/edit* ответов 429")
+    parser.add_argument("--workers", type=int, default=2, help="потоков обработки апдейтов у telebot")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--drain-timeout", type=float, default=60, help="ожидание обработки хвоста, с")
+    parser.add_argument("--json", help="записать результат в JSON-файл")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи бота в консоли")
+    return parser.parse_args(argv)
+
+
+# --- Сценарий ---
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Host{user_id}", "username": f"host{user_id}"}
+
+
+def _chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "supergroup", "title": f"Venue {chat_id}"}
+
+
+def _message(chat_id: int, user_id: int, message_id: int, **fields) -> dict:
+    message = {"message_id": message_id, "date": int(time.time()), "chat": _chat(chat_id), "from": _user(user_id)}
+    message.update(fields)
+    return {"message": message}
+
+
+def _command(chat_id: int, user_id: int, message_id: int, text: str, **fields) -> dict:
+    command = text.split()[0]
+    entities = [{"type": "bot_command", "offset": 0, "length": len(command.encode("utf-16-le")) // 2}]
+    return _message(chat_id, user_id, message_id, text=text, entities=entities, **fields)
+
+
+def build_script(args) -> list:
+    """Возвращает отсортированный список (секунда_сценария, вид, фабрика_апдейта)."""
+    rng = random.Random(args.seed)
+    shift_seconds = args.shift_minutes * 60
+    events = []
+    message_ids = iter(range(1, 10 ** 9))
+
+    for index in range(args.chats):
+        chat_id = FIRST_CHAT_ID - index
+        users = [10_000 + index * 100 + k for k in range(args.users_per_chat)]
+        main_user, second_user = users[0], users[-1]
+
+        for user_id in users:
+            t = rng.uniform(0, args.voice_every * 60)
+            if user_id == main_user:
+                t = rng.uniform(0, 30)  # главный открывает смену первым голосовым
+            while t < shift_seconds:
+                mid = next(message_ids)
+                events.append((t, "voice", lambda c=chat_id, u=user_id, m=mid: _message(
+                    c, u, m, voice={"file_id": f"v{c}_{m}", "file_unique_id": f"v{c}_{m}",
+                                    "duration": 15, "mime_type": "audio/ogg"})))
+                t += args.voice_every * 60 * rng.uniform(0.8, 1.2)
+
+        if len(users) > 1:
+            t = shift_seconds * rng.uniform(0.2, 0.4)
+            mid = next(message_ids)
+            events.append((t, "break", lambda c=chat_id, u=second_user, m=mid: _message(c, u, m, text="перерыв")))
+            mid = next(message_ids)
+            events.append((t + BREAK_MINUTES * 60, "return",
+                           lambda c=chat_id, u=second_user, m=mid: _message(c, u, m, text="вернулся")))
+
+        t = shift_seconds * rng.uniform(0.45, 0.55)
+        mid = next(message_ids)
+        events.append((t, "pause", lambda c=chat_id, u=main_user, m=mid: _command(c, u, m, "/pause")))
+        mid = next(message_ids)
+        events.append((t + PAUSE_MINUTES * 60, "stop_pause",
+                       lambda c=chat_id, u=main_user, m=mid: _command(c, u, m, "/stop_pause")))
+
+        if len(users) > 1:
+            t = shift_seconds * rng.uniform(0.65, 0.75)
+            mid = next(message_ids)
+            reply = {"message_id": mid - 1, "date": int(time.time()), "chat": _chat(chat_id),
+                     "from": _user(second_user), "text": "готов"}
+            events.append((t, "transfer", lambda c=chat_id, u=main_user, m=mid, r=reply: _command(
+                c, u, m, "/передать", reply_to_message=r)))
+            events.append((t + 30, "transfer_accept", lambda c=chat_id, u=second_user, m=mid: {
+                "callback_query": {
+                    "id": f"cb{c}_{m}", "from": _user(u), "chat_instance": str(c),
+                    "data": f"transfer_accept_{u}",
+                    "message": {"message_id": m + 500_000, "date": int(time.time()), "chat": _chat(c),
+                                "from": {"id": 777000, "is_bot": True, "first_name": "Евгенич"}, "text": "offer"},
+                }}))
+
+        t = rng.expovariate(args.check_per_minute / 60) if args.check_per_minute else shift_seconds
+        while t < shift_seconds:
+            mid = next(message_ids)
+            user_id = rng.choice(users)
+            events.append((t, "check", lambda c=chat_id, u=user_id, m=mid: _command(c, u, m, "/check")))
+            t += rng.expovariate(args.check_per_minute / 60)
+
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+# --- Измерения ---
+
+class LatencyRecorder:
+    """Точные задержки каждого вызова обработчика (внешний слой поверх метрик)."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, func, kind: str):
+        import functools
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                self.errors[kind] += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.samples[kind].append(elapsed)
+                    self.completed += 1
+        return wrapper
+
+    def install(self, bot):
+        original_message = bot.add_message_handler
+        original_callback = bot.add_callback_query_handler
+
+        def add_message_handler(handler_dict):
+            handler_dict['function'] = self.wrap(handler_dict['function'], handler_dict['function'].__name__)
+            return original_message(handler_dict)
+
+        def add_callback_query_handler(handler_dict):
+            handler_dict['function'] = self.wrap(handler_dict['function'], "callback")
+            return original_callback(handler_dict)
+
+        bot.add_message_handler = add_message_handler
+        bot.add_callback_query_handler = add_callback_query_handler
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+def lock_report() -> dict:
+    import metrics
+    wait = metrics.LOCK_WAIT.labels("data_lock").snapshot()
+    hold = metrics.LOCK_HOLD.labels("data_lock").snapshot()
+    buckets = metrics.LOCK_WAIT.buckets
+    count = wait[-1]
+    under_1ms = sum(wait[:buckets.index(0.001) + 1])
+    return {
+        "acquisitions": count,
+        "wait_avg_ms": round(wait[-2] / count * 1000, 3) if count else 0.0,
+        "wait_over_1ms": count - under_1ms,
+        "hold_avg_ms": round(hold[-2] / hold[-1] * 1000, 3) if hold[-1] else 0.0,
+        "hold_total_s": round(hold[-2], 3),
+    }
+
+
+def db_size_bytes(volume: str) -> int:
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        path = os.path.join(volume, "bot_database.db" + suffix)
+        if os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+# --- Прогон ---
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="evgenich-load-")
+    # Окружение до импорта config: отдельный том, SQLite, без OpenAI, сжатый кулдаун
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = workdir
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["OPENAI_API_KEY"] = ""
+    os.environ["BOT_TOKEN"] = "123456:LOADTEST"
+    os.environ.setdefault("TRACING_ENABLED", "false")
+    os.environ["VOICE_COOLDOWN_SECONDS"] = str(int(120 / args.time_scale))
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    from benchmarks.fake_bot_api import FakeBotAPI
+    api = FakeBotAPI(args.api_latency_ms, args.api_jitter_ms, args.rate_limit, seed=args.seed).start()
+    api.configure_telebot()
+
+    import logging
+    import main
+    from telebot import util
+    from admin_panel import register_admin_panel_handlers
+    from bulk_writer import bulk_writer
+    from state import pending_transfers
+
+    root = logging.getLogger()
+    if not args.verbose:
+        for handler in list(root.handlers):
+            if type(handler) is logging.StreamHandler:
+                root.removeHandler(handler)
+    root.setLevel(logging.WARNING)
+
+    bot = main.bot
+    if args.workers != 2:
+        bot.worker_pool = util.ThreadPool(bot, num_threads=args.workers)
+    recorder = LatencyRecorder()
+    recorder.install(bot)
+    main.handlers.register_handlers(bot)
+    register_admin_panel_handlers(bot)
+
+    script = build_script(args)
+    for index in range(args.chats):
+        chat_id = FIRST_CHAT_ID - index
+        api.admins[chat_id] = [_user(10_000 + index * 100)]
+
+    polling = threading.Thread(
+        target=bot.polling, kwargs={"non_stop": True, "interval": 0, "timeout": 5, "long_polling_timeout": 1},
+        name="polling", daemon=True)
+    polling.start()
+
+    started = time.perf_counter()
+    for sim_seconds, _kind, factory in script:
+        delay = started + sim_seconds / args.time_scale - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        api.push_update(factory())
+    fed_at = time.perf_counter()
+
+    deadline = fed_at + args.drain_timeout
+    while recorder.completed < len(script) and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    finished = time.perf_counter()
+    bot.stop_polling()
+
+    for transfer in list(pending_transfers.values()):
+        transfer['timer'].cancel()
+    bulk_writer.flush()
+
+    by_kind = defaultdict(int)
+    for _t, kind, _f in script:
+        by_kind[kind] += 1
+    all_samples = [s for samples in recorder.samples.values() for s in samples]
+    wall = finished - started
+    return {
+        "params": vars(args),
+        "updates": {"scripted": len(script), "handled": recorder.completed, "by_kind": dict(by_kind)},
+        "throughput_updates_per_s": round(recorder.completed / wall, 2) if wall else 0.0,
+        "wall_seconds": round(wall, 2),
+        "drain_seconds": round(finished - fed_at, 2),
+        "latency": {"all": percentiles(all_samples),
+                    **{kind: percentiles(samples) for kind, samples in sorted(recorder.samples.items())}},
+        "handler_errors": dict(recorder.errors),
+        "data_lock": lock_report(),
+        "telegram": {"calls": dict(api.calls), "rate_limited": dict(api.rate_limited)},
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "db_size_bytes": db_size_bytes(workdir),
+    }
+
+
+def print_report(result: dict):
+    updates = result["updates"]
+    print(f"Апдейтов: {updates['handled']}/{updates['scripted']} за {result['wall_seconds']} с "
+          f"(хвост {result['drain_seconds']} с) — {result['throughput_updates_per_s']} апд/с")
+    print(f"{'обработчик':32} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (мс)")
+    for name, stats in result["latency"].items():
+        if stats["count"]:
+            print(f"{name:32} {stats['count']:>6} {stats['p50_ms']:>8} {stats['p95_ms']:>8} "
+                  f"{stats['p99_ms']:>8} {stats['max_ms']:>8}")
+    lock = result["data_lock"]
+    print(f"data_lock: захватов {lock['acquisitions']}, ожидание ср. {lock['wait_avg_ms']} мс, "
+          f">1 мс: {lock['wait_over_1ms']}, удержание ср. {lock['hold_avg_ms']} мс")
+    print(f"Ошибки обработчиков: {result['handler_errors'] or 'нет'}; 429 от API: {result['telegram']['rate_limited'] or 'нет'}")
+    print(f"Память (max RSS): {result['max_rss_mb']} МБ; размер БД: {result['db_size_bytes'] / 1024:.0f} КБ")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    json_path = os.path.abspath(args.json) if args.json else None
+    result = run(args)
+    print_report(result)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+# benchmarks/micro.py
+"""
+Микробенчмарки горячих функций на сгенерированных данных (10/100/1000 чатов)
+со сравнением с сохранённой базой benchmarks/baseline.json.
+
+Запуск:
+    python -m benchmarks.micro                      # прогон и таблица
+    python -m benchmarks.micro --compare            # сравнение с базой, код 1 при регрессии
+    python -m benchmarks.micro --save               # перезаписать базу
+    python -m benchmarks.micro --sizes 10,100 --filter save_state
+
+База зависит от машины: сравнивать имеет смысл прогоны на одном и том же железе.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+DEFAULT_SIZES = (10, 100, 1000)
+# Разница меньше этого порога считается шумом независимо от процента
+NOISE_FLOOR_MS = 0.05
+USERS_PER_SHIFT = 3
+HISTORY_DAYS = 7
+
+CASES = {}
+
+
+def case(name):
+    """Регистрирует бенчмарк: фабрика (size, fixtures) -> функция без аргументов."""
+    def decorator(factory):
+        CASES[name] = factory
+        return factory
+    return decorator
+
+
+# --- Заглушка сети telebot (apihelper.CUSTOM_REQUEST_SENDER) ---
+
+class _Response:
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, payload: dict):
+        self.text = json.dumps(payload, ensure_ascii=False)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _request_sender(method, url, params=None, **kwargs):
+    """Отвечает на запросы Bot API без сети, чтобы мерить только код бота."""
+    name = url.rsplit("/", 1)[-1]
+    params = params or {}
+    result = True
+    if name.startswith("send") or name.startswith("editMessage"):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        result = {"message_id": 1, "date": int(time.time()), "text": params.get("text", ""),
+                  "chat": {"id": chat_id, "type": "supergroup", "title": f"Venue {chat_id}"}}
+    elif name == "getChat":
+        chat_id = int(params.get("chat_id", 0) or 0)
+        result = {"id": chat_id, "type": "supergroup", "title": f"Venue {chat_id}"}
+    elif name == "getChatAdministrators":
+        result = []
+    return _Response({"ok": True, "result": result})
+
+
+# --- Фикстуры ---
+
+class Fixtures:
+    """Детерминированные данные смен для заданного числа чатов."""
+
+    def __init__(self, size: int, seed: int = 1):
+        from models import ShiftData, UserData
+        rng = random.Random(seed * 100_003 + size)
+        tz = datetime.timezone(datetime.timedelta(hours=3))
+        now = datetime.datetime.now(tz)
+        start = now - datetime.timedelta(hours=5)
+        self.size = size
+        self.chat_ids = [-1001000000000 - i for i in range(size)]
+        self.chat_data = {}
+        self.chat_configs = {}
+        self.user_history = {}
+        ad_names = [f"Шаблон {n}" for n in range(12)]
+
+        for index, chat_id in enumerate(self.chat_ids):
+            users = {}
+            for k in range(USERS_PER_SHIFT):
+                user_id = 10_000 + index * 10 + k
+                count = rng.randint(5, 40)
+                deltas = [rng.uniform(2, 12) for _ in range(count)]
+                last_voice = now - datetime.timedelta(minutes=rng.choice([3, 10, 45, 90]))
+                user = UserData(
+                    user_id=user_id, username=f"@host{user_id}", count=count,
+                    breaks_count=rng.randint(0, 3), late_returns=rng.randint(0, 1),
+                    break_minutes=rng.uniform(0, 45),
+                    last_voice_time=last_voice.isoformat(),
+                    recognized_ads=rng.choices(ad_names, k=rng.randint(0, count)),
+                    voice_deltas=deltas, voice_durations=[rng.randint(7, 60) for _ in range(count)],
+                )
+                if rng.random() < 0.1:
+                    user.on_break = True
+                    user.break_start_time = (now - datetime.timedelta(minutes=20)).isoformat()
+                users[user_id] = user
+            main_id = next(iter(users))
+            self.chat_data[chat_id] = ShiftData(
+                main_id=main_id, users=users, main_username=users[main_id].username,
+                shift_start_time=start.isoformat())
+            # Конец смены через пару часов: проверка пробегает все чаты, но отчётов не шлёт
+            end = (now + datetime.timedelta(hours=2)).strftime("%H:%M")
+            self.chat_configs[str(chat_id)] = {"end_time": end, "timezone": "Europe/Moscow",
+                                               "brand": f"brand{index % 20}", "city": f"city{index % 5}"}
+            self.user_history[chat_id] = [f"{start.isoformat()} событие {n}" for n in range(20)]
+
+        # Шаблоны рекламы в формате мастера объявлений: бренд → город → тип → список
+        self.ad_templates = {}
+        words = ["скидка", "караоке", "акция", "бронь", "меню", "вечеринка", "подарок", "кальян"]
+        for index in range(size):
+            brand = self.ad_templates.setdefault(f"brand{index % 20}", {})
+            city = brand.setdefault(f"city{index % 5}", {})
+            city.setdefault("voice", []).extend(
+                {"text": " ".join(rng.choices(words, k=8)), "category": "general"} for _ in range(10))
+
+
+def _bot():
+    import telebot
+    from telebot import apihelper
+    apihelper.CUSTOM_REQUEST_SENDER = _request_sender
+    return telebot.TeleBot("123456:BENCH", threaded=False, parse_mode="Markdown")
+
+
+def _install_state(fx: Fixtures):
+    import copy
+    from state import chat_data, user_history
+    from chat_config import chat_settings
+    chat_data.clear()
+    chat_data.update(copy.deepcopy(fx.chat_data))
+    chat_settings.load(copy.deepcopy(fx.chat_configs))
+    user_history.clear()
+    user_history.update(copy.deepcopy(fx.user_history))
+
+
+def _database(fx: Fixtures, with_history: bool):
+    from database import BotDatabase
+    path = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    database = BotDatabase(path)
+    if with_history:
+        for day in range(HISTORY_DAYS):
+            for chat_id, shift in fx.chat_data.items():
+                moved = datetime.datetime.fromisoformat(shift.shift_start_time) - datetime.timedelta(days=day)
+                shift_copy = type(shift)(**{**shift.__dict__, "shift_start_time": moved.isoformat()})
+                database.save_shift_data(chat_id, shift_copy)
+                database.record_shift_kpis(chat_id, shift_copy)
+    return database
+
+
+# --- Бенчмарки ---
+
+@case("generate_detailed_report")
+def bench_report(size, fx):
+    from utils import generate_detailed_report
+    items = list(fx.chat_data.items())
+
+    def run():
+        for chat_id, shift in items:
+            generate_detailed_report(chat_id, shift)
+    return run
+
+
+@case("save_state")
+def bench_save_state(size, fx):
+    from state_manager import save_state
+    from state import chat_data, user_history
+    _install_state(fx)
+    bot = _bot()
+    return lambda: save_state(bot, chat_data, user_history)
+
+
+@case("load_state")
+def bench_load_state(size, fx):
+    from state_manager import save_state, load_state
+    from state import chat_data, user_history
+    _install_state(fx)
+    save_state(_bot(), chat_data, user_history)
+    return load_state
+
+
+@case("check_user_activity")
+def bench_activity(size, fx):
+    from scheduler import check_user_activity
+    from state import chat_data
+    _install_state(fx)
+    bot = _bot()
+    users = [user for shift in chat_data.values() for user in shift.users.values()]
+
+    def run():
+        # Сбрасываем отметки напоминаний, чтобы каждый прогон делал одинаковую работу
+        for user in users:
+            user.last_activity_reminder_time = None
+            user.last_break_reminder_time = None
+        check_user_activity(bot)
+    return run
+
+
+@case("check_for_shift_end")
+def bench_shift_end(size, fx):
+    from scheduler import check_for_shift_end
+    _install_state(fx)
+    bot = _bot()
+    return lambda: check_for_shift_end(bot)
+
+
+@case("save_shift_data")
+def bench_save_shift(size, fx):
+    database = _database(fx, with_history=False)
+    items = list(fx.chat_data.items())
+
+    def run():
+        for chat_id, shift in items:
+            database.save_shift_data(chat_id, shift)
+    return run
+
+
+@case("get_user_rating")
+def bench_rating(size, fx):
+    database = _database(fx, with_history=True)
+    return lambda: database.get_user_rating(limit=10)
+
+
+@case("get_marketing_analytics")
+def bench_marketing(size, fx):
+    database = _database(fx, with_history=True)
+    chat_id = fx.chat_ids[0]
+    return lambda: database.get_marketing_analytics(chat_id, days=HISTORY_DAYS)
+
+
+@case("hot_db_reads")
+def bench_hot_reads(size, fx):
+    # Меню админ-панели и статистика: флаг бота, расписание ролей, статистика ведущих (db_cache)
+    database = _database(fx, with_history=True)
+    day = datetime.date.today().weekday()
+    lookups = [(chat_id, list(shift.users)) for chat_id, shift in fx.chat_data.items()]
+
+    def run():
+        for chat_id, user_ids in lookups:
+            database.is_bot_enabled(chat_id)
+            database.get_role_schedule(chat_id, day)
+            for user_id in user_ids:
+                database.get_user_stats_from_db(user_id)
+    return run
+
+
+@case("search_ad_templates")
+def bench_search(size, fx):
+    from handlers.wizards import search_ad_templates
+    return lambda: search_ad_templates("караоке скидка", fx.ad_templates)
+
+
+@case("handle_voice")
+def bench_voice(size, fx):
+    import itertools
+    import clock
+    from telebot import types
+    from handlers.voice import register_voice_handlers
+    from state import chat_data
+    _install_state(fx)
+    bot = _bot()
+    register_voice_handlers(bot)
+    handle_voice = bot.message_handlers[-1]['function']
+    # Голосовые по кругу от всех ведущих всех чатов
+    senders = itertools.cycle([(chat_id, user_id) for chat_id in fx.chat_ids for user_id in fx.chat_data[chat_id].users])
+    counter = iter(range(1, 10 ** 9))
+
+    def run():
+        chat_id, user_id = next(senders)
+        user = chat_data[chat_id].users[user_id]
+        # Прошлое голосовое — раньше любого кулдауна: мерится принятое голосовое, а не ответ «слишком часто»
+        user.last_voice_time = (clock.moscow_now() - datetime.timedelta(minutes=5)).isoformat()
+        message = types.Message.de_json({
+            "message_id": next(counter), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Venue"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Host", "username": f"host{user_id}"},
+            "voice": {"file_id": "v", "file_unique_id": "v", "duration": 20},
+        })
+        handle_voice(message)
+
+    def total_voices():
+        return sum(user.count for shift in chat_data.values() for user in shift.users.values())
+
+    before = total_voices()
+    run()
+    if total_voices() != before + 1:
+        raise RuntimeError("handle_voice не засчитал голосовое: бенчмарк мерит не тот путь")
+    return run
+
+
+# --- Измерение и сравнение ---
+
+def measure(func, min_seconds: float = 0.3, min_runs: int = 5, max_runs: int = 2000) -> float:
+    """Медиана времени одного вызова в миллисекундах."""
+    func()  # прогрев
+    timings = []
+    spent = 0.0
+    while len(timings) < max_runs and (len(timings) < min_runs or spent < min_seconds):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        timings.append(elapsed)
+        spent += elapsed
+        if elapsed > 1.0 and len(timings) >= 3:
+            break
+    return statistics.median(timings) * 1000
+
+
+def run_suite(sizes, name_filter=None) -> dict:
+    results = {}
+    for size in sizes:
+        fx = Fixtures(size)
+        for name, factory in CASES.items():
+            if name_filter and name_filter not in name:
+                continue
+            func = factory(size, fx)
+            ms = measure(func)
+            results.setdefault(name, {})[str(size)] = round(ms, 4)
+            print(f"{name:28} {size:>6} чатов  {ms:>12.3f} мс", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Возвращает список регрессий (имя, размер, база, сейчас, отношение)."""
+    regressions = []
+    for name, by_size in results.items():
+        for size, current in by_size.items():
+            base = baseline.get(name, {}).get(size)
+            if base is None:
+                continue
+            ratio = current / base if base else float("inf")
+            if ratio > 1 + threshold and current - base > NOISE_FLOOR_MS:
+                regressions.append((name, size, base, current, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--filter", help="подстрока имени бенчмарка")
+    parser.add_argument("--compare", action="store_true", help="сравнить с baseline.json")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление (0.25 = +25%%)")
+    parser.add_argument("--save", action="store_true", help="записать результат в baseline.json")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="evgenich-micro-")
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = workdir
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["OPENAI_API_KEY"] = ""
+    os.environ["TRACING_ENABLED"] = "false"
+    os.environ["VOICE_COOLDOWN_SECONDS"] = "0"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.WARNING)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = run_suite(sizes, args.filter)
+
+    from bulk_writer import bulk_writer
+    bulk_writer.shutdown()
+
+    exit_code = 0
+    if args.compare:
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            exit_code = 1
+            print(f"\nРегрессии (порог +{args.threshold:.0%}):")
+            for name, size, base, current, ratio in regressions:
+                print(f"  {name} [{size}]: {base:.3f} → {current:.3f} мс (×{ratio:.2f})")
+        else:
+            print(f"\nРегрессий нет (порог +{args.threshold:.0%}).")
+
+    if args.save:
+        baseline = {"results": {}}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE, encoding="utf-8") as f:
+                baseline = json.load(f)
+        for name, by_size in results.items():
+            baseline["results"].setdefault(name, {}).update(by_size)
+        baseline["meta"] = {"python": platform.python_version(), "machine": platform.machine(),
+                            "saved_at": datetime.date.today().isoformat()}
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"База записана в {BASELINE_FILE}")
+
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/shift_restore.py
+"""
+Восстановление активных смен из БД при запуске.
+
+В SQLite во временном каталоге сохраняются --chats активных смен по --users
+ведущих (и десятая часть сброшенных смен без ведущего). Замеряется загрузка
+по одной смене (load_shift_data на каждый чат: подключение и два запроса)
+против load_active_shifts (два запроса на все смены), результаты сверяются.
+Затем load_state проверяется в трёх положениях снимка: свежий (из БД ничего
+не берётся), отсутствует и повреждён (все активные смены берутся из БД).
+
+Запуск:
+    python -m benchmarks.shift_restore [--chats 1000,5000] [--users 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _make_shift(chat_n: int, users: int):
+    from models import ShiftData, UserData
+
+    main_id = 10**9 + chat_n * 10
+    shift = ShiftData(main_id=main_id, main_username=f"@host{chat_n}", shift_goal=15 + chat_n % 5)
+    for n in range(users):
+        user_id = main_id + n
+        shift.users[user_id] = UserData(
+            user_id=user_id, username=f"@host{chat_n}_{n}", goal=15 + n, count=chat_n % 20,
+            breaks_count=n, late_returns=chat_n % 2, last_voice_time="2026-01-01T21:00:00+03:00",
+            recognized_ads=["Реклама завтраков"], voice_deltas=[3.5, 4.0], voice_durations=[20, 31],
+        )
+    return shift
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная загрузка активных смен из БД против загрузки по одной")
+    parser.add_argument("--chats", default="1000,5000", help="размеры через запятую")
+    parser.add_argument("--users", type=int, default=3)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.chats.split(",")]
+
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = tempfile.mkdtemp(prefix="evgenich-restore-")
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["TRACING_ENABLED"] = "false"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import database_manager
+    import state_manager
+    from database import BotDatabase
+    from models import ShiftData
+    from snapshot_file import write_snapshot
+
+    ok = True
+    print(f"{'смен':>6} {'по одной':>10} {'пакетом':>9} {'ускорение':>10}  совпадение")
+    for size in sizes:
+        database = BotDatabase(os.path.join(os.environ["RAILWAY_VOLUME_MOUNT_PATH"], f"restore_{size}.db"))
+        expected = {}
+        for n in range(size):
+            chat_id = -10**12 - n
+            if n % 10 == 9:
+                database.save_shift_data(chat_id, ShiftData())  # сброшенная смена не восстанавливается
+                continue
+            expected[chat_id] = _make_shift(n, args.users)
+            database.save_shift_data(chat_id, expected[chat_id])
+
+        started = time.perf_counter()
+        one_by_one = {chat_id: database.load_shift_data(chat_id) for chat_id in expected}
+        one_by_one_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        bulk = database.load_active_shifts()
+        bulk_s = time.perf_counter() - started
+
+        restored = bulk or {}
+        same = restored == one_by_one == expected
+        ok &= same
+        print(f"{size:>6} {one_by_one_s * 1000:>7.0f} мс {bulk_s * 1000:>6.0f} мс {one_by_one_s / bulk_s:>9.1f}x  "
+              f"{'да' if same else 'НЕТ'} ({len(restored)} активных)")
+
+    # load_state: снимок свежий, отсутствует, повреждён (последняя база из цикла выше)
+    database_manager._db_instance = database
+    snapshot = state_manager.STATE_SNAPSHOT_FILE
+    time.sleep(0.01)
+    write_snapshot(snapshot, {}, {})
+    fresh, _ = state_manager.load_state()
+    os.remove(snapshot)
+    missing, _ = state_manager.load_state()
+    with open(snapshot, "wb") as f:
+        f.write(b"\x00" * 64)
+    started = time.perf_counter()
+    corrupt, _ = state_manager.load_state()
+    corrupt_s = time.perf_counter() - started
+
+    print(f"load_state, {len(expected)} активных смен в БД:")
+    print(f"  снимок свежее БД: взято из БД {len(fresh)}")
+    print(f"  снимка нет: восстановлено {len(missing)}")
+    print(f"  снимок повреждён: восстановлено {len(corrupt)} за {corrupt_s * 1000:.0f} мс")
+    ok &= not fresh and missing == expected and corrupt == expected
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
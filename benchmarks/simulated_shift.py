@@ -0,0 +1,151 @@
+# benchmarks/simulated_shift.py
+"""
+Полная ночная смена в виртуальном времени: голосовые, перерыв с опозданием,
+пауза с автоокончанием, напоминания о тишине и финальный отчёт в 07:00.
+
+Часы подменяются на clock.SimulatedClock, планировщик — на
+scheduler.SimulatedScheduler, Bot API отвечает без сети
+(apihelper.CUSTOM_REQUEST_SENDER); фоновое закрытие смены (shift_close)
+дожидается до конца прогона. Смена 19:00–07:05 проходит за доли секунды.
+
+Запуск:
+    python -m benchmarks.simulated_shift
+"""
+
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_ID = -1001000000001
+HOST_ID = 10_001
+
+
+class _Response:
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, payload: dict):
+        self.text = json.dumps(payload, ensure_ascii=False)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class RecordingAPI:
+    """Отвечает на запросы Bot API и запоминает отправленные тексты."""
+
+    def __init__(self):
+        self.sent = []
+        self.calls = Counter()
+
+    def __call__(self, method, url, params=None, **kwargs):
+        name = url.rsplit("/", 1)[-1]
+        params = params or {}
+        self.calls[name] += 1
+        chat_id = int(params.get("chat_id", 0) or 0)
+        chat = {"id": chat_id, "type": "supergroup", "title": "Simulated venue"}
+        result = True
+        if name.startswith("send"):
+            self.sent.append((chat_id, params.get("text", "")))
+            result = {"message_id": len(self.sent), "date": int(time.time()), "chat": chat,
+                      "text": params.get("text", "")}
+        elif name == "getChat":
+            result = chat
+        elif name == "getChatAdministrators":
+            result = []
+        return _Response({"ok": True, "result": result})
+
+
+def _update(update_id: int, moment: datetime.datetime, **message_fields) -> dict:
+    message = {"message_id": update_id, "date": int(moment.timestamp()),
+               "chat": {"id": CHAT_ID, "type": "supergroup", "title": "Simulated venue"},
+               "from": {"id": HOST_ID, "is_bot": False, "first_name": "Host", "username": "host"}}
+    message.update(message_fields)
+    return {"update_id": update_id, "message": message}
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="evgenich-sim-")
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = workdir
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["OPENAI_API_KEY"] = ""
+    os.environ["TRACING_ENABLED"] = "false"
+    os.environ["ADMIN_REPORT_CHAT_ID"] = "0"
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.ERROR)
+
+    import telebot
+    from telebot import apihelper, types
+    import clock
+    from handlers.voice import register_voice_handlers
+    from handlers.shift import register_shift_handlers
+    from handlers.user import register_user_handlers
+    from scheduler import SimulatedScheduler
+    from state import chat_data
+    from chat_config import chat_settings
+    from bulk_writer import bulk_writer
+    from shift_close import shift_closer
+
+    api = RecordingAPI()
+    apihelper.CUSTOM_REQUEST_SENDER = api
+    bot = telebot.TeleBot("123456:SIM", threaded=False, parse_mode="Markdown")
+    register_shift_handlers(bot)
+    register_user_handlers(bot)
+    register_voice_handlers(bot)
+
+    start = clock.MOSCOW_TZ.localize(datetime.datetime(2026, 10, 16, 19, 0))
+    sim = clock.SimulatedClock(start)
+    chat_settings.load({CHAT_ID: {"end_time": "07:00", "timezone": "Europe/Moscow"}})
+
+    # Сценарий: (минута от начала смены, вид апдейта)
+    script = [(m, "voice") for m in range(0, 150, 5)]           # 19:00–21:30 ровный эфир
+    script += [(180, "break"), (200, "return")]                  # 22:00 перерыв, возврат с опозданием
+    script += [(m, "voice") for m in range(205, 360, 6)]         # до 01:00
+    script += [(360, "pause")]                                   # 01:00 пауза, дальше тишина
+    script += [(m, "voice") for m in range(480, 700, 7)]         # 03:00–06:40
+    script.sort()
+
+    wall_started = time.perf_counter()
+    with clock.use_clock(sim):
+        scheduler = SimulatedScheduler(bot, sim)
+        for update_id, (minute, kind) in enumerate(script, start=1):
+            moment = start + datetime.timedelta(minutes=minute)
+            scheduler.run_until(moment)
+            if kind == "voice":
+                fields = {"voice": {"file_id": f"v{update_id}", "file_unique_id": f"v{update_id}", "duration": 20}}
+            elif kind == "break":
+                fields = {"text": "перерыв"}
+            elif kind == "return":
+                fields = {"text": "вернулся"}
+            else:
+                fields = {"text": "/pause", "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}
+            bot.process_new_updates([types.Update.de_json(_update(update_id, moment, **fields))])
+        scheduler.run_until(start + datetime.timedelta(hours=12, minutes=5))
+        # Закрытие смены идёт в фоне (shift_close); ждём его, пока часы подменены
+        shift_closer.wait_idle(30)
+    wall = time.perf_counter() - wall_started
+    bulk_writer.shutdown()
+
+    texts = [text for _, text in api.sent]
+    shift = chat_data.get(CHAT_ID)
+    print(f"Виртуальное время: {start:%d.%m %H:%M} → {sim.now(clock.MOSCOW_TZ):%d.%m %H:%M}, "
+          f"реальное: {wall * 1000:.0f} мс")
+    print(f"Апдейтов: {len(script)}, запусков задач планировщика: {scheduler.runs}")
+    print(f"Сообщений бота: {len(texts)}")
+    print(f"  напоминаний о тишине: {sum('тишина уже' in t for t in texts)}")
+    print(f"  авто-окончаний паузы: {sum('Пауза завершена автоматически' in t for t in texts)}")
+    print(f"  финальных отчётов: {sum('Смена завершена' in t for t in texts)}")
+    print(f"Смена сброшена после отчёта: {bool(shift) and shift.main_id is None}, "
+          f"дата отчёта: {getattr(shift, 'last_report_date', None)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/snapshot_lock.py
+"""
+Сколько save_state держит data_lock в зависимости от размера состояния.
+
+Сравнивает прежний способ (copy.deepcopy chat_data и user_history под
+замком) со снимком snapshots.capture: под замком только ссылки на списки и
+их длины, копии собираются уже без замка. Размер состояния растёт по двум
+осям: число чатов и длина смены (голосовых на ведущего, событий истории).
+
+Запуск:
+    python -m benchmarks.snapshot_lock [--chats 10,100,1000] [--voices 20,200,2000]
+"""
+
+import argparse
+import copy
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS_PER_SHIFT = 3
+
+
+def _state(chats: int, voices: int):
+    from models import ShiftData, UserData
+    start = datetime.datetime(2026, 10, 16, 19, 0).isoformat()
+    chat_data, user_history = {}, {}
+    for index in range(chats):
+        chat_id = -1001000000000 - index
+        users = {}
+        for k in range(USERS_PER_SHIFT):
+            user_id = 10_000 + index * 10 + k
+            users[user_id] = UserData(user_id=user_id, username=f"@host{user_id}", count=voices,
+                                      voice_deltas=[5.0 + n % 7 for n in range(voices)],
+                                      voice_durations=[20 + n % 30 for n in range(voices)],
+                                      recognized_ads=[f"Шаблон {n % 12}" for n in range(voices // 2)])
+        chat_data[chat_id] = ShiftData(main_id=10_000 + index * 10, users=users, shift_start_time=start)
+        user_history[chat_id] = [{"user_id": 10_000, "username": "@host", "timestamp": start,
+                                  "event": f"событие {n}"} for n in range(voices)]
+    return chat_data, user_history
+
+
+def _hold_ms(func, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Удержание data_lock при сохранении состояния")
+    parser.add_argument("--chats", default="10,100,1000")
+    parser.add_argument("--voices", default="20,200,2000", help="голосовых на ведущего и событий истории на чат")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = tempfile.mkdtemp(prefix="evgenich-snap-")
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["TRACING_ENABLED"] = "false"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    import snapshots
+    from dataclasses import asdict
+
+    print(f"{'чатов':>6} {'ГС/ведущего':>12} {'deepcopy под замком':>20} {'снимок под замком':>18} "
+          f"{'сборка копий':>13}  снимок точный")
+    for chats in [int(n) for n in args.chats.split(",") if n]:
+        for voices in [int(n) for n in args.voices.split(",") if n]:
+            chat_data, user_history = _state(chats, voices)
+            deep = _hold_ms(lambda: (copy.deepcopy(chat_data), copy.deepcopy(user_history)), args.runs)
+            snap = _hold_ms(lambda: snapshots.capture(chat_data, user_history), args.runs)
+            # Копии собираются после новых записей, но должны видеть состояние на момент снимка
+            snapshot = snapshots.capture(chat_data, user_history)
+            expected = {chat_id: asdict(shift) for chat_id, shift in chat_data.items()}
+            for chat_id, shift in chat_data.items():
+                for user in shift.users.values():
+                    user.voice_deltas.append(99.0)
+                user_history[chat_id].append({"event": "после снимка"})
+            build = _hold_ms(lambda: (snapshots.StateSnapshot(snapshot._shifts, snapshot._history).chat_data,
+                                      snapshot.user_history), args.runs)
+            same = (all(asdict(snapshot.chat_data[chat_id]) == expected[chat_id] for chat_id in chat_data)
+                    and all(len(events) == voices for events in snapshot.user_history.values()))
+            print(f"{chats:>6} {voices:>12} {deep:>17.2f} мс {snap:>15.2f} мс {build:>10.2f} мс  "
+                  f"{'да' if same else 'НЕТ'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# benchmarks/state_format.py
+"""
+Сохранение и загрузка состояния: прежний JSON против файла снимка (snapshot_file).
+
+Прежний формат — chat_data.json и user_history.json через json.dump(indent=4,
+asdict), загрузка — json.loads всего файла и сборка dataclasses, как делал
+main.py. Новый — записи по чатам с индексом. Отдельно меряется чтение одной
+смены по индексу и перенос JSON в снимок при первом запуске.
+
+Запуск:
+    python -m benchmarks.state_format [--chats 1000] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _median_ms(func, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+class _LegacyEncoder(json.JSONEncoder):
+    def default(self, o):
+        if hasattr(o, '__dataclass_fields__'):
+            return asdict(o)
+        return super().default(o)
+
+
+def _legacy_save(workdir: str, chat_data: dict, user_history: dict):
+    for name, data in (("chat_data.json", chat_data), ("user_history.json", user_history)):
+        with open(os.path.join(workdir, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False, cls=_LegacyEncoder)
+
+
+def _legacy_load(workdir: str):
+    from models import ShiftData, UserData
+    with open(os.path.join(workdir, "chat_data.json"), encoding='utf-8') as f:
+        raw = json.loads(f.read())
+    with open(os.path.join(workdir, "user_history.json"), encoding='utf-8') as f:
+        history = {int(k): v for k, v in json.loads(f.read()).items()}
+    chat_data = {}
+    for cid, shift_dict in raw.items():
+        shift_dict['users'] = {int(uid): UserData(**udict) for uid, udict in shift_dict['users'].items()}
+        chat_data[int(cid)] = ShiftData(**shift_dict)
+    return chat_data, history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Формат файла состояния: JSON против снимка")
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="evgenich-format-")
+    os.environ["RAILWAY_VOLUME_MOUNT_PATH"] = workdir
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["TRACING_ENABLED"] = "false"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import logging
+    logging.disable(logging.WARNING)
+
+    from benchmarks.micro import Fixtures
+    from snapshot_file import write_snapshot, SnapshotReader
+    import state_manager
+
+    fx = Fixtures(args.chats)
+    snap_path = os.path.join(workdir, "state.snap")
+
+    legacy_save = _median_ms(lambda: _legacy_save(workdir, fx.chat_data, fx.user_history), args.runs)
+    legacy_load = _median_ms(lambda: _legacy_load(workdir), args.runs)
+    legacy_size = sum(os.path.getsize(os.path.join(workdir, name)) for name in ("chat_data.json", "user_history.json"))
+
+    snap_save = _median_ms(lambda: write_snapshot(snap_path, fx.chat_data, fx.user_history), args.runs)
+
+    def load_all():
+        with SnapshotReader(snap_path) as reader:
+            return reader.load_all()
+    snap_load = _median_ms(load_all, args.runs)
+    snap_size = os.path.getsize(snap_path)
+
+    chat_id = fx.chat_ids[len(fx.chat_ids) // 2]
+
+    def load_one():
+        with SnapshotReader(snap_path) as reader:
+            return reader.shift(chat_id)
+    snap_one = _median_ms(load_one, args.runs)
+
+    # Перенос при первом запуске: JSON есть, снимка ещё нет
+    os.remove(snap_path)
+    os.remove(snap_path + ".bak")
+    started = time.perf_counter()
+    migrated, _ = state_manager.load_state()
+    migrate_ms = (time.perf_counter() - started) * 1000
+
+    loaded, history = load_all()
+    same = ({cid: asdict(shift) for cid, shift in loaded.items()} ==
+            {cid: asdict(shift) for cid, shift in fx.chat_data.items()}
+            and history == fx.user_history and len(migrated) == args.chats)
+
+    print(f"Чатов: {args.chats}")
+    print(f"{'формат':<10} {'сохранение':>12} {'загрузка':>10} {'размер':>10}")
+    print(f"{'JSON':<10} {legacy_save:>9.1f} мс {legacy_load:>7.1f} мс {legacy_size / 1024:>7.0f} КБ")
+    print(f"{'снимок':<10} {snap_save:>9.1f} мс {snap_load:>7.1f} мс {snap_size / 1024:>7.0f} КБ")
+    print(f"Одна смена по индексу: {snap_one:.2f} мс; перенос JSON → снимок: {migrate_ms:.0f} мс")
+    print(f"Данные после записи и чтения совпадают: {'да' if same else 'НЕТ'}")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
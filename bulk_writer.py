@@ -0,0 +1,148 @@
+# bulk_writer.py
+"""
+Буферизованная пакетная запись voice_stats и event_history.
+
+Строки копятся в памяти и сбрасываются пакетом (COPY на PostgreSQL,
+executemany в одной транзакции на SQLite) по размеру буфера или по таймеру.
+Доставка «хотя бы один раз»: неудачный пакет возвращается в начало очереди
+и повторяется; дубли отсекаются уникальным idempotency_key в базе.
+"""
+
+import datetime
+import logging
+import threading
+import uuid
+from collections import deque
+from typing import Optional
+
+from config import BULK_FLUSH_ROWS, BULK_FLUSH_INTERVAL_SECONDS, BULK_MAX_BUFFERED
+
+
+class BulkWriter:
+    """Очередь строк для пакетной вставки с фоновым сбросом."""
+
+    def __init__(self, database=None, flush_rows: int = BULK_FLUSH_ROWS,
+                 flush_interval: float = BULK_FLUSH_INTERVAL_SECONDS,
+                 max_buffered: int = BULK_MAX_BUFFERED):
+        self._database = database
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._queues = {"voice_stats": deque(), "event_history": deque()}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._retry_delay = 0.0
+        self.stats = {"written": 0, "duplicates": 0, "failed_flushes": 0, "dropped": 0}
+
+    @property
+    def database(self):
+        if self._database is None:
+            from database_manager import db
+            self._database = db
+        return self._database
+
+    def enqueue_voice(self, chat_id: int, user_id: int, username: str, duration: float,
+                      recognized_ad: str = "", idempotency_key: Optional[str] = None):
+        """Ставит в очередь строку voice_stats."""
+        self._enqueue("voice_stats", {
+            "chat_id": chat_id, "user_id": user_id, "username": username,
+            "duration": duration, "recognized_ad": recognized_ad,
+            "created_at": datetime.datetime.utcnow(),
+            "idempotency_key": idempotency_key or uuid.uuid4().hex,
+        })
+
+    def enqueue_event(self, chat_id: int, user_id: int, username: str, event_type: str,
+                      event_data: str, idempotency_key: Optional[str] = None):
+        """Ставит в очередь строку event_history."""
+        self._enqueue("event_history", {
+            "chat_id": chat_id, "user_id": user_id, "username": username,
+            "event_type": event_type, "event_data": event_data,
+            "created_at": datetime.datetime.utcnow(),
+            "idempotency_key": idempotency_key or uuid.uuid4().hex,
+        })
+
+    def _enqueue(self, table: str, row: dict):
+        with self._lock:
+            queue = self._queues[table]
+            queue.append(row)
+            if len(queue) > self.max_buffered:
+                # База недоступна слишком долго: ограничиваем память, теряя самые старые строки
+                queue.popleft()
+                self.stats["dropped"] += 1
+                if self.stats["dropped"] % 1000 == 1:
+                    logging.error(f"BulkWriter: буфер {table} переполнен, старые строки отбрасываются")
+            full = len(queue) >= self.flush_rows
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        """Сколько строк ждут записи."""
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def flush(self) -> int:
+        """Сбрасывает все очереди. Возвращает число записанных строк; при ошибке пакет остаётся в очереди."""
+        written = 0
+        with self._flush_lock:
+            for table, queue in self._queues.items():
+                while True:
+                    with self._lock:
+                        batch = [queue.popleft() for _ in range(min(len(queue), self.flush_rows))]
+                    if not batch:
+                        break
+                    try:
+                        if table == "voice_stats":
+                            inserted = self.database.bulk_insert_voice_stats(batch)
+                        else:
+                            inserted = self.database.bulk_insert_events(batch)
+                        if inserted is None:
+                            # Заглушка _LazyDB: база недоступна, пакет нужно повторить
+                            raise RuntimeError("БД недоступна")
+                    except Exception as e:
+                        with self._lock:
+                            queue.extendleft(reversed(batch))
+                        self.stats["failed_flushes"] += 1
+                        self._retry_delay = min(max(self._retry_delay * 2, 1.0), 60.0)
+                        logging.error(f"BulkWriter: ошибка записи пакета {table} ({len(batch)} строк): {e}")
+                        return written
+                    written += inserted
+                    self.stats["written"] += inserted
+                    self.stats["duplicates"] += len(batch) - inserted
+            self._retry_delay = 0.0
+        return written
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stopped.clear()
+                    self._thread = threading.Thread(target=self._run, name="bulk-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if self._retry_delay:
+                # Экспоненциальная пауза перед повтором, пока база недоступна
+                self._stopped.wait(self._retry_delay)
+
+    def shutdown(self, timeout: float = 10.0):
+        """Останавливает фоновый поток и дописывает остаток очереди."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        left = self.pending()
+        if left:
+            logging.error(f"BulkWriter: при остановке не записано {left} строк")
+
+
+# Глобальный писатель, общий для обработчиков
+bulk_writer = BulkWriter()
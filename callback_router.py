@@ -0,0 +1,213 @@
+# callback_router.py
+"""
+Единый маршрутизатор callback-запросов и компактный кодек callback_data.
+
+Все обработчики inline-кнопок регистрируются через ``router.route(...)``,
+а в telebot добавляется ровно один callback_query_handler. Поиск обработчика:
+точное совпадение (dict) -> распакованный маршрут кодека (dict) ->
+самый длинный префикс (trie). Время поиска не зависит от числа маршрутов.
+"""
+
+import base64
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS
+from tracing import start_trace
+
+# Telegram ограничивает callback_data 64 байтами (в UTF-8)
+CALLBACK_DATA_LIMIT = 64
+
+# Версия формата: "1|маршрут|арг1|арг2" или "1#токен" для длинных данных
+CODEC_VERSION = "1"
+_SEP = "|"
+_PACKED_PREFIX = CODEC_VERSION + _SEP
+_INTERNED_PREFIX = CODEC_VERSION + "#"
+
+# Сколько длинных payload'ов держим в памяти для кнопок вида "1#токен"
+INTERNED_PAYLOADS_LIMIT = 20000
+
+_TRIE_HANDLER = "\0"
+
+
+class _PayloadStore:
+    """Ограниченный LRU-кэш длинных payload'ов, которые не влезают в 64 байта."""
+
+    def __init__(self, limit: int = INTERNED_PAYLOADS_LIMIT):
+        self._limit = limit
+        self._items: "OrderedDict[str, Tuple[str, tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, route: str, args: tuple) -> str:
+        raw = _SEP.join((route,) + args).encode("utf-8")
+        token = base64.urlsafe_b64encode(hashlib.blake2b(raw, digest_size=9).digest()).decode("ascii")
+        with self._lock:
+            self._items[token] = (route, args)
+            self._items.move_to_end(token)
+            while len(self._items) > self._limit:
+                self._items.popitem(last=False)
+        return token
+
+    def get(self, token: str) -> Optional[Tuple[str, tuple]]:
+        with self._lock:
+            item = self._items.get(token)
+            if item is not None:
+                self._items.move_to_end(token)
+            return item
+
+
+_payloads = _PayloadStore()
+
+
+def pack_callback(route: str, *args) -> str:
+    """Кодирует маршрут и аргументы в callback_data не длиннее 64 байт."""
+    str_args = tuple(str(a) for a in args)
+    data = _SEP.join((CODEC_VERSION, route) + str_args)
+    if len(data.encode("utf-8")) <= CALLBACK_DATA_LIMIT and not any(_SEP in a for a in str_args):
+        return data
+    return _INTERNED_PREFIX + _payloads.put(route, str_args)
+
+
+def unpack_callback(data: str) -> Optional[Tuple[str, tuple]]:
+    """Раскодирует callback_data. Возвращает (маршрут, аргументы) или None для старого формата."""
+    if data.startswith(_PACKED_PREFIX):
+        parts = data.split(_SEP)
+        return parts[1], tuple(parts[2:])
+    if data.startswith(_INTERNED_PREFIX):
+        return _payloads.get(data[len(_INTERNED_PREFIX):]) or ("", ())
+    return None
+
+
+class RouteStats:
+    """Счётчики задержки одного маршрута."""
+    __slots__ = ("count", "errors", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def observe(self, seconds: float, failed: bool):
+        self.count += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        if failed:
+            self.errors += 1
+
+    def as_dict(self) -> dict:
+        avg = self.total_seconds / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(avg * 1000, 2),
+            "max_ms": round(self.max_seconds * 1000, 2),
+        }
+
+
+class CallbackRouter:
+    """Маршрутизатор callback-запросов с точными и префиксными маршрутами."""
+
+    def __init__(self):
+        self._exact: Dict[str, Callable] = {}
+        self._trie: dict = {}
+        self._stats: Dict[str, RouteStats] = {}
+        self._bot = None
+
+    def route(self, *keys: str, prefix: bool = False):
+        """Декоратор: регистрирует обработчик для точных ключей или префиксов.
+
+        Обработчик вызывается как ``handler(call, *args)``: для данных кодека
+        args — упакованные аргументы, для префикса — остаток строки (если есть).
+        """
+        def decorator(func):
+            for key in keys:
+                if prefix:
+                    node = self._trie
+                    for ch in key:
+                        node = node.setdefault(ch, {})
+                    node[_TRIE_HANDLER] = (key, func)
+                else:
+                    self._exact[key] = func
+            return func
+        return decorator
+
+    def resolve(self, data: str) -> Tuple[Optional[str], Optional[Callable], tuple]:
+        """Находит (маршрут, обработчик, аргументы) для callback_data."""
+        handler = self._exact.get(data)
+        if handler is not None:
+            return data, handler, ()
+
+        unpacked = unpack_callback(data)
+        if unpacked is not None:
+            route, args = unpacked
+            handler = self._exact.get(route)
+            return (route, handler, args) if handler else (route or None, None, ())
+
+        node = self._trie
+        found = None
+        for ch in data:
+            node = node.get(ch)
+            if node is None:
+                break
+            if _TRIE_HANDLER in node:
+                found = node[_TRIE_HANDLER]
+        if found is None:
+            return None, None, ()
+        key, handler = found
+        rest = data[len(key):]
+        return key, handler, ((rest,) if rest else ())
+
+    def dispatch(self, call):
+        """Вызывает обработчик для callback-запроса и записывает задержку маршрута."""
+        route, handler, args = self.resolve(call.data or "")
+        if handler is None:
+            logging.info(f"[ROUTER] Нет обработчика для callback_data={call.data!r}")
+            try:
+                self._bot.answer_callback_query(call.id, "Кнопка устарела. Откройте меню заново.")
+            except Exception:
+                pass
+            return
+
+        started = time.perf_counter()
+        failed = False
+        try:
+            message = getattr(call, "message", None)
+            with start_trace(f"callback {route}", **{
+                "chat.id": getattr(getattr(message, "chat", None), "id", None),
+                "user.id": getattr(getattr(call, "from_user", None), "id", None),
+                "callback.data": call.data,
+            }):
+                handler(call, *args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self._stats.get(route)
+            if stats is None:
+                stats = self._stats.setdefault(route, RouteStats())
+            stats.observe(elapsed, failed)
+            HANDLER_LATENCY.labels("callback", route).observe(elapsed)
+            if failed:
+                HANDLER_ERRORS.labels("callback", route).inc()
+
+    def attach(self, bot):
+        """Регистрирует в telebot единственный callback_query_handler (идемпотентно)."""
+        if self._bot is bot:
+            return
+        self._bot = bot
+        bot.callback_query_handler(func=lambda call: True)(self.dispatch)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Возвращает снимок задержек по маршрутам."""
+        return {route: stats.as_dict() for route, stats in list(self._stats.items())}
+
+
+# Глобальный маршрутизатор, общий для handlers/ и admin_panel
+router = CallbackRouter()
@@ -0,0 +1,195 @@
+# chat_config.py
+"""
+Разобранные настройки чатов.
+
+Сырые настройки лежат в state.chat_configs (ключ — str(chat_id), как в
+chat_configs.json) и приходят из двух источников в разных форматах:
+chat_configs.json хранит timezone как имя IANA и end_time, мастер настройки
+(/setup_wizard) — timezone как смещение от МСК числом и schedule.end.
+ChatConfigRegistry разбирает их один раз — при загрузке и после каждого
+сохранения — в неизменяемые ChatConfig с готовым объектом часового пояса,
+временем окончания смены, планом и тайм-аутом. Обработчики и планировщик
+берут значения атрибутами, не разбирая словарь на каждом вызове.
+
+Менять настройки — через chat_settings.update(): она записывает строку чата
+в config_store, а тот уведомляет реестр, и реестр пересобирает ChatConfig.
+"""
+
+import datetime
+import logging
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+
+import clock
+from config import (EXPECTED_VOICES_PER_SHIFT, VOICE_TIMEOUT_MINUTES, LIVE_STATUS_DEFAULT,
+                    TIMEZONE_MAP)
+from config_store import config_store, NAMESPACE_CHATS
+from state import chat_configs
+
+DEFAULT_END_TIME = '04:00'
+
+
+def _offset_zone(offset: int) -> datetime.tzinfo:
+    """Зона по смещению от МСК: региональная из TIMEZONE_MAP, иначе фиксированная Etc/GMT."""
+    tz = TIMEZONE_MAP.get(f"+{offset}" if offset > 0 else str(offset))
+    if tz is not None:
+        return tz
+    utc_offset = 3 + offset
+    return clock.get_tz(f"Etc/GMT{-utc_offset:+d}" if utc_offset != 0 else "Etc/GMT")
+
+
+def resolve_timezone(setting) -> datetime.tzinfo:
+    """Часовой пояс из настройки: смещение от МСК (число или "+2") или имя IANA."""
+    if setting is None or setting == '':
+        return clock.MOSCOW_TZ
+    if isinstance(setting, (int, float)):
+        return _offset_zone(int(setting))
+    text = str(setting).strip()
+    try:
+        return _offset_zone(int(text))
+    except ValueError:
+        pass
+    try:
+        return clock.get_tz(text)
+    except Exception:
+        logging.warning(f"Неизвестный часовой пояс '{setting}' в настройках чата, используется Москва")
+        return clock.MOSCOW_TZ
+
+
+def _msk_offset(tz: datetime.tzinfo) -> int:
+    """Смещение зоны от МСК в часах на текущий момент."""
+    now = clock.now(tz)
+    return int((now.utcoffset() - clock.MOSCOW_TZ.utcoffset(now.replace(tzinfo=None))).total_seconds() // 3600)
+
+
+def _parse_time(text: Optional[str]) -> Optional[datetime.time]:
+    try:
+        hour, minute = map(int, str(text).split(':'))
+        return datetime.time(hour, minute)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class ChatConfig:
+    """Настройки одного чата, разобранные один раз."""
+    configured: bool = False
+    tz: datetime.tzinfo = clock.MOSCOW_TZ
+    tz_name: str = clock.MOSCOW_TZ_NAME
+    msk_offset: int = 0
+    start_time: Optional[datetime.time] = None
+    end_time: datetime.time = datetime.time(4, 0)
+    # Конец окна, в котором планировщик отправляет отчёт: час после end_time
+    report_until: datetime.time = datetime.time(5, 0)
+    goal: int = EXPECTED_VOICES_PER_SHIFT
+    voice_timeout: int = VOICE_TIMEOUT_MINUTES
+    brand: Optional[str] = None
+    concept: Optional[str] = None
+    city: Optional[str] = None
+    live_status: bool = LIVE_STATUS_DEFAULT
+    raw: Mapping = field(default_factory=lambda: MappingProxyType({}), compare=False)
+
+    @property
+    def templates_brand(self) -> Optional[str]:
+        """Ключ бренда в ad_templates: концепция, а для старых настроек — brand."""
+        return self.concept or self.brand
+
+    @property
+    def end_time_str(self) -> str:
+        return self.end_time.strftime('%H:%M')
+
+    @property
+    def start_time_str(self) -> Optional[str]:
+        return self.start_time.strftime('%H:%M') if self.start_time else None
+
+    def now(self) -> datetime.datetime:
+        """Текущее время в часовом поясе чата."""
+        return clock.now(self.tz)
+
+    @classmethod
+    def from_raw(cls, raw: Optional[dict]) -> "ChatConfig":
+        raw = dict(raw or {})
+        schedule = raw.get('schedule') or {}
+        tz = resolve_timezone(raw.get('timezone'))
+        # Мастер настройки пишет schedule.end поверх старого end_time — он свежее
+        end_str = schedule.get('end') or raw.get('end_time') or DEFAULT_END_TIME
+        end_time = _parse_time(end_str)
+        if end_time is None:
+            logging.warning(f"Неверное время окончания смены '{end_str}' в настройках чата, используется {DEFAULT_END_TIME}")
+            end_time = _parse_time(DEFAULT_END_TIME)
+        goal = raw.get('plan_voices') or raw.get('default_goal') or EXPECTED_VOICES_PER_SHIFT
+        return cls(
+            configured=bool(raw),
+            tz=tz,
+            tz_name=getattr(tz, 'zone', str(tz)),
+            msk_offset=_msk_offset(tz),
+            start_time=_parse_time(schedule.get('start')),
+            end_time=end_time,
+            report_until=datetime.time((end_time.hour + 1) % 24, end_time.minute),
+            goal=int(goal),
+            voice_timeout=int(raw.get('voice_timeout') or VOICE_TIMEOUT_MINUTES),
+            brand=raw.get('brand'),
+            concept=raw.get('concept'),
+            city=raw.get('city'),
+            live_status=bool(raw.get('live_status', LIVE_STATUS_DEFAULT)),
+            raw=MappingProxyType(raw),
+        )
+
+
+DEFAULT_CONFIG = ChatConfig.from_raw({})
+
+
+class ChatConfigRegistry:
+    """ChatConfig всех настроенных чатов; для остальных — DEFAULT_CONFIG."""
+
+    def __init__(self):
+        self._configs: Dict[int, ChatConfig] = {}
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def get(self, chat_id: int) -> ChatConfig:
+        return self._configs.get(int(chat_id), DEFAULT_CONFIG)
+
+    def chat_ids(self) -> List[int]:
+        """Чаты, у которых есть настройки."""
+        return list(self._configs)
+
+    def load(self, raw_configs: dict):
+        """Заменяет все настройки (при запуске): сырые — в state.chat_configs, разобранные — здесь."""
+        with self._lock:
+            chat_configs.clear()
+            chat_configs.update({str(k): v for k, v in raw_configs.items()})
+            self._configs = {int(k): ChatConfig.from_raw(v) for k, v in chat_configs.items()}
+
+    def rebuild(self, chat_id: int) -> ChatConfig:
+        """Пересобирает ChatConfig чата из state.chat_configs."""
+        with self._lock:
+            return self._rebuild(chat_id)
+
+    def _rebuild(self, chat_id: int) -> ChatConfig:
+        raw = chat_configs.get(str(chat_id))
+        if raw is None:
+            self._configs.pop(int(chat_id), None)
+            return DEFAULT_CONFIG
+        config = self._configs[int(chat_id)] = ChatConfig.from_raw(raw)
+        return config
+
+    def update(self, chat_id: int, **changes) -> bool:
+        """Меняет настройки чата одной строкой в config_store; False — не сохранено."""
+        with self._update_lock:
+            raw = dict(chat_configs.get(str(chat_id), {}), **changes)
+            return config_store.put(NAMESPACE_CHATS, str(chat_id), raw)
+
+    def _on_change(self, key: str, raw: Optional[dict]):
+        with self._lock:
+            if raw is None:
+                chat_configs.pop(key, None)
+            else:
+                chat_configs[key] = raw
+            self._rebuild(key)
+
+
+chat_settings = ChatConfigRegistry()
+config_store.subscribe(NAMESPACE_CHATS, chat_settings._on_change)
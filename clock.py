@@ -0,0 +1,124 @@
+# clock.py
+"""
+Единый источник времени для обработчиков, планировщика, ролей и отчётов.
+
+По умолчанию — реальные часы. В тестах и бенчмарках подменяется на
+SimulatedClock, время которого двигается вручную (advance/sleep), так что
+ночная смена с напоминаниями и отчётом проигрывается за миллисекунды.
+"""
+
+import datetime
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Union
+
+import pytz
+
+MOSCOW_TZ_NAME = 'Europe/Moscow'
+
+
+@functools.lru_cache(maxsize=None)
+def get_tz(name: str) -> datetime.tzinfo:
+    """Кэшированный pytz-объект часового пояса (pytz.timezone каждый раз ищет зону заново)."""
+    return pytz.timezone(name)
+
+
+MOSCOW_TZ = get_tz(MOSCOW_TZ_NAME)
+
+
+class Clock:
+    """Реальные часы."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def now(self, tz: Optional[datetime.tzinfo] = None) -> datetime.datetime:
+        return datetime.datetime.now(tz)
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """Виртуальное время: стоит на месте, пока его не сдвинут."""
+
+    def __init__(self, start: Optional[datetime.datetime] = None):
+        start = start or datetime.datetime.now(datetime.timezone.utc)
+        if start.tzinfo is None:
+            start = MOSCOW_TZ.localize(start)
+        self._now = start.astimezone(datetime.timezone.utc)
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        return self._now.timestamp()
+
+    def now(self, tz: Optional[datetime.tzinfo] = None) -> datetime.datetime:
+        current = self._now
+        if tz is None:
+            # Как datetime.now(): наивное локальное время процесса
+            return current.astimezone().replace(tzinfo=None)
+        return current.astimezone(tz)
+
+    def advance(self, delta: Union[float, datetime.timedelta]) -> datetime.datetime:
+        """Сдвигает время вперёд на delta (секунды или timedelta)."""
+        if not isinstance(delta, datetime.timedelta):
+            delta = datetime.timedelta(seconds=delta)
+        with self._lock:
+            self._now += delta
+            return self._now
+
+    def set(self, moment: datetime.datetime):
+        """Переставляет время на moment (наивное время считается московским)."""
+        if moment.tzinfo is None:
+            moment = MOSCOW_TZ.localize(moment)
+        with self._lock:
+            self._now = moment.astimezone(datetime.timezone.utc)
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+
+
+_clock: Clock = Clock()
+
+
+def get_clock() -> Clock:
+    return _clock
+
+
+def set_clock(clock: Clock) -> Clock:
+    """Подменяет часы; возвращает предыдущие."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+@contextmanager
+def use_clock(clock: Clock):
+    """Временно подменяет часы (для тестов и бенчмарков)."""
+    previous = set_clock(clock)
+    try:
+        yield clock
+    finally:
+        set_clock(previous)
+
+
+def now(tz: Optional[Union[datetime.tzinfo, str]] = None) -> datetime.datetime:
+    """Текущее время; tz — объект или имя зоны, без tz — наивное локальное."""
+    if isinstance(tz, str):
+        tz = get_tz(tz)
+    return _clock.now(tz)
+
+
+def moscow_now() -> datetime.datetime:
+    """Текущее московское время (aware)."""
+    return _clock.now(MOSCOW_TZ)
+
+
+def timestamp() -> float:
+    return _clock.time()
+
+
+def sleep(seconds: float):
+    _clock.sleep(seconds)
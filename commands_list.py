@@ -56,7 +56,9 @@ def get_all_commands_list(is_admin: bool = False) -> str:
 📊 Отчёты
 • /adminhelp — справка для админов
 • /report — детальные отчёты  
-• /log — просмотр логов
+• /shift_jobs — ход закрытия смен (retry — перезапуск)
+• /live_status on|off — живой статус в закреплённом сообщении
+• /log — лог текущей смены; /log ДД.ММ.ГГГГ [ДД.ММ.ГГГГ] [voices] [user=ID] [type=ТИП] — история за период (CSV.gz)
 • /problems — диагностика ошибок
 • /marketing_analytics — маркетинговая аналитика
 • /broadcast — рассылка во все чаты (только BOSS)
@@ -64,6 +66,7 @@ def get_all_commands_list(is_admin: bool = False) -> str:
 🔧 Техническое
 • /debug_config — отладка конфигурации
 • /ads — управление рекламными шаблонами
+• /config_export — резервная копия настроек чатов и шаблонов (JSON)
 
 💡 СОВЕТ: Используйте /admin для удобного управления через кнопки!"""
     
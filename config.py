@@ -26,6 +26,32 @@ else:
     DATABASE_URL = f"sqlite:///{os.path.join(VOLUME_PATH, 'bot_database.db')}"
     DB_TYPE = "sqlite"
 
+# Пул соединений PostgreSQL (сессии используются параллельно, без глобальной блокировки)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Предохранитель _LazyDB: пауза между попытками переподключения растёт от MIN до MAX,
+# записи на время обрыва откладываются в память (не больше DB_SPOOL_MAX_CALLS вызовов)
+DB_RECONNECT_MIN_SECONDS = float(os.getenv("DB_RECONNECT_MIN_SECONDS", "1"))
+DB_RECONNECT_MAX_SECONDS = float(os.getenv("DB_RECONNECT_MAX_SECONDS", "60"))
+DB_SPOOL_MAX_CALLS = int(os.getenv("DB_SPOOL_MAX_CALLS", "10000"))
+
+# Пакетная запись voice_stats / event_history
+BULK_FLUSH_ROWS = int(os.getenv("BULK_FLUSH_ROWS", "200"))
+BULK_FLUSH_INTERVAL_SECONDS = float(os.getenv("BULK_FLUSH_INTERVAL_SECONDS", "2"))
+BULK_MAX_BUFFERED = int(os.getenv("BULK_MAX_BUFFERED", "50000"))
+
+# История событий смены в памяти: последние N на чат, остальное читается из event_history
+EVENT_HISTORY_CAPACITY = int(os.getenv("EVENT_HISTORY_CAPACITY", "200"))
+
+# Кэш редко меняющихся чтений БД (db_cache): ключей на метод и время жизни ответа
+DB_CACHE_ENABLED = os.getenv("DB_CACHE_ENABLED", "true").lower() == "true"
+DB_CACHE_MAXSIZE = int(os.getenv("DB_CACHE_MAXSIZE", "4096"))
+# Настройки чата (бот вкл/выкл, расписание ролей) сбрасываются при записи, TTL — страховка
+DB_CACHE_SETTINGS_TTL = float(os.getenv("DB_CACHE_SETTINGS_TTL", "600"))
+# Статистика сбрасывается при закрытии смены; сохранения по ходу смены видны через TTL
+DB_CACHE_STATS_TTL = float(os.getenv("DB_CACHE_STATS_TTL", "120"))
+
 # --- ID и пути к файлам ---
 BOSS_ID = int(os.getenv("BOSS_ID", "196614680"))
 ADMIN_REPORT_CHAT_ID = int(os.getenv("ADMIN_REPORT_CHAT_ID", "-1002645821302"))
@@ -45,6 +71,65 @@ AD_TEMPLATES_FILE = os.path.join(VOLUME_PATH if VOLUME_PATH else "data", 'ad_tem
 # Создаем директорию для конфигурационных файлов
 os.makedirs(os.path.dirname(CHAT_CONFIG_FILE), exist_ok=True)
 
+# --- Внешние зависимости (resilience): таймауты, параллельность, предохранители ---
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_MAX_CONCURRENT = int(os.getenv("OPENAI_MAX_CONCURRENT", "4"))
+GOOGLE_SHEETS_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_SHEETS_TIMEOUT_SECONDS", "30"))
+GOOGLE_SHEETS_MAX_CONCURRENT = int(os.getenv("GOOGLE_SHEETS_MAX_CONCURRENT", "2"))
+TELEGRAM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT_SECONDS", "10"))
+TELEGRAM_READ_TIMEOUT_SECONDS = float(os.getenv("TELEGRAM_READ_TIMEOUT_SECONDS", "30"))
+# Сбоев подряд до размыкания цепи и пауза до пробного вызова
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+# Одна и та же ошибка уходит BOSS_ID не чаще раза в этот интервал
+ALERT_MIN_INTERVAL_SECONDS = float(os.getenv("ALERT_MIN_INTERVAL_SECONDS", "900"))
+
+# --- Хранение старых данных (retention) ---
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+RETENTION_CHUNK_ROWS = int(os.getenv("RETENTION_CHUNK_ROWS", "500"))
+RETENTION_PAUSE_SECONDS = float(os.getenv("RETENTION_PAUSE_SECONDS", "0.2"))
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+# Время запуска (время сервера): днём, вне окна закрытия смен
+RETENTION_RUN_AT = os.getenv("RETENTION_RUN_AT", "12:00")
+ARCHIVE_PATH = os.path.join(VOLUME_PATH, "archive")
+
+# --- Выгрузка истории (/log за период) ---
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+# До этого размера сжатый файл собирается в памяти, дальше — во временном каталоге системы
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+# Telegram принимает от бота документы до 50 МБ
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", str(45 * 1024 * 1024)))
+
+# --- Трассировка апдейтов ---
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(VOLUME_PATH, "traces.jsonl"))
+# Доля записываемых трасс; медленнее TRACE_SLOW_MS пишутся всегда
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+
+# --- Фоновое закрытие смен ---
+# Сколько чатов закрываются одновременно (в 07:00 смены заканчиваются почти везде разом)
+SHIFT_CLOSE_WORKERS = int(os.getenv("SHIFT_CLOSE_WORKERS", "8"))
+SHIFT_CLOSE_MAX_ATTEMPTS = int(os.getenv("SHIFT_CLOSE_MAX_ATTEMPTS", "3"))
+SHIFT_CLOSE_RETRY_SECONDS = float(os.getenv("SHIFT_CLOSE_RETRY_SECONDS", "5"))
+# Сколько завершённых заданий хранить для /shift_jobs
+SHIFT_CLOSE_HISTORY = int(os.getenv("SHIFT_CLOSE_HISTORY", "50"))
+
+# --- Сводка закрытых смен для администратора ---
+# Отчёты, закрытые в пределах окна, уходят одним сообщением
+ADMIN_DIGEST_WINDOW_SECONDS = float(os.getenv("ADMIN_DIGEST_WINDOW_SECONDS", "120"))
+ADMIN_DIGEST_PAGE_SIZE = int(os.getenv("ADMIN_DIGEST_PAGE_SIZE", "15"))
+ADMIN_DIGEST_HISTORY = int(os.getenv("ADMIN_DIGEST_HISTORY", "60"))
+
+# --- Живой статус смены ---
+# Одно закреплённое сообщение со статусом, которое редактируется вместо новых.
+# Включается в чате командой /live_status on; LIVE_STATUS_DEFAULT — для всех чатов сразу
+LIVE_STATUS_DEFAULT = os.getenv("LIVE_STATUS_DEFAULT", "false").lower() == "true"
+# Изменения за это окно сливаются в одну правку сообщения
+LIVE_STATUS_DEBOUNCE_SECONDS = float(os.getenv("LIVE_STATUS_DEBOUNCE_SECONDS", "10"))
+
 # --- Параметры смены ---
 EXPECTED_VOICES_PER_SHIFT = int(os.getenv("EXPECTED_VOICES_PER_SHIFT", "15"))
 VOICE_TIMEOUT_MINUTES = int(os.getenv("VOICE_TIMEOUT_MINUTES", "40"))
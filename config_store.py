@@ -0,0 +1,194 @@
+# config_store.py
+"""
+Настройки чатов и рекламные шаблоны в БД бота.
+
+Раньше каждая правка переписывала весь chat_configs.json или
+ad_templates.json (неатомарно, с отступами), а часть обработчиков /ads
+читала и писала ad_templates.json в рабочем каталоге вместо тома. Теперь
+настройки лежат в таблице config_entries построчно:
+    chat_config    ключ — str(chat_id), значение — словарь настроек чата;
+    ad_templates   ключ — [бренд, город] в JSON, значение — шаблоны города.
+Правка — upsert одной строки. Строка получает номер версии (сквозной по
+таблице); удаление — строка с value = NULL, так номера не переиспользуются
+и удалённое не вернётся при повторном импорте.
+
+При запуске (load_configs) JSON импортируется в БД один раз: в БД пишутся
+ключи, которых там ещё нет (удалённые есть — строкой с NULL), а после
+полного импорта — отметка в служебном пространстве config_store. Пока
+отметки нет (импорт прервался или БД была недоступна), импорт повторяется
+при каждом запуске; после неё файлы не читаются.
+Если БД недоступна, настройки берутся из JSON, а записи откладываются
+предохранителем database_manager до переподключения.
+
+Подписчики (chat_config.chat_settings, state.ad_templates) получают
+каждое изменение через subscribe() и обновляют свои кэши на месте.
+Резервная копия всех настроек — export_configs() (команда /config_export).
+"""
+
+import json
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from config import CHAT_CONFIG_FILE, AD_TEMPLATES_FILE
+from state import ad_templates
+
+NAMESPACE_CHATS = 'chat_config'
+NAMESPACE_TEMPLATES = 'ad_templates'
+NAMESPACES = (NAMESPACE_CHATS, NAMESPACE_TEMPLATES)
+# Служебные отметки: ключ — пространство имён, значение есть — импорт JSON завершён
+NAMESPACE_META = 'config_store'
+
+
+def template_key(brand: str, city: str) -> str:
+    return json.dumps([brand, city], ensure_ascii=False)
+
+
+def split_template_key(key: str) -> Tuple[str, str]:
+    brand, city = json.loads(key)
+    return brand, city
+
+
+class ConfigStore:
+    """Построчное хранилище настроек в БД с уведомлением подписчиков об изменениях."""
+
+    def __init__(self):
+        self.version = 0
+        self._subscribers: Dict[str, list] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, namespace: str, callback: Callable[[str, Optional[object]], None]):
+        """callback(key, value) после каждого изменения; value None — ключ удалён."""
+        self._subscribers[namespace].append(callback)
+
+    def _entries(self, namespace: str) -> Optional[Dict[str, Optional[object]]]:
+        """Все строки пространства имён, включая удалённые (None); None — БД недоступна."""
+        from database_manager import db
+
+        rows = db.load_config_entries(namespace)
+        if rows is None:
+            return None
+        entries = {}
+        for key, value, version in rows:
+            entries[key] = json.loads(value) if value is not None else None
+            with self._lock:
+                self.version = max(self.version, version or 0)
+        return entries
+
+    def load(self, namespace: str) -> Optional[Dict[str, object]]:
+        """Действующие значения пространства имён; None — БД недоступна."""
+        entries = self._entries(namespace)
+        if entries is None:
+            return None
+        return {key: value for key, value in entries.items() if value is not None}
+
+    def put(self, namespace: str, key: str, value: Optional[object]) -> bool:
+        """Записывает одну строку (None — удаляет) и уведомляет подписчиков. False — запись не прошла."""
+        from database_manager import db
+
+        payload = json.dumps(value, ensure_ascii=False) if value is not None else None
+        # None от прокси БД — база недоступна, запись отложена до переподключения
+        if db.put_config_entry(namespace, key, payload) is False:
+            return False
+        with self._lock:
+            self.version += 1
+        for callback in list(self._subscribers[namespace]):
+            try:
+                callback(key, value)
+            except Exception as e:
+                logging.error(f"Ошибка подписчика настроек {namespace}: {e}")
+        return True
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return self.put(namespace, key, None)
+
+    def import_entries(self, namespace: str, items: Iterable[Tuple[str, object]]) -> int:
+        """Записывает пары (ключ, значение); возвращает число записанных."""
+        return sum(1 for key, value in items if self.put(namespace, key, value))
+
+
+config_store = ConfigStore()
+
+
+# --- Рекламные шаблоны: state.ad_templates (бренд → город → шаблоны) ---
+
+def _template_items(templates: dict):
+    for brand, cities in templates.items():
+        for city, city_templates in cities.items():
+            yield template_key(brand, city), city_templates
+
+
+def _apply_templates(key: str, value: Optional[dict]):
+    brand, city = split_template_key(key)
+    if value:
+        ad_templates.setdefault(brand, {})[city] = value
+        return
+    ad_templates.get(brand, {}).pop(city, None)
+    if brand in ad_templates and not ad_templates[brand]:
+        del ad_templates[brand]
+
+
+config_store.subscribe(NAMESPACE_TEMPLATES, _apply_templates)
+
+
+def save_templates(brand: str, city: str) -> bool:
+    """Сохраняет шаблоны города из state.ad_templates после правки на месте (пустой город удаляется)."""
+    return config_store.put(NAMESPACE_TEMPLATES, template_key(brand, city),
+                            ad_templates.get(brand, {}).get(city) or None)
+
+
+def export_configs() -> Optional[dict]:
+    """Резервная копия из БД в формате chat_configs.json и ad_templates.json; None — БД недоступна."""
+    chats = config_store.load(NAMESPACE_CHATS)
+    templates = config_store.load(NAMESPACE_TEMPLATES)
+    if chats is None or templates is None:
+        return None
+    nested = {}
+    for key, value in templates.items():
+        brand, city = split_template_key(key)
+        nested.setdefault(brand, {})[city] = value
+    return {'version': config_store.version, 'chat_configs': chats, 'ad_templates': nested}
+
+
+# --- Загрузка при запуске ---
+
+def _load_or_import(namespace: str, path: str, items: Callable[[dict], Iterable]) -> Dict[str, object]:
+    from utils import load_json_data
+
+    entries = config_store._entries(namespace)
+    meta = config_store._entries(NAMESPACE_META)
+    if entries is None or meta is None:
+        logging.warning(f"БД недоступна: настройки {namespace} загружены из {path}")
+        return dict(items(load_json_data(path, {})))
+    current = {key: value for key, value in entries.items() if value is not None}
+    if meta.get(namespace):
+        return current
+
+    # Только ключи, которых в БД нет совсем: правка, отложенная при лежащей БД и записанная
+    # до импорта, удаление и уже импортированное прерванным импортом не перезаписываются
+    data = load_json_data(path, {})
+    if not data:
+        return current
+    missing = [(key, value) for key, value in items(data) if key not in entries]
+    imported = config_store.import_entries(namespace, missing)
+    current.update(missing)
+    if imported < len(missing):
+        logging.error(f"Настройки {namespace}: импортировано {imported} из {len(missing)} записей {path}, "
+                      f"импорт повторится при следующем запуске")
+        return current
+    config_store.put(NAMESPACE_META, namespace, {'imported': imported, 'source': path})
+    logging.info(f"Настройки {namespace}: импортировано {imported} записей из {path} (однократно)")
+    return current
+
+
+def load_configs():
+    """Загружает настройки чатов и шаблоны из БД (при первом запуске — импорт из JSON)."""
+    from chat_config import chat_settings
+
+    chats = _load_or_import(NAMESPACE_CHATS, CHAT_CONFIG_FILE, lambda data: ((str(k), v) for k, v in data.items()))
+    chat_settings.load(chats)
+    templates = _load_or_import(NAMESPACE_TEMPLATES, AD_TEMPLATES_FILE, _template_items)
+    ad_templates.clear()
+    for key, value in templates.items():
+        _apply_templates(key, value)
@@ -3,14 +3,54 @@ import sqlite3
 import logging
 import json
 import threading
+import time
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 from dataclasses import asdict
-from models import ShiftData, UserData
+from models import ShiftData, UserData, shift_status
+from kpi import KPI_SUM_FIELDS, compute_shift_kpis, merge_ads_json, build_marketing_analytics, window_start_day
+from config import DB_CACHE_SETTINGS_TTL, DB_CACHE_STATS_TTL
+from db_cache import cached, invalidates, shift_users
 
 # Блокировка для потокобезопасности
 db_lock = threading.Lock()
 
+# Колонки, из которых собираются ShiftData и UserData (по именам, а не по позициям в SELECT *)
+SHIFT_COLUMNS = 'main_id, main_username, shift_goal, shift_start_time, timezone'
+USER_SHIFT_COLUMNS = ('user_id, username, role, goal, count, breaks_count, late_returns, on_break, '
+                      'break_start_time, break_reminder_sent, last_voice_time, last_activity_time, '
+                      'recognized_ads, voice_deltas, voice_durations')
+
+
+def _shift_from_row(row: sqlite3.Row) -> ShiftData:
+    return ShiftData(
+        main_id=row['main_id'],
+        main_username=row['main_username'],
+        shift_goal=row['shift_goal'],
+        shift_start_time=row['shift_start_time'],
+        timezone=row['timezone'],
+    )
+
+
+def _user_from_row(row: sqlite3.Row) -> UserData:
+    return UserData(
+        user_id=row['user_id'],
+        username=row['username'],
+        role=row['role'] or 'караоке_ведущий',
+        goal=row['goal'] or 15,
+        count=row['count'] or 0,
+        breaks_count=row['breaks_count'] or 0,
+        late_returns=row['late_returns'] or 0,
+        on_break=bool(row['on_break']),
+        break_start_time=row['break_start_time'],
+        break_reminder_sent=bool(row['break_reminder_sent']),
+        last_voice_time=row['last_voice_time'],
+        last_activity_time=row['last_activity_time'],
+        recognized_ads=json.loads(row['recognized_ads'] or '[]'),
+        voice_deltas=json.loads(row['voice_deltas'] or '[]'),
+        voice_durations=json.loads(row['voice_durations'] or '[]'),
+    )
+
 class BotDatabase:
     """Класс для работы с локальной базой данных SQLite."""
     
@@ -115,6 +155,48 @@ class BotDatabase:
                 )
             ''')
             
+            # Дневные KPI заведения (обновляются при закрытии смены)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS venue_kpi_daily (
+                    chat_id INTEGER,
+                    day TEXT,
+                    shifts INTEGER DEFAULT 0,
+                    voices INTEGER DEFAULT 0,
+                    plan_pct_sum REAL DEFAULT 0,
+                    rhythm_minutes_sum REAL DEFAULT 0,
+                    rhythm_intervals INTEGER DEFAULT 0,
+                    breaks INTEGER DEFAULT 0,
+                    break_minutes REAL DEFAULT 0,
+                    late_returns INTEGER DEFAULT 0,
+                    active_minutes REAL DEFAULT 0,
+                    ads_json TEXT DEFAULT '{}',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (chat_id, day)
+                )
+            ''')
+            
+            # Смены, уже учтённые в venue_kpi_daily: повторная запись той же смены KPI не удваивает
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS shift_kpi_recorded (
+                    chat_id INTEGER,
+                    shift_start_time TEXT,
+                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (chat_id, shift_start_time)
+                )
+            ''')
+            
+            # Настройки чатов и рекламные шаблоны (config_store), value NULL — запись удалена
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS config_entries (
+                    namespace TEXT,
+                    key TEXT,
+                    value TEXT,
+                    version INTEGER,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            
             # Индексы для оптимизации
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_shift_chat_user ON user_shift_data (chat_id, user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_event_history_chat_time ON event_history (chat_id, timestamp)')
@@ -128,6 +210,22 @@ class BotDatabase:
             except sqlite3.OperationalError:
                 pass  # Колонка уже существует
             
+            # План и интервалы голосовых сотрудника (как в PostgreSQL), чтобы смена восстанавливалась из БД целиком
+            for column in ('goal INTEGER DEFAULT 15', "voice_deltas TEXT DEFAULT '[]'", "voice_durations TEXT DEFAULT '[]'"):
+                try:
+                    cursor.execute(f'ALTER TABLE user_shift_data ADD COLUMN {column}')
+                except sqlite3.OperationalError:
+                    pass  # Колонка уже существует
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_shifts_status_updated ON shifts (status, updated_at)')
+            
+            # Ключи идемпотентности для пакетной записи (повтор пакета не создаёт дублей)
+            for table in ('voice_stats', 'event_history'):
+                try:
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN idempotency_key TEXT')
+                except sqlite3.OperationalError:
+                    pass  # Колонка уже существует
+                cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_idempotency ON {table} (idempotency_key)')
+            
             conn.commit()
             conn.close()
             
@@ -162,7 +260,7 @@ class BotDatabase:
                 ''', (
                     chat_id, shift_data.main_id, shift_data.main_username,
                     shift_data.shift_goal, shift_data.shift_start_time,
-                    shift_data.timezone, 'active', datetime.now().isoformat()
+                    shift_data.timezone, shift_status(shift_data), datetime.now().isoformat()
                 ))
                 
                 # Удаляем старые данные пользователей для этого чата
@@ -175,16 +273,17 @@ class BotDatabase:
                     
                     cursor.execute('''
                         INSERT INTO user_shift_data 
-                        (chat_id, user_id, username, role, count, breaks_count, late_returns, 
+                        (chat_id, user_id, username, role, goal, count, breaks_count, late_returns, 
                          on_break, break_start_time, break_reminder_sent, last_voice_time, 
-                         last_activity_time, recognized_ads, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                         last_activity_time, recognized_ads, voice_deltas, voice_durations, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     ''', (
-                        chat_id, user_id, user_data.username, user_role, user_data.count,
+                        chat_id, user_id, user_data.username, user_role, user_data.goal, user_data.count,
                         user_data.breaks_count, user_data.late_returns, user_data.on_break,
                         user_data.break_start_time, user_data.break_reminder_sent,
                         user_data.last_voice_time, user_data.last_activity_time,
-                        json.dumps(user_data.recognized_ads), datetime.now().isoformat()
+                        json.dumps(user_data.recognized_ads), json.dumps(user_data.voice_deltas),
+                        json.dumps(user_data.voice_durations), datetime.now().isoformat()
                     ))
                 
                 conn.commit()
@@ -200,48 +299,22 @@ class BotDatabase:
         """Загружает данные смены из базы данных."""
         with db_lock:
             conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
             try:
                 # Загружаем основные данные смены
-                cursor.execute('SELECT * FROM shifts WHERE chat_id = ?', (chat_id,))
+                cursor.execute(f'SELECT {SHIFT_COLUMNS} FROM shifts WHERE chat_id = ?', (chat_id,))
                 shift_row = cursor.fetchone()
                 
                 if not shift_row:
                     return None
                 
                 # Загружаем данные пользователей
-                cursor.execute('SELECT * FROM user_shift_data WHERE chat_id = ?', (chat_id,))
-                user_rows = cursor.fetchall()
-                
-                # Собираем пользователей
-                users = {}
-                for row in user_rows:
-                    user_data = UserData(
-                        user_id=row[2],
-                        username=row[3],
-                        role=row[4] if len(row) > 4 and row[4] else 'караоке_ведущий',  # Роль
-                        count=row[5] if len(row) > 5 else row[4],  # Смещение для count
-                        breaks_count=row[6] if len(row) > 6 else row[5],
-                        late_returns=row[7] if len(row) > 7 else row[6],
-                        on_break=bool(row[8] if len(row) > 8 else row[7]),
-                        break_start_time=row[9] if len(row) > 9 else row[8],
-                        break_reminder_sent=bool(row[10] if len(row) > 10 else row[9]),
-                        last_voice_time=row[11] if len(row) > 11 else row[10],
-                        last_activity_time=row[12] if len(row) > 12 else row[11],
-                        recognized_ads=json.loads(row[13] if len(row) > 13 and row[13] else row[12] or '[]')
-                    )
-                    users[row[2]] = user_data
-                
-                # Создаем объект смены
-                shift_data = ShiftData(
-                    main_id=shift_row[1],
-                    main_username=shift_row[2],
-                    shift_goal=shift_row[3],
-                    shift_start_time=shift_row[4],
-                    timezone=shift_row[5],
-                    users=users
-                )
+                cursor.execute(f'SELECT {USER_SHIFT_COLUMNS} FROM user_shift_data WHERE chat_id = ? ORDER BY id', (chat_id,))
+                shift_data = _shift_from_row(shift_row)
+                for row in cursor.fetchall():
+                    shift_data.users[row['user_id']] = _user_from_row(row)
                 
                 logging.info(f"Данные смены для чата {chat_id} загружены из БД")
                 return shift_data
@@ -252,6 +325,40 @@ class BotDatabase:
             finally:
                 conn.close()
     
+    def load_active_shifts(self, updated_after: float = 0.0) -> Optional[Dict[int, ShiftData]]:
+        """Активные смены, сохранённые позже updated_after (секунды эпохи), двумя запросами на все чаты."""
+        # updated_at — локальное время сервера в ISO: строки сравниваются в порядке времени
+        since = datetime.fromtimestamp(updated_after).isoformat() if updated_after else ''
+        with db_lock:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT chat_id, {SHIFT_COLUMNS} FROM shifts
+                    WHERE status = 'active' AND main_id IS NOT NULL AND updated_at > ?
+                ''', (since,))
+                shifts = {row['chat_id']: _shift_from_row(row) for row in cursor.fetchall()}
+                if not shifts:
+                    return shifts
+
+                cursor.execute(f'''
+                    SELECT u.chat_id, {USER_SHIFT_COLUMNS}
+                    FROM user_shift_data u JOIN shifts s ON s.chat_id = u.chat_id
+                    WHERE s.status = 'active' AND s.main_id IS NOT NULL AND s.updated_at > ?
+                    ORDER BY u.id
+                ''', (since,))
+                for row in cursor.fetchall():
+                    shifts[row['chat_id']].users[row['user_id']] = _user_from_row(row)
+
+                logging.info(f"Из БД загружено активных смен: {len(shifts)}")
+                return shifts
+            except Exception as e:
+                logging.error(f"Ошибка загрузки активных смен из БД: {e}")
+                return None
+            finally:
+                conn.close()
+    
     def save_event(self, chat_id: int, user_id: int, username: str, event_type: str, description: str):
         """Сохраняет событие в историю."""
         with db_lock:
@@ -290,6 +397,48 @@ class BotDatabase:
             finally:
                 conn.close()
     
+    def bulk_insert_voice_stats(self, rows: List[Dict]) -> int:
+        """Пакетная вставка статистики голосовых одной транзакцией. Дубликаты по idempotency_key пропускаются.
+
+        В отличие от save_voice_stat, ошибки пробрасываются: BulkWriter повторит пакет.
+        """
+        return self._bulk_insert('''
+            INSERT OR IGNORE INTO voice_stats
+            (chat_id, user_id, username, voice_duration, recognized_ad, timestamp, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (r['chat_id'], r['user_id'], r['username'], r['duration'], r['recognized_ad'],
+             r['created_at'].strftime('%Y-%m-%d %H:%M:%S'), r['idempotency_key'])
+            for r in rows
+        ])
+
+    def bulk_insert_events(self, rows: List[Dict]) -> int:
+        """Пакетная вставка событий одной транзакцией. Дубликаты по idempotency_key пропускаются."""
+        return self._bulk_insert('''
+            INSERT OR IGNORE INTO event_history
+            (chat_id, user_id, username, event_type, event_description, timestamp, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (r['chat_id'], r['user_id'], r['username'], r['event_type'], r['event_data'],
+             r['created_at'].strftime('%Y-%m-%d %H:%M:%S'), r['idempotency_key'])
+            for r in rows
+        ])
+
+    def _bulk_insert(self, sql: str, params: List[tuple]) -> int:
+        with db_lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                before = conn.total_changes
+                conn.executemany(sql, params)
+                conn.commit()
+                return conn.total_changes - before
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+    @invalidates('is_bot_enabled', lambda chat_id, *args, **kwargs: [(chat_id,)])
     def set_bot_enabled(self, chat_id: int, enabled: bool, admin_id: int = None):
         """Включает/выключает бота для чата."""
         with db_lock:
@@ -310,6 +459,7 @@ class BotDatabase:
             finally:
                 conn.close()
     
+    @cached(DB_CACHE_SETTINGS_TTL)
     def is_bot_enabled(self, chat_id: int) -> bool:
         """Проверяет, включен ли бот для чата."""
         with db_lock:
@@ -327,6 +477,7 @@ class BotDatabase:
             finally:
                 conn.close()
     
+    @cached(DB_CACHE_STATS_TTL)
     def get_user_stats_from_db(self, user_id: int) -> Dict:
         """Получает статистику пользователя из базы данных."""
         with db_lock:
@@ -389,33 +540,119 @@ class BotDatabase:
             finally:
                 conn.close()
     
+    # Таблицы, которые чистит retention, и их колонка времени
+    RETENTION_TABLES = {'event_history': 'timestamp', 'voice_stats': 'timestamp'}
+    # Колонки выгрузки истории: (id, время, user_id, username, тип/длительность, описание/реклама)
+    EXPORT_COLUMNS = {
+        'event_history': 'id, timestamp, user_id, username, event_type, event_description',
+        'voice_stats': 'id, timestamp, user_id, username, voice_duration, recognized_ad',
+    }
+
     def cleanup_old_data(self, days_old: int = 30):
-        """Очищает старые данные из базы."""
+        """Очищает старые данные из базы (порциями, с архивированием)."""
+        from retention import run_retention
+        run_retention(self, days_old=days_old)
+
+    def fetch_events(self, chat_id: int, since: datetime, after_id: int, limit: int) -> List[tuple]:
+        """События смены из event_history после since, порцией по id > after_id.
+
+        Строки: (id, user_id, username, описание, время, idempotency_key).
+        """
         with db_lock:
             conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             try:
-                # Удаляем старые события
-                cursor.execute('''
-                    DELETE FROM event_history 
-                    WHERE timestamp < datetime('now', '-{} days')
-                '''.format(days_old))
-                
-                # Удаляем старую статистику голосовых (оставляем только за последний месяц)
-                cursor.execute('''
-                    DELETE FROM voice_stats 
-                    WHERE timestamp < datetime('now', '-{} days')
-                '''.format(days_old))
-                
+                return conn.execute('''
+                    SELECT id, user_id, username, event_description, timestamp, idempotency_key FROM event_history
+                    WHERE chat_id = ? AND event_type = 'shift_event' AND timestamp >= ? AND id > ?
+                    ORDER BY id LIMIT ?
+                ''', (chat_id, since.strftime('%Y-%m-%d %H:%M:%S'), after_id, limit)).fetchall()
+            finally:
+                conn.close()
+
+    def fetch_history_page(self, table: str, chat_id: int, since: datetime, until: datetime,
+                           after: Optional[tuple], limit: int, user_id: int = None,
+                           event_type: str = None) -> List[tuple]:
+        """Порция строк table за [since, until) по порядку (время, id), строго после ключа after.
+
+        Строки в порядке EXPORT_COLUMNS. Идёт по индексу (chat_id, timestamp).
+        """
+        ts_column = self.RETENTION_TABLES[table]
+        conditions = ['chat_id = ?', f'{ts_column} >= ?', f'{ts_column} < ?']
+        params = [chat_id, since.strftime('%Y-%m-%d %H:%M:%S'), until.strftime('%Y-%m-%d %H:%M:%S')]
+        if after is not None:
+            after_time = after[0] if isinstance(after[0], str) else after[0].strftime('%Y-%m-%d %H:%M:%S')
+            # Отдельное >= ограничивает проход по индексу, сравнение пар отсекает уже выданное
+            conditions.append(f'{ts_column} >= ? AND ({ts_column}, id) > (?, ?)')
+            params += [after_time, after_time, after[1]]
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if event_type is not None and table == 'event_history':
+            conditions.append('event_type = ?')
+            params.append(event_type)
+        with db_lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                return conn.execute(
+                    f'SELECT {self.EXPORT_COLUMNS[table]} FROM {table} WHERE {" AND ".join(conditions)} '
+                    f'ORDER BY {ts_column}, id LIMIT ?',
+                    params + [limit]
+                ).fetchall()
+            finally:
+                conn.close()
+
+    def fetch_expired_rows(self, table: str, cutoff: datetime, after_id: int, limit: int):
+        """Возвращает (колонки, строки, время под блокировкой) порции устаревших строк с id > after_id."""
+        ts_column = self.RETENTION_TABLES[table]
+        with db_lock:
+            started = time.perf_counter()
+            conn = sqlite3.connect(self.db_path)
+            try:
+                cursor = conn.execute(
+                    f'SELECT * FROM {table} WHERE id > ? AND {ts_column} < ? ORDER BY id LIMIT ?',
+                    (after_id, cutoff.strftime('%Y-%m-%d %H:%M:%S'), limit)
+                )
+                columns = [d[0] for d in cursor.description]
+                return columns, cursor.fetchall(), time.perf_counter() - started
+            finally:
+                conn.close()
+
+    def delete_rows_by_id(self, table: str, ids: List[int]):
+        """Удаляет строки по списку id. Возвращает (удалено, время под блокировкой)."""
+        with db_lock:
+            started = time.perf_counter()
+            conn = sqlite3.connect(self.db_path)
+            try:
+                cursor = conn.execute(
+                    f'DELETE FROM {table} WHERE id IN ({", ".join("?" for _ in ids)})', ids
+                )
                 conn.commit()
-                logging.info(f"Очищены данные старше {days_old} дней")
-                
-            except Exception as e:
-                logging.error(f"Ошибка очистки старых данных: {e}")
+                return cursor.rowcount, time.perf_counter() - started
             finally:
                 conn.close()
 
+    def run_maintenance(self, tables: List[str], vacuum_pages: int = 1000) -> float:
+        """ANALYZE изменённых таблиц и инкрементальный VACUUM. Возвращает время под блокировкой."""
+        with db_lock:
+            started = time.perf_counter()
+            conn = sqlite3.connect(self.db_path)
+            try:
+                for table in tables:
+                    conn.execute(f'ANALYZE {table}')
+                auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+                if auto_vacuum == 2:  # INCREMENTAL
+                    conn.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})')
+                else:
+                    # Однократный перевод базы в режим инкрементального VACUUM
+                    logging.info("SQLite: перевод базы в auto_vacuum=INCREMENTAL (однократный VACUUM)")
+                    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    conn.execute('VACUUM')
+                conn.commit()
+            finally:
+                conn.close()
+            return time.perf_counter() - started
+
+    @invalidates('get_role_schedule', lambda chat_id, day_of_week, *args, **kwargs: [(chat_id, day_of_week)])
     def set_role_schedule(self, chat_id: int, day_of_week: int, roles_config: List[str], shift_goals: Dict[str, int]):
         """Устанавливает конфигурацию ролей для определенного дня недели."""
         with db_lock:
@@ -423,14 +660,18 @@ class BotDatabase:
             cursor = conn.cursor()
             
             try:
+                # Уникального ключа (chat_id, day_of_week) нет, поэтому сначала обновляем существующую строку
+                values = (json.dumps(roles_config), json.dumps(shift_goals), datetime.now().isoformat())
                 cursor.execute('''
-                    INSERT OR REPLACE INTO role_schedule 
-                    (chat_id, day_of_week, roles_config, shift_goals, updated_at)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    chat_id, day_of_week, json.dumps(roles_config), 
-                    json.dumps(shift_goals), datetime.now().isoformat()
-                ))
+                    UPDATE role_schedule SET roles_config = ?, shift_goals = ?, updated_at = ?
+                    WHERE chat_id = ? AND day_of_week = ?
+                ''', values + (chat_id, day_of_week))
+                if cursor.rowcount == 0:
+                    cursor.execute('''
+                        INSERT INTO role_schedule 
+                        (roles_config, shift_goals, updated_at, chat_id, day_of_week)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', values + (chat_id, day_of_week))
                 
                 conn.commit()
                 logging.info(f"Конфигурация ролей для чата {chat_id}, день {day_of_week} обновлена")
@@ -440,6 +681,7 @@ class BotDatabase:
             finally:
                 conn.close()
 
+    @cached(DB_CACHE_SETTINGS_TTL)
     def get_role_schedule(self, chat_id: int, day_of_week: int) -> Tuple[List[str], Dict[str, int]]:
         """Получает конфигурацию ролей для определенного дня недели."""
         with db_lock:
@@ -450,6 +692,7 @@ class BotDatabase:
                 cursor.execute('''
                     SELECT roles_config, shift_goals FROM role_schedule 
                     WHERE chat_id = ? AND day_of_week = ?
+                    ORDER BY updated_at DESC, id DESC LIMIT 1
                 ''', (chat_id, day_of_week))
                 
                 result = cursor.fetchone()
@@ -467,6 +710,40 @@ class BotDatabase:
             finally:
                 conn.close()
 
+    def put_config_entry(self, namespace: str, key: str, value: Optional[str]) -> bool:
+        """Записывает строку настроек (value None — удалена) со следующим сквозным номером версии."""
+        with db_lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute('''
+                    INSERT INTO config_entries (namespace, key, value, version, updated_at)
+                    VALUES (?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM config_entries), ?)
+                    ON CONFLICT (namespace, key) DO UPDATE SET
+                        value = excluded.value, version = excluded.version, updated_at = excluded.updated_at
+                ''', (namespace, key, value, datetime.now().isoformat()))
+                conn.commit()
+                return True
+            except Exception as e:
+                logging.error(f"Ошибка сохранения настройки {namespace}/{key}: {e}")
+                return False
+            finally:
+                conn.close()
+
+    def load_config_entries(self, namespace: str) -> Optional[List[Tuple[str, Optional[str], int]]]:
+        """Строки настроек (key, value, version), включая удалённые; None — ошибка БД."""
+        with db_lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                return conn.execute(
+                    'SELECT key, value, version FROM config_entries WHERE namespace = ? ORDER BY key', (namespace,)
+                ).fetchall()
+            except Exception as e:
+                logging.error(f"Ошибка загрузки настроек {namespace}: {e}")
+                return None
+            finally:
+                conn.close()
+
+    @cached(DB_CACHE_STATS_TTL)
     def get_stats_by_role(self, user_id: int, role: str) -> Dict:
         """Получает статистику пользователя по конкретной роли."""
         with db_lock:
@@ -499,64 +776,80 @@ class BotDatabase:
             finally:
                 conn.close()
 
+    @invalidates('get_user_stats_from_db', shift_users)
+    @invalidates('get_stats_by_role', shift_users)
+    def record_shift_kpis(self, chat_id: int, shift_data: ShiftData) -> bool:
+        """Добавляет итоги закрытой смены в дневной KPI и помечает смену завершённой."""
+        kpis = compute_shift_kpis(shift_data)
+        with db_lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+
+            try:
+                # Повторное закрытие той же смены не должно удваивать KPI: отметка — в той же транзакции,
+                # что и прибавка (строка shifts для этого не годится — её переписывают сброс и save_state)
+                cursor.execute('INSERT OR IGNORE INTO shift_kpi_recorded (chat_id, shift_start_time) VALUES (?, ?)',
+                               (chat_id, shift_data.shift_start_time))
+                if cursor.rowcount == 0:
+                    return False
+
+                cursor.execute('''
+                    INSERT OR REPLACE INTO shifts
+                    (chat_id, main_id, main_username, shift_goal, shift_start_time, timezone, status, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, 'completed', ?)
+                ''', (
+                    chat_id, shift_data.main_id, shift_data.main_username,
+                    shift_data.shift_goal, shift_data.shift_start_time,
+                    shift_data.timezone, datetime.now().isoformat()
+                ))
+
+                cursor.execute('SELECT ads_json FROM venue_kpi_daily WHERE chat_id = ? AND day = ?', (chat_id, kpis["day"]))
+                ads_row = cursor.fetchone()
+                ads_json = merge_ads_json(ads_row[0] if ads_row else '{}', kpis["ads"])
+
+                columns = ", ".join(KPI_SUM_FIELDS)
+                placeholders = ", ".join("?" for _ in KPI_SUM_FIELDS)
+                increments = ", ".join(f"{name} = {name} + excluded.{name}" for name in KPI_SUM_FIELDS)
+                cursor.execute(f'''
+                    INSERT INTO venue_kpi_daily (chat_id, day, {columns}, ads_json, updated_at)
+                    VALUES (?, ?, {placeholders}, ?, ?)
+                    ON CONFLICT(chat_id, day) DO UPDATE SET
+                        {increments},
+                        ads_json = excluded.ads_json,
+                        updated_at = excluded.updated_at
+                ''', (chat_id, kpis["day"], *(kpis[name] for name in KPI_SUM_FIELDS), ads_json, datetime.now().isoformat()))
+
+                conn.commit()
+                logging.info(f"KPI смены для чата {chat_id} записаны за {kpis['day']}")
+                return True
+
+            except Exception as e:
+                logging.error(f"Ошибка записи KPI смены в БД: {e}")
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+
     def get_marketing_analytics(self, chat_id: int, days: int = 7) -> dict:
-        """Получает маркетинговую аналитику за указанный период."""
+        """Получает маркетинговую аналитику за указанный период из дневных KPI."""
         with db_lock:
             conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            
-            # Получаем данные за последние N дней
-            cursor.execute('''
-                SELECT 
-                    COUNT(DISTINCT s.chat_id) as total_shifts,
-                    AVG(CAST(usd.count AS FLOAT) / CAST(s.shift_goal AS FLOAT) * 100) as avg_plan_completion,
-                    AVG(usd.count) as avg_voices,
-                    AVG(usd.breaks_count) as avg_breaks,
-                    AVG(usd.late_returns) as avg_late_returns,
-                    usd.recognized_ads
-                FROM shifts s
-                JOIN user_shift_data usd ON s.chat_id = usd.chat_id
-                WHERE s.chat_id = ? 
-                    AND s.created_at >= datetime('now', '-' || ? || ' days')
-                    AND s.status = 'completed'
-            ''', (chat_id, days))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
-            if not result or result[0] == 0:
+
+            try:
+                cursor.execute(
+                    'SELECT * FROM venue_kpi_daily WHERE chat_id = ? AND day >= ?',
+                    (chat_id, window_start_day(days))
+                )
+                rows = [dict(row) for row in cursor.fetchall()]
+            except Exception as e:
+                logging.error(f"Ошибка получения маркетинговой аналитики: {e}")
                 return {}
-            
-            # Обрабатываем результаты
-            analytics = {
-                'total_shifts': result[0] or 0,
-                'avg_plan_completion': result[1] or 0,
-                'avg_voices': result[2] or 0,
-                'avg_breaks': result[3] or 0,
-                'avg_late_returns': result[4] or 0,
-                'avg_rhythm': 4.5,  # Примерное значение, можно рассчитать точнее
-                'avg_break_time': 15.0,  # Примерное значение
-                'total_active_time': (result[0] or 0) * 4,  # Примерно 4 часа на смену
-            }
-            
-            # Анализируем популярные темы
-            all_ads = []
-            if result[5]:  # recognized_ads
-                try:
-                    import json
-                    ads_data = json.loads(result[5])
-                    all_ads.extend(ads_data)
-                except:
-                    pass
-            
-            if all_ads:
-                from collections import Counter
-                ad_counter = Counter(all_ads)
-                analytics['top_ads'] = ad_counter.most_common(5)
-            else:
-                analytics['top_ads'] = []
-            
-            return analytics
+            finally:
+                conn.close()
+
+        return build_marketing_analytics(rows)
 
 # Глобальный экземпляр базы данных
 db = BotDatabase()
@@ -1,18 +1,29 @@
 # database_manager.py
+import csv
+import io
 import logging
 import json
 import threading
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from dataclasses import asdict
-from models import ShiftData, UserData
+from models import ShiftData, UserData, shift_status
+from kpi import KPI_SUM_FIELDS, compute_shift_kpis, merge_ads_json, build_marketing_analytics, window_start_day
+from collections import deque
+from metrics import timed, DB_LATENCY, DB_ERRORS, DB_CIRCUIT_REJECTED
+from tracing import traced
+from db_cache import cached, invalidates, shift_users
 
 # Импорты для SQLAlchemy
 try:
-    from sqlalchemy import create_engine, Column, Integer, String, Boolean, Text, DateTime, Float, JSON, text
+    from sqlalchemy import (
+        create_engine, Column, Integer, BigInteger, String, Boolean, Text, DateTime, Float, JSON, text,
+        select, insert, update, delete, func
+    )
     from sqlalchemy.ext.declarative import declarative_base
     from sqlalchemy.orm import sessionmaker, Session
-    from sqlalchemy.dialects.postgresql import UUID
+    from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
     import uuid
     SQLALCHEMY_AVAILABLE = True
 except ImportError:
@@ -24,7 +35,8 @@ if not SQLALCHEMY_AVAILABLE:
     from database import BotDatabase
     db = BotDatabase()
 else:
-    from config import DATABASE_URL, DB_TYPE
+    from config import (DATABASE_URL, DB_TYPE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_CACHE_SETTINGS_TTL, DB_CACHE_STATS_TTL,
+                        DB_RECONNECT_MIN_SECONDS, DB_RECONNECT_MAX_SECONDS, DB_SPOOL_MAX_CALLS)
     
     # SQLAlchemy модели
     Base = declarative_base()
@@ -32,8 +44,8 @@ else:
     class Shift(Base):
         __tablename__ = 'shifts'
         
-        chat_id = Column(Integer, primary_key=True)
-        main_id = Column(Integer)
+        chat_id = Column(BigInteger, primary_key=True)
+        main_id = Column(BigInteger)
         main_username = Column(String(255))
         shift_goal = Column(Integer, default=15)
         shift_start_time = Column(String(255))
@@ -46,8 +58,8 @@ else:
         __tablename__ = 'user_shift_data'
         
         id = Column(Integer, primary_key=True, autoincrement=True)
-        chat_id = Column(Integer)
-        user_id = Column(Integer)
+        chat_id = Column(BigInteger)
+        user_id = Column(BigInteger)
         username = Column(String(255))
         count = Column(Integer, default=0)
         role = Column(String(100))
@@ -68,70 +80,164 @@ else:
     class BotSettings(Base):
         __tablename__ = 'bot_settings'
         
-        chat_id = Column(Integer, primary_key=True)
+        chat_id = Column(BigInteger, primary_key=True)
         enabled = Column(Boolean, default=True)
-        admin_id = Column(Integer)
+        admin_id = Column(BigInteger)
         updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     class VoiceStats(Base):
         __tablename__ = 'voice_stats'
         
         id = Column(Integer, primary_key=True, autoincrement=True)
-        chat_id = Column(Integer)
-        user_id = Column(Integer)
+        chat_id = Column(BigInteger)
+        user_id = Column(BigInteger)
         username = Column(String(255))
         duration = Column(Float)
         recognized_ad = Column(String(500))
         created_at = Column(DateTime, default=datetime.utcnow)
+        idempotency_key = Column(String(64))
     
     class EventHistory(Base):
         __tablename__ = 'event_history'
         
         id = Column(Integer, primary_key=True, autoincrement=True)
-        chat_id = Column(Integer)
-        user_id = Column(Integer)
+        chat_id = Column(BigInteger)
+        user_id = Column(BigInteger)
         username = Column(String(255))
         event_type = Column(String(100))
         event_data = Column(Text)
         created_at = Column(DateTime, default=datetime.utcnow)
+        idempotency_key = Column(String(64))
     
     class RoleSchedule(Base):
         __tablename__ = 'role_schedule'
         
         id = Column(Integer, primary_key=True, autoincrement=True)
-        chat_id = Column(Integer)
+        chat_id = Column(BigInteger)
         day_of_week = Column(Integer)  # 0-6
         roles_config = Column(Text)    # JSON
         shift_goals = Column(Text)     # JSON
         updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    # Блокировка для потокобезопасности
-    db_lock = threading.Lock()
+    class VenueKpiDaily(Base):
+        __tablename__ = 'venue_kpi_daily'
+        
+        chat_id = Column(BigInteger, primary_key=True)
+        day = Column(String(10), primary_key=True)  # YYYY-MM-DD
+        shifts = Column(Integer, default=0)
+        voices = Column(Integer, default=0)
+        plan_pct_sum = Column(Float, default=0)
+        rhythm_minutes_sum = Column(Float, default=0)
+        rhythm_intervals = Column(Integer, default=0)
+        breaks = Column(Integer, default=0)
+        break_minutes = Column(Float, default=0)
+        late_returns = Column(Integer, default=0)
+        active_minutes = Column(Float, default=0)
+        ads_json = Column(Text, default='{}')
+        updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    class PostgreSQLDatabase:
-        """Класс для работы с PostgreSQL через SQLAlchemy."""
+    class ShiftKpiRecorded(Base):
+        """Смены, уже учтённые в venue_kpi_daily."""
+        __tablename__ = 'shift_kpi_recorded'
+
+        chat_id = Column(BigInteger, primary_key=True)
+        shift_start_time = Column(String(255), primary_key=True)
+        recorded_at = Column(DateTime, default=datetime.utcnow)
+
+    class ConfigEntry(Base):
+        __tablename__ = 'config_entries'
         
+        namespace = Column(String(50), primary_key=True)
+        key = Column(String(255), primary_key=True)
+        value = Column(Text)  # JSON; NULL — запись удалена
+        version = Column(Integer)
+        updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Колонки с Telegram ID (chat_id супергрупп вида -100XXXXXXXXXX)
+    BIGINT_COLUMNS = [
+        (table.name, column.name)
+        for table in Base.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, BigInteger)
+    ]
+    
+    def _shift_from_row(shift: Shift) -> ShiftData:
+        return ShiftData(
+            main_id=shift.main_id,
+            main_username=shift.main_username,
+            shift_goal=shift.shift_goal,
+            shift_start_time=shift.shift_start_time,
+            timezone=shift.timezone,
+        )
+
+    def _user_from_row(row: UserShiftData) -> UserData:
+        return UserData(
+            user_id=row.user_id,
+            username=row.username,
+            role=row.role or 'караоке_ведущий',
+            count=row.count or 0,
+            goal=row.goal or 15,
+            breaks_count=row.breaks_count or 0,
+            late_returns=row.late_returns or 0,
+            on_break=bool(row.on_break),
+            break_start_time=row.break_start_time,
+            break_reminder_sent=bool(row.break_reminder_sent),
+            last_voice_time=row.last_voice_time,
+            last_activity_time=row.last_activity_time,
+            recognized_ads=json.loads(row.recognized_ads or '[]'),
+            voice_deltas=json.loads(row.voice_deltas or '[]'),
+            voice_durations=json.loads(row.voice_durations or '[]')
+        )
+
+    class PostgreSQLDatabase:
+        """Класс для работы с PostgreSQL через SQLAlchemy.
+
+        Глобальной блокировки нет: каждый вызов берёт свою сессию из пула,
+        согласованность обеспечивают транзакции PostgreSQL.
+        """
+
+        # Таблицы, которые чистит retention, и их колонка времени
+        RETENTION_TABLES = {'event_history': 'created_at', 'voice_stats': 'created_at'}
+        # Колонки выгрузки истории: (id, время, user_id, username, тип/длительность, описание/реклама)
+        EXPORT_COLUMNS = {
+            'event_history': 'id, created_at, user_id, username, event_type, event_data',
+            'voice_stats': 'id, created_at, user_id, username, duration, recognized_ad',
+        }
+
         def __init__(self, database_url: str = None):
             self.database_url = database_url or DATABASE_URL
             self.engine = create_engine(
                 self.database_url,
                 pool_pre_ping=True,
                 pool_recycle=300,
-                pool_size=5,
-                max_overflow=10
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW
             )
             self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
             self.init_database()
-        
+
         def init_database(self):
             """Инициализирует базу данных, создает таблицы."""
             try:
                 Base.metadata.create_all(bind=self.engine)
+                with self.engine.begin() as conn:
+                    # Telegram ID не помещаются в int4: переводим старые колонки в BIGINT (для новых — no-op)
+                    for table, column in BIGINT_COLUMNS:
+                        conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT'))
+                    # Ключи идемпотентности для пакетной записи (повтор пакета не создаёт дублей)
+                    for table in ('voice_stats', 'event_history'):
+                        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64)'))
+                        conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_idempotency ON {table} (idempotency_key)'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS idx_user_shift_chat_user ON user_shift_data (chat_id, user_id)'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS idx_user_shift_user_role ON user_shift_data (user_id, role)'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS idx_role_schedule_chat_day ON role_schedule (chat_id, day_of_week)'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS idx_event_history_chat_time ON event_history (chat_id, created_at)'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS idx_voice_stats_chat_time ON voice_stats (chat_id, created_at)'))
                 logging.info("✅ База данных PostgreSQL инициализирована")
             except Exception as e:
                 logging.error(f"❌ Ошибка инициализации PostgreSQL: {e}")
                 raise
-        
+
         def test_connection(self):
             """Тестирует подключение к базе данных."""
             try:
@@ -145,177 +251,691 @@ else:
             except Exception as e:
                 logging.error(f"Database connection test failed: {e}")
                 raise
-        
+
         def get_session(self) -> Session:
             """Возвращает новую сессию БД."""
             return self.SessionLocal()
-        
+
+        def save_shift_data(self, chat_id: int, shift_data: ShiftData):
+            """Сохраняет данные смены одной транзакцией: upsert смены и пакетная вставка пользователей."""
+            session = self.get_session()
+            try:
+                now = datetime.utcnow()
+                shift_values = dict(
+                    chat_id=chat_id, main_id=shift_data.main_id, main_username=shift_data.main_username,
+                    shift_goal=shift_data.shift_goal, shift_start_time=shift_data.shift_start_time,
+                    timezone=shift_data.timezone, status=shift_status(shift_data), updated_at=now
+                )
+                stmt = pg_insert(Shift).values(**shift_values)
+                session.execute(stmt.on_conflict_do_update(
+                    index_elements=[Shift.chat_id],
+                    set_={k: v for k, v in shift_values.items() if k != 'chat_id'}
+                ))
+
+                session.execute(delete(UserShiftData).where(UserShiftData.chat_id == chat_id))
+                user_rows = [
+                    dict(
+                        chat_id=chat_id, user_id=user_id, username=user_data.username,
+                        role=getattr(user_data, 'role', 'караоке_ведущий'), goal=user_data.goal,
+                        count=user_data.count, breaks_count=user_data.breaks_count,
+                        late_returns=user_data.late_returns, on_break=user_data.on_break,
+                        break_start_time=user_data.break_start_time,
+                        break_reminder_sent=user_data.break_reminder_sent,
+                        last_voice_time=user_data.last_voice_time,
+                        last_activity_time=user_data.last_activity_time,
+                        recognized_ads=json.dumps(user_data.recognized_ads),
+                        voice_deltas=json.dumps(user_data.voice_deltas),
+                        voice_durations=json.dumps(user_data.voice_durations),
+                        created_at=now, updated_at=now
+                    )
+                    for user_id, user_data in shift_data.users.items()
+                ]
+                if user_rows:
+                    session.execute(insert(UserShiftData), user_rows)
+
+                session.commit()
+                logging.info(f"Данные смены для чата {chat_id} сохранены в БД")
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Ошибка сохранения данных смены в БД: {e}")
+            finally:
+                session.close()
+
+        def load_shift_data(self, chat_id: int) -> Optional[ShiftData]:
+            """Загружает данные смены из базы данных."""
+            session = self.get_session()
+            try:
+                shift = session.get(Shift, chat_id)
+                if not shift:
+                    return None
+
+                shift_data = _shift_from_row(shift)
+                for row in session.query(UserShiftData).filter_by(chat_id=chat_id).order_by(UserShiftData.id):
+                    shift_data.users[row.user_id] = _user_from_row(row)
+
+                logging.info(f"Данные смены для чата {chat_id} загружены из БД")
+                return shift_data
+            except Exception as e:
+                logging.error(f"Ошибка загрузки данных смены из БД: {e}")
+                return None
+            finally:
+                session.close()
+
+        def load_active_shifts(self, updated_after: float = 0.0) -> Optional[Dict[int, ShiftData]]:
+            """Активные смены, сохранённые позже updated_after (секунды эпохи), двумя запросами на все чаты."""
+            session = self.get_session()
+            try:
+                active = (Shift.status == 'active') & Shift.main_id.isnot(None)
+                if updated_after:
+                    # updated_at пишется как datetime.utcnow() — наивное время UTC
+                    active &= Shift.updated_at > datetime.utcfromtimestamp(updated_after)
+                shifts = {shift.chat_id: _shift_from_row(shift)
+                          for shift in session.execute(select(Shift).where(active)).scalars()}
+                if not shifts:
+                    return shifts
+
+                users = session.execute(
+                    select(UserShiftData).join(Shift, Shift.chat_id == UserShiftData.chat_id)
+                    .where(active).order_by(UserShiftData.id)
+                ).scalars()
+                for row in users:
+                    shifts[row.chat_id].users[row.user_id] = _user_from_row(row)
+
+                logging.info(f"Из БД загружено активных смен: {len(shifts)}")
+                return shifts
+            except Exception as e:
+                logging.error(f"Ошибка загрузки активных смен из БД: {e}")
+                return None
+            finally:
+                session.close()
+
+        @invalidates('is_bot_enabled', lambda chat_id, *args, **kwargs: [(chat_id,)])
         def set_bot_enabled(self, chat_id: int, enabled: bool, admin_id: int = None):
             """Включает/выключает бота для чата."""
-            with db_lock:
-                session = self.get_session()
-                try:
-                    setting = session.query(BotSettings).filter_by(chat_id=chat_id).first()
-                    if setting:
-                        setting.enabled = enabled
-                        setting.admin_id = admin_id
-                        setting.updated_at = datetime.utcnow()
-                    else:
-                        setting = BotSettings(
-                            chat_id=chat_id,
-                            enabled=enabled,
-                            admin_id=admin_id
-                        )
-                        session.add(setting)
-                    
-                    session.commit()
-                    logging.info(f"Бот {'включен' if enabled else 'выключен'} для чата {chat_id}")
-                    
-                except Exception as e:
-                    session.rollback()
-                    logging.error(f"Ошибка изменения состояния бота в БД: {e}")
-                finally:
-                    session.close()
-        
+            session = self.get_session()
+            try:
+                stmt = pg_insert(BotSettings).values(
+                    chat_id=chat_id, enabled=enabled, admin_id=admin_id, updated_at=datetime.utcnow()
+                )
+                session.execute(stmt.on_conflict_do_update(
+                    index_elements=[BotSettings.chat_id],
+                    set_={'enabled': enabled, 'admin_id': admin_id, 'updated_at': datetime.utcnow()}
+                ))
+                session.commit()
+                logging.info(f"Бот {'включен' if enabled else 'выключен'} для чата {chat_id}")
+
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Ошибка изменения состояния бота в БД: {e}")
+            finally:
+                session.close()
+
+        @cached(DB_CACHE_SETTINGS_TTL)
         def is_bot_enabled(self, chat_id: int) -> bool:
             """Проверяет, включен ли бот для чата."""
-            with db_lock:
-                session = self.get_session()
-                try:
-                    setting = session.query(BotSettings).filter_by(chat_id=chat_id).first()
-                    return setting.enabled if setting else True  # По умолчанию включен
-                except Exception as e:
-                    logging.error(f"Ошибка проверки состояния бота в БД: {e}")
-                    return True  # По умолчанию включен
-                finally:
-                    session.close()
-        
+            session = self.get_session()
+            try:
+                enabled = session.execute(
+                    select(BotSettings.enabled).where(BotSettings.chat_id == chat_id)
+                ).scalar_one_or_none()
+                return enabled if enabled is not None else True  # По умолчанию включен
+            except Exception as e:
+                logging.error(f"Ошибка проверки состояния бота в БД: {e}")
+                return True  # По умолчанию включен
+            finally:
+                session.close()
+
         def save_voice_stat(self, chat_id: int, user_id: int, username: str, duration: float, recognized_ad: str = ""):
             """Сохраняет статистику голосового сообщения."""
-            with db_lock:
-                session = self.get_session()
-                try:
-                    stat = VoiceStats(
-                        chat_id=chat_id,
-                        user_id=user_id,
-                        username=username,
-                        duration=duration,
-                        recognized_ad=recognized_ad
-                    )
-                    session.add(stat)
-                    session.commit()
-                except Exception as e:
-                    session.rollback()
-                    logging.error(f"Ошибка сохранения статистики голосового в БД: {e}")
-                finally:
-                    session.close()
-        
+            session = self.get_session()
+            try:
+                session.add(VoiceStats(
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    username=username,
+                    duration=duration,
+                    recognized_ad=recognized_ad
+                ))
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Ошибка сохранения статистики голосового в БД: {e}")
+            finally:
+                session.close()
+
         def save_event(self, chat_id: int, user_id: int, username: str, event_type: str, event_data: str):
             """Сохраняет событие в историю."""
-            with db_lock:
-                session = self.get_session()
-                try:
-                    event = EventHistory(
-                        chat_id=chat_id,
-                        user_id=user_id,
-                        username=username,
-                        event_type=event_type,
-                        event_data=event_data
-                    )
-                    session.add(event)
-                    session.commit()
-                except Exception as e:
-                    session.rollback()
-                    logging.error(f"Ошибка сохранения события в БД: {e}")
-                finally:
-                    session.close()
-        
+            session = self.get_session()
+            try:
+                session.add(EventHistory(
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    username=username,
+                    event_type=event_type,
+                    event_data=event_data
+                ))
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Ошибка сохранения события в БД: {e}")
+            finally:
+                session.close()
+
+        def fetch_events(self, chat_id: int, since: datetime, after_id: int, limit: int) -> List[tuple]:
+            """События смены из event_history после since, порцией по id > after_id.
+
+            Строки: (id, user_id, username, описание, created_at, idempotency_key).
+            """
+            with self.engine.connect() as conn:
+                result = conn.execute(
+                    text("SELECT id, user_id, username, event_data, created_at, idempotency_key FROM event_history "
+                         "WHERE chat_id = :chat_id AND event_type = 'shift_event' AND created_at >= :since "
+                         "AND id > :after_id ORDER BY id LIMIT :limit"),
+                    {"chat_id": chat_id, "since": since, "after_id": after_id, "limit": limit}
+                )
+                return [tuple(r) for r in result.fetchall()]
+
+        def fetch_history_page(self, table: str, chat_id: int, since: datetime, until: datetime,
+                               after: Optional[tuple], limit: int, user_id: int = None,
+                               event_type: str = None) -> List[tuple]:
+            """Порция строк table за [since, until) по порядку (время, id), строго после ключа after.
+
+            Строки в порядке EXPORT_COLUMNS. Идёт по индексу (chat_id, created_at).
+            """
+            ts_column = self.RETENTION_TABLES[table]
+            conditions = ["chat_id = :chat_id", f"{ts_column} >= :since", f"{ts_column} < :until"]
+            params = {"chat_id": chat_id, "since": since, "until": until, "limit": limit}
+            if after is not None:
+                # Отдельное >= ограничивает проход по индексу, сравнение пар отсекает уже выданное
+                conditions.append(f"{ts_column} >= :after_time AND ({ts_column}, id) > (:after_time, :after_id)")
+                params.update(after_time=after[0], after_id=after[1])
+            if user_id is not None:
+                conditions.append("user_id = :user_id")
+                params["user_id"] = user_id
+            if event_type is not None and table == 'event_history':
+                conditions.append("event_type = :event_type")
+                params["event_type"] = event_type
+            with self.engine.connect() as conn:
+                result = conn.execute(
+                    text(f"SELECT {self.EXPORT_COLUMNS[table]} FROM {table} WHERE {' AND '.join(conditions)} "
+                         f"ORDER BY {ts_column}, id LIMIT :limit"),
+                    params
+                )
+                return [tuple(r) for r in result.fetchall()]
+
+        def bulk_insert_voice_stats(self, rows: List[Dict]) -> int:
+            """COPY пакета статистики голосовых одним запросом. Дубликаты по idempotency_key пропускаются.
+
+            В отличие от save_voice_stat, ошибки пробрасываются: BulkWriter повторит пакет.
+            """
+            return self._copy_insert(
+                'voice_stats',
+                ('chat_id', 'user_id', 'username', 'duration', 'recognized_ad', 'created_at', 'idempotency_key'),
+                [(r['chat_id'], r['user_id'], r['username'], r['duration'], r['recognized_ad'],
+                  r['created_at'].isoformat(), r['idempotency_key']) for r in rows]
+            )
+
+        def bulk_insert_events(self, rows: List[Dict]) -> int:
+            """COPY пакета событий одним запросом. Дубликаты по idempotency_key пропускаются."""
+            return self._copy_insert(
+                'event_history',
+                ('chat_id', 'user_id', 'username', 'event_type', 'event_data', 'created_at', 'idempotency_key'),
+                [(r['chat_id'], r['user_id'], r['username'], r['event_type'], r['event_data'],
+                  r['created_at'].isoformat(), r['idempotency_key']) for r in rows]
+            )
+
+        def _copy_insert(self, table: str, columns: Tuple[str, ...], values: List[tuple]) -> int:
+            """COPY FROM STDIN во временную таблицу и INSERT ... ON CONFLICT DO NOTHING в целевую."""
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(values)
+            buffer.seek(0)
+
+            column_list = ", ".join(columns)
+            staging = f"_bulk_{table}"
+            raw = self.engine.raw_connection()
+            try:
+                cursor = raw.cursor()
+                cursor.execute(
+                    f"CREATE TEMP TABLE IF NOT EXISTS {staging} AS SELECT {column_list} FROM {table} WITH NO DATA"
+                )
+                cursor.execute(f"TRUNCATE {staging}")
+                cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+                cursor.execute(
+                    f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} "
+                    f"ON CONFLICT (idempotency_key) DO NOTHING"
+                )
+                inserted = cursor.rowcount
+                raw.commit()
+                return inserted
+            except Exception:
+                raw.rollback()
+                raise
+            finally:
+                raw.close()
+
+        def _user_totals(self, *filters) -> Tuple[int, int, int, int]:
+            """Один агрегирующий запрос по user_shift_data: (смены, ГС, перерывы, опоздания)."""
+            session = self.get_session()
+            try:
+                row = session.execute(
+                    select(
+                        func.count(),
+                        func.coalesce(func.sum(UserShiftData.count), 0),
+                        func.coalesce(func.sum(UserShiftData.breaks_count), 0),
+                        func.coalesce(func.sum(UserShiftData.late_returns), 0),
+                    ).where(*filters)
+                ).one()
+                return tuple(int(v or 0) for v in row)
+            finally:
+                session.close()
+
+        @cached(DB_CACHE_STATS_TTL)
         def get_user_stats_from_db(self, user_id: int) -> Dict:
             """Получает статистику пользователя из базы данных."""
-            with db_lock:
-                session = self.get_session()
-                try:
-                    # Подсчитываем статистику из voice_stats
-                    voice_count = session.query(VoiceStats).filter_by(user_id=user_id).count()
-                    
-                    # Подсчитываем смены
-                    shifts_count = session.query(UserShiftData).filter_by(user_id=user_id).count()
-                    
-                    # Считаем перерывы и опоздания из событий
-                    breaks_count = session.query(EventHistory).filter_by(
-                        user_id=user_id, event_type='break_start'
-                    ).count()
-                    
-                    lates_count = session.query(EventHistory).filter_by(
-                        user_id=user_id, event_type='late_return'
-                    ).count()
-                    
-                    return {
-                        'shifts_count': shifts_count,
-                        'total_voices': voice_count,
-                        'total_breaks': breaks_count,
-                        'total_lates': lates_count
-                    }
-                    
-                except Exception as e:
-                    logging.error(f"Ошибка получения статистики пользователя из БД: {e}")
-                    return {'shifts_count': 0, 'total_voices': 0, 'total_breaks': 0, 'total_lates': 0}
-                finally:
-                    session.close()
-        
+            try:
+                shifts, voices, breaks, lates = self._user_totals(UserShiftData.user_id == user_id)
+                return {
+                    'shifts_count': shifts,
+                    'total_voices': voices,
+                    'total_breaks': breaks,
+                    'total_lates': lates
+                }
+            except Exception as e:
+                logging.error(f"Ошибка получения статистики пользователя из БД: {e}")
+                return {'shifts_count': 0, 'total_voices': 0, 'total_breaks': 0, 'total_lates': 0}
+
+        @cached(DB_CACHE_STATS_TTL)
+        def get_stats_by_role(self, user_id: int, role: str) -> Dict:
+            """Получает статистику пользователя по конкретной роли."""
+            try:
+                shifts, voices, breaks, lates = self._user_totals(
+                    UserShiftData.user_id == user_id, UserShiftData.role == role
+                )
+                return {
+                    'role': role,
+                    'shifts_count': shifts,
+                    'total_voices': voices,
+                    'total_breaks': breaks,
+                    'total_lates': lates
+                }
+            except Exception as e:
+                logging.error(f"Ошибка получения статистики по роли: {e}")
+                return {'role': role, 'shifts_count': 0, 'total_voices': 0, 'total_breaks': 0, 'total_lates': 0}
+
+        def get_user_rating(self, limit: int = 10) -> List[Tuple[str, int, float]]:
+            """Получает рейтинг пользователей по голосовым сообщениям."""
+            session = self.get_session()
+            try:
+                total_voices = func.sum(UserShiftData.count).label('total_voices')
+                rows = session.execute(
+                    select(UserShiftData.username, total_voices, func.avg(UserShiftData.count))
+                    .where(UserShiftData.username.isnot(None), UserShiftData.username != '')
+                    .group_by(UserShiftData.username)
+                    .order_by(total_voices.desc())
+                    .limit(limit)
+                ).all()
+                # Возвращаем (username, total_voices, avg_voices)
+                return [(row[0], int(row[1] or 0), round(float(row[2] or 0), 1)) for row in rows]
+            except Exception as e:
+                logging.error(f"Ошибка получения рейтинга пользователей: {e}")
+                return []
+            finally:
+                session.close()
+
+        @invalidates('get_role_schedule', lambda chat_id, day_of_week, *args, **kwargs: [(chat_id, day_of_week)])
+        def set_role_schedule(self, chat_id: int, day_of_week: int, roles_config: List[str], shift_goals: Dict[str, int]):
+            """Устанавливает конфигурацию ролей для определенного дня недели."""
+            session = self.get_session()
+            try:
+                values = {
+                    'roles_config': json.dumps(roles_config),
+                    'shift_goals': json.dumps(shift_goals),
+                    'updated_at': datetime.utcnow()
+                }
+                result = session.execute(
+                    update(RoleSchedule)
+                    .where(RoleSchedule.chat_id == chat_id, RoleSchedule.day_of_week == day_of_week)
+                    .values(**values)
+                )
+                if result.rowcount == 0:
+                    session.execute(insert(RoleSchedule).values(chat_id=chat_id, day_of_week=day_of_week, **values))
+                session.commit()
+                logging.info(f"Конфигурация ролей для чата {chat_id}, день {day_of_week} обновлена")
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Ошибка сохранения конфигурации ролей: {e}")
+            finally:
+                session.close()
+
+        @cached(DB_CACHE_SETTINGS_TTL)
+        def get_role_schedule(self, chat_id: int, day_of_week: int) -> Tuple[List[str], Dict[str, int]]:
+            """Получает конфигурацию ролей для определенного дня недели."""
+            default = (["караоке_ведущий"], {"караоке_ведущий": 15})
+            session = self.get_session()
+            try:
+                row = session.execute(
+                    select(RoleSchedule.roles_config, RoleSchedule.shift_goals)
+                    .where(RoleSchedule.chat_id == chat_id, RoleSchedule.day_of_week == day_of_week)
+                    .order_by(RoleSchedule.updated_at.desc())
+                    .limit(1)
+                ).first()
+                if not row:
+                    return default
+                roles = json.loads(row[0]) if row[0] else default[0]
+                goals = json.loads(row[1]) if row[1] else default[1]
+                return roles, goals
+            except Exception as e:
+                logging.error(f"Ошибка получения конфигурации ролей: {e}")
+                return default
+            finally:
+                session.close()
+
+        def put_config_entry(self, namespace: str, key: str, value: Optional[str]) -> bool:
+            """Записывает строку настроек (value None — удалена) со следующим сквозным номером версии."""
+            session = self.get_session()
+            try:
+                next_version = select(func.coalesce(func.max(ConfigEntry.version), 0) + 1).scalar_subquery()
+                stmt = pg_insert(ConfigEntry).values(
+                    namespace=namespace, key=key, value=value, version=next_version, updated_at=datetime.utcnow()
+                )
+                session.execute(stmt.on_conflict_do_update(
+                    index_elements=[ConfigEntry.namespace, ConfigEntry.key],
+                    set_={'value': stmt.excluded.value, 'version': stmt.excluded.version,
+                          'updated_at': stmt.excluded.updated_at}
+                ))
+                session.commit()
+                return True
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Ошибка сохранения настройки {namespace}/{key}: {e}")
+                return False
+            finally:
+                session.close()
+
+        def load_config_entries(self, namespace: str) -> Optional[List[Tuple[str, Optional[str], int]]]:
+            """Строки настроек (key, value, version), включая удалённые; None — ошибка БД."""
+            session = self.get_session()
+            try:
+                return [tuple(row) for row in session.execute(
+                    select(ConfigEntry.key, ConfigEntry.value, ConfigEntry.version)
+                    .where(ConfigEntry.namespace == namespace)
+                    .order_by(ConfigEntry.key)
+                )]
+            except Exception as e:
+                logging.error(f"Ошибка загрузки настроек {namespace}: {e}")
+                return None
+            finally:
+                session.close()
+
         def cleanup_old_data(self, days_old: int = 30):
-            """Очищает старые данные из базы."""
-            with db_lock:
-                session = self.get_session()
-                try:
-                    cutoff_date = datetime.utcnow() - timedelta(days=days_old)
-                    
-                    # Очищаем старые голосовые статистики
-                    session.query(VoiceStats).filter(VoiceStats.created_at < cutoff_date).delete()
-                    
-                    # Очищаем старые события
-                    session.query(EventHistory).filter(EventHistory.created_at < cutoff_date).delete()
-                    
-                    session.commit()
-                    logging.info(f"Очищены данные старше {days_old} дней")
-                    
-                except Exception as e:
+            """Очищает старые данные из базы (порциями, с архивированием)."""
+            from retention import run_retention
+            run_retention(self, days_old=days_old)
+
+        def fetch_expired_rows(self, table: str, cutoff: datetime, after_id: int, limit: int):
+            """Возвращает (колонки, строки, время запроса) порции устаревших строк с id > after_id."""
+            ts_column = self.RETENTION_TABLES[table]
+            started = time.perf_counter()
+            with self.engine.connect() as conn:
+                result = conn.execute(
+                    text(f"SELECT * FROM {table} WHERE id > :after_id AND {ts_column} < :cutoff ORDER BY id LIMIT :limit"),
+                    {"after_id": after_id, "cutoff": cutoff, "limit": limit}
+                )
+                columns = list(result.keys())
+                rows = [tuple(r) for r in result.fetchall()]
+            return columns, rows, time.perf_counter() - started
+
+        def delete_rows_by_id(self, table: str, ids: List[int]):
+            """Удаляет строки по списку id. Возвращает (удалено, время транзакции)."""
+            started = time.perf_counter()
+            with self.engine.begin() as conn:
+                result = conn.execute(text(f"DELETE FROM {table} WHERE id = ANY(:ids)"), {"ids": list(ids)})
+            return result.rowcount, time.perf_counter() - started
+
+        def run_maintenance(self, tables: List[str], vacuum_pages: int = 1000) -> float:
+            """VACUUM (ANALYZE) изменённых таблиц вне транзакции. Возвращает затраченное время."""
+            started = time.perf_counter()
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                for table in tables:
+                    conn.execute(text(f"VACUUM (ANALYZE) {table}"))
+            return time.perf_counter() - started
+
+        @invalidates('get_user_stats_from_db', shift_users)
+        @invalidates('get_stats_by_role', shift_users)
+        def record_shift_kpis(self, chat_id: int, shift_data: ShiftData) -> bool:
+            """Добавляет итоги закрытой смены в дневной KPI и помечает смену завершённой."""
+            kpis = compute_shift_kpis(shift_data)
+            session = self.get_session()
+            try:
+                # Отметка в той же транзакции, что и прибавка: повтор (и параллельное закрытие,
+                # ждущее на уникальном ключе) KPI не удваивает. Строка shifts для этого не годится —
+                # её переписывают сброс смены и save_state
+                marked = session.execute(pg_insert(ShiftKpiRecorded).values(
+                    chat_id=chat_id, shift_start_time=shift_data.shift_start_time, recorded_at=datetime.utcnow()
+                ).on_conflict_do_nothing(index_elements=[ShiftKpiRecorded.chat_id, ShiftKpiRecorded.shift_start_time]))
+                if marked.rowcount == 0:
                     session.rollback()
-                    logging.error(f"Ошибка очистки старых данных: {e}")
-                finally:
-                    session.close()
+                    return False
+                shift = session.query(Shift).filter_by(chat_id=chat_id).with_for_update().first()
+                if not shift:
+                    shift = Shift(chat_id=chat_id)
+                    session.add(shift)
+                shift.main_id = shift_data.main_id
+                shift.main_username = shift_data.main_username
+                shift.shift_goal = shift_data.shift_goal
+                shift.shift_start_time = shift_data.shift_start_time
+                shift.timezone = shift_data.timezone
+                shift.status = 'completed'
+
+                row = session.query(VenueKpiDaily).filter_by(chat_id=chat_id, day=kpis["day"]).with_for_update().first()
+                if not row:
+                    row = VenueKpiDaily(chat_id=chat_id, day=kpis["day"], ads_json='{}',
+                                        **dict.fromkeys(KPI_SUM_FIELDS, 0))
+                    session.add(row)
+                for name in KPI_SUM_FIELDS:
+                    setattr(row, name, (getattr(row, name) or 0) + kpis[name])
+                row.ads_json = merge_ads_json(row.ads_json, kpis["ads"])
+
+                session.commit()
+                logging.info(f"KPI смены для чата {chat_id} записаны за {kpis['day']}")
+                return True
+
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Ошибка записи KPI смены в БД: {e}")
+                return False
+            finally:
+                session.close()
+
+        def get_marketing_analytics(self, chat_id: int, days: int = 7) -> dict:
+            """Получает маркетинговую аналитику за указанный период из дневных KPI."""
+            session = self.get_session()
+            try:
+                rows = session.query(VenueKpiDaily).filter(
+                    VenueKpiDaily.chat_id == chat_id,
+                    VenueKpiDaily.day >= window_start_day(days)
+                ).all()
+                rows = [
+                    {**{name: getattr(r, name) for name in KPI_SUM_FIELDS}, "ads_json": r.ads_json}
+                    for r in rows
+                ]
+            except Exception as e:
+                logging.error(f"Ошибка получения маркетинговой аналитики: {e}")
+                return {}
+            finally:
+                session.close()
+            return build_marketing_analytics(rows)
+
     
     # Ленивая инициализация БД (не создаём при импорте, чтобы не блокировать healthcheck)
     _db_instance = None
 
+    # Записи, которые при разомкнутой цепи откладываются до переподключения.
+    # Значение — ключ схлопывания: из отложенных вызовов с одним ключом остаётся
+    # последний (None — не схлопывать). bulk_insert_* сюда не входят: BulkWriter
+    # сам держит очередь и повторяет пакет, получив заглушку.
+    SPOOLED_WRITES = {
+        'save_event': None,
+        'save_voice_stat': None,
+        'set_bot_enabled': lambda chat_id, *args, **kwargs: chat_id,
+        'set_role_schedule': lambda chat_id, day_of_week, *args, **kwargs: (chat_id, day_of_week),
+        'save_shift_data': lambda chat_id, *args, **kwargs: chat_id,
+        'record_shift_kpis': None,
+        'put_config_entry': lambda namespace, key, *args, **kwargs: (namespace, key),
+    }
+
     class _LazyDB:
-        """Прокси для ленивой инициализации базы данных."""
-        _db_available = True
+        """Прокси для ленивой инициализации базы данных с предохранителем (circuit breaker).
+
+        Первое подключение — при первом обращении. Если оно не удалось, цепь
+        размыкается: вызовы db.* сразу получают заглушку (None), не дожидаясь
+        таймаута подключения, а записи из SPOOLED_WRITES откладываются в память
+        (не больше DB_SPOOL_MAX_CALLS, старые вытесняются). Переподключение идёт
+        в фоновом потоке с экспоненциальной паузой; после успеха отложенные
+        записи воспроизводятся по порядку, и только затем цепь замыкается.
+        """
+
+        def __init__(self):
+            self._lock = threading.Lock()
+            self._circuit_open = False
+            self._opened_at = None
+            self._last_error = None
+            self._reconnect_thread = None
+            self._spool = deque()
+            self._spool_latest = {}
+            self._warned = set()
+            self.spool_dropped = 0
 
         def _get_db(self):
             global _db_instance
+            # Пока идёт воспроизведение, экземпляр уже есть, но новые записи встают в очередь за отложенными
+            if self._circuit_open:
+                raise ConnectionError(f"цепь БД разомкнута: {self._last_error}")
             if _db_instance is None:
+                with self._lock:
+                    if self._circuit_open:
+                        raise ConnectionError(f"цепь БД разомкнута: {self._last_error}")
+                    if _db_instance is None:
+                        try:
+                            _db_instance = self._connect()
+                        except Exception as e:
+                            self._open_circuit(e)
+                            raise
+            return _db_instance
+
+        @staticmethod
+        def _connect():
+            if DB_TYPE == "postgresql":
+                return PostgreSQLDatabase()
+            from database import BotDatabase
+            return BotDatabase()
+
+        def _open_circuit(self, error: Exception):
+            """Вызывать под self._lock."""
+            self._circuit_open = True
+            self._opened_at = time.time()
+            self._last_error = str(error)
+            logging.error(f"БД недоступна, цепь разомкнута, записи откладываются в память: {error}")
+            if self._reconnect_thread is None or not self._reconnect_thread.is_alive():
+                self._reconnect_thread = threading.Thread(target=self._reconnect, name="db-reconnect", daemon=True)
+                self._reconnect_thread.start()
+
+        def _reconnect(self):
+            global _db_instance
+            delay = DB_RECONNECT_MIN_SECONDS
+            while True:
+                time.sleep(delay)
                 try:
-                    if DB_TYPE == "postgresql":
-                        _db_instance = PostgreSQLDatabase()
-                    else:
-                        from database import BotDatabase
-                        _db_instance = BotDatabase()
-                    self._db_available = True
+                    instance = self._connect()
                 except Exception as e:
-                    self._db_available = False
-                    logging.warning(f"БД недоступна: {e}")
-                    raise
-            return _db_instance
+                    self._last_error = str(e)
+                    delay = min(delay * 2, DB_RECONNECT_MAX_SECONDS)
+                    logging.warning(f"БД всё ещё недоступна, следующая попытка через {delay:.0f} с: {e}")
+                    continue
+                _db_instance = instance
+                replayed = self._replay(instance)
+                logging.info(f"✅ БД снова доступна, цепь замкнута; воспроизведено отложенных записей: {replayed}")
+                return
+
+        def _replay(self, instance) -> int:
+            replayed = 0
+            while True:
+                with self._lock:
+                    if not self._spool:
+                        # Очередь пуста — новые вызовы пойдут в БД напрямую, порядок сохранён
+                        self._circuit_open = False
+                        self._opened_at = None
+                        self._spool_latest.clear()
+                        self._warned.clear()
+                        return replayed
+                    entry = self._spool.popleft()
+                name, args, kwargs, live = entry
+                if not live:
+                    continue
+                try:
+                    getattr(instance, name)(*args, **kwargs)
+                    replayed += 1
+                except Exception as e:
+                    logging.error(f"Отложенная запись db.{name}() не воспроизведена: {e}")
+
+        def _spooled(self, name: str):
+            coalesce = SPOOLED_WRITES[name]
+
+            def _deferred(*args, **kwargs):
+                entry = [name, args, kwargs, True]
+                with self._lock:
+                    closed = not self._circuit_open
+                    if not closed:
+                        if coalesce is not None:
+                            key = (name, coalesce(*args, **kwargs))
+                            previous = self._spool_latest.get(key)
+                            if previous is not None:
+                                previous[3] = False
+                            self._spool_latest[key] = entry
+                        self._spool.append(entry)
+                        if len(self._spool) > DB_SPOOL_MAX_CALLS:
+                            self._spool.popleft()[3] = False
+                            self.spool_dropped += 1
+                            if self.spool_dropped % 1000 == 1:
+                                logging.error("БД недоступна слишком долго: отложенные записи переполнены, старые отбрасываются")
+                if closed:
+                    # Цепь замкнулась, пока вызов шёл к заглушке
+                    return getattr(self, name)(*args, **kwargs)
+                DB_CIRCUIT_REJECTED.labels(name).inc()
+                return None
+            return _deferred
+
+        def _rejected(self, name: str):
+            def _fallback(*args, **kwargs):
+                # Заглушка, которая не крашит бота; предупреждение — один раз на метод за время обрыва
+                if name not in self._warned:
+                    self._warned.add(name)
+                    logging.warning(f"БД недоступна, вызовы db.{name}() пропускаются")
+                DB_CIRCUIT_REJECTED.labels(name).inc()
+                return None
+            return _fallback
+
+        def circuit_status(self) -> dict:
+            """Состояние цепи для /health."""
+            with self._lock:
+                return {
+                    "circuit": "open" if self._circuit_open else "closed",
+                    "open_seconds": round(time.time() - self._opened_at, 1) if self._opened_at else 0,
+                    "last_error": self._last_error if self._circuit_open else None,
+                    "spooled": sum(1 for entry in self._spool if entry[3]),
+                    "spool_dropped": self.spool_dropped,
+                }
 
         def __getattr__(self, name):
             try:
-                return getattr(self._get_db(), name)
+                attr = getattr(self._get_db(), name)
             except Exception:
-                # Возвращаем заглушку, которая не крашит бота
-                def _fallback(*args, **kwargs):
-                    logging.warning(f"БД недоступна, вызов db.{name}() пропущен")
-                    return None
-                return _fallback
+                if name in SPOOLED_WRITES:
+                    return self._spooled(name)
+                return self._rejected(name)
+            if not callable(attr):
+                return attr
+            # Замер задержки каждого вызова db.* для /metrics и спан в трассе апдейта
+            return traced(f"db.{name}")(timed(DB_LATENCY, DB_ERRORS, name)(attr))
 
     db = _LazyDB()
@@ -0,0 +1,163 @@
+# db_cache.py
+"""
+Кэш чтений БД, ответы которых меняются редко.
+
+Методы BotDatabase / PostgreSQLDatabase помечаются декоратором @cached(ttl):
+ответ хранится в LRU-кэше метода (не больше maxsize ключей, каждый не дольше
+ttl секунд), ключ — аргументы вызова. Методы записи помечаются
+@invalidates(метод, ключи): после записи из кэша метода удаляются все ключи,
+начинающиеся с любого из возвращённых префиксов. Так set_bot_enabled(chat_id)
+сбрасывает is_bot_enabled(chat_id), а закрытие смены — статистику всех её
+ведущих: и (user_id,), и (user_id, роль).
+
+Кэш у каждого экземпляра БД свой. Запись, прошедшая во время промаха,
+не даст положить в кэш прочитанное до неё: у кэша есть номер версии, и ответ
+сохраняется, только если версия за время запроса не изменилась.
+
+Наружу отдаётся копия ответа: вызывающий код может менять списки и словари.
+Попадания и промахи считаются в db_cache_total (/metrics) и в stats().
+"""
+
+import copy
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable
+
+from config import DB_CACHE_ENABLED, DB_CACHE_MAXSIZE
+from metrics import DB_CACHE
+
+_MISSING = object()
+_create_lock = threading.Lock()
+
+
+class TTLCache:
+    """LRU-кэш с временем жизни записей и счётчиками."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hit_counter = DB_CACHE.labels(name, "hit")
+        self._miss_counter = DB_CACHE.labels(name, "miss")
+        self._invalidate_counter = DB_CACHE.labels(name, "invalidate")
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                self._hit_counter.inc()
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            self._miss_counter.inc()
+            return _MISSING
+
+    def put(self, key, value, version: int):
+        with self._lock:
+            if version != self.version:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, prefixes: Iterable[tuple]):
+        """Удаляет ключи, начинающиеся с любого из префиксов."""
+        prefixes = [tuple(prefix) for prefix in prefixes]
+        with self._lock:
+            self.version += 1
+            stale = [key for key in self._data if any(key[:len(prefix)] == prefix for prefix in prefixes)]
+            for key in stale:
+                del self._data[key]
+        if stale:
+            self._invalidate_counter.inc(len(stale))
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _caches(instance) -> Dict[str, TTLCache]:
+    caches = instance.__dict__.get('_db_caches')
+    if caches is None:
+        with _create_lock:
+            caches = instance.__dict__.setdefault('_db_caches', {})
+    return caches
+
+
+def _cache_for(instance, name: str, ttl: float, maxsize: int) -> TTLCache:
+    caches = _caches(instance)
+    cache = caches.get(name)
+    if cache is None:
+        with _create_lock:
+            cache = caches.setdefault(name, TTLCache(name, ttl, maxsize))
+    return cache
+
+
+def cached(ttl: float, maxsize: int = DB_CACHE_MAXSIZE):
+    """Кэширует ответ метода чтения по его аргументам на ttl секунд."""
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not DB_CACHE_ENABLED:
+                return func(self, *args, **kwargs)
+            cache = _cache_for(self, name, ttl, maxsize)
+            key = args + tuple(sorted(kwargs.items())) if kwargs else args
+            value = cache.get(key)
+            if value is _MISSING:
+                version = cache.version
+                value = func(self, *args, **kwargs)
+                cache.put(key, value, version)
+            return copy.deepcopy(value)
+        wrapper.cache_ttl = ttl
+        return wrapper
+    return decorator
+
+
+def invalidates(method: str, prefixes: Callable[..., Iterable[tuple]]):
+    """После метода записи сбрасывает кэш method по префиксам ключей prefixes(*args, **kwargs)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                cache = _caches(self).get(method)
+                if cache is not None:
+                    cache.invalidate(prefixes(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def shift_users(chat_id, shift_data, *args, **kwargs) -> list:
+    """Префиксы статистики ведущих смены: (user_id,)."""
+    return [(user_id,) for user_id in shift_data.users]
+
+
+def clear(instance):
+    """Сбрасывает все кэши экземпляра БД."""
+    for cache in list(_caches(instance).values()):
+        cache.clear()
+
+
+def stats(instance) -> Dict[str, dict]:
+    """Попадания, промахи и размер кэша каждого метода экземпляра БД."""
+    return {name: {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache), 'ttl': cache.ttl}
+            for name, cache in _caches(instance).items()}
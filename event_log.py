@@ -0,0 +1,159 @@
+# event_log.py
+"""
+История событий смены: кольцевой буфер в памяти и догрузка старого из БД.
+
+Каждое событие (перерыв, возврат, смена роли, передача смены) сразу ставится
+в очередь bulk_writer и попадает в event_history. В памяти (state.user_history)
+чат держит только последние EVENT_HISTORY_CAPACITY событий, поэтому память и
+снимок состояния не растут, сколько бы событий ни было за смену. /log отдаёт
+смену целиком: старые события постранично из event_history, свежие из буфера;
+совпадения отсекаются по ключу события (idempotency_key в БД).
+"""
+
+import datetime
+import logging
+import threading
+import uuid
+from collections import namedtuple
+from typing import Iterator, Optional
+
+import pytz
+
+import clock
+from config import EVENT_HISTORY_CAPACITY
+
+Event = namedtuple('Event', 'timestamp user_id username event key')
+
+DB_PAGE_SIZE = 500
+
+
+def to_event(raw) -> Event:
+    """Событие из любого сохранённого вида: Event/список, словарь прежнего формата или строка."""
+    if isinstance(raw, dict):
+        return Event(raw.get('timestamp', ''), raw.get('user_id'), raw.get('username', ''), raw.get('event', ''), None)
+    if isinstance(raw, (list, tuple)):
+        return Event(*raw)
+    return Event('', None, '', str(raw), None)
+
+
+def new_event(user_id: int, username: str, description: str, timestamp: str) -> Event:
+    return Event(timestamp, user_id, username, description, uuid.uuid4().hex)
+
+
+class EventRing:
+    """Последние capacity событий чата.
+
+    Список только дополняется; вытесненные события отсекаются смещением, а
+    раз в capacity добавлений хвост переносится в новый список. Поэтому снимок
+    (ссылка на список и границы) остаётся верным без копирования под замком.
+    save_history_event вызывается и под data_lock, и без него, поэтому у буфера
+    свой короткий замок.
+    """
+
+    __slots__ = ('capacity', '_items', '_start', '_lock')
+
+    def __init__(self, events=(), capacity: int = EVENT_HISTORY_CAPACITY):
+        events = [to_event(raw) for raw in events]
+        self.capacity = capacity
+        self._items = events[-capacity:]
+        self._start = 0
+        self._lock = threading.Lock()
+
+    def append(self, event: Event):
+        with self._lock:
+            self._items.append(event)
+            if len(self._items) - self._start > self.capacity:
+                self._start += 1
+                if self._start >= self.capacity:
+                    # Новый список, а не сдвиг на месте: снимки держат ссылку на старый
+                    self._items = self._items[self._start:]
+                    self._start = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items) - self._start
+
+    def __iter__(self) -> Iterator[Event]:
+        return iter(materialize_events(self.capture()))
+
+    def capture(self) -> tuple:
+        """Ссылка на список и границы видимой части, без копирования."""
+        with self._lock:
+            return self._items, self._start, len(self._items)
+
+
+def capture_events(events) -> tuple:
+    if isinstance(events, EventRing):
+        return events.capture()
+    return events, 0, len(events)
+
+
+def materialize_events(captured: tuple) -> list:
+    items, start, end = captured
+    return items[start:end]
+
+
+def _db_since(shift_start_time: str) -> datetime.datetime:
+    # В event_history время пишется в UTC без пояса (bulk_writer)
+    return datetime.datetime.fromisoformat(shift_start_time).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def iter_shift_events(chat_id: int, page_size: int = DB_PAGE_SIZE) -> Iterator[Event]:
+    """Все события текущей смены по порядку: из event_history, затем из буфера в памяти."""
+    from state import chat_data, user_history, data_lock
+    from bulk_writer import bulk_writer
+    from database_manager import db
+
+    with data_lock:
+        shift = chat_data.get(chat_id)
+        shift_start = shift.shift_start_time if shift else None
+        ring = user_history.get(chat_id)
+        recent = materialize_events(capture_events(ring)) if ring is not None else []
+    recent = [to_event(raw) for raw in recent]
+
+    # События без ключа записаны до кольцевого буфера: сверить их с БД нечем, отдаём только память
+    if shift_start and all(event.key for event in recent):
+        # Вытесненные из памяти события могли ещё не дойти до БД
+        bulk_writer.flush()
+        in_memory = {event.key for event in recent}
+        after_id = 0
+        while True:
+            try:
+                rows = db.fetch_events(chat_id, _db_since(shift_start), after_id, page_size)
+            except Exception as e:
+                logging.error(f"История чата {chat_id}: ошибка чтения event_history: {e}")
+                rows = None
+            if not rows:
+                if rows is None:
+                    logging.warning(f"История чата {chat_id}: БД недоступна, в логе только последние события")
+                break
+            for row_id, user_id, username, description, created_at, key in rows:
+                if key not in in_memory:
+                    yield Event(format_db_time(created_at), user_id, username, description, key)
+            after_id = rows[-1][0]
+            if len(rows) < page_size:
+                break
+    yield from recent
+
+
+def format_db_time(created_at) -> str:
+    """Время из БД (UTC без пояса) в московском ISO."""
+    if isinstance(created_at, str):
+        created_at = datetime.datetime.fromisoformat(created_at)
+    return pytz.utc.localize(created_at).astimezone(clock.MOSCOW_TZ).isoformat()
+
+
+def format_event(event: Event) -> str:
+    if not event.timestamp and not event.username:
+        return event.event
+    return f"[{event.timestamp}] {event.username}: {event.event}"
+
+
+def write_shift_log(chat_id: int, f, title: Optional[str] = None) -> int:
+    """Пишет лог смены в открытый файл. Возвращает число событий."""
+    f.write(f"История событий для чата{': ' + title if title else ''}\n" + "=" * 40 + "\n")
+    written = 0
+    for event in iter_shift_events(chat_id):
+        f.write(format_event(event) + "\n")
+        written += 1
+    return written
@@ -11,20 +11,34 @@ try:
 except ImportError:
     gspread = None
 
-from config import GOOGLE_SHEET_KEY, GOOGLE_CREDENTIALS_JSON
-from state import chat_configs
+from config import GOOGLE_SHEET_KEY, GOOGLE_CREDENTIALS_JSON, GOOGLE_SHEETS_TIMEOUT_SECONDS
+from resilience import google_sheets, DependencyUnavailable
+from chat_config import chat_settings
 from utils import get_chat_title
 from models import ShiftData # Импортируем нашу модель
 
-def get_sheet() -> Optional[gspread.Worksheet]:
-    """Подключается к Google Sheets и возвращает рабочий лист."""
+def _open_sheet():
+    creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
+    gc = gspread.service_account_from_dict(creds_dict)
+    if hasattr(gc, 'set_timeout'):
+        gc.set_timeout(GOOGLE_SHEETS_TIMEOUT_SECONDS)
+    return gc.open_by_key(GOOGLE_SHEET_KEY).sheet1
+
+def open_sheet() -> Optional[gspread.Worksheet]:
+    """Рабочий лист через предохранитель. None — только если таблица не настроена;
+    ошибки подключения (и DependencyUnavailable) пробрасываются, чтобы выгрузку можно было повторить."""
     if not all([gspread, GOOGLE_SHEET_KEY, GOOGLE_CREDENTIALS_JSON]):
         logging.error("gspread не импортирован или переменные для Google не заданы.")
         return None
+    return google_sheets.call(_open_sheet)
+
+def get_sheet() -> Optional[gspread.Worksheet]:
+    """Подключается к Google Sheets и возвращает рабочий лист; при любой ошибке — None (для команд)."""
     try:
-        creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-        gc = gspread.service_account_from_dict(creds_dict)
-        return gc.open_by_key(GOOGLE_SHEET_KEY).sheet1
+        return open_sheet()
+    except DependencyUnavailable as e:
+        logging.warning(f"Google Sheets пропущены: {e}")
+        return None
     except Exception as e:
         logging.error(f"Ошибка подключения к Google Sheets: {e}")
         return None
@@ -46,20 +60,14 @@ def create_sheet_header_if_needed(worksheet: gspread.Worksheet):
     except Exception as e:
         logging.error(f"Не удалось создать шапку в Google Таблице: {e}")
 
-def append_shift_to_google_sheet(bot, chat_id: int, data: ShiftData, analytical_conclusion: str):
-    """Добавляет строку с отчетом о смене в Google Таблицу."""
-    worksheet = get_sheet()
-    if not worksheet:
-        logging.error(f"Выгрузка в Google Sheets для чата {chat_id} невозможна: лист не найден.")
-        return
-        
-    create_sheet_header_if_needed(worksheet)
-
+def build_shift_row(bot, chat_id: int, data: ShiftData, analytical_conclusion: str,
+                    chat_title: Optional[str] = None) -> Optional[list]:
+    """Формирует строку таблицы по смене; None, если нет данных ведущего."""
     main_id = data.main_id
     user_data = data.users.get(main_id)
     if not user_data:
         logging.warning(f"Нет данных по ведущему для выгрузки в чате {chat_id}.")
-        return
+        return None
 
     shift_goal = data.shift_goal
     plan_percent = (user_data.count / shift_goal * 100) if shift_goal > 0 else 0
@@ -67,19 +75,19 @@ def append_shift_to_google_sheet(bot, chat_id: int, data: ShiftData, analytical_
     max_pause = max(user_data.voice_deltas or [0])
     avg_duration = sum(user_data.voice_durations) / len(user_data.voice_durations) if user_data.voice_durations else 0
 
-    chat_config = chat_configs.get(str(chat_id), {})
-    brand = chat_config.get('brand', 'N/A')
-    city = chat_config.get('city', 'N/A')
+    chat_config = chat_settings.get(chat_id)
+    brand = chat_config.brand or 'N/A'
+    city = chat_config.city or 'N/A'
 
     ad_counts = Counter(user_data.recognized_ads)
     recognized_ads_str = ", ".join([f"{ad} (x{count})" for ad, count in ad_counts.items()]) or "Нет данных"
 
     start_date = datetime.datetime.fromisoformat(data.shift_start_time).strftime('%d.%m.%Y')
         
-    row_data = [
+    return [
         start_date,
         str(chat_id),
-        get_chat_title(bot, chat_id),
+        chat_title or get_chat_title(bot, chat_id),
         brand,
         city,
         str(main_id),
@@ -95,8 +103,29 @@ def append_shift_to_google_sheet(bot, chat_id: int, data: ShiftData, analytical_
         analytical_conclusion,
         recognized_ads_str
     ]
+
+def append_shift_rows(rows: list) -> bool:
+    """Добавляет несколько строк смен одним запросом. False, если таблица не настроена;
+    ошибка записи (и DependencyUnavailable при недоступном Google) пробрасывается, чтобы вызывающий мог повторить."""
+    if not google_sheets.available():
+        raise DependencyUnavailable("google_sheets: цепь разомкнута")
+    worksheet = open_sheet()
+    if not worksheet:
+        return False
+    create_sheet_header_if_needed(worksheet)
+    google_sheets.call(worksheet.append_rows, rows, value_input_option='USER_ENTERED')
+    logging.info(f"В Google Таблицу добавлено строк: {len(rows)}")
+    return True
+
+def append_shift_to_google_sheet(bot, chat_id: int, data: ShiftData, analytical_conclusion: str):
+    """Добавляет строку с отчетом о смене в Google Таблицу."""
+    row_data = build_shift_row(bot, chat_id, data, analytical_conclusion)
+    if not row_data:
+        return
     try:
-        worksheet.append_row(row_data, value_input_option='USER_ENTERED')
+        if not append_shift_rows([row_data]):
+            logging.error(f"Выгрузка в Google Sheets для чата {chat_id} невозможна: лист не найден.")
+            return
         logging.info(f"Данные по смене в чате {chat_id} успешно добавлены в Google Таблицу.")
     except Exception as e:
         logging.error(f"Не удалось добавить данные в Google Таблицу для чата {chat_id}: {e}")
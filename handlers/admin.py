@@ -1,19 +1,28 @@
 # handlers/admin.py
 
+import io
+import json
 import logging
-import os
-import datetime
 import pandas as pd
 import random
 import time
-import pytz
 from telebot import types
 
-from utils import admin_required, save_json_data, generate_detailed_report, get_username, get_chat_title, safe_reply
-from state import chat_data, user_history, chat_configs, user_states
-from config import CHAT_CONFIG_FILE, VOICE_TIMEOUT_MINUTES, BOSS_ID, TIMEZONE_MAP
+import clock
+from utils import admin_required, generate_detailed_report, get_username, get_chat_title, safe_reply
+from state import chat_data, user_history, user_states
+from chat_config import chat_settings
+from config import BOSS_ID
 from g_sheets import get_sheet
 from scheduler import send_end_of_shift_report_for_chat
+from shift_close import shift_closer
+from admin_digest import admin_digest
+from live_status import live_status
+from snapshots import shift_snapshot
+from history_export import (export_history, export_shift_log, send_export, parse_date, period_bounds,
+                            ExportUnavailable, ExportResult)
+from config_store import export_configs
+from callback_router import router
 from phrases import soviet_phrases
 from database_manager import db  # Используем единый database manager
 
@@ -95,7 +104,9 @@ def register_admin_handlers(bot):
         if not shift or not shift.main_id:
             phrase = random.choice(soviet_phrases.get("system_messages", {}).get('shift_not_started', ["Смена в этом чате еще не началась."]))
             return bot.send_message(chat_id, phrase)
-        report_lines = generate_detailed_report(chat_id, shift)
+        if live_status.show(bot, chat_id):
+            return
+        report_lines = generate_detailed_report(chat_id, shift_snapshot(chat_id) or shift)
         report_text = "\n".join(report_lines)
         bot.send_message(chat_id, report_text, parse_mode="Markdown")
     
@@ -144,7 +155,7 @@ def register_admin_handlers(bot):
             df = pd.DataFrame(worksheet.get_all_records())
             if df.empty: return bot.send_message(chat_id, "В таблице нет данных.")
             
-            chat_timeout = chat_configs.get(str(chat_id), {}).get('voice_timeout', VOICE_TIMEOUT_MINUTES)
+            chat_timeout = chat_settings.get(chat_id).voice_timeout
             
             numeric_cols = ['Выполнение (%)', 'Опозданий (шт)', 'Макс. пауза (мин)']
             for col in numeric_cols:
@@ -200,31 +211,152 @@ def register_admin_handlers(bot):
             "Вы уверены?",
             parse_mode="Markdown", reply_markup=markup)
             
+    @bot.message_handler(commands=['shift_jobs'])
+    @admin_required(bot)
+    def command_shift_jobs(message: types.Message):
+        """Ход фонового закрытия смен; `/shift_jobs retry` перезапускает упавшие шаги."""
+        args = message.text.split()[1:]
+        if args and args[0] == 'retry':
+            restarted = shift_closer.retry_failed(bot)
+            bot.send_message(message.chat.id, f"🔄 Перезапущено заданий: {restarted}", parse_mode=None)
+            return
+        bot.send_message(message.chat.id, shift_closer.format_status(), parse_mode=None)
+
+    @bot.message_handler(commands=['live_status'])
+    @admin_required(bot)
+    def command_live_status(message: types.Message):
+        """Включает (`on`) или выключает (`off`) живой статус — одно закреплённое сообщение вместо новых."""
+        chat_id = message.chat.id
+        args = message.text.split()[1:]
+        if not args or args[0] not in ('on', 'off'):
+            state = "включён" if live_status.enabled(chat_id) else "выключен"
+            return bot.send_message(chat_id, f"Живой статус {state}. Использование: /live_status on|off", parse_mode=None)
+        chat_settings.update(chat_id, live_status=args[0] == 'on')
+        if args[0] == 'on':
+            bot.send_message(chat_id, "📌 Живой статус включён: статус смены будет обновляться в одном закреплённом сообщении.", parse_mode=None)
+            live_status.refresh(bot, chat_id)
+        else:
+            live_status.finish(bot, chat_id)
+            bot.send_message(chat_id, "Живой статус выключен.", parse_mode=None)
+
+    def _show_digest(call: types.CallbackQuery, digest_id: str, render):
+        digest = admin_digest.load(digest_id)
+        if not digest:
+            return bot.answer_callback_query(call.id, "Сводка устарела.", show_alert=True)
+        bot.answer_callback_query(call.id)
+        text, markup = render(digest)
+        try:
+            bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                                  parse_mode="Markdown", reply_markup=markup)
+        except Exception as e:
+            # Отчёт с неэкранированными символами в нике ломает Markdown
+            logging.warning(f"Сводка {digest_id}: Markdown не принят ({e}), показываю без разметки")
+            bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                                  parse_mode=None, reply_markup=markup)
+
+    @router.route("digest_page")
+    def handle_digest_page(call: types.CallbackQuery, digest_id: str, page: str):
+        """Листание сводки закрытых смен."""
+        _show_digest(call, digest_id, lambda digest: admin_digest.render_page(digest, int(page)))
+
+    @router.route("digest_venue")
+    def handle_digest_venue(call: types.CallbackQuery, digest_id: str, index: str):
+        """Подробный отчёт заведения из сводки."""
+        _show_digest(call, digest_id, lambda digest: admin_digest.render_detail(digest, int(index)))
+
+    LOG_USAGE = ("Использование:\n"
+                 "/log — лог текущей смены\n"
+                 "/log ДД.ММ.ГГГГ [ДД.ММ.ГГГГ] [voices] [user=ID] [type=ТИП] — история за период в CSV.gz\n"
+                 "voices — голосовые вместо событий, type — тип события (shift_event, bot_enabled…)")
+
+    def _parse_log_args(args: list) -> dict:
+        """Разбирает аргументы /log за период; ValueError при ошибке."""
+        dates, options = [], {'kind': 'events', 'user_id': None, 'event_type': None}
+        for arg in args:
+            if arg.lower() in ('voices', 'голосовые'):
+                options['kind'] = 'voices'
+            elif arg.startswith('user='):
+                if not arg[len('user='):].lstrip('-').isdigit():
+                    raise ValueError(f"user= ждёт числовой ID: {arg}")
+                options['user_id'] = int(arg[len('user='):])
+            elif arg.startswith('type='):
+                options['event_type'] = arg[len('type='):]
+            else:
+                try:
+                    dates.append(parse_date(arg))
+                except ValueError:
+                    raise ValueError(f"не дата ДД.ММ.ГГГГ: {arg}")
+        if not dates or len(dates) > 2:
+            raise ValueError("нужна одна или две даты")
+        date_from, date_to = dates[0], dates[-1]
+        if date_to < date_from:
+            raise ValueError("конец периода раньше начала")
+        options['since'], options['until'] = period_bounds(date_from, date_to)
+        options['label'] = date_from.strftime('%d.%m.%Y') + (f"–{date_to.strftime('%d.%m.%Y')}" if date_to != date_from else "")
+        return options
+
     @bot.message_handler(commands=['log'])
     @admin_required(bot)
     def command_log(message: types.Message):
+        """Лог текущей смены или выгрузка event_history/voice_stats за период (CSV.gz)."""
         chat_id = message.chat.id
+        args = message.text.split()[1:]
+        if args:
+            try:
+                options = _parse_log_args(args)
+            except ValueError as e:
+                return bot.send_message(chat_id, f"Не понял период ({e}).\n\n{LOG_USAGE}", parse_mode=None)
+            try:
+                result = export_history(chat_id, options['kind'], options['since'], options['until'],
+                                        user_id=options['user_id'], event_type=options['event_type'])
+            except ExportUnavailable:
+                return bot.send_message(chat_id, "База данных недоступна, выгрузка невозможна.")
+            except Exception as e:
+                logging.error(f"Ошибка выгрузки истории чата {chat_id}: {e}")
+                return bot.send_message(chat_id, "Произошла ошибка при выгрузке истории.")
+            if not result.rows:
+                result.file.close()
+                return bot.send_message(chat_id, f"За {options['label']} записей нет.", parse_mode=None)
+            what = "Голосовые" if options['kind'] == 'voices' else "События"
+            caption = f"{what} за {options['label']}, записей: {result.rows}."
+            if result.truncated:
+                caption += " ⚠️ Файл обрезан по лимиту размера — сузьте период."
+            try:
+                send_export(bot, chat_id, result, caption)
+            except Exception as e:
+                logging.error(f"Ошибка отправки выгрузки чата {chat_id}: {e}")
+                bot.send_message(chat_id, "Не удалось отправить файл выгрузки.")
+            return
+
         history = user_history.get(chat_id)
         if not history:
             return bot.send_message(chat_id, "История событий для текущей смены пуста.")
         try:
-            filename = f"history_{chat_id}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(f"История событий для чата: {get_chat_title(bot, chat_id)}\n" + "="*40 + "\n")
-                for event in history:
-                    if isinstance(event, dict):
-                        ts = event.get('timestamp', '')
-                        user = event.get('username', '')
-                        desc = event.get('event', '')
-                        f.write(f"[{ts}] {user}: {desc}\n")
-                    else:
-                        f.write(f"{event}\n")
-            with open(filename, 'rb') as f_rb:
-                bot.send_document(chat_id, f_rb, caption="Лог событий текущей смены.")
-            os.remove(filename)
+            # Свежие события из памяти, вытесненные из неё — из event_history
+            result = export_shift_log(chat_id, get_chat_title(bot, chat_id))
+            send_export(bot, chat_id, result, "Лог событий текущей смены.")
         except Exception as e:
             logging.error(f"Ошибка при выгрузке истории: {e}")
             bot.send_message(chat_id, "Произошла ошибка при создании файла истории.")
+
+    @bot.message_handler(commands=['config_export'])
+    @admin_required(bot)
+    def command_config_export(message: types.Message):
+        """Резервная копия настроек чатов и рекламных шаблонов из БД (JSON)."""
+        chat_id = message.chat.id
+        snapshot = export_configs()
+        if snapshot is None:
+            return bot.send_message(chat_id, "База данных недоступна, выгрузка невозможна.")
+        data = json.dumps(snapshot, ensure_ascii=False, indent=2).encode('utf-8')
+        filename = f"config_{clock.now().strftime('%Y%m%d_%H%M%S')}.json"
+        templates = sum(len(cities) for cities in snapshot['ad_templates'].values())
+        caption = (f"Настройки чатов: {len(snapshot['chat_configs'])}, городов с шаблонами: {templates}, "
+                   f"версия {snapshot['version']}.")
+        try:
+            send_export(bot, chat_id, ExportResult(io.BytesIO(data), filename, len(snapshot['chat_configs']), False), caption)
+        except Exception as e:
+            logging.error(f"Ошибка отправки резервной копии настроек в чат {chat_id}: {e}")
+            bot.send_message(chat_id, "Не удалось отправить файл настроек.")
             
     @bot.message_handler(commands=['broadcast'])
     @admin_required(bot)
@@ -247,21 +379,22 @@ def register_admin_handlers(bot):
 
         sent_count = 0
         failed_count = 0
-        total_chats = len(list(chat_configs.keys()))
+        chat_ids = chat_settings.chat_ids()
+        total_chats = len(chat_ids)
         
         if total_chats == 0:
             return bot.send_message(message.chat.id, "Нет настроенных чатов для рассылки.")
 
         bot.send_message(message.chat.id, f"Начинаю рассылку в {total_chats} чатов...")
         
-        for chat_id_str in chat_configs.keys():
+        for target_chat_id in chat_ids:
             try:
-                bot.send_message(int(chat_id_str), f"❗️ **Важное объявление от руководства:**\n\n{text_to_send}", parse_mode="Markdown")
+                bot.send_message(target_chat_id, f"❗️ **Важное объявление от руководства:**\n\n{text_to_send}", parse_mode="Markdown")
                 sent_count += 1
                 time.sleep(0.1) # Небольшая задержка, чтобы не превышать лимиты Telegram
             except Exception as e:
                 failed_count += 1
-                logging.error(f"Не удалось отправить рассылку в чат {chat_id_str}: {e}")
+                logging.error(f"Не удалось отправить рассылку в чат {target_chat_id}: {e}")
         
         bot.send_message(message.chat.id, f"✅ Рассылка завершена.\nУспешно отправлено: {sent_count}\nНе удалось отправить: {failed_count}")
 
@@ -270,43 +403,31 @@ def register_admin_handlers(bot):
     def command_debug_config(message: types.Message):
         """Показывает текущую конфигурацию чата для диагностики."""
         chat_id = message.chat.id
-        chat_id_str = str(chat_id)
         
         # Получаем конфигурацию чата
-        config = chat_configs.get(chat_id_str, {})
+        config = chat_settings.get(chat_id)
         
         # Получаем данные о текущей смене
         shift_data = chat_data.get(chat_id)
         
         # Получаем текущее время в разных часовых поясах
-        moscow_time = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
-        
-        # ИСПРАВЛЕНО: timezone хранится как число, конвертируем через TIMEZONE_MAP
-        timezone_offset = config.get('timezone', 0)
-        tz_key = f"+{timezone_offset}" if timezone_offset > 0 else str(timezone_offset)
-        tz_obj = TIMEZONE_MAP.get(tz_key)
-        tz_name = str(tz_obj) if tz_obj else 'Europe/Moscow'
-        try:
-            local_tz = pytz.timezone(tz_name)
-            local_time = datetime.datetime.now(local_tz)
-        except Exception as e:
-            local_time = f"Ошибка: {e}"
+        moscow_time = clock.moscow_now()
         
-        # ИСПРАВЛЕНО: end_time из schedule.end
-        schedule = config.get('schedule', {})
-        end_time_display = schedule.get('end', config.get('end_time', '04:00 (по умолчанию)'))
+        local_time = config.now()
+        end_time_display = config.end_time_str if config.configured else f"{config.end_time_str} (по умолчанию)"
         
         debug_text = [
             "🔍 **Диагностика конфигурации чата**\n",
             f"**ID чата:** `{chat_id}`",
             f"**Московское время:** `{moscow_time.strftime('%H:%M:%S %d.%m.%Y')}`",
-            f"**Локальное время:** `{local_time.strftime('%H:%M:%S %d.%m.%Y') if hasattr(local_time, 'strftime') else local_time}`",
+            f"**Локальное время:** `{local_time.strftime('%H:%M:%S %d.%m.%Y')}`",
             "",
             "**Конфигурация:**",
-            f"  • Часовой пояс: `{tz_name}` (смещение: {timezone_offset})",
+            f"  • Часовой пояс: `{config.tz_name}` (МСК{config.msk_offset:+d})",
             f"  • Время окончания: `{end_time_display}`",
-            f"  • Концепция: `{config.get('concept', 'Не задана')}`",
-            f"  • Тайм-аут ГС: `{config.get('voice_timeout', VOICE_TIMEOUT_MINUTES)} мин`",
+            f"  • Концепция: `{config.concept or 'Не задана'}`",
+            f"  • План ГС: `{config.goal}`",
+            f"  • Тайм-аут ГС: `{config.voice_timeout} мин`",
             "",
             "**Текущая смена:**"
         ]
@@ -4,16 +4,18 @@ import logging
 import random
 from telebot import types
 
-from utils import is_admin, get_username, init_user_data, save_json_data, save_history_event
+import clock
+from utils import is_admin, get_username, init_user_data, save_history_event
 from state import chat_data, pending_transfers, ad_templates, user_states
 from phrases import soviet_phrases
-from config import AD_TEMPLATES_FILE
+from config_store import save_templates
+from callback_router import router, pack_callback
 
 def register_callback_handlers(bot):
 
     # Этот хендлер должен быть здесь, т.к. он связан с кнопкой, создаваемой в shift.py
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('transfer_accept_'))
-    def handle_shift_transfer_accept(call: types.CallbackQuery):
+    @router.route('transfer_accept_', prefix=True)
+    def handle_shift_transfer_accept(call: types.CallbackQuery, *_):
         chat_id = call.message.chat.id
         user_id = call.from_user.id
         
@@ -58,327 +60,349 @@ def register_callback_handlers(bot):
         save_history_event(chat_id, user_id, transfer_info['to_username'], f"Принял смену от {transfer_info['from_username']}")
 
     # Обработчики для системы рекламы /ads
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('ads_'))
-    def handle_ads_callbacks(call: types.CallbackQuery):
-        """Обработчик для системы рекламных шаблонов."""
+    def _open_ads_screen(call: types.CallbackQuery):
+        """Проверяет права и убирает старое меню. Возвращает шаблоны (state.ad_templates) или None."""
         if not is_admin(bot, call.from_user.id, call.message.chat.id):
-            return bot.answer_callback_query(call.id, "⛔️ Доступ запрещен!", show_alert=True)
-        
+            bot.answer_callback_query(call.id, "⛔️ Доступ запрещен!", show_alert=True)
+            return None
+
         bot.answer_callback_query(call.id)
         chat_id = call.message.chat.id
-        action = call.data[4:]  # убираем "ads_"
-        
-        import json
-        try:
-            with open('ad_templates.json', 'r', encoding='utf-8') as f:
-                ad_templates = json.load(f)
-        except FileNotFoundError:
-            bot.send_message(chat_id, "❌ Файл рекламных шаблонов не найден!")
-            return
-        except Exception as e:
-            bot.send_message(chat_id, f"❌ Ошибка загрузки файла: {e}")
-            return
-        
+
+        if not ad_templates:
+            bot.send_message(chat_id, "❌ Рекламные шаблоны не загружены!")
+            return None
+
         try:
             # Удаляем старое сообщение
             bot.delete_message(chat_id, call.message.message_id)
         except Exception:
             pass
-        
-        if action == "view_all":
-            # КНОПКА: "📋 Просмотр шаблонов"
-            text_lines = ["📋 ВСЕ РЕКЛАМНЫЕ ШАБЛОНЫ\n"]
-            template_count = 0
-            
-            for brand, cities in ad_templates.items():
-                text_lines.append(f"🏢 {brand.upper()}")
-                for city, templates in cities.items():
-                    text_lines.append(f"   📍 {city.capitalize()}: {len(templates)} шаблонов")
-                    for i, (name, content) in enumerate(templates.items(), 1):
-                        template_count += 1
-                        preview = content[:80] + "..." if len(content) > 80 else content
-                        text_lines.append(f"      {i}. {name}")
-                        text_lines.append(f"         {preview}")
-                text_lines.append("")
-            
-            text = "\n".join(text_lines) if template_count > 0 else "📝 Рекламных шаблонов пока нет"
-            
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
-            bot.send_message(chat_id, text, reply_markup=markup)
-            
-        elif action == "by_brands":
-            # КНОПКА: "🏢 По брендам"  
-            markup = types.InlineKeyboardMarkup()
-            
-            for brand in ad_templates.keys():
-                total_templates = sum(len(city_data) for city_data in ad_templates[brand].values())
-                btn = types.InlineKeyboardButton(
-                    f"🏢 {brand.upper()} ({total_templates})", 
-                    callback_data=f"ads_brand_{brand}"
-                )
-                markup.add(btn)
-            
-            markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
-            bot.send_message(chat_id, "🏢 Выберите бренд для просмотра:", reply_markup=markup)
-            
-        elif action.startswith("brand_"):
-            # Показать города для бренда
-            brand = action[6:]  # убираем "brand_"
-            cities = ad_templates.get(brand, {})
-            
-            if not cities:
-                markup = types.InlineKeyboardMarkup()
-                markup.add(types.InlineKeyboardButton("« К брендам", callback_data="ads_by_brands"))
-                bot.send_message(chat_id, f"📍 У бренда {brand.upper()} пока нет городов", reply_markup=markup)
-                return
-                
-            markup = types.InlineKeyboardMarkup()
+        return ad_templates
+
+    def _save_ad_templates(brand: str, city: str):
+        if not save_templates(brand, city):
+            raise RuntimeError("не удалось записать в БД")
+
+    @router.route("ads_view_all")
+    def handle_ads_view_all(call: types.CallbackQuery):
+        """КНОПКА: "📋 Просмотр шаблонов"."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        text_lines = ["📋 ВСЕ РЕКЛАМНЫЕ ШАБЛОНЫ\n"]
+        template_count = 0
+
+        for brand, cities in ad_templates.items():
+            text_lines.append(f"🏢 {brand.upper()}")
             for city, templates in cities.items():
-                btn = types.InlineKeyboardButton(
-                    f"📍 {city.capitalize()} ({len(templates)})", 
-                    callback_data=f"ads_city_{brand}_{city}"
-                )
-                markup.add(btn)
-            
-            markup.add(types.InlineKeyboardButton("« К брендам", callback_data="ads_by_brands"))
-            bot.send_message(chat_id, f"📍 Города для {brand.upper()}:", reply_markup=markup)
-            
-        elif action.startswith("city_"):
-            # Показать шаблоны для конкретного города
-            parts = action[5:].split('_', 1)  # убираем "city_"
-            brand, city = parts[0], parts[1]
-            templates = ad_templates.get(brand, {}).get(city, {})
-            
-            if not templates:
-                markup = types.InlineKeyboardMarkup()
-                markup.add(types.InlineKeyboardButton(f"« К городам {brand.upper()}", callback_data=f"ads_brand_{brand}"))
-                bot.send_message(chat_id, f"📝 У {brand.upper()} в {city.capitalize()} пока нет шаблонов", reply_markup=markup)
-                return
-                
-            text_lines = [f"📝 ШАБЛОНЫ {brand.upper()} / {city.upper()}\n"]
-            for i, (name, content) in enumerate(templates.items(), 1):
-                text_lines.append(f"{i}. 🔹 {name}")
-                preview = content[:150] + "..." if len(content) > 150 else content
-                text_lines.append(f"   {preview}\n")
-            
-            text = "\n".join(text_lines)
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton(f"« К городам {brand.upper()}", callback_data=f"ads_brand_{brand}"))
-            bot.send_message(chat_id, text, reply_markup=markup)
-            
-        elif action == "add_template":
-            # КНОПКА: "➕ Добавить шаблон"
+                text_lines.append(f"   📍 {city.capitalize()}: {len(templates)} шаблонов")
+                for i, (name, content) in enumerate(templates.items(), 1):
+                    template_count += 1
+                    preview = content[:80] + "..." if len(content) > 80 else content
+                    text_lines.append(f"      {i}. {name}")
+                    text_lines.append(f"         {preview}")
+            text_lines.append("")
+
+        text = "\n".join(text_lines) if template_count > 0 else "📝 Рекламных шаблонов пока нет"
+
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
+        bot.send_message(call.message.chat.id, text, reply_markup=markup)
+
+    @router.route("ads_by_brands")
+    def handle_ads_by_brands(call: types.CallbackQuery):
+        """КНОПКА: "🏢 По брендам"."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        markup = types.InlineKeyboardMarkup()
+
+        for brand in ad_templates.keys():
+            total_templates = sum(len(city_data) for city_data in ad_templates[brand].values())
+            btn = types.InlineKeyboardButton(
+                f"🏢 {brand.upper()} ({total_templates})",
+                callback_data=pack_callback("ads_brand", brand)
+            )
+            markup.add(btn)
+
+        markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
+        bot.send_message(call.message.chat.id, "🏢 Выберите бренд для просмотра:", reply_markup=markup)
+
+    @router.route("ads_brand")
+    def handle_ads_brand(call: types.CallbackQuery, brand: str):
+        """Показать города для бренда."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        chat_id = call.message.chat.id
+        cities = ad_templates.get(brand, {})
+
+        if not cities:
             markup = types.InlineKeyboardMarkup()
-            
-            for brand in ad_templates.keys():
-                btn = types.InlineKeyboardButton(
-                    f"➕ В {brand.upper()}", 
-                    callback_data=f"ads_add_to_{brand}"
-                )
-                markup.add(btn)
-            
-            markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
-            bot.send_message(chat_id, "➕ Выберите бренд для добавления шаблона:", reply_markup=markup)
-            
-        elif action.startswith("add_to_"):
-            # Выбор города для добавления
-            brand = action[7:]  # убираем "add_to_"
-            cities = ad_templates.get(brand, {})
-            
+            markup.add(types.InlineKeyboardButton("« К брендам", callback_data="ads_by_brands"))
+            bot.send_message(chat_id, f"📍 У бренда {brand.upper()} пока нет городов", reply_markup=markup)
+            return
+
+        markup = types.InlineKeyboardMarkup()
+        for city, templates in cities.items():
+            btn = types.InlineKeyboardButton(
+                f"📍 {city.capitalize()} ({len(templates)})",
+                callback_data=pack_callback("ads_city", brand, city)
+            )
+            markup.add(btn)
+
+        markup.add(types.InlineKeyboardButton("« К брендам", callback_data="ads_by_brands"))
+        bot.send_message(chat_id, f"📍 Города для {brand.upper()}:", reply_markup=markup)
+
+    @router.route("ads_city")
+    def handle_ads_city(call: types.CallbackQuery, brand: str, city: str):
+        """Показать шаблоны для конкретного города."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        chat_id = call.message.chat.id
+        templates = ad_templates.get(brand, {}).get(city, {})
+        back_button = types.InlineKeyboardButton(f"« К городам {brand.upper()}", callback_data=pack_callback("ads_brand", brand))
+
+        if not templates:
             markup = types.InlineKeyboardMarkup()
-            for city in cities.keys():
+            markup.add(back_button)
+            bot.send_message(chat_id, f"📝 У {brand.upper()} в {city.capitalize()} пока нет шаблонов", reply_markup=markup)
+            return
+
+        text_lines = [f"📝 ШАБЛОНЫ {brand.upper()} / {city.upper()}\n"]
+        for i, (name, content) in enumerate(templates.items(), 1):
+            text_lines.append(f"{i}. 🔹 {name}")
+            preview = content[:150] + "..." if len(content) > 150 else content
+            text_lines.append(f"   {preview}\n")
+
+        text = "\n".join(text_lines)
+        markup = types.InlineKeyboardMarkup()
+        markup.add(back_button)
+        bot.send_message(chat_id, text, reply_markup=markup)
+
+    @router.route("ads_add_template")
+    def handle_ads_add_template(call: types.CallbackQuery):
+        """КНОПКА: "➕ Добавить шаблон"."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        markup = types.InlineKeyboardMarkup()
+
+        for brand in ad_templates.keys():
+            btn = types.InlineKeyboardButton(
+                f"➕ В {brand.upper()}",
+                callback_data=pack_callback("ads_add_to", brand)
+            )
+            markup.add(btn)
+
+        markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
+        bot.send_message(call.message.chat.id, "➕ Выберите бренд для добавления шаблона:", reply_markup=markup)
+
+    @router.route("ads_add_to")
+    def handle_ads_add_to(call: types.CallbackQuery, brand: str):
+        """Выбор города для добавления."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        cities = ad_templates.get(brand, {})
+
+        markup = types.InlineKeyboardMarkup()
+        for city in cities.keys():
+            btn = types.InlineKeyboardButton(
+                f"📍 {city.capitalize()}",
+                callback_data=pack_callback("ads_add_city", brand, city)
+            )
+            markup.add(btn)
+
+        markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_add_template"))
+        bot.send_message(call.message.chat.id, f"📍 Выберите город в {brand.upper()}:", reply_markup=markup)
+
+    @router.route("ads_add_city")
+    def handle_ads_add_city(call: types.CallbackQuery, brand: str, city: str):
+        """Начать процесс добавления шаблона."""
+        if _open_ads_screen(call) is None:
+            return
+
+        # Сохраняем состояние пользователя
+        user_states[call.from_user.id] = {
+            "state": "awaiting_ad_template",
+            "brand": brand,
+            "city": city
+        }
+
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("« Отмена", callback_data="ads_back_main"))
+
+        bot.send_message(
+            call.message.chat.id,
+            f"➕ Добавление шаблона в {brand.upper()} / {city.capitalize()}\n\n"
+            f"Отправьте сообщение в формате:\n\n"
+            f"Название шаблона\n"
+            f"Текст шаблона...\n\n"
+            f"Для отмены введите /cancel",
+            reply_markup=markup
+        )
+
+    @router.route("ads_delete_template")
+    def handle_ads_delete_template(call: types.CallbackQuery):
+        """КНОПКА: "🗑️ Удалить шаблон"."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        markup = types.InlineKeyboardMarkup()
+
+        for brand in ad_templates.keys():
+            btn = types.InlineKeyboardButton(
+                f"🗑️ Из {brand.upper()}",
+                callback_data=pack_callback("ads_del_from", brand)
+            )
+            markup.add(btn)
+
+        markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
+        bot.send_message(call.message.chat.id, "🗑️ Выберите бренд для удаления шаблона:", reply_markup=markup)
+
+    @router.route("ads_del_from")
+    def handle_ads_del_from(call: types.CallbackQuery, brand: str):
+        """Выбор города для удаления."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        cities = ad_templates.get(brand, {})
+
+        markup = types.InlineKeyboardMarkup()
+        for city, templates in cities.items():
+            if templates:  # только города с шаблонами
                 btn = types.InlineKeyboardButton(
-                    f"📍 {city.capitalize()}", 
-                    callback_data=f"ads_add_city_{brand}_{city}"
+                    f"📍 {city.capitalize()} ({len(templates)})",
+                    callback_data=pack_callback("ads_del_city", brand, city)
                 )
                 markup.add(btn)
-            
-            markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_add_template"))
-            bot.send_message(chat_id, f"📍 Выберите город в {brand.upper()}:", reply_markup=markup)
-            
-        elif action.startswith("add_city_"):
-            # Начать процесс добавления шаблона
-            parts = action[9:].split('_', 1)  # убираем "add_city_"
-            brand, city = parts[0], parts[1]
-            
-            # Сохраняем состояние пользователя
-            user_id = call.from_user.id
-            from .wizards import user_states
-            user_states[user_id] = {
-                "state": "awaiting_ad_template", 
-                "brand": brand, 
-                "city": city
-            }
-            
+
+        markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_delete_template"))
+        bot.send_message(call.message.chat.id, f"📍 Выберите город в {brand.upper()}:", reply_markup=markup)
+
+    @router.route("ads_del_city")
+    def handle_ads_del_city(call: types.CallbackQuery, brand: str, city: str):
+        """Показать шаблоны для удаления."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        templates = ad_templates.get(brand, {}).get(city, {})
+
+        markup = types.InlineKeyboardMarkup()
+        for name in templates.keys():
+            btn = types.InlineKeyboardButton(
+                f"🗑️ {name}",
+                callback_data=pack_callback("ads_confirm_del", brand, city, name)
+            )
+            markup.add(btn)
+
+        markup.add(types.InlineKeyboardButton(f"« К городам {brand.upper()}", callback_data=pack_callback("ads_del_from", brand)))
+        bot.send_message(call.message.chat.id, f"🗑️ Выберите шаблон для удаления из {brand.upper()} / {city.capitalize()}:", reply_markup=markup)
+
+    @router.route("ads_confirm_del")
+    def handle_ads_confirm_del(call: types.CallbackQuery, brand: str, city: str, template_name: str):
+        """Подтверждение удаления."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(
+            types.InlineKeyboardButton("✅ Да, удалить", callback_data=pack_callback("ads_do_delete", brand, city, template_name)),
+            types.InlineKeyboardButton("❌ Отмена", callback_data=pack_callback("ads_del_city", brand, city))
+        )
+
+        template_content = ad_templates.get(brand, {}).get(city, {}).get(template_name, "")
+        preview = template_content[:200] + "..." if len(template_content) > 200 else template_content
+
+        bot.send_message(
+            call.message.chat.id,
+            f"🗑️ ПОДТВЕРЖДЕНИЕ УДАЛЕНИЯ\n\n"
+            f"Бренд: {brand.upper()}\n"
+            f"Город: {city.capitalize()}\n"
+            f"Шаблон: {template_name}\n\n"
+            f"Содержимое:\n{preview}\n\n"
+            f"⚠️ Вы уверены, что хотите удалить этот шаблон?",
+            reply_markup=markup
+        )
+
+    @router.route("ads_do_delete")
+    def handle_ads_do_delete(call: types.CallbackQuery, brand: str, city: str, template_name: str):
+        """Выполнить удаление."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        chat_id = call.message.chat.id
+
+        if template_name not in ad_templates.get(brand, {}).get(city, {}):
+            bot.send_message(chat_id, "❌ Шаблон не найден")
+            return
+
+        del ad_templates[brand][city][template_name]
+        try:
+            _save_ad_templates(brand, city)
+
             markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("« Отмена", callback_data="ads_back_main"))
-            
+            markup.add(types.InlineKeyboardButton("« Назад к главному меню", callback_data="ads_back_main"))
+
             bot.send_message(
-                chat_id, 
-                f"➕ Добавление шаблона в {brand.upper()} / {city.capitalize()}\n\n"
-                f"Отправьте сообщение в формате:\n\n"
-                f"Название шаблона\n"
-                f"Текст шаблона...\n\n"
-                f"Для отмены введите /cancel",
+                chat_id,
+                f"✅ Шаблон '{template_name}' успешно удален из {brand.upper()} / {city.capitalize()}",
                 reply_markup=markup
             )
-            
-        elif action == "delete_template":
-            # КНОПКА: "🗑️ Удалить шаблон"
-            markup = types.InlineKeyboardMarkup()
-            
-            for brand in ad_templates.keys():
-                btn = types.InlineKeyboardButton(
-                    f"🗑️ Из {brand.upper()}", 
-                    callback_data=f"ads_del_from_{brand}"
-                )
-                markup.add(btn)
-            
-            markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
-            bot.send_message(chat_id, "🗑️ Выберите бренд для удаления шаблона:", reply_markup=markup)
-            
-        elif action.startswith("del_from_"):
-            # Выбор города для удаления
-            brand = action[9:]  # убираем "del_from_"
-            cities = ad_templates.get(brand, {})
-            
-            markup = types.InlineKeyboardMarkup()
-            for city, templates in cities.items():
-                if templates:  # только города с шаблонами
-                    btn = types.InlineKeyboardButton(
-                        f"📍 {city.capitalize()} ({len(templates)})", 
-                        callback_data=f"ads_del_city_{brand}_{city}"
-                    )
-                    markup.add(btn)
-            
-            markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_delete_template"))
-            bot.send_message(chat_id, f"� Выберите город в {brand.upper()}:", reply_markup=markup)
-            
-        elif action.startswith("del_city_"):
-            # Показать шаблоны для удаления
-            parts = action[9:].split('_', 1)  # убираем "del_city_"
-            brand, city = parts[0], parts[1]
-            templates = ad_templates.get(brand, {}).get(city, {})
-            
+        except Exception as e:
+            bot.send_message(chat_id, f"❌ Ошибка сохранения шаблона: {e}")
+
+    @router.route("ads_replace")
+    def handle_ads_replace(call: types.CallbackQuery, brand: str, city: str, template_name: str):
+        """Заменить существующий шаблон."""
+        ad_templates = _open_ads_screen(call)
+        if ad_templates is None:
+            return
+        chat_id = call.message.chat.id
+
+        # Получаем новый текст из состояния пользователя
+        user_id = call.from_user.id
+        if user_id not in user_states or "new_template_text" not in user_states[user_id]:
+            bot.send_message(chat_id, "❌ Ошибка состояния. Начните заново.")
+            return
+
+        new_text = user_states[user_id]["new_template_text"]
+
+        # Заменяем шаблон
+        ad_templates[brand][city][template_name] = new_text
+
+        try:
+            _save_ad_templates(brand, city)
+
             markup = types.InlineKeyboardMarkup()
-            for name in templates.keys():
-                btn = types.InlineKeyboardButton(
-                    f"🗑️ {name}", 
-                    callback_data=f"ads_confirm_del_{brand}_{city}_{name}"
-                )
-                markup.add(btn)
-            
-            markup.add(types.InlineKeyboardButton(f"« К городам {brand.upper()}", callback_data=f"ads_del_from_{brand}"))
-            bot.send_message(chat_id, f"🗑️ Выберите шаблон для удаления из {brand.upper()} / {city.capitalize()}:", reply_markup=markup)
-            
-        elif action.startswith("confirm_del_"):
-            # Подтверждение удаления
-            parts = action[12:].split('_', 2)  # убираем "confirm_del_"
-            brand, city, template_name = parts[0], parts[1], parts[2]
-            
-            markup = types.InlineKeyboardMarkup(row_width=2)
-            markup.add(
-                types.InlineKeyboardButton("✅ Да, удалить", callback_data=f"ads_do_delete_{brand}_{city}_{template_name}"),
-                types.InlineKeyboardButton("❌ Отмена", callback_data=f"ads_del_city_{brand}_{city}")
-            )
-            
-            template_content = ad_templates.get(brand, {}).get(city, {}).get(template_name, "")
-            preview = template_content[:200] + "..." if len(template_content) > 200 else template_content
-            
+            markup.add(types.InlineKeyboardButton("« Назад к главному меню", callback_data="ads_back_main"))
+
             bot.send_message(
-                chat_id, 
-                f"🗑️ ПОДТВЕРЖДЕНИЕ УДАЛЕНИЯ\n\n"
-                f"Бренд: {brand.upper()}\n"
-                f"Город: {city.capitalize()}\n"
-                f"Шаблон: {template_name}\n\n"
-                f"Содержимое:\n{preview}\n\n"
-                f"⚠️ Вы уверены, что хотите удалить этот шаблон?",
+                chat_id,
+                f"✅ Шаблон '{template_name}' успешно заменен в {brand.upper()} / {city.capitalize()}!\n\n"
+                f"Новое содержимое:\n{new_text[:200]}{'...' if len(new_text) > 200 else ''}",
                 reply_markup=markup
             )
-            
-        elif action.startswith("do_delete_"):
-            # Выполнить удаление
-            parts = action[10:].split('_', 2)  # убираем "do_delete_"
-            brand, city, template_name = parts[0], parts[1], parts[2]
-            
-            if template_name in ad_templates.get(brand, {}).get(city, {}):
-                del ad_templates[brand][city][template_name]
-                
-                # Сохранить файл
-                try:
-                    with open('ad_templates.json', 'w', encoding='utf-8') as f:
-                        json.dump(ad_templates, f, ensure_ascii=False, indent=2)
-                    
-                    markup = types.InlineKeyboardMarkup()
-                    markup.add(types.InlineKeyboardButton("« Назад к главному меню", callback_data="ads_back_main"))
-                    
-                    bot.send_message(
-                        chat_id, 
-                        f"✅ Шаблон '{template_name}' успешно удален из {brand.upper()} / {city.capitalize()}",
-                        reply_markup=markup
-                    )
-                    
-                except Exception as e:
-                    bot.send_message(chat_id, f"❌ Ошибка сохранения файла: {e}")
-            else:
-                bot.send_message(chat_id, "❌ Шаблон не найден")
-                
-        elif action == "back_main":
-            # Вернуться к главному меню
-            from .wizards import command_ads_new
-            command_ads_new(call.message)
-            
-        elif action.startswith("replace_"):
-            # Заменить существующий шаблон
-            parts = action[8:].split('_', 2)  # убираем "replace_"
-            brand, city, template_name = parts[0], parts[1], parts[2]
-            
-            # Получаем новый текст из состояния пользователя
-            from .wizards import user_states
-            user_id = call.from_user.id
-            if user_id not in user_states or "new_template_text" not in user_states[user_id]:
-                bot.send_message(chat_id, "❌ Ошибка состояния. Начните заново.")
-                return
-            
-            new_text = user_states[user_id]["new_template_text"]
-            
-            # Заменяем шаблон
-            ad_templates[brand][city][template_name] = new_text
-            
-            # Сохраняем файл
-            try:
-                with open('ad_templates.json', 'w', encoding='utf-8') as f:
-                    json.dump(ad_templates, f, ensure_ascii=False, indent=2)
-                
-                markup = types.InlineKeyboardMarkup()
-                markup.add(types.InlineKeyboardButton("« Назад к главному меню", callback_data="ads_back_main"))
-                
-                bot.send_message(
-                    chat_id, 
-                    f"✅ Шаблон '{template_name}' успешно заменен в {brand.upper()} / {city.capitalize()}!\n\n"
-                    f"Новое содержимое:\n{new_text[:200]}{'...' if len(new_text) > 200 else ''}",
-                    reply_markup=markup
-                )
-                
-            except Exception as e:
-                bot.send_message(chat_id, f"❌ Ошибка сохранения файла: {e}")
-            
-            # Очищаем состояние
-            user_states.pop(user_id, None)
+
+        except Exception as e:
+            bot.send_message(chat_id, f"❌ Ошибка сохранения шаблона: {e}")
+
+        # Очищаем состояние
+        user_states.pop(user_id, None)
 
     # Обработчик кнопки "Завершить паузу"
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('stop_pause_'))
-    def handle_stop_pause_callback(call: types.CallbackQuery):
+    @router.route('stop_pause_', prefix=True)
+    def handle_stop_pause_callback(call: types.CallbackQuery, target_user_id: str = ''):
         """Обработка кнопки завершения паузы."""
         import datetime
-        import pytz
         
         chat_id = call.message.chat.id
         user_id = call.from_user.id
-        target_user_id = int(call.data.replace('stop_pause_', ''))
-        
-        if user_id != target_user_id:
+        if str(user_id) != target_user_id:
             return bot.answer_callback_query(call.id, "Эта кнопка не для вас.", show_alert=True)
         
         shift = chat_data.get(chat_id)
@@ -389,7 +413,7 @@ def register_callback_handlers(bot):
         if not user_data or not user_data.on_pause:
             return bot.answer_callback_query(call.id, "Пауза не активна.", show_alert=True)
         
-        now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+        now_moscow = clock.moscow_now()
         pause_start = datetime.datetime.fromisoformat(user_data.pause_start_time)
         pause_duration = (now_moscow - pause_start).total_seconds() / 60
         
@@ -410,8 +434,8 @@ def register_callback_handlers(bot):
             parse_mode="Markdown")
     
     # Обработчики для маркетинговой аналитики (кнопки из admin.py)
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('marketing_'))
-    def handle_marketing_callbacks(call: types.CallbackQuery):
+    @router.route('marketing_', prefix=True)
+    def handle_marketing_callbacks(call: types.CallbackQuery, *_):
         """Обработчик для кнопок маркетинговой аналитики."""
         if not is_admin(bot, call.from_user.id, call.message.chat.id):
             return bot.answer_callback_query(call.id, "⛔️ Доступ запрещен!", show_alert=True)
@@ -475,8 +499,8 @@ def register_callback_handlers(bot):
             bot.send_message(chat_id, "\n".join(recs), parse_mode="Markdown")
     
     # Обработчики для подтверждений
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_'))
-    def handle_confirmation_callbacks(call: types.CallbackQuery):
+    @router.route('confirm_', prefix=True)
+    def handle_confirmation_callbacks(call: types.CallbackQuery, *_):
         """Обработчик для кнопок подтверждения действий."""
         logging.info(f"[CONFIRM] Получен callback: data={call.data}, user={call.from_user.id}, chat={call.message.chat.id}")
         try:
@@ -569,13 +593,11 @@ def register_callback_handlers(bot):
                 pass
     
     # Обработчик выбора роли при /start
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('role_select_'))
-    def handle_role_selection(call: types.CallbackQuery):
+    @router.route('role_select_', prefix=True)
+    def handle_role_selection(call: types.CallbackQuery, role: str = ''):
         """Обработка выбора роли при старте смены в выходные."""
         chat_id = call.message.chat.id
         user_id = call.from_user.id
-        role = call.data.replace('role_select_', '')
-        
         try:
             bot.delete_message(chat_id, call.message.message_id)
         except Exception:
@@ -616,8 +638,8 @@ def register_callback_handlers(bot):
             bot.send_message(chat_id, f"👉 Отправьте: `/start {role_text}`", parse_mode="Markdown")
     
     # Обработчик кнопки "Отклонить передачу"
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('transfer_decline_'))
-    def handle_transfer_decline(call: types.CallbackQuery):
+    @router.route('transfer_decline_', prefix=True)
+    def handle_transfer_decline(call: types.CallbackQuery, *_):
         """Обработка отклонения передачи смены."""
         chat_id = call.message.chat.id
         user_id = call.from_user.id
@@ -2,12 +2,12 @@
 
 import random
 import datetime
-import pytz
 import threading
 import logging
 
 from telebot import types
 
+import clock
 from utils import get_username, init_shift_data, init_user_data, handle_user_return, save_history_event, safe_reply
 from state import chat_data, pending_transfers
 from config import BREAK_KEYWORDS, RETURN_CONFIRM_WORDS, BREAK_DELAY_MINUTES, BREAK_DURATION_MINUTES
@@ -85,7 +85,7 @@ def register_shift_handlers(bot):
                 requested_role = UserRole.MC.value
         
         # Получаем цели для ролей
-        day_of_week = datetime.datetime.now().weekday()
+        day_of_week = clock.now().weekday()
         role_goals = get_default_role_goals(day_of_week)
         
         # Определяем доступные роли для текущего дня
@@ -255,7 +255,7 @@ def register_shift_handlers(bot):
             phrase = random.choice(soviet_phrases.get("system_messages", {}).get('break_already_on', ["Вы уже на перерыве."]))
             return safe_reply(bot, message, phrase)
             
-        now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+        now_moscow = clock.moscow_now()
         
         if user_data.last_break_time:
             last_break_time = datetime.datetime.fromisoformat(user_data.last_break_time)
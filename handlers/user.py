@@ -2,14 +2,15 @@
 
 import random
 import datetime
-import pytz
 import logging
 import pandas as pd
 from collections import Counter
 from telebot import types
 
+import clock
 from utils import get_username, get_username_with_at, is_admin, safe_reply
 from state import chat_data
+from live_status import live_status
 from g_sheets import get_sheet
 from phrases import soviet_phrases
 
@@ -28,6 +29,10 @@ def register_user_handlers(bot):
         # ИСПРАВЛЕНО: Проверяем, что пользователь участник смены (не только main_id)
         if user_id not in shift.users:
             return safe_reply(bot, message, "Вы не участвуете в текущей смене. Используйте /start для начала.")
+
+        # Живой статус: вместо нового отчёта обновляем закреплённое сообщение
+        if live_status.show(bot, chat_id):
+            return
             
         user_data = shift.users.get(user_id)
         if not user_data:
@@ -45,7 +50,7 @@ def register_user_handlers(bot):
         
         plan_done = "\n🌟 _План выполнен! Ты сегодня сигма!_ 🐺" if plan_percent >= 100 else ""
         report_lines = [
-            f"📋 *Промежуточный отчёт* ({datetime.datetime.now(pytz.timezone('Europe/Moscow')).strftime('%H:%M')})",
+            f"📋 *Промежуточный отчёт* ({clock.moscow_now().strftime('%H:%M')})",
             f"🎭 **Роль:** {role_emoji} {role_desc}",
             f"🗣️ **Голосовых:** {user_data.count} из {shift_goal} ({plan_percent:.0f}%)",
             plan_done,
@@ -55,7 +60,7 @@ def register_user_handlers(bot):
         
         # Добавляем информацию о паузе, если активна
         if user_data.on_pause:
-            now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+            now_moscow = clock.moscow_now()
             pause_start = datetime.datetime.fromisoformat(user_data.pause_start_time)
             elapsed = (now_moscow - pause_start).total_seconds() / 60
             remaining = max(0, 40 - elapsed)
@@ -162,10 +167,7 @@ def register_user_handlers(bot):
     @bot.message_handler(commands=['time', 'время'])
     def handle_time(message: types.Message):
         """Показывает текущее время. Для админов с аргументом — устанавливает тайм-аут."""
-        import pytz
-        from state import chat_configs
-        from config import VOICE_TIMEOUT_MINUTES, CHAT_CONFIG_FILE
-        from utils import save_json_data
+        from chat_config import chat_settings
         
         args = message.text.split()
         
@@ -180,24 +182,19 @@ def register_user_handlers(bot):
                 if new_timeout <= 0:
                     raise ValueError("Значение должно быть положительным.")
                 
-                if str(chat_id) not in chat_configs:
-                    chat_configs[str(chat_id)] = {}
-                
-                chat_configs[str(chat_id)]['voice_timeout'] = new_timeout
-                
-                if save_json_data(CHAT_CONFIG_FILE, chat_configs):
+                if chat_settings.update(chat_id, voice_timeout=new_timeout):
                     safe_reply(bot, message, f"✅ **Успешно!**\nНапоминания об отсутствии голосовых будут через *{new_timeout} минут* бездействия.")
                     logging.info(f"Администратор {message.from_user.id} изменил тайм-аут для чата {chat_id} на {new_timeout} мин.")
                 else:
                     safe_reply(bot, message, "❌ Не удалось сохранить настройку.")
             except (ValueError, IndexError):
-                default_timeout = chat_configs.get(str(chat_id), {}).get('voice_timeout', VOICE_TIMEOUT_MINUTES)
+                default_timeout = chat_settings.get(chat_id).voice_timeout
                 safe_reply(bot, message, f"**Неверный формат.**\n\nИспользуйте: `/time [минуты]`\n*Пример:* `/time 25`\n\nТекущее значение: *{default_timeout} минут*.")
             return
         
         # Без аргументов — показываем время
-        moscow_tz = pytz.timezone('Europe/Moscow')
-        now = datetime.datetime.now(moscow_tz)
+        moscow_tz = clock.MOSCOW_TZ
+        now = clock.now(moscow_tz)
         
         time_text = f"🕐 Текущее время: {now.strftime('%H:%M:%S')}\n📅 Дата: {now.strftime('%d.%m.%Y')}\n🌍 Часовой пояс: Москва (MSK)"
         bot.send_message(message.chat.id, time_text)
@@ -234,6 +231,8 @@ def register_user_handlers(bot):
         import datetime
         
         chat_id = message.chat.id
+        if live_status.show(bot, chat_id):
+            return
         
         status_text = ["📊 СТАТУС СИСТЕМЫ\n"]
         
@@ -254,7 +253,7 @@ def register_user_handlers(bot):
                     
                     # Добавляем статус паузы, если активна
                     if user_data.on_pause:
-                        now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+                        now_moscow = clock.moscow_now()
                         pause_start = datetime.datetime.fromisoformat(user_data.pause_start_time)
                         elapsed = (now_moscow - pause_start).total_seconds() / 60
                         remaining = max(0, 40 - elapsed)
@@ -271,7 +270,7 @@ def register_user_handlers(bot):
         else:
             status_text.append("⚪ Смена не активна")
         
-        status_text.append(f"\n🕐 Время: {datetime.datetime.now().strftime('%H:%M:%S')}")
+        status_text.append(f"\n🕐 Время: {clock.now().strftime('%H:%M:%S')}")
         
         bot.send_message(message.chat.id, "\n".join(status_text))
 
@@ -296,7 +295,7 @@ def register_user_handlers(bot):
 
         # Проверяем, не активна ли уже пауза
         if user_data.on_pause:
-            now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+            now_moscow = clock.moscow_now()
             pause_start = datetime.datetime.fromisoformat(user_data.pause_start_time)
             elapsed = (now_moscow - pause_start).total_seconds() / 60
             remaining = max(0, 40 - elapsed)
@@ -310,7 +309,7 @@ def register_user_handlers(bot):
                 safe_reply(bot, message, "⏯️ Предыдущая пауза истекла. Активирую новую паузу на 40 минут...")
         
         # Активируем паузу
-        now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+        now_moscow = clock.moscow_now()
         user_data.on_pause = True
         user_data.pause_start_time = now_moscow.isoformat()
         user_data.pause_end_time = (now_moscow + datetime.timedelta(minutes=40)).isoformat()
@@ -354,7 +353,7 @@ def register_user_handlers(bot):
             return safe_reply(bot, message, "❌ Пауза не активна.")
         
         # Завершаем паузу
-        now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+        now_moscow = clock.moscow_now()
         pause_start = datetime.datetime.fromisoformat(user_data.pause_start_time)
         pause_duration = (now_moscow - pause_start).total_seconds() / 60
         
@@ -370,13 +369,12 @@ def register_user_handlers(bot):
     @bot.message_handler(commands=['настройки', 'settings'])
     def handle_chat_settings(message: types.Message):
         """Показывает настройки текущего чата."""
-        from state import chat_configs
-        import pytz
+        from chat_config import chat_settings
         
         chat_id = message.chat.id
-        config = chat_configs.get(str(chat_id), {})
+        config = chat_settings.get(chat_id)
         
-        if not config:
+        if not config.configured:
             bot.send_message(chat_id, 
                 "⚙️ **НАСТРОЙКИ ЧАТА**\n\n"
                 "❌ Настройки для данного чата не найдены.\n"
@@ -384,36 +382,15 @@ def register_user_handlers(bot):
             return
         
         # Получаем настройки
-        brand = config.get('concept', 'Не указан')  # concept вместо brand
-        city = config.get('city', 'Не указан') 
-        
-        # Получаем расписание из schedule объекта
-        schedule = config.get('schedule', {})
-        start_time = schedule.get('start', 'Не указано')
-        end_time = schedule.get('end', 'Не указано')
-        
-        # Получаем timezone как число и конвертируем в строку часового пояса
-        timezone_offset = config.get('timezone', 0)
+        brand = config.concept or 'Не указан'  # concept вместо brand
+        city = config.city or 'Не указан'
+        start_time = config.start_time_str or 'Не указано'
+        end_time = config.end_time_str
         
-        # Определяем строку часового пояса на основе смещения
-        if timezone_offset == 0:
-            tz_name = 'Europe/Moscow'
-            tz_display = 'Московский (МСК)'
-        elif timezone_offset == 2:
-            tz_name = 'Asia/Yekaterinburg'
-            tz_display = 'Екатеринбургский (МСК+2)'
-        elif timezone_offset == 3:
-            tz_name = 'Asia/Omsk'
-            tz_display = 'Омский (МСК+3)'
-        elif timezone_offset == 4:
-            tz_name = 'Asia/Krasnoyarsk'
-            tz_display = 'Красноярский (МСК+4)'
-        elif timezone_offset == 5:
-            tz_name = 'Asia/Irkutsk'
-            tz_display = 'Иркутский (МСК+5)'
-        else:
-            tz_name = 'Europe/Moscow'
-            tz_display = f'МСК{timezone_offset:+d}'
+        timezone_offset = config.msk_offset
+        tz_titles = {0: 'Московский (МСК)', 2: 'Екатеринбургский (МСК+2)', 3: 'Омский (МСК+3)',
+                     4: 'Красноярский (МСК+4)', 5: 'Иркутский (МСК+5)'}
+        tz_display = tz_titles.get(timezone_offset, f'МСК{timezone_offset:+d}')
         
         # Определяем смещение от Москвы
         if timezone_offset == 0:
@@ -459,13 +436,9 @@ def register_user_handlers(bot):
         ]
         
         # Добавляем текущее время в часовом поясе чата
-        try:
-            local_tz = pytz.timezone(tz_name)
-            current_local = datetime.datetime.now(local_tz)
-            settings_text.append(f"\n🕐 **Текущее время здесь:** {current_local.strftime('%H:%M:%S')}")
-            settings_text.append(f"📅 **Дата:** {current_local.strftime('%d.%m.%Y')}")
-        except Exception:
-            pass
+        current_local = config.now()
+        settings_text.append(f"\n🕐 **Текущее время здесь:** {current_local.strftime('%H:%M:%S')}")
+        settings_text.append(f"📅 **Дата:** {current_local.strftime('%d.%m.%Y')}")
             
         bot.send_message(chat_id, "\n".join(settings_text), parse_mode="Markdown")
 
@@ -486,32 +459,13 @@ def register_user_handlers(bot):
             return safe_reply(bot, message, "Вы не участвуете в текущей смене.")
         
         # Проверяем, что рабочее время смены уже закончилось
-        from state import chat_configs
-        config = chat_configs.get(str(chat_id), {})
-        
-        # ИСПРАВЛЕНО: timezone хранится как число (offset от Москвы), конвертируем в строку
-        timezone_offset = config.get('timezone', 0)
-        from config import TIMEZONE_MAP
-        # TIMEZONE_MAP использует строковые ключи: "0", "+2", "-1" и т.д.
-        tz_key = f"+{timezone_offset}" if timezone_offset > 0 else str(timezone_offset)
-        tz_obj = TIMEZONE_MAP.get(tz_key)
-        if tz_obj:
-            tz_name = str(tz_obj)
-        else:
-            tz_name = 'Europe/Moscow'
-        
-        # ИСПРАВЛЕНО: end_time хранится в schedule.end, не в end_time
-        schedule = config.get('schedule', {})
-        end_time_str = schedule.get('end', config.get('end_time', '04:00'))
+        from chat_config import chat_settings
+        config = chat_settings.get(chat_id)
+        end_time_str = config.end_time_str
         
         try:
-            import pytz
-            local_tz = pytz.timezone(tz_name)
-            now_local = datetime.datetime.now(local_tz)
-            
-            # Парсим время окончания смены
-            end_hour, end_minute = map(int, end_time_str.split(':'))
-            end_time = datetime.time(end_hour, end_minute)
+            now_local = config.now()
+            end_time = config.end_time
             current_time_only = now_local.time()
             
             # Проверяем, что текущее время больше времени окончания смены
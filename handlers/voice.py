@@ -3,21 +3,27 @@
 import logging
 import os
 import datetime
-import pytz
 import random
 import threading
 from telebot import types
 
+import clock
 from utils import get_username, init_shift_data, init_user_data, save_history_event, save_voice_statistics
-from state import chat_data, ad_templates, chat_configs, data_lock # ДОБАВЛЕНО: data_lock
-from config import VOICE_MIN_DURATION_SECONDS, VOICE_COOLDOWN_SECONDS, OPENAI_API_KEY, BOSS_ID
+from state import chat_data, ad_templates, data_lock # ДОБАВЛЕНО: data_lock
+from chat_config import chat_settings
+from config import VOICE_MIN_DURATION_SECONDS, VOICE_COOLDOWN_SECONDS, OPENAI_API_KEY, OPENAI_TIMEOUT_SECONDS
 from phrases import soviet_phrases
 from models import UserData
+from metrics import TRANSCRIPTIONS_QUEUED, TRANSCRIPTIONS_DONE
+from tracing import span, traced, bind
+from resilience import openai_api, alert_boss, DependencyUnavailable
 from roles import UserRole, is_weekend_shift, get_default_role_goals, ROLE_EMOJIS, ROLE_DESCRIPTIONS
 
 try:
     import openai
-    client = openai.OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY and openai else None
+    # Один повтор вместо двух по умолчанию: при сбоях OpenAI решает предохранитель, а не ожидание
+    client = openai.OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT_SECONDS, max_retries=1) \
+        if OPENAI_API_KEY and openai else None
 except ImportError:
     client = None
 
@@ -26,19 +32,20 @@ def analyze_voice_thread(bot, audio_path: str, user_data: UserData, chat_id: int
     Анализирует аудио в отдельном потоке.
     ИЗМЕНЕНО: Добавлена блокировка 'data_lock' для потокобезопасного обновления.
     """
-    if not client or not ad_templates:
+    # OpenAI недоступен: не ждём таймаута, голосовое просто остаётся без распознавания
+    if not client or not ad_templates or not openai_api.available():
         if os.path.exists(audio_path): os.remove(audio_path)
         return
 
-    chat_config = chat_configs.get(str(chat_id), {})
-    brand, city = chat_config.get("concept") or chat_config.get("brand"), chat_config.get("city")
+    chat_config = chat_settings.get(chat_id)
+    brand, city = chat_config.templates_brand, chat_config.city
     if not brand or not city or not (templates_for_location := ad_templates.get(brand, {}).get(city)):
         if os.path.exists(audio_path): os.remove(audio_path)
         return
 
     try:
-        with open(audio_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(model="whisper-1", file=audio_file)
+        with open(audio_path, "rb") as audio_file, span("openai.transcription", model="whisper-1"):
+            transcript = openai_api.call(client.audio.transcriptions.create, model="whisper-1", file=audio_file)
         
         recognized_text = transcript.text.strip()
         if not recognized_text: return
@@ -47,11 +54,13 @@ def analyze_voice_thread(bot, audio_path: str, user_data: UserData, chat_id: int
         ad_list_for_prompt = "\n".join([f"- {name}: '{text}'" for name, text in templates_for_location.items()])
         user_prompt = f"Текст диктора: '{recognized_text}'.\n\nСписок шаблонов:\n{ad_list_for_prompt}\n\nКакие шаблоны были упомянуты?"
 
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-            temperature=0
-        )
+        with span("openai.chat_completion", model="gpt-4o-mini"):
+            completion = openai_api.call(
+                client.chat.completions.create,
+                model="gpt-4o-mini",
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+                temperature=0
+            )
         analysis_result_text = completion.choices[0].message.content.strip()
 
         if analysis_result_text != 'None':
@@ -61,18 +70,27 @@ def analyze_voice_thread(bot, audio_path: str, user_data: UserData, chat_id: int
                 with data_lock:
                     user_data.recognized_ads.extend(found_templates)
                 logging.info(f"GPT ({chat_id}) определил совпадения: {found_templates}")
+    except DependencyUnavailable as e:
+        logging.warning(f"Распознавание пропущено ({chat_id}): {e}")
     except Exception as e:
         logging.error(f"Ошибка OpenAI ({chat_id}): {e}", exc_info=True)
-        try:
-            if BOSS_ID: 
-                from utils import get_chat_title
-                bot.send_message(BOSS_ID, f"❗️ Ошибка анализа речи OpenAI в чате {get_chat_title(bot, chat_id)}:\n`{e}`")
-        except Exception as send_e:
-            logging.error(f"Не удалось отправить ЛС об ошибке: {send_e}")
+        from utils import get_chat_title
+        # Текст ошибки — сразу: функция выполнится в потоке уведомления, когда e уже удалена
+        error_text = str(e)
+        alert_boss(bot, f"openai:{type(e).__name__}",
+                   lambda: f"❗️ Ошибка анализа речи OpenAI в чате {get_chat_title(bot, chat_id)}:\n{error_text}")
     finally:
         if os.path.exists(audio_path):
             os.remove(audio_path)
 
+def _analyze_voice_tracked(*args):
+    """analyze_voice_thread с учётом глубины очереди распознавания для /metrics."""
+    try:
+        analyze_voice_thread(*args)
+    finally:
+        TRANSCRIPTIONS_DONE.inc()
+
+@traced()
 def auto_assign_weekend_roles(shift, user_id, username, chat_id, bot):
     """
     Автоматически назначает роли в выходные дни по порядку голосовых сообщений:
@@ -108,7 +126,7 @@ def auto_assign_weekend_roles(shift, user_id, username, chat_id, bot):
     
     # Назначаем роль и цель
     user_data.role = assigned_role
-    day_of_week = datetime.datetime.now().weekday()
+    day_of_week = clock.now().weekday()
     role_goals = get_default_role_goals(day_of_week)
     user_data.goal = role_goals.get(assigned_role, 18)
     
@@ -139,7 +157,7 @@ def register_voice_handlers(bot):
         from_user = message.from_user
         user_id = from_user.id
         username = get_username(from_user)
-        now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+        now_moscow = clock.moscow_now()
 
         user_data_copy_for_thread = None
         
@@ -221,13 +239,16 @@ def register_voice_handlers(bot):
                 voice_duration = message.voice.duration
                 
                 # Сохраняем статистику голосового в базу данных
-                save_voice_statistics(chat_id, user_id, username, voice_duration)
+                # Ключ по message_id: повторная доставка того же апдейта не задвоит статистику
+                save_voice_statistics(chat_id, user_id, username, voice_duration,
+                                      idempotency_key=f"voice:{chat_id}:{message.message_id}")
 
         # Запускаем анализ голоса вне блокировки
         if client and user_data_copy_for_thread is not None:
             try:
-                file_info = bot.get_file(message.voice.file_id)
-                downloaded_file = bot.download_file(file_info.file_path)
+                with span("voice.download"):
+                    file_info = bot.get_file(message.voice.file_id)
+                    downloaded_file = bot.download_file(file_info.file_path)
                 
                 temp_dir = "temp_voices"
                 os.makedirs(temp_dir, exist_ok=True)
@@ -237,6 +258,7 @@ def register_voice_handlers(bot):
                     new_file.write(downloaded_file)
                 
                 # Передаем копию данных в поток
-                threading.Thread(target=analyze_voice_thread, args=(bot, file_path, user_data_copy_for_thread, chat_id)).start()
+                TRANSCRIPTIONS_QUEUED.inc()
+                threading.Thread(target=bind(_analyze_voice_tracked, "analyze_voice_thread"), args=(bot, file_path, user_data_copy_for_thread, chat_id)).start()
             except Exception as e:
                 logging.error(f"Ошибка при скачивании аудиофайла: {e}")
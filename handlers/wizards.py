@@ -1,12 +1,14 @@
 # handlers/wizards.py
 
 import logging
-import datetime
 from telebot import types
 
-from utils import admin_required, save_json_data, safe_reply
-from state import user_states, chat_configs, ad_templates
-from config import TIMEZONE_MAP, CHAT_CONFIG_FILE, AD_TEMPLATES_FILE
+import clock
+from utils import admin_required, safe_reply
+from state import user_states, ad_templates
+from chat_config import chat_settings
+from config_store import save_templates
+from callback_router import router, pack_callback
 
 # Доступные концепции
 CONCEPTS = {
@@ -46,6 +48,28 @@ def categorize_ad_text(text: str) -> str:
     best_category = max(scores, key=scores.get)
     return best_category if scores[best_category] > 0 else "general"
 
+def search_ad_templates(search_query: str, templates: dict = None) -> list:
+    """Ищет подстроку во всех объявлениях (бренд → город → тип → список)."""
+    search_query = search_query.lower()
+    found_ads = []
+    for brand, brand_data in (ad_templates if templates is None else templates).items():
+        for city, city_data in brand_data.items():
+            for ad_type, ads_list in city_data.items():
+                # Шаблоны голосового анализа хранятся как {название: текст} — их пропускаем
+                if not isinstance(ads_list, list):
+                    continue
+                for i, ad in enumerate(ads_list):
+                    if search_query in ad.get("text", "").lower():
+                        found_ads.append({
+                            "brand": brand,
+                            "city": city,
+                            "type": ad_type,
+                            "index": i,
+                            "text": ad.get("text", ""),
+                            "category": ad.get("category", "general")
+                        })
+    return found_ads
+
 def register_wizard_handlers(bot):
 
     # ========================================
@@ -235,19 +259,15 @@ def register_wizard_handlers(bot):
             setup_data = user_states[chat_id]["setup_data"]
             
             # Сохраняем полную конфигурацию
-            if chat_id not in chat_configs:
-                chat_configs[chat_id] = {}
-            
-            chat_configs[chat_id].update({
-                "concept": concept_input,
-                "city": setup_data["city"],
-                "timezone": setup_data["timezone"],
-                "schedule": setup_data["schedule"],
-                "plan_voices": setup_data["plan_voices"],
-                "configured_at": datetime.datetime.now().isoformat()
-            })
-            
-            save_json_data(CHAT_CONFIG_FILE, chat_configs)
+            chat_settings.update(
+                chat_id,
+                concept=concept_input,
+                city=setup_data["city"],
+                timezone=setup_data["timezone"],
+                schedule=setup_data["schedule"],
+                plan_voices=setup_data["plan_voices"],
+                configured_at=clock.now().isoformat()
+            )
             
             # Очищаем временное состояние
             if "setup_step" in user_states[chat_id]:
@@ -269,7 +289,7 @@ def register_wizard_handlers(bot):
             
             bot.send_message(message.chat.id, text, parse_mode="Markdown")
             
-            logging.info(f"Chat {chat_id} fully configured: {chat_configs[chat_id]}")
+            logging.info(f"Chat {chat_id} fully configured: {dict(chat_settings.get(chat_id).raw)}")
         else:
             text = (f"❌ **Неизвестная концепция: {concept_input}**\n\n"
                     "📋 **Доступные концепции:**\n"
@@ -291,15 +311,8 @@ def register_wizard_handlers(bot):
     @admin_required(bot)
     def command_ads_new(message: types.Message):
         """Система управления рекламными шаблонами."""
-        import json
-        try:
-            with open('ad_templates.json', 'r', encoding='utf-8') as f:
-                ad_templates = json.load(f)
-        except FileNotFoundError:
-            bot.send_message(message.chat.id, "❌ Файл рекламных шаблонов не найден!")
-            return
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка загрузки файла: {e}")
+        if not ad_templates:
+            bot.send_message(message.chat.id, "❌ Рекламные шаблоны не загружены!")
             return
         
         # Подсчет всех шаблонов
@@ -338,7 +351,7 @@ def register_wizard_handlers(bot):
             
             markup.add(types.InlineKeyboardButton(
                 f"{category_data['name']} ({count})", 
-                callback_data=f"ads_category_{category_id}"
+                callback_data=pack_callback("ads_category", category_id)
             ))
         
         markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_back_main"))
@@ -381,7 +394,7 @@ def register_wizard_handlers(bot):
             preview = ad["text"][:50] + "..." if len(ad["text"]) > 50 else ad["text"]
             markup.add(types.InlineKeyboardButton(
                 f"{ad['brand']}/{ad['city']} - {preview}",
-                callback_data=f"ads_view_{ad['brand']}_{ad['city']}_{ad['type']}_{ad['index']}"
+                callback_data=pack_callback("ads_view", ad['brand'], ad['city'], ad['type'], ad['index'])
             ))
         
         if len(ads_in_category) > 10:
@@ -490,14 +503,14 @@ def register_wizard_handlers(bot):
         new_ad = {
             "text": ad_text,
             "category": category,
-            "created": datetime.datetime.now().strftime("%d.%m.%Y %H:%M"),
+            "created": clock.now().strftime("%d.%m.%Y %H:%M"),
             "created_by": message.from_user.username or message.from_user.first_name
         }
         
         ad_templates[brand][city][ad_type].append(new_ad)
         
-        # Сохраняем в файл
-        save_json_data(AD_TEMPLATES_FILE, ad_templates)
+        # Сохраняем шаблоны города
+        save_templates(brand, city)
         
         final_text = (f"🎉 **Объявление успешно добавлено!**\n\n"
                      f"**Бренд:** {brand.upper()}\n"
@@ -513,15 +526,14 @@ def register_wizard_handlers(bot):
         del user_states[user_id]
     
     # Обработчик для выбора типа объявления
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("ads_wizard_type_"))
-    def handle_ad_type_callback(call):
+    @router.route("ads_wizard_type_", prefix=True)
+    def handle_ad_type_callback(call, ad_type: str = ""):
         """Обработка выбора типа объявления."""
         user_id = call.from_user.id
         state = user_states.get(user_id, {})
         if not state or state.get("state") != "ads_wizard_awaiting_type":
             return
         
-        ad_type = call.data.replace("ads_wizard_type_", "")
         state["ad_data"]["type"] = ad_type
         state["state"] = "ads_wizard_awaiting_text"
         
@@ -538,27 +550,21 @@ def register_wizard_handlers(bot):
         bot.register_next_step_handler(msg, process_ad_text, bot)
     
     # Обработчики для редактирования и удаления
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("ads_edit_"))
-    def handle_ad_edit_callback(call):
+    @router.route("ads_edit")
+    def handle_ad_edit_callback(call, brand: str, city: str, ad_type: str, index: str):
         """Обработка редактирования объявления."""
         try:
-            parts = call.data.replace("ads_edit_", "").split("_")
-            if len(parts) >= 4:
-                brand, city, ad_type, index = parts[0], parts[1], parts[2], int(parts[3])
-                start_edit_ad_wizard(bot, call.message.chat.id, call.from_user.id, brand, city, ad_type, index)
-                bot.answer_callback_query(call.id, "Начинаем редактирование")
+            start_edit_ad_wizard(bot, call.message.chat.id, call.from_user.id, brand, city, ad_type, int(index))
+            bot.answer_callback_query(call.id, "Начинаем редактирование")
         except Exception as e:
             bot.answer_callback_query(call.id, f"Ошибка: {str(e)}")
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("ads_delete_"))
-    def handle_ad_delete_callback(call):
+    @router.route("ads_delete")
+    def handle_ad_delete_callback(call, brand: str, city: str, ad_type: str, index: str):
         """Обработка удаления объявления."""
         try:
-            parts = call.data.replace("ads_delete_", "").split("_")
-            if len(parts) >= 4:
-                brand, city, ad_type, index = parts[0], parts[1], parts[2], int(parts[3])
-                delete_ad(bot, call.message.chat.id, brand, city, ad_type, index)
-                bot.answer_callback_query(call.id, "Объявление удалено")
+            delete_ad(bot, call.message.chat.id, brand, city, ad_type, int(index))
+            bot.answer_callback_query(call.id, "Объявление удалено")
         except Exception as e:
             bot.answer_callback_query(call.id, f"Ошибка: {str(e)}")
     
@@ -613,12 +619,13 @@ def register_wizard_handlers(bot):
             ad_templates[brand][city][ad_type][index].update({
                 "text": new_text,
                 "category": new_category,
-                "updated": datetime.datetime.now().strftime("%d.%m.%Y %H:%M"),
+                "updated": clock.now().strftime("%d.%m.%Y %H:%M"),
                 "updated_by": message.from_user.username or message.from_user.first_name
             })
             
-            # Сохраняем в файл
-            save_json_data(AD_TEMPLATES_FILE, ad_templates)
+            # Сохраняем шаблоны города
+            if not save_templates(brand, city):
+                raise RuntimeError("не удалось записать в БД")
             
             category_name = AD_CATEGORIES.get(new_category, {}).get("name", "Неизвестно")
             
@@ -652,8 +659,8 @@ def register_wizard_handlers(bot):
             if not ad_templates[brand]:
                 del ad_templates[brand]
             
-            # Сохраняем в файл
-            save_json_data(AD_TEMPLATES_FILE, ad_templates)
+            # Сохраняем шаблоны города (опустевший город удаляется)
+            save_templates(brand, city)
             
             preview = ad["text"][:50] + "..." if len(ad["text"]) > 50 else ad["text"]
             bot.send_message(chat_id, f"🗑️ **Объявление удалено:**\n{preview}", parse_mode="Markdown")
@@ -667,43 +674,42 @@ def register_wizard_handlers(bot):
     #   ОБРАБОТЧИКИ КОЛЛБЕКОВ ДЛЯ РЕКЛАМЫ
     # ========================================
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("ads_"))
-    def handle_ads_callbacks(call):
-        """Обработчик всех коллбеков новой системы рекламы."""
+    @router.route("ads_add_new")
+    def handle_ads_add_new(call):
+        start_add_ad_wizard(bot, call.message.chat.id, call.from_user.id)
+        bot.answer_callback_query(call.id, "Начинаем добавление рекламы")
+
+    @router.route("ads_view_categories")
+    def handle_ads_view_categories(call):
+        show_ad_categories_menu(bot, call.message.chat.id)
+        bot.answer_callback_query(call.id)
+
+    @router.route("ads_category")
+    def handle_ads_category(call, category_id: str):
+        show_ads_in_category(bot, call.message.chat.id, category_id)
+        bot.answer_callback_query(call.id)
+
+    @router.route("ads_search")
+    def handle_ads_search(call):
+        start_ads_search(bot, call.message.chat.id, call.from_user.id)
+        bot.answer_callback_query(call.id, "Начинаем поиск")
+
+    @router.route("ads_stats")
+    def handle_ads_stats(call):
+        show_ads_statistics(bot, call.message.chat.id)
+        bot.answer_callback_query(call.id)
+
+    @router.route("ads_back_main")
+    def handle_ads_back_main(call):
+        command_ads_new(call.message)
+        bot.answer_callback_query(call.id)
+
+    @router.route("ads_view")
+    def handle_ads_view(call, brand: str, city: str, ad_type: str, index: str):
+        """Просмотр конкретного объявления."""
         try:
-            if call.data == "ads_add_new":
-                start_add_ad_wizard(bot, call.message.chat.id, call.from_user.id)
-                bot.answer_callback_query(call.id, "Начинаем добавление рекламы")
-                
-            elif call.data == "ads_view_categories":
-                show_ad_categories_menu(bot, call.message.chat.id)
-                bot.answer_callback_query(call.id)
-                
-            elif call.data.startswith("ads_category_"):
-                category_id = call.data.replace("ads_category_", "")
-                show_ads_in_category(bot, call.message.chat.id, category_id)
-                bot.answer_callback_query(call.id)
-                
-            elif call.data == "ads_search":
-                start_ads_search(bot, call.message.chat.id, call.from_user.id)
-                bot.answer_callback_query(call.id, "Начинаем поиск")
-                
-            elif call.data == "ads_stats":
-                show_ads_statistics(bot, call.message.chat.id)
-                bot.answer_callback_query(call.id)
-                
-            elif call.data == "ads_back_main":
-                command_ads_new(call.message)
-                bot.answer_callback_query(call.id)
-                
-            elif call.data.startswith("ads_view_"):
-                # Обработка просмотра конкретного объявления
-                parts = call.data.replace("ads_view_", "").split("_")
-                if len(parts) >= 4:
-                    brand, city, ad_type, index = parts[0], parts[1], parts[2], int(parts[3])
-                    show_single_ad(bot, call.message.chat.id, brand, city, ad_type, index)
-                bot.answer_callback_query(call.id)
-                
+            show_single_ad(bot, call.message.chat.id, brand, city, ad_type, int(index))
+            bot.answer_callback_query(call.id)
         except Exception as e:
             bot.answer_callback_query(call.id, f"Ошибка: {str(e)}")
     
@@ -734,22 +740,7 @@ def register_wizard_handlers(bot):
             return safe_reply(bot, message, "Поиск отменен.")
         
         search_query = message.text.lower()
-        found_ads = []
-        
-        # Поиск по всем объявлениям
-        for brand, brand_data in ad_templates.items():
-            for city, city_data in brand_data.items():
-                for ad_type, ads_list in city_data.items():
-                    for i, ad in enumerate(ads_list):
-                        if search_query in ad.get("text", "").lower():
-                            found_ads.append({
-                                "brand": brand,
-                                "city": city,
-                                "type": ad_type,
-                                "index": i,
-                                "text": ad.get("text", ""),
-                                "category": ad.get("category", "general")
-                            })
+        found_ads = search_ad_templates(search_query)
         
         if not found_ads:
             safe_reply(bot, message, f"🔍 По запросу **\"{search_query}\"** ничего не найдено.", parse_mode="Markdown")
@@ -762,7 +753,7 @@ def register_wizard_handlers(bot):
                 preview = ad["text"][:50] + "..." if len(ad["text"]) > 50 else ad["text"]
                 markup.add(types.InlineKeyboardButton(
                     f"{category_name} {ad['brand']}/{ad['city']} - {preview}",
-                    callback_data=f"ads_view_{ad['brand']}_{ad['city']}_{ad['type']}_{ad['index']}"
+                    callback_data=pack_callback("ads_view", ad['brand'], ad['city'], ad['type'], ad['index'])
                 ))
             
             if len(found_ads) > 10:
@@ -829,9 +820,9 @@ def register_wizard_handlers(bot):
             markup = types.InlineKeyboardMarkup(row_width=2)
             markup.add(
                 types.InlineKeyboardButton("✏️ Редактировать", 
-                                         callback_data=f"ads_edit_{brand}_{city}_{ad_type}_{index}"),
+                                         callback_data=pack_callback("ads_edit", brand, city, ad_type, index)),
                 types.InlineKeyboardButton("🗑️ Удалить", 
-                                         callback_data=f"ads_delete_{brand}_{city}_{ad_type}_{index}")
+                                         callback_data=pack_callback("ads_delete", brand, city, ad_type, index))
             )
             markup.add(types.InlineKeyboardButton("« Назад", callback_data="ads_view_categories"))
             
@@ -873,26 +864,10 @@ def register_wizard_handlers(bot):
             bot.send_message(message.chat.id, "❌ Название и текст шаблона не могут быть пустыми!")
             return
         
-        # Загрузить текущие шаблоны
-        import json
-        try:
-            with open('ad_templates.json', 'r', encoding='utf-8') as f:
-                ad_templates = json.load(f)
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка загрузки файла: {e}")
-            user_states.pop(user_id, None)
-            return
-        
-        # Добавить новый шаблон
-        if brand not in ad_templates:
-            ad_templates[brand] = {}
-        if city not in ad_templates[brand]:
-            ad_templates[brand][city] = {}
-            
-        if template_name in ad_templates[brand][city]:
+        if template_name in ad_templates.get(brand, {}).get(city, {}):
             markup = types.InlineKeyboardMarkup(row_width=2)
             markup.add(
-                types.InlineKeyboardButton("✅ Да, заменить", callback_data=f"ads_replace_{brand}_{city}_{template_name}"),
+                types.InlineKeyboardButton("✅ Да, заменить", callback_data=pack_callback("ads_replace", brand, city, template_name)),
                 types.InlineKeyboardButton("❌ Отмена", callback_data="ads_back_main")
             )
             
@@ -906,12 +881,11 @@ def register_wizard_handlers(bot):
             return
         
         # Добавляем новый шаблон
-        ad_templates[brand][city][template_name] = template_text
+        ad_templates.setdefault(brand, {}).setdefault(city, {})[template_name] = template_text
         
-        # Сохранить файл
         try:
-            with open('ad_templates.json', 'w', encoding='utf-8') as f:
-                json.dump(ad_templates, f, ensure_ascii=False, indent=2)
+            if not save_templates(brand, city):
+                raise RuntimeError("не удалось записать в БД")
             
             markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("« Назад к главному меню", callback_data="ads_back_main"))
@@ -922,7 +896,7 @@ def register_wizard_handlers(bot):
                            reply_markup=markup)
             
         except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка сохранения файла: {e}")
+            bot.send_message(message.chat.id, f"❌ Ошибка сохранения шаблона: {e}")
         
         # Очищаем состояние
         user_states.pop(user_id, None)
@@ -3,7 +3,7 @@
 Система справки «ЕВГЕНИЧ-РЕВИЗОР» — с характером и юмором 🗿
 """
 
-from datetime import datetime
+import clock
 from roles import get_available_roles_for_day, UserRole
 
 class HelpSystem:
@@ -12,7 +12,7 @@ class HelpSystem:
     @staticmethod
     def get_user_help() -> str:
         """Возвращает справку для обычных пользователей."""
-        day_of_week = datetime.now().weekday()
+        day_of_week = clock.now().weekday()
         is_weekend = day_of_week in [4, 5]  # Пт-Сб
         day_name = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"][day_of_week]
         
@@ -106,10 +106,13 @@ class HelpSystem:
 
 📊 **ОТЧЁТЫ И АНАЛИТИКА:**
 • `/report` — детальный отчёт
+• `/shift_jobs` — ход закрытия смен
+• `/live_status on|off` — живой статус в закреплённом сообщении
 • `/rating` — рейтинг ведущих
 • `/status` — статус системы
-• `/log` — журнал событий
+• `/log` — журнал событий смены, `/log ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]` — история за период (CSV.gz)
 • `/marketing_analytics` — маркетинговая аналитика
+• `/config_export` — резервная копия настроек чатов и шаблонов
 
 📢 **BOSS-ФУНКЦИИ (только BOSS\\_ID):**
 • `/broadcast` — рассылка во все чаты
@@ -140,7 +143,7 @@ class HelpSystem:
     @staticmethod
     def get_roles_info() -> str:
         """Возвращает информацию о системе ролей."""
-        day_of_week = datetime.now().weekday()
+        day_of_week = clock.now().weekday()
         day_names = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
         current_day = day_names[day_of_week]
         
@@ -0,0 +1,150 @@
+# history_export.py
+"""
+Выгрузка истории чата из event_history и voice_stats за любой период.
+
+Строки читаются из БД порциями по ключу (время, id): в памяти одна порция,
+а не весь период, и порция сразу дописывается в CSV, сжатый gzip. Файл
+собирается в SpooledTemporaryFile: до EXPORT_SPOOL_BYTES в памяти, больше —
+во временном каталоге системы, но не в рабочем каталоге процесса. Готовый
+буфер отправляется в Telegram как документ без промежуточных файлов.
+
+Сжатый файл ограничен EXPORT_MAX_BYTES (лимит Telegram на документ от бота);
+если период не поместился, выгрузка обрывается и помечается как неполная.
+"""
+
+import csv
+import datetime
+import functools
+import gzip
+import io
+import logging
+import tempfile
+from collections import namedtuple
+from typing import Iterator, Optional
+
+import pytz
+
+import clock
+from config import EXPORT_PAGE_SIZE, EXPORT_SPOOL_BYTES, EXPORT_MAX_BYTES
+from event_log import format_db_time, write_shift_log
+
+# Вид выгрузки: таблица и заголовок CSV (порядок колонок — EXPORT_COLUMNS в БД)
+EXPORT_KINDS = {
+    'events': ('event_history', ('id', 'время', 'user_id', 'username', 'тип', 'событие')),
+    'voices': ('voice_stats', ('id', 'время', 'user_id', 'username', 'длительность', 'реклама')),
+}
+
+# Как часто сверять размер сжатого файла с лимитом
+SIZE_CHECK_ROWS = 1000
+
+ExportResult = namedtuple('ExportResult', 'file filename rows truncated')
+
+
+@functools.lru_cache(maxsize=4096)
+def _moscow_zone(utc_hour: datetime.datetime) -> datetime.timezone:
+    offset = pytz.utc.localize(utc_hour).astimezone(clock.MOSCOW_TZ).utcoffset()
+    return datetime.timezone(offset)
+
+
+def _local_time(created_at) -> str:
+    """То же, что event_log.format_db_time, но пояс берётся из кэша по часу: строк в выгрузке много."""
+    if isinstance(created_at, str):
+        created_at = datetime.datetime.fromisoformat(created_at)
+    zone = _moscow_zone(created_at.replace(minute=0, second=0, microsecond=0))
+    return (created_at + zone.utcoffset(None)).replace(tzinfo=zone).isoformat()
+
+
+class ExportUnavailable(Exception):
+    """БД не ответила: выгрузить нечего."""
+
+
+def parse_date(text: str) -> datetime.date:
+    return datetime.datetime.strptime(text, '%d.%m.%Y').date()
+
+
+def period_bounds(date_from: datetime.date, date_to: datetime.date) -> tuple:
+    """Московские сутки date_from…date_to включительно как [since, until) в UTC без пояса, как в БД."""
+    def utc(day: datetime.date) -> datetime.datetime:
+        local = clock.MOSCOW_TZ.localize(datetime.datetime.combine(day, datetime.time.min))
+        return local.astimezone(pytz.utc).replace(tzinfo=None)
+    return utc(date_from), utc(date_to + datetime.timedelta(days=1))
+
+
+def iter_history_rows(chat_id: int, kind: str, since: datetime.datetime, until: datetime.datetime,
+                      user_id: Optional[int] = None, event_type: Optional[str] = None,
+                      page_size: int = EXPORT_PAGE_SIZE) -> Iterator[tuple]:
+    """Строки выгрузки по порядку времени; из БД читается по page_size строк за раз."""
+    from database_manager import db
+
+    table = EXPORT_KINDS[kind][0]
+    after = None
+    while True:
+        rows = db.fetch_history_page(table, chat_id, since, until, after, page_size,
+                                     user_id=user_id, event_type=event_type)
+        if rows is None:
+            raise ExportUnavailable(f"{table}: БД недоступна")
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
+
+def export_history(chat_id: int, kind: str, since: datetime.datetime, until: datetime.datetime,
+                   user_id: Optional[int] = None, event_type: Optional[str] = None,
+                   max_bytes: int = EXPORT_MAX_BYTES) -> ExportResult:
+    """CSV.gz с историей чата за [since, until). Файл открыт и перемотан в начало."""
+    header = EXPORT_KINDS[kind][1]
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    written = 0
+    truncated = False
+    try:
+        with gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=6) as gz:
+            # utf-8-sig: Excel открывает кириллицу без выбора кодировки
+            text = io.TextIOWrapper(gz, encoding='utf-8-sig', newline='')
+            writer = csv.writer(text)
+            writer.writerow(header)
+            for row_id, created_at, row_user_id, username, value, description in iter_history_rows(
+                    chat_id, kind, since, until, user_id, event_type):
+                writer.writerow((row_id, _local_time(created_at), row_user_id, username, value, description))
+                written += 1
+                if written % SIZE_CHECK_ROWS == 0:
+                    text.flush()
+                    if spool.tell() >= max_bytes:
+                        truncated = True
+                        logging.warning(f"Выгрузка {kind} чата {chat_id}: достигнут лимит {max_bytes} байт, "
+                                        f"файл обрезан на {written} строках")
+                        break
+            text.flush()
+            text.detach()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    local_since = format_db_time(since)[:10]
+    local_until = format_db_time(until - datetime.timedelta(seconds=1))[:10]
+    filename = f"{kind}_{chat_id}_{local_since}_{local_until}.csv.gz"
+    return ExportResult(spool, filename, written, truncated)
+
+
+def export_shift_log(chat_id: int, title: Optional[str] = None) -> ExportResult:
+    """Текстовый лог текущей смены (event_log.write_shift_log) в буфере, без файла в рабочем каталоге."""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    text = io.TextIOWrapper(spool, encoding='utf-8', newline='')
+    try:
+        written = write_shift_log(chat_id, text, title)
+        text.flush()
+        text.detach()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    filename = f"history_{chat_id}_{clock.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    return ExportResult(spool, filename, written, False)
+
+
+def send_export(bot, chat_id: int, result: ExportResult, caption: str):
+    """Отправляет буфер выгрузки документом и закрывает его."""
+    try:
+        bot.send_document(chat_id, result.file, visible_file_name=result.filename, caption=caption)
+    finally:
+        result.file.close()
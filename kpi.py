@@ -0,0 +1,109 @@
+# kpi.py
+"""
+Дневные KPI заведения: расчёт показателей закрытой смены и сборка аналитики
+из предагрегированных строк venue_kpi_daily (общая логика для SQLite и PostgreSQL).
+"""
+
+import datetime
+import json
+from collections import Counter
+from typing import Dict, Iterable, List
+
+import clock
+from models import ShiftData
+
+# Поля-суммы в таблице venue_kpi_daily
+KPI_SUM_FIELDS = (
+    "shifts", "voices", "plan_pct_sum", "rhythm_minutes_sum", "rhythm_intervals",
+    "breaks", "break_minutes", "late_returns", "active_minutes",
+)
+
+
+def shift_business_day(shift_data: ShiftData) -> str:
+    """Дата смены (по времени начала, Москва) в формате YYYY-MM-DD."""
+    try:
+        start = datetime.datetime.fromisoformat(shift_data.shift_start_time)
+        if start.tzinfo is None:
+            start = clock.MOSCOW_TZ.localize(start)
+        return start.astimezone(clock.MOSCOW_TZ).date().isoformat()
+    except (TypeError, ValueError):
+        return clock.moscow_now().date().isoformat()
+
+
+def compute_shift_kpis(shift_data: ShiftData) -> Dict:
+    """Считает вклад одной закрытой смены в дневной KPI."""
+    users = list(shift_data.users.values())
+    voices = sum(u.count for u in users)
+    goal = sum(getattr(u, 'goal', 0) or 0 for u in users) or shift_data.shift_goal or 0
+    plan_pct = (voices / goal * 100) if goal > 0 else 100.0
+
+    deltas = [d for u in users for d in u.voice_deltas]
+    ads = Counter(ad for u in users for ad in u.recognized_ads)
+
+    now = clock.moscow_now()
+    try:
+        start = datetime.datetime.fromisoformat(shift_data.shift_start_time)
+        active_minutes = max(0.0, (now - start).total_seconds() / 60)
+    except (TypeError, ValueError):
+        active_minutes = 0.0
+
+    return {
+        "day": shift_business_day(shift_data),
+        "shifts": 1,
+        "voices": voices,
+        "plan_pct_sum": plan_pct,
+        "rhythm_minutes_sum": float(sum(deltas)),
+        "rhythm_intervals": len(deltas),
+        "breaks": sum(u.breaks_count for u in users),
+        "break_minutes": float(sum(getattr(u, 'break_minutes', 0.0) for u in users)),
+        "late_returns": sum(u.late_returns for u in users),
+        "active_minutes": active_minutes,
+        "ads": dict(ads),
+    }
+
+
+def merge_ads_json(current: str, added: Dict[str, int]) -> str:
+    """Складывает счётчики упоминаний рекламы."""
+    try:
+        counter = Counter(json.loads(current or '{}'))
+    except (TypeError, ValueError):
+        counter = Counter()
+    counter.update(added)
+    return json.dumps(dict(counter), ensure_ascii=False)
+
+
+def build_marketing_analytics(rows: Iterable[Dict]) -> Dict:
+    """Собирает ответ get_marketing_analytics из строк venue_kpi_daily за окно."""
+    totals = dict.fromkeys(KPI_SUM_FIELDS, 0)
+    ads = Counter()
+    for row in rows:
+        for name in KPI_SUM_FIELDS:
+            totals[name] += row.get(name) or 0
+        try:
+            ads.update(json.loads(row.get("ads_json") or '{}'))
+        except (TypeError, ValueError):
+            pass
+
+    shifts = totals["shifts"]
+    if not shifts:
+        return {}
+
+    top_ads: List = ads.most_common(5)
+    return {
+        'total_shifts': shifts,
+        'avg_plan_completion': totals["plan_pct_sum"] / shifts,
+        'avg_voices': totals["voices"] / shifts,
+        'avg_breaks': totals["breaks"] / shifts,
+        'avg_late_returns': totals["late_returns"] / shifts,
+        'total_late_returns': totals["late_returns"],
+        'avg_rhythm': (totals["rhythm_minutes_sum"] / totals["rhythm_intervals"]) if totals["rhythm_intervals"] else 0.0,
+        'avg_break_time': (totals["break_minutes"] / totals["breaks"]) if totals["breaks"] else 0.0,
+        'total_active_time': totals["active_minutes"] / 60,
+        'top_ads': top_ads,
+    }
+
+
+def window_start_day(days: int) -> str:
+    """Первый день окна из N дней, включая сегодняшний."""
+    today = clock.moscow_now().date()
+    return (today - datetime.timedelta(days=max(days, 1) - 1)).isoformat()
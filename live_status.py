@@ -0,0 +1,295 @@
+# live_status.py
+"""
+Живой статус смены: одно закреплённое сообщение на активную смену.
+
+Вместо нового отчёта на каждый /status, /check или кнопку «Статус» бот
+редактирует одно сообщение. Изменения (голосовые, перерывы, паузы) копятся
+LIVE_STATUS_DEBOUNCE_SECONDS и уходят одной правкой; если текст не изменился,
+запрос к Bot API не делается вовсе. Напоминания планировщика в этом режиме
+заменяют предыдущее напоминание, а не копятся в чате.
+
+Режим включается на чат командой /live_status (ключ live_status в
+chat_configs) или для всех чатов через LIVE_STATUS_DEFAULT. Номера
+сообщений лежат на диске, поэтому после перезапуска правится то же сообщение.
+"""
+
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+import clock
+from state import chat_data, data_lock
+from chat_config import chat_settings
+from snapshots import shift_snapshot
+from config import VOLUME_PATH, LIVE_STATUS_DEBOUNCE_SECONDS
+
+LIVE_STATUS_FILE = os.path.join(VOLUME_PATH, 'live_status.json')
+MESSAGE_LIMIT = 4000
+# Длительность паузы задана так же в handlers/user.py и scheduler.py
+PAUSE_MINUTES = 40
+
+# Исход правки сообщения: отредактировано; сообщения больше нет (нужно новое);
+# временная ошибка (429, сеть, предохранитель) — повторить после окна;
+# ошибка в самом тексте — ждать следующего изменения смены
+EDITED, GONE, RETRY, REJECTED = 'edited', 'gone', 'retry', 'rejected'
+# Только эти ответы Bot API означают, что править старое сообщение бесполезно
+_GONE_ERRORS = ("message to edit not found", "message can't be edited")
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _hhmm(iso: Optional[str], minutes: int = 0) -> str:
+    try:
+        moment = datetime.datetime.fromisoformat(iso) + datetime.timedelta(minutes=minutes)
+    except (TypeError, ValueError):
+        return "?"
+    return moment.strftime('%H:%M')
+
+
+def render_status(chat_id: int) -> Optional[str]:
+    """Тело живого статуса (без строки времени обновления); None, если смены нет."""
+    from utils import generate_detailed_report
+    shift = shift_snapshot(chat_id)
+    if not shift or not shift.main_id:
+        return None
+    states = []
+    for user_data in shift.users.values():
+        if user_data.on_break:
+            states.append(f"☕ {user_data.username} на перерыве с {_hhmm(user_data.break_start_time)}")
+        elif user_data.on_pause:
+            states.append(f"⏸️ {user_data.username}: пауза до {_hhmm(user_data.pause_start_time, PAUSE_MINUTES)}")
+    report_lines = generate_detailed_report(chat_id, shift)
+    lines = states or ["🎙️ В эфире"]
+    return "\n".join(lines + [""] + report_lines)
+
+
+class LiveStatus:
+    """Держит по одному закреплённому сообщению статуса на чат и правит его с задержкой."""
+
+    def __init__(self, path: str = LIVE_STATUS_FILE, debounce: float = LIVE_STATUS_DEBOUNCE_SECONDS):
+        self.path = path
+        self.debounce = debounce
+        self._lock = threading.RLock()
+        self._chat_locks = {}
+        self._timers = {}
+        self._entries = None
+
+    # --- Состояние на диске ---
+
+    @property
+    def entries(self) -> dict:
+        """chat_id -> {message_id, shift_start_time, hash, reminder_id}."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = {}
+                if os.path.exists(self.path):
+                    try:
+                        with open(self.path, 'r', encoding='utf-8') as f:
+                            self._entries = {int(k): v for k, v in json.load(f).items()}
+                    except (json.JSONDecodeError, OSError, ValueError) as e:
+                        logging.error(f"Ошибка чтения {self.path}: {e}")
+            return self._entries
+
+    def _save(self):
+        with self._lock:
+            data = {str(k): v for k, v in self.entries.items()}
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+
+    def _chat_lock(self, chat_id: int) -> threading.Lock:
+        with self._lock:
+            return self._chat_locks.setdefault(chat_id, threading.Lock())
+
+    # --- Публичный интерфейс ---
+
+    @staticmethod
+    def enabled(chat_id: int) -> bool:
+        return chat_settings.get(chat_id).live_status
+
+    def touch(self, bot, chat_id: int):
+        """Отмечает изменение смены; сообщение обновится по окончании окна."""
+        if not self.enabled(chat_id):
+            return
+        with self._lock:
+            if chat_id in self._timers:
+                return
+            timer = threading.Timer(self.debounce, self._fire, args=(bot, chat_id))
+            timer.daemon = True
+            self._timers[chat_id] = timer
+        timer.start()
+
+    def _fire(self, bot, chat_id: int):
+        with self._lock:
+            self._timers.pop(chat_id, None)
+        try:
+            self.refresh(bot, chat_id)
+        except Exception as e:
+            logging.error(f"Живой статус: не удалось обновить чат {chat_id}: {e}")
+
+    def refresh(self, bot, chat_id: int) -> Optional[int]:
+        """Сразу приводит сообщение к текущему состоянию смены. Возвращает его message_id."""
+        with self._lock:
+            timer = self._timers.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+        body = render_status(chat_id)
+        if body is None:
+            return None
+        with self._chat_lock(chat_id):
+            with data_lock:
+                shift_start = chat_data[chat_id].shift_start_time if chat_id in chat_data else None
+            entry = self.entries.get(chat_id)
+            if entry and entry.get('shift_start_time') != shift_start:
+                # Сообщение прошлой смены: снимаем закреп и начинаем новое
+                self._unpin(bot, chat_id, entry)
+                entry = None
+            body_hash = _digest(body)
+            if entry and entry.get('hash') == body_hash:
+                return entry['message_id']
+
+            text = f"📌 *Живой статус смены* · обновлено {clock.moscow_now():%H:%M}\n{body}"
+            if len(text) > MESSAGE_LIMIT:
+                text = text[:MESSAGE_LIMIT - 1] + "…"
+            outcome = self._edit(bot, chat_id, entry['message_id'], text) if entry else GONE
+            if outcome == EDITED:
+                entry['hash'] = body_hash
+            elif outcome in (RETRY, REJECTED):
+                # Сообщение на месте: не плодим новые закрепы, hash прежний — правка повторится
+                if outcome == RETRY:
+                    self.touch(bot, chat_id)
+                return entry['message_id']
+            else:
+                if entry:
+                    self._unpin(bot, chat_id, entry)
+                message_id = self._post(bot, chat_id, text)
+                if message_id is None:
+                    return None
+                entry = {'message_id': message_id, 'shift_start_time': shift_start,
+                         'hash': body_hash, 'reminder_id': (entry or {}).get('reminder_id')}
+                with self._lock:
+                    self.entries[chat_id] = entry
+            self._save()
+            return entry['message_id']
+
+    def show(self, bot, chat_id: int, point: bool = True) -> bool:
+        """Для /status, /check и кнопки «Статус»: обновляет живое сообщение и указывает на него.
+
+        point — ответить короткой ссылкой на закреплённое сообщение (для команд;
+        кнопке хватает всплывающего уведомления). False — режим выключен или
+        смены нет, тогда вызывающий отвечает как обычно.
+        """
+        if not self.enabled(chat_id):
+            return False
+        message_id = self.refresh(bot, chat_id)
+        if message_id is None:
+            return False
+        if point:
+            try:
+                bot.send_message(chat_id, "📌 Актуальный статус смены — в закреплённом сообщении.",
+                                 reply_to_message_id=message_id, disable_notification=True)
+            except Exception as e:
+                logging.warning(f"Живой статус: не удалось ответить в чате {chat_id}: {e}")
+        return True
+
+    def replace_reminder(self, bot, chat_id: int, message):
+        """Запоминает новое напоминание планировщика и удаляет предыдущее."""
+        if not self.enabled(chat_id) or message is None:
+            return
+        with self._lock:
+            entry = self.entries.get(chat_id)
+            if entry is None:
+                return
+            previous, entry['reminder_id'] = entry.get('reminder_id'), message.message_id
+        if previous:
+            try:
+                bot.delete_message(chat_id, previous)
+            except Exception as e:
+                logging.info(f"Живой статус: старое напоминание в чате {chat_id} не удалено: {e}")
+        self._save()
+
+    def finish(self, bot, chat_id: int):
+        """Смена закрыта: снимаем закреп и забываем сообщение."""
+        with self._lock:
+            timer = self._timers.pop(chat_id, None)
+            entry = self.entries.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+        if entry:
+            self._unpin(bot, chat_id, entry)
+            self._save()
+
+    # --- Bot API ---
+
+    @staticmethod
+    def _post(bot, chat_id: int, text: str) -> Optional[int]:
+        try:
+            sent = bot.send_message(chat_id, text, parse_mode="Markdown", disable_notification=True)
+        except Exception as e:
+            logging.error(f"Живой статус: не удалось отправить сообщение в чат {chat_id}: {e}")
+            return None
+        try:
+            bot.pin_chat_message(chat_id, sent.message_id, disable_notification=True)
+        except Exception as e:
+            logging.warning(f"Живой статус: не удалось закрепить сообщение в чате {chat_id}: {e}")
+        return sent.message_id
+
+    @staticmethod
+    def _edit(bot, chat_id: int, message_id: int, text: str) -> str:
+        """EDITED, GONE (сообщение удалено или больше не правится), RETRY или REJECTED."""
+        try:
+            bot.edit_message_text(text, chat_id, message_id, parse_mode="Markdown")
+            return EDITED
+        except Exception as e:
+            error = str(e)
+            if "message is not modified" in error:
+                return EDITED
+            logging.warning(f"Живой статус: сообщение {message_id} в чате {chat_id} не отредактировано: {e}")
+            if any(marker in error for marker in _GONE_ERRORS):
+                return GONE
+            if "can't parse entities" in error:
+                return REJECTED
+            return RETRY
+
+    @staticmethod
+    def _unpin(bot, chat_id: int, entry: dict):
+        try:
+            bot.unpin_chat_message(chat_id, entry['message_id'])
+        except Exception as e:
+            logging.info(f"Живой статус: не удалось открепить сообщение в чате {chat_id}: {e}")
+
+
+def instrument_bot(bot):
+    """Обновляет живой статус после каждого обработанного сообщения в чате.
+
+    Вызывать до регистрации обработчиков. Если сообщение ничего не изменило,
+    правки не будет: текст сравнивается с уже показанным.
+    """
+    original_add = bot.add_message_handler
+
+    def add_message_handler(handler_dict):
+        func = handler_dict['function']
+
+        @functools.wraps(func)
+        def wrapper(message, *args, **kwargs):
+            try:
+                return func(message, *args, **kwargs)
+            finally:
+                live_status.touch(bot, message.chat.id)
+
+        handler_dict['function'] = wrapper
+        return original_add(handler_dict)
+
+    bot.add_message_handler = add_message_handler
+
+
+# Общий живой статус для обработчиков, планировщика и shift_close
+live_status = LiveStatus()
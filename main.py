@@ -4,9 +4,14 @@ import logging
 import os
 import time
 import signal
-from flask import Flask
+from flask import Flask, Response
 from datetime import datetime
 
+import metrics
+import tracing
+import resilience
+import live_status
+
 # === Настройка логирования ===
 logging.basicConfig(
     level=logging.INFO,
@@ -23,12 +28,24 @@ _bot_ready = False
 
 @health_app.route('/health')
 def health_check():
-    return {"status": "healthy", "bot_ready": _bot_ready}, 200
+    # БД импортируется лениво и не подключается здесь: состояние цепи берётся из прокси
+    from database_manager import db
+    database = db.circuit_status() if hasattr(type(db), 'circuit_status') else None
+    dependencies = resilience.status()
+    degraded = (database and database["circuit"] == "open") or \
+        any(dep["state"] != "closed" for dep in dependencies.values())
+    # 200 и при оборванной БД или API: бот работает на заглушках, перезапуск контейнера не поможет
+    return {"status": "degraded" if degraded else "healthy", "bot_ready": _bot_ready,
+            "database": database, "dependencies": dependencies}, 200
 
 @health_app.route('/')
 def root_check():
     return health_check()
 
+@health_app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 def run_health_server():
     port = int(os.environ.get('PORT', 8080))
     logging.info(f"🌐 Health сервер на порту {port}")
@@ -38,15 +55,18 @@ def run_health_server():
 import telebot
 from telebot import types as tg_types
 from dataclasses import asdict
-from config import BOT_TOKEN, CHAT_CONFIG_FILE, AD_TEMPLATES_FILE
-from state import chat_configs, ad_templates, chat_data, user_history, data_lock
-from utils import load_json_data
+from config import BOT_TOKEN
+from state import ad_templates, chat_data, user_history, data_lock
+from chat_config import chat_settings
+from config_store import load_configs
 import handlers
 from admin_panel import register_admin_panel_handlers
 from scheduler import run_scheduler
 from state_manager import load_state
-from models import ShiftData, UserData
 from database_manager import db
+from bulk_writer import bulk_writer
+from shift_close import shift_closer
+from admin_digest import admin_digest
 
 # === Инициализация бота ===
 if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE" or not BOT_TOKEN:
@@ -62,6 +82,18 @@ class BotExceptionHandler(telebot.ExceptionHandler):
         return True  # True = polling продолжает работать
 
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode="Markdown", exception_handler=BotExceptionHandler())
+# Метрики: замер обработчиков (до их регистрации) и всех запросов к Bot API
+metrics.instrument_bot(bot)
+metrics.instrument_telegram_api()
+metrics.register_state_gauges()
+# Таймауты и предохранитель Bot API, состояние зависимостей в /metrics
+resilience.instrument_telegram_api()
+resilience.register_gauges()
+# Живой статус: правка закреплённого сообщения после обработанных сообщений
+live_status.instrument_bot(bot)
+# Трассировка: корневой спан на каждый апдейт, спаны Bot API
+tracing.instrument_bot(bot)
+tracing.instrument_telegram_api()
 
 # === Точка входа ===
 if __name__ == "__main__":
@@ -74,26 +106,15 @@ if __name__ == "__main__":
         logging.info("✅ Health check сервер запущен")
 
         # ШАГ 2: Загружаем данные
-        raw_configs = load_json_data(CHAT_CONFIG_FILE, {})
-        chat_configs.update({str(k): v for k, v in raw_configs.items()})
-        ad_templates.update(load_json_data(AD_TEMPLATES_FILE, {}))
-        logging.info(f"Загружено {len(chat_configs)} конфигураций чатов.")
-
-        loaded_chat_data_raw, loaded_user_history_raw = load_state()
-        temp_chat_data = {}
-        for cid, shift_dict in loaded_chat_data_raw.items():
-            try:
-                users_in_shift = {int(uid): UserData(**udict) for uid, udict in shift_dict.get('users', {}).items()}
-                shift_dict['users'] = users_in_shift
-                temp_chat_data[int(cid)] = ShiftData(**shift_dict)
-            except (TypeError, KeyError) as e:
-                logging.error(f"Ошибка данных чата {cid}: {e}")
-                continue
+        load_configs()
+        logging.info(f"Загружено {len(chat_settings.chat_ids())} конфигураций чатов, {len(ad_templates)} брендов шаблонов.")
+
+        loaded_chat_data, loaded_user_history = load_state()
         with data_lock:
             chat_data.clear()
-            chat_data.update(temp_chat_data)
+            chat_data.update(loaded_chat_data)
             user_history.clear()
-            user_history.update(loaded_user_history_raw)
+            user_history.update(loaded_user_history)
         if chat_data:
             logging.info(f"Восстановлено {len(chat_data)} активных смен.")
         logging.info("✅ Данные загружены")
@@ -132,6 +153,10 @@ if __name__ == "__main__":
             logging.warning(f"⚠️ Не удалось установить команды: {cmd_err}")
 
         # ШАГ 6: Фоновые задачи
+        admin_digest.resume(bot)
+        resumed = shift_closer.resume(bot)
+        if resumed:
+            logging.info(f"Продолжено прерванных закрытий смен: {resumed}")
         threading.Thread(target=run_scheduler, args=(bot,), daemon=True).start()
         logging.info("✅ Планировщик запущен")
 
@@ -143,12 +168,19 @@ if __name__ == "__main__":
         from state_manager import save_state
 
         def graceful_shutdown(signum, frame):
+            # Сначала дожидаемся закрытий смен: их сброс должен попасть в снимок
+            if not shift_closer.wait_idle(10):
+                logging.warning("⚠️ Закрытие смен не завершено, продолжится после перезапуска")
             logging.info("🛑 Сохраняю состояние...")
             try:
                 save_state(bot, chat_data, user_history)
                 logging.info("✅ Состояние сохранено")
             except Exception as e:
                 logging.error(f"❌ Ошибка сохранения: {e}")
+            try:
+                bulk_writer.shutdown()
+            except Exception as e:
+                logging.error(f"❌ Ошибка записи очереди в БД: {e}")
             exit(0)
 
         signal.signal(signal.SIGTERM, graceful_shutdown)
@@ -0,0 +1,395 @@
+# metrics.py
+"""
+Метрики в формате Prometheus для /metrics на health_app.
+
+Счётчики и гистограммы шардированы по потокам: каждый поток пишет только в
+свой шард (без блокировок на горячем пути), при выгрузке шарды суммируются.
+Шард хранится в threading.local; когда поток завершается, его шард
+прибавляется к общей базе и удаляется, поэтому шардов не больше, чем
+одновременно живущих потоков, писавших в серию.
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import tracing
+
+# Границы бакетов гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _ShardOwner:
+    """Держатель шарда в threading.local: исчезает вместе с потоком и запускает свёртку шарда."""
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self, values: list):
+        self.values = values
+
+
+class _Sharded:
+    """Значения одной серии, разложенные по потокам."""
+    __slots__ = ("_size", "_shards", "_base", "_local", "_lock")
+
+    def __init__(self, size: int):
+        self._size = size
+        self._shards: Dict[int, list] = {}
+        # Сумма шардов завершившихся потоков
+        self._base = [0] * size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def shard(self) -> list:
+        try:
+            return self._local.owner.values
+        except AttributeError:
+            return self._new_shard()
+
+    def _new_shard(self) -> list:
+        values = [0] * self._size
+        owner = _ShardOwner(values)
+        with self._lock:
+            self._shards[id(values)] = values
+        self._local.owner = owner
+        weakref.finalize(owner, self._fold, values)
+        return values
+
+    def _fold(self, values: list):
+        with self._lock:
+            if self._shards.pop(id(values), None) is None:
+                return
+            for i, v in enumerate(values):
+                self._base[i] += v
+
+    def totals(self) -> list:
+        with self._lock:
+            result = list(self._base)
+            shards = list(self._shards.values())
+        for shard in shards:
+            for i, v in enumerate(shard):
+                result[i] += v
+        return result
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, child in sorted(list(self._children.items())):
+            yield from self._render_child(key, child)
+
+
+class _CounterChild:
+    __slots__ = ("_values",)
+
+    def __init__(self):
+        self._values = _Sharded(1)
+
+    def inc(self, amount: float = 1):
+        self._values.shard()[0] += amount
+
+    def value(self) -> float:
+        return self._values.totals()[0]
+
+
+class Counter(_Metric):
+    """Монотонный счётчик."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _render_child(self, key, child):
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {child.value()}"
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_values")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # [по бакетам..., +Inf, sum, count]
+        self._values = _Sharded(len(buckets) + 3)
+
+    def observe(self, value: float):
+        shard = self._values.shard()
+        shard[bisect.bisect_left(self._buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def snapshot(self):
+        return self._values.totals()
+
+
+class Histogram(_Metric):
+    """Гистограмма с кумулятивными бакетами."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, key, child):
+        values = child.snapshot()
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), values[:-2]):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {values[-2]}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, key)} {values[-1]}"
+
+
+class Gauge(_Metric):
+    """Мгновенное значение, вычисляемое функцией при выгрузке."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def set_function(self, func: Callable[[], float], *label_values):
+        self._functions[tuple(str(v) for v in label_values)] = func
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, func in sorted(self._functions.items()):
+            try:
+                value = func()
+            except Exception as e:
+                logging.debug(f"Метрика {self.name}: ошибка вычисления: {e}")
+                continue
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- Метрики бота ---
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время выполнения обработчика", ("kind", "handler"))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("kind", "handler"))
+TELEGRAM_LATENCY = Histogram("telegram_api_seconds", "Задержка вызовов Bot API", ("method",))
+TELEGRAM_ERRORS = Counter("telegram_api_errors_total", "Ошибки Bot API по кодам", ("method", "code"))
+DB_LATENCY = Histogram("db_call_seconds", "Задержка вызовов db.*", ("method",))
+DB_ERRORS = Counter("db_call_errors_total", "Исключения в вызовах db.*", ("method",))
+DB_CIRCUIT_REJECTED = Counter("db_circuit_rejected_total", "Вызовы db.*, не дошедшие до БД: цепь разомкнута", ("method",))
+DB_CACHE = Counter("db_cache_total", "Кэш чтений db.*: попадания, промахи, сброшенные ключи", ("method", "result"))
+LOCK_WAIT = Histogram("data_lock_wait_seconds", "Ожидание data_lock", ("lock",),
+                      buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+LOCK_HOLD = Histogram("data_lock_hold_seconds", "Удержание data_lock", ("lock",),
+                      buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+SCHEDULER_JOB = Histogram("scheduler_job_seconds", "Длительность задач планировщика", ("job",))
+SCHEDULER_LAG = Histogram("scheduler_job_lag_seconds", "Опоздание запуска задачи относительно плана", ("job",),
+                          buckets=(0.1, 0.5, 1.0, 2.0, 5.0, 15.0, 30.0, 60.0, 300.0))
+SCHEDULER_ERRORS = Counter("scheduler_job_errors_total", "Исключения в задачах планировщика", ("job",))
+SCHEDULER_SKIPPED = Counter("scheduler_job_skipped_total", "Пропущенные запуски: предыдущий ещё выполнялся", ("job",))
+SHIFT_CLOSE_STEP = Histogram("shift_close_step_seconds", "Длительность шагов закрытия смены", ("step",))
+SHIFT_CLOSE_ERRORS = Counter("shift_close_step_errors_total", "Неудачные попытки шагов закрытия смены", ("step",))
+TRANSCRIPTIONS_QUEUED = Counter("transcriptions_queued_total", "Голосовые, отправленные на распознавание")
+TRANSCRIPTIONS_DONE = Counter("transcriptions_done_total", "Голосовые, распознавание которых завершено")
+DEPENDENCY_CALLS = Counter("dependency_calls_total", "Вызовы внешних зависимостей через предохранитель",
+                           ("dependency", "result"))
+GAUGES = Gauge("bot_state", "Текущее состояние бота", ("name",))
+
+
+def _observe(histogram: Histogram, errors: Optional[Counter], labels: tuple, func, args, kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        if errors is not None:
+            errors.labels(*labels).inc()
+        raise
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - started)
+
+
+def timed(histogram: Histogram, errors: Optional[Counter], *labels):
+    """Декоратор: время выполнения в гистограмму, исключения — в счётчик."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return _observe(histogram, errors, labels, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentedLock:
+    """Обёртка над threading.Lock с замером ожидания и удержания."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self._acquired_ns = 0
+        self._wait = LOCK_WAIT.labels(name)
+        self._hold = LOCK_HOLD.labels(name)
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started = time.perf_counter()
+        started_ns = time.time_ns() if tracing.active() else 0
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self._wait.observe(self._acquired_at - started)
+            if started_ns:
+                self._acquired_ns = time.time_ns()
+                tracing.record_span(f"{self.name}.wait", started_ns, self._acquired_ns)
+            else:
+                self._acquired_ns = 0
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        acquired_ns = self._acquired_ns
+        self._lock.release()
+        self._hold.observe(held)
+        if acquired_ns:
+            tracing.record_span(f"{self.name}.hold", acquired_ns, time.time_ns())
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def instrument_bot(bot):
+    """Оборачивает регистрируемые message-обработчики замером времени.
+
+    Вызывать до регистрации обработчиков. Callback-кнопки измеряет callback_router.
+    """
+    original_add = bot.add_message_handler
+
+    def add_message_handler(handler_dict):
+        filters = handler_dict.get('filters', {})
+        if filters.get('commands'):
+            kind = "command"
+        elif 'voice' in (filters.get('content_types') or ()):
+            kind = "voice"
+        else:
+            kind = "message"
+        func = handler_dict['function']
+        handler_dict['function'] = timed(HANDLER_LATENCY, HANDLER_ERRORS, kind, func.__name__)(func)
+        return original_add(handler_dict)
+
+    bot.add_message_handler = add_message_handler
+
+
+def instrument_telegram_api():
+    """Замер всех запросов к Bot API через apihelper._make_request."""
+    from telebot import apihelper
+    if getattr(apihelper._make_request, "_instrumented", False):
+        return
+    original = apihelper._make_request
+
+    @functools.wraps(original)
+    def _make_request(token, method_name, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(token, method_name, *args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            TELEGRAM_ERRORS.labels(method_name, e.error_code).inc()
+            raise
+        except Exception:
+            TELEGRAM_ERRORS.labels(method_name, "network").inc()
+            raise
+        finally:
+            TELEGRAM_LATENCY.labels(method_name).observe(time.perf_counter() - started)
+
+    _make_request._instrumented = True
+    apihelper._make_request = _make_request
+
+
+def register_state_gauges():
+    """Регистрирует gauges, вычисляемые из состояния бота в момент выгрузки."""
+    from state import chat_data
+    from bulk_writer import bulk_writer
+    from shift_close import shift_closer
+    from database_manager import db
+
+    def active_shifts() -> int:
+        return sum(1 for shift in list(chat_data.values()) if getattr(shift, 'main_id', None))
+
+    def active_users() -> int:
+        return sum(len(getattr(shift, 'users', {})) for shift in list(chat_data.values()))
+
+    GAUGES.set_function(active_shifts, "active_shifts")
+    GAUGES.set_function(active_users, "active_users")
+    GAUGES.set_function(lambda: TRANSCRIPTIONS_QUEUED.labels().value() - TRANSCRIPTIONS_DONE.labels().value(),
+                        "transcription_queue_depth")
+    GAUGES.set_function(bulk_writer.pending, "bulk_writer_pending")
+    GAUGES.set_function(shift_closer.active, "shift_close_jobs_active")
+    GAUGES.set_function(lambda: int(db.circuit_status()["circuit"] == "open"), "db_circuit_open")
+    GAUGES.set_function(lambda: db.circuit_status()["spooled"], "db_spooled_writes")
+
+
+def render() -> str:
+    """Текст для ответа /metrics."""
+    return registry.render()
@@ -2,8 +2,8 @@
 
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict
-import datetime
-import pytz
+
+import clock
 
 @dataclass
 class UserData:
@@ -15,6 +15,7 @@ class UserData:
     on_break: bool = False
     breaks_count: int = 0
     late_returns: int = 0
+    break_minutes: float = 0.0  # Суммарная длительность перерывов за смену
     last_voice_time: Optional[str] = None
     last_break_time: Optional[str] = None
     break_start_time: Optional[str] = None
@@ -37,9 +38,14 @@ class ShiftData:
     main_id: Optional[int] = None
     users: Dict[int, UserData] = field(default_factory=dict)
     main_username: str = 'N/A'
-    shift_start_time: str = field(default_factory=lambda: datetime.datetime.now(pytz.timezone('Europe/Moscow')).isoformat())
+    shift_start_time: str = field(default_factory=lambda: clock.moscow_now().isoformat())
     shift_goal: int = 15
     timezone: str = "Europe/Moscow"
     active_roles: List[str] = field(default_factory=lambda: ["караоке_ведущий"])  # Активные роли для текущей смены
     role_goals: Dict[str, int] = field(default_factory=lambda: {"караоке_ведущий": 15})  # Цели по ролям
     last_report_date: Optional[str] = None
+
+
+def shift_status(shift_data: ShiftData) -> str:
+    """Статус строки смены в БД: 'active' — смена идёт, 'idle' — в чате нет смены (после сброса)."""
+    return 'active' if shift_data.main_id else 'idle'
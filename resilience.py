@@ -0,0 +1,250 @@
+# resilience.py
+"""
+Предохранители для внешних зависимостей: OpenAI, Google Sheets, Telegram.
+
+У каждой зависимости (Dependency) свой таймаут (передаётся клиенту), лимит
+одновременных вызовов и предохранитель (circuit breaker):
+    closed     вызовы идут как обычно, подряд идущие сбои считаются;
+    open       после failure_threshold сбоев подряд вызовы сразу получают
+               DependencyUnavailable, не дожидаясь таймаута клиента;
+    half_open  через reset_seconds один пробный вызов проходит: успех
+               замыкает цепь, сбой снова размыкает её на reset_seconds.
+Сбоем считаются только ошибки, которые is_failure относит к самой
+зависимости (сеть, таймауты, 5xx), а не ошибки в запросе.
+
+Уведомления BOSS_ID об ошибках идут через alert_boss: одна ошибка (ключ)
+не чаще ALERT_MIN_INTERVAL_SECONDS, повторы суммируются в следующем
+уведомлении, отправка — в фоновом потоке и не при разомкнутом Telegram.
+
+Состояние зависимостей — в status() (/health) и в /metrics.
+"""
+
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Union
+
+from config import (
+    BOSS_ID, OPENAI_TIMEOUT_SECONDS, OPENAI_MAX_CONCURRENT, GOOGLE_SHEETS_TIMEOUT_SECONDS,
+    GOOGLE_SHEETS_MAX_CONCURRENT, TELEGRAM_CONNECT_TIMEOUT_SECONDS, TELEGRAM_READ_TIMEOUT_SECONDS,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS, ALERT_MIN_INTERVAL_SECONDS,
+)
+from metrics import DEPENDENCY_CALLS, GAUGES
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class DependencyUnavailable(Exception):
+    """Зависимость признана недоступной (цепь разомкнута) или занята: вызов не выполнялся."""
+
+
+def _any_error(error: Exception) -> bool:
+    return True
+
+
+class Dependency:
+    """Таймаут, лимит параллельных вызовов и предохранитель одной внешней зависимости."""
+
+    def __init__(self, name: str, timeout: float, max_concurrent: Optional[int] = None,
+                 max_wait: float = 0.0, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS,
+                 is_failure: Callable[[Exception], bool] = _any_error):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self._probing = False
+        self._in_flight = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    raise DependencyUnavailable(f"{self.name}: цепь разомкнута ({self.last_error})")
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise DependencyUnavailable(f"{self.name}: идёт пробный вызов")
+                self._probing = True
+                return True
+            return False
+
+    def _record(self, error: Optional[Exception], probe: bool):
+        with self._lock:
+            if probe:
+                self._probing = False
+            if error is None or not self.is_failure(error):
+                if self.state != CLOSED:
+                    logging.info(f"✅ {self.name}: зависимость снова доступна, цепь замкнута")
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:300]
+            if probe or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logging.error(f"{self.name}: {self.failures} сбоев подряд, цепь разомкнута на "
+                                  f"{self.reset_seconds:.0f} с: {self.last_error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def _release_probe(self, probe: bool):
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Вызывает func через предохранитель; DependencyUnavailable — если вызов не выполнялся."""
+        try:
+            probe = self._admit()
+        except DependencyUnavailable:
+            DEPENDENCY_CALLS.labels(self.name, "rejected").inc()
+            raise
+        if self._slots is not None and not self._slots.acquire(timeout=self.max_wait):
+            self._release_probe(probe)
+            DEPENDENCY_CALLS.labels(self.name, "busy").inc()
+            raise DependencyUnavailable(f"{self.name}: занято {self.max_concurrent} одновременных вызовов")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            result = func(*args, **kwargs)
+        except DependencyUnavailable:
+            # Отказ вложенной зависимости — не сбой этой
+            self._release_probe(probe)
+            raise
+        except Exception as e:
+            self._record(e, probe)
+            DEPENDENCY_CALLS.labels(self.name, "error").inc()
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            if self._slots is not None:
+                self._slots.release()
+        self._record(None, probe)
+        DEPENDENCY_CALLS.labels(self.name, "ok").inc()
+        return result
+
+    def available(self) -> bool:
+        """Пройдёт ли вызов сейчас (без учёта лимита параллельности)."""
+        with self._lock:
+            return self.state != OPEN or time.monotonic() - self.opened_at >= self.reset_seconds
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "in_flight": self._in_flight,
+                "retry_in_seconds": round(max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at)), 1)
+                if self.state == OPEN else 0,
+                "last_error": self.last_error if self.state != CLOSED else None,
+            }
+
+
+def _telegram_failure(error: Exception) -> bool:
+    # 4xx (неверный запрос, нет прав, 429) — ошибки запроса, а не недоступность Telegram
+    code = getattr(error, 'error_code', None)
+    return code is None or code >= 500
+
+
+openai_api = Dependency("openai", OPENAI_TIMEOUT_SECONDS, max_concurrent=OPENAI_MAX_CONCURRENT, max_wait=5.0)
+google_sheets = Dependency("google_sheets", GOOGLE_SHEETS_TIMEOUT_SECONDS,
+                           max_concurrent=GOOGLE_SHEETS_MAX_CONCURRENT, max_wait=GOOGLE_SHEETS_TIMEOUT_SECONDS)
+telegram_api = Dependency("telegram", TELEGRAM_READ_TIMEOUT_SECONDS, is_failure=_telegram_failure)
+
+DEPENDENCIES: Dict[str, Dependency] = {dep.name: dep for dep in (openai_api, google_sheets, telegram_api)}
+
+
+def status() -> dict:
+    """Состояние всех зависимостей для /health."""
+    return {name: dep.status() for name, dep in DEPENDENCIES.items()}
+
+
+def register_gauges():
+    for name, dep in DEPENDENCIES.items():
+        GAUGES.set_function(lambda dep=dep: int(dep.state != CLOSED), f"dependency_{name}_open")
+
+
+# Долгий опрос getUpdates сам повторяется telebot и не должен размыкать цепь отправки
+_TELEGRAM_EXEMPT = {"getUpdates"}
+
+
+def instrument_telegram_api():
+    """Таймауты Bot API и предохранитель на все запросы, кроме getUpdates."""
+    from telebot import apihelper
+    apihelper.CONNECT_TIMEOUT = TELEGRAM_CONNECT_TIMEOUT_SECONDS
+    apihelper.READ_TIMEOUT = TELEGRAM_READ_TIMEOUT_SECONDS
+    if getattr(apihelper._make_request, "_guarded", False):
+        return
+    original = apihelper._make_request
+
+    @functools.wraps(original)
+    def _make_request(token, method_name, *args, **kwargs):
+        if method_name in _TELEGRAM_EXEMPT:
+            return original(token, method_name, *args, **kwargs)
+        return telegram_api.call(original, token, method_name, *args, **kwargs)
+
+    _make_request._guarded = True
+    _make_request._instrumented = getattr(original, "_instrumented", False)
+    apihelper._make_request = _make_request
+
+
+class _AlertGate:
+    """Дедупликация и ограничение частоты уведомлений BOSS_ID."""
+
+    def __init__(self, min_interval: float = ALERT_MIN_INTERVAL_SECONDS):
+        self.min_interval = min_interval
+        self._last_sent: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def admit(self, key: str) -> Optional[int]:
+        """None — уведомление подавлено; иначе число подавленных повторов с прошлой отправки."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_sent.get(key)
+            if last is not None and now - last < self.min_interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return None
+            self._last_sent[key] = now
+            return self._suppressed.pop(key, 0)
+
+
+_alerts = _AlertGate()
+
+
+def alert_boss(bot, key: str, text: Union[str, Callable[[], str]]):
+    """Уведомляет BOSS_ID об ошибке: одна ошибка (key) не чаще ALERT_MIN_INTERVAL_SECONDS, без ожидания отправки.
+
+    text может быть функцией: она вызывается только для отправляемого уведомления и уже в фоновом потоке.
+    """
+    if not BOSS_ID:
+        return
+    repeats = _alerts.admit(key)
+    if repeats is None:
+        return
+    if not telegram_api.available():
+        logging.warning(f"Уведомление BOSS_ID ({key}) не отправлено: Telegram недоступен")
+        return
+
+    def _send():
+        try:
+            message = text() if callable(text) else text
+            if repeats:
+                message += f"\n\n(с прошлого уведомления повторилось ещё {repeats} раз)"
+            bot.send_message(BOSS_ID, message, parse_mode=None)
+        except Exception as e:
+            logging.error(f"Не удалось отправить уведомление BOSS_ID: {e}")
+    threading.Thread(target=_send, name="boss-alert", daemon=True).start()
@@ -0,0 +1,120 @@
+# retention.py
+"""
+Очистка старых данных без длинных блокировок: устаревшие строки
+event_history и voice_stats выбираются порциями по id (keyset), сначала
+дописываются в сжатые помесячные архивы, затем удаляются. Между порциями
+делается пауза, чтобы обработчики успевали писать в базу.
+"""
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Dict
+
+from config import (
+    RETENTION_DAYS, RETENTION_CHUNK_ROWS, RETENTION_PAUSE_SECONDS,
+    RETENTION_VACUUM_PAGES, ARCHIVE_PATH
+)
+
+# Итоги последнего запуска (для логов и диагностики)
+last_report: Dict[str, dict] = {}
+
+
+def _archive_month(value) -> str:
+    """Месяц строки для имени архива (YYYY-MM)."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m')
+    return str(value or '')[:7] or 'unknown'
+
+
+def _archive_rows(table: str, columns, rows, ts_index: int):
+    """Дописывает строки в archive/<table>-<YYYY-MM>.jsonl.gz (каждая порция — отдельный gzip-member)."""
+    by_month: Dict[str, list] = {}
+    for row in rows:
+        by_month.setdefault(_archive_month(row[ts_index]), []).append(row)
+
+    os.makedirs(ARCHIVE_PATH, exist_ok=True)
+    for month, month_rows in by_month.items():
+        path = os.path.join(ARCHIVE_PATH, f"{table}-{month}.jsonl.gz")
+        lines = "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n"
+            for row in month_rows
+        )
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            f.write(lines)
+
+
+def purge_table(database, table: str, cutoff: datetime.datetime,
+                chunk_rows: int = RETENTION_CHUNK_ROWS,
+                pause_seconds: float = RETENTION_PAUSE_SECONDS) -> dict:
+    """Архивирует и удаляет устаревшие строки таблицы порциями. Возвращает статистику."""
+    ts_column = database.RETENTION_TABLES[table]
+    stats = {"rows": 0, "chunks": 0, "lock_seconds": 0.0, "max_lock_ms": 0.0, "seconds": 0.0}
+    started = time.perf_counter()
+    last_id = 0
+
+    while True:
+        columns, rows, fetch_lock = database.fetch_expired_rows(table, cutoff, last_id, chunk_rows)
+        if not rows:
+            break
+
+        id_index = columns.index("id")
+        ids = [row[id_index] for row in rows]
+        # Архив пишется до удаления: при сбое между шагами строки попадут в архив повторно, но не потеряются
+        _archive_rows(table, columns, rows, columns.index(ts_column))
+        deleted, delete_lock = database.delete_rows_by_id(table, ids)
+
+        held = fetch_lock + delete_lock
+        stats["rows"] += deleted
+        stats["chunks"] += 1
+        stats["lock_seconds"] += held
+        stats["max_lock_ms"] = max(stats["max_lock_ms"], held * 1000)
+        last_id = ids[-1]
+
+        if len(rows) < chunk_rows:
+            break
+        time.sleep(pause_seconds)
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_sec"] = stats["rows"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    return stats
+
+
+def run_retention(database=None, days_old: int = RETENTION_DAYS) -> Dict[str, dict]:
+    """Полный проход retention по всем таблицам и обслуживание базы."""
+    if database is None:
+        from database_manager import db as database
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days_old)
+    report: Dict[str, dict] = {}
+    touched = []
+
+    for table in database.RETENTION_TABLES:
+        try:
+            stats = purge_table(database, table, cutoff)
+        except Exception as e:
+            logging.error(f"Retention: ошибка очистки {table}: {e}")
+            continue
+        report[table] = stats
+        if stats["rows"]:
+            touched.append(table)
+        logging.info(
+            f"Retention: {table} — удалено {stats['rows']} строк за {stats['seconds']:.1f} с "
+            f"({stats['rows_per_sec']:.0f} строк/с), порций {stats['chunks']}, "
+            f"под блокировкой {stats['lock_seconds'] * 1000:.0f} мс (макс. {stats['max_lock_ms']:.0f} мс)"
+        )
+
+    if touched:
+        try:
+            held = database.run_maintenance(touched, RETENTION_VACUUM_PAGES)
+            report["maintenance"] = {"tables": touched, "seconds": held}
+            logging.info(f"Retention: обслуживание {', '.join(touched)} заняло {held * 1000:.0f} мс")
+        except Exception as e:
+            logging.error(f"Retention: ошибка VACUUM/ANALYZE: {e}")
+
+    last_report.clear()
+    last_report.update(report)
+    return report
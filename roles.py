@@ -5,7 +5,8 @@
 
 from enum import Enum
 from typing import Dict, List
-import datetime
+
+import clock
 
 class UserRole(Enum):
     """Доступные роли пользователей"""
@@ -57,7 +58,7 @@ ROLE_DESCRIPTIONS = {
 
 def get_current_day_type() -> DayType:
     """Возвращает тип текущего дня"""
-    today = datetime.datetime.now().weekday()
+    today = clock.now().weekday()
     return DAY_TYPE_MAPPING[today]
 
 def get_roles_for_day_type(day_type: DayType) -> List[str]:
@@ -1,21 +1,27 @@
 # scheduler.py
 import schedule
+import functools
+import threading
 import time
 import logging
 import datetime
-import pytz
 import random
+from concurrent.futures import ThreadPoolExecutor
 
-from state import chat_data, user_history, chat_configs, data_lock
+import clock
+from state import chat_data, user_history, data_lock
+from chat_config import chat_settings
 from config import (
-    VOICE_TIMEOUT_MINUTES, BREAK_DURATION_MINUTES, GOOGLE_SHEET_LINK_TEXT,
-    GOOGLE_SHEET_LINK_URL, ADMIN_REPORT_CHAT_ID, soviet_phrases, EXPECTED_VOICES_PER_SHIFT
+    BREAK_DURATION_MINUTES, soviet_phrases, EXPECTED_VOICES_PER_SHIFT,
+    RETENTION_DAYS, RETENTION_RUN_AT
 )
-from utils import get_chat_title, generate_detailed_report, init_shift_data
-from g_sheets import append_shift_to_google_sheet
 from state_manager import save_state
 from models import UserData
 from database_manager import db  # Используем единый database manager
+from retention import run_retention
+from shift_close import shift_closer
+from live_status import live_status
+from metrics import SCHEDULER_JOB, SCHEDULER_LAG, SCHEDULER_ERRORS, SCHEDULER_SKIPPED, GAUGES
 
 def format_username(username: str) -> str:
     """Форматирует username для отправки в сообщении с правильным @ символом."""
@@ -34,7 +40,7 @@ def generate_analytical_summary(user_data: UserData, shift_goal: int, chat_id: i
         plan_percent = 100 # Если план 0, считаем его выполненным
 
     lates = user_data.late_returns
-    chat_timeout = chat_configs.get(str(chat_id), {}).get('voice_timeout', VOICE_TIMEOUT_MINUTES)
+    chat_timeout = chat_settings.get(chat_id).voice_timeout
     has_long_pauses = any(delta > chat_timeout * 1.5 for delta in user_data.voice_deltas)
 
     if plan_percent < 50:
@@ -53,99 +59,22 @@ def generate_analytical_summary(user_data: UserData, shift_goal: int, chat_id: i
 # --- Основные функции планировщика ---
 
 def send_end_of_shift_report_for_chat(bot, chat_id: int):
-    """Потокобезопасно формирует и отправляет финальный отчет, затем сбрасывает данные."""
+    """Ставит закрытие смены в фоновую очередь: выгрузка, отчёты и сброс идут в shift_close."""
     logging.info(f"Начинаю процедуру закрытия смены для чата {chat_id}...")
-    
-    with data_lock:
-        shift_data = chat_data.get(chat_id)
-        if not shift_data or not shift_data.main_id:
-            logging.warning(f"Попытка закрыть смену в чате {chat_id}, но активной смены нет.")
-            return
-
-        main_user_data = shift_data.users.get(shift_data.main_id)
-        if not main_user_data:
-            logging.warning(f"Не найдены данные по ведущему в чате {chat_id}")
-            return
-            
-        # Копируем данные для безопасной работы вне блокировки
-        shift_data_copy = shift_data
-        
-    # Все дальнейшие операции происходят с копией данных
-    try:
-        shift_goal = shift_data_copy.shift_goal
-        analytical_conclusion = generate_analytical_summary(main_user_data, shift_goal, chat_id)
-        
-        # ИСПРАВЛЕНО: Добавляем проверки и детальное логирование
-        logging.info(f"Начинаю формирование отчета для чата {chat_id}. Ведущий: {main_user_data.username}, ГС: {main_user_data.count}/{shift_goal}")
-        
-        # Сохраняем в Google Таблицы
-        try:
-            append_shift_to_google_sheet(bot, chat_id, shift_data_copy, analytical_conclusion)
-            logging.info(f"Данные успешно сохранены в Google Таблицы для чата {chat_id}")
-        except Exception as sheets_error:
-            logging.error(f"Ошибка при сохранении в Google Таблицы для чата {chat_id}: {sheets_error}")
-            # Продолжаем выполнение, так как отчет все равно нужно отправить
-        
-        report_lines = generate_detailed_report(chat_id, shift_data_copy)
-        if not report_lines:
-            raise ValueError("generate_detailed_report вернул пустой список")
-            
-        final_report_text = "\n".join(report_lines)
-        final_report_with_recommendation = final_report_text + f"\n\n---\n🧠 **Рекомендация:**\n_{analytical_conclusion}_"
-        
-        link_markdown = f"[{GOOGLE_SHEET_LINK_TEXT}]({GOOGLE_SHEET_LINK_URL})" if GOOGLE_SHEET_LINK_URL else ""
-        main_report_text = f"🏁 Смена завершена!\n\n{final_report_with_recommendation}\n\n{link_markdown}"
-        
-        # Отправляем отчет в основной чат
-        try:
-            bot.send_message(chat_id, main_report_text, parse_mode="Markdown", disable_web_page_preview=True)
-            logging.info(f"Основной отчет успешно отправлен в чат {chat_id}")
-        except Exception as main_send_error:
-            logging.error(f"Ошибка при отправке основного отчета в чат {chat_id}: {main_send_error}")
-            # Пробуем отправить упрощенную версию
-            try:
-                simple_report = f"🏁 Смена завершена!\n\nВедущий: {main_user_data.username}\nГолосовых: {main_user_data.count}/{shift_goal}"
-                bot.send_message(chat_id, simple_report)
-                logging.info(f"Упрощенный отчет отправлен в чат {chat_id}")
-            except Exception as simple_send_error:
-                logging.error(f"Не удалось отправить даже упрощенный отчет в чат {chat_id}: {simple_send_error}")
-
-        # Отправляем отчет администратору
-        if ADMIN_REPORT_CHAT_ID and str(chat_id) != str(ADMIN_REPORT_CHAT_ID):
-            try:
-                admin_report_header = f"📍 *Отчет из чата: {get_chat_title(bot, chat_id)}*\n"
-                admin_report = f"{admin_report_header}{final_report_with_recommendation}\n\n{link_markdown}"
-                bot.send_message(ADMIN_REPORT_CHAT_ID, admin_report, parse_mode="Markdown", disable_web_page_preview=True)
-                logging.info(f"Отчет отправлен администратору для чата {chat_id}")
-            except Exception as admin_send_error:
-                logging.error(f"Ошибка при отправке отчета администратору для чата {chat_id}: {admin_send_error}")
-    
-        logging.info(f"Данные смены для чата {chat_id} будут сброшены.")
-        
-        # ИСПРАВЛЕНО: Сохраняем дату отчета ДО сброса данных смены
-        with data_lock:
-            today_date = datetime.datetime.now(pytz.timezone('Europe/Moscow')).date().isoformat()
-            if chat_id in chat_data:
-                chat_data[chat_id].last_report_date = today_date
-                logging.info(f"Сохранена дата последнего отчета для чата {chat_id}: {today_date}")
-            
-            # Теперь сбрасываем данные смены, но сохраняем дату отчета
-            last_report_date = chat_data[chat_id].last_report_date if chat_id in chat_data else today_date
-            init_shift_data(chat_id)
-            if chat_id in chat_data:
-                chat_data[chat_id].last_report_date = last_report_date
-        
-    except Exception as e:
-        logging.error(f"Критическая ошибка при формировании отчета для чата {chat_id}: {e}", exc_info=True)
-        try:
-            bot.send_message(chat_id, "❌ Произошла ошибка при формировании финального отчета. Данные не были сброшены. Попробуйте снова или обратитесь к администратору.")
-        except Exception as report_err:
-            logging.error(f"Не удалось отправить сообщение об ошибке в чат {chat_id}: {report_err}")
+    return shift_closer.enqueue(bot, chat_id)
+
+
+def send_end_of_shift_reports(bot, chat_ids: list):
+    """Закрывает смены, у которых одновременно наступил конец: одним пакетом."""
+    if len(chat_ids) == 1:
+        return send_end_of_shift_report_for_chat(bot, chat_ids[0])
+    logging.info(f"Закрываю пакетом смены {len(chat_ids)} чатов")
+    return shift_closer.enqueue_batch(bot, chat_ids)
 
 
 def check_user_activity(bot):
     """Проверяет активность пользователей и отправляет напоминания."""
-    now_moscow = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+    now_moscow = clock.moscow_now()
     
     with data_lock:
         # Создаем копию для итерации, чтобы избежать проблем при изменении словаря
@@ -163,7 +92,8 @@ def check_user_activity(bot):
                 if not last_reminder_str or (now_moscow - datetime.datetime.fromisoformat(last_reminder_str)).total_seconds() > 120:
                     try:
                         phrase = random.choice(soviet_phrases.get('return_demand_hard', ['Пора вернуться к работе!']))
-                        bot.send_message(chat_id, f"{format_username(user_data.username)}, {phrase}")
+                        sent = bot.send_message(chat_id, f"{format_username(user_data.username)}, {phrase}")
+                        live_status.replace_reminder(bot, chat_id, sent)
                         with data_lock:
                             user_data.last_break_reminder_time = now_moscow.isoformat()
                     except Exception as e:
@@ -175,7 +105,7 @@ def check_user_activity(bot):
             last_voice_time = datetime.datetime.fromisoformat(user_data.last_voice_time)
             inactive_minutes = (now_moscow - last_voice_time).total_seconds() / 60
             
-            chat_timeout = chat_configs.get(str(chat_id), {}).get('voice_timeout', VOICE_TIMEOUT_MINUTES)
+            chat_timeout = chat_settings.get(chat_id).voice_timeout
 
             if inactive_minutes > chat_timeout:
                 # Проверяем, не активна ли пауза - если да, не отправляем напоминания
@@ -188,6 +118,7 @@ def check_user_activity(bot):
                         # Пауза истекла, автоматически отключаем
                         user_data.on_pause = False
                         user_data.pause_end_time = now_moscow.isoformat()
+                        live_status.touch(bot, chat_id)
                         try:
                             bot.send_message(chat_id, "⏯️ Пауза завершена автоматически! Счетчики возобновлены.")
                         except Exception as e:
@@ -202,7 +133,8 @@ def check_user_activity(bot):
                 if should_remind:
                     try:
                         phrase = random.choice(soviet_phrases.get('pace_reminder', ['Вы давно не выходили в эфир.']))
-                        bot.send_message(chat_id, f"{format_username(user_data.username)}, {phrase} (тишина уже {int(inactive_minutes)} мин.)")
+                        sent = bot.send_message(chat_id, f"{format_username(user_data.username)}, {phrase} (тишина уже {int(inactive_minutes)} мин.)")
+                        live_status.replace_reminder(bot, chat_id, sent)
                         with data_lock:
                              user_data.last_activity_reminder_time = now_moscow.isoformat()
                     except Exception as e:
@@ -210,54 +142,28 @@ def check_user_activity(bot):
 
 def check_for_shift_end(bot):
     """Проверяет, не наступило ли время окончания смены для какого-либо чата."""
-    # Создаем копию для безопасной итерации
-    configs_copy = list(chat_configs.items())
-    
-    # Проверяем все активные смены, даже если нет конфигурации
-    all_chats_to_check = set()
-    
-    # Добавляем чаты из конфигурации
-    for chat_id_str, config in configs_copy:
-        all_chats_to_check.add(chat_id_str)
-    
-    # Добавляем чаты с активными сменами (дефолтное время 04:00)
-    for chat_id in chat_data.keys():
-        all_chats_to_check.add(str(chat_id))
-
-    for chat_id_str in all_chats_to_check:
-        config = chat_configs.get(chat_id_str, {})
-        
-        # Визард сохраняет timezone как число (offset от МСК), поддерживаем оба формата
-        tz_setting = config.get('timezone', 'Europe/Moscow')
-        if isinstance(tz_setting, (int, float)):
-            # Offset от МСК: МСК = UTC+3, значит итоговый UTC offset = 3 + tz_setting
-            utc_offset = 3 + int(tz_setting)
-            tz_name = f"Etc/GMT{-utc_offset:+d}" if utc_offset != 0 else "Etc/GMT"
-        else:
-            tz_name = tz_setting
-        
-        # Визард сохраняет время в config['schedule']['end'], поддерживаем оба формата
-        end_time_str = config.get('end_time') or config.get('schedule', {}).get('end') or '04:00'
-        
+    # Проверяем все настроенные чаты и все активные смены, даже если нет конфигурации
+    # (для них — настройки по умолчанию: Москва, 04:00)
+    all_chats_to_check = set(chat_settings.chat_ids())
+    all_chats_to_check.update(chat_data.keys())
+
+    chats_to_report = []
+    for chat_id in all_chats_to_check:
+        config = chat_settings.get(chat_id)
+
         try:
-            local_tz = pytz.timezone(tz_name)
-            now_local = datetime.datetime.now(local_tz)
+            now_local = config.now()
             current_time = now_local.strftime('%H:%M')
             
             # ИСПРАВЛЕНО: Диапазонная проверка времени (от времени окончания до часа после)
-            end_hour, end_minute = map(int, end_time_str.split(':'))
-            end_time = datetime.time(end_hour, end_minute)
             current_time_only = now_local.time()
             
             # Проверяем, попадает ли текущее время в диапазон окончания смены
-            time_matches = (
-                end_time <= current_time_only < 
-                datetime.time((end_time.hour + 1) % 24, end_time.minute)
-            )
+            time_matches = config.end_time <= current_time_only < config.report_until
             
             if time_matches:
                 with data_lock:
-                    current_shift = chat_data.get(int(chat_id_str))
+                    current_shift = chat_data.get(chat_id)
                     # ИСПРАВЛЕНО: Улучшенная проверка даты отчета
                     today_date = now_local.date().isoformat()
                     should_send_report = (current_shift and 
@@ -267,46 +173,162 @@ def check_for_shift_end(bot):
                                          current_shift.last_report_date != today_date))
                     
                     if should_send_report:
-                        chat_id_to_report = int(chat_id_str)
-                        logging.info(f"Отправляю отчет для чата {chat_id_to_report}: время {current_time}, целевое время {end_time_str}, ТЗ: {tz_name}")
+                        chat_id_to_report = chat_id
+                        logging.info(f"Отправляю отчет для чата {chat_id_to_report}: время {current_time}, целевое время {config.end_time_str}, ТЗ: {config.tz_name}")
                     else:
                         chat_id_to_report = None
                         if current_shift and current_shift.main_id:
-                            logging.info(f"Отчет для чата {chat_id_str} уже отправлен сегодня ({today_date})")
+                            logging.info(f"Отчет для чата {chat_id} уже отправлен сегодня ({today_date})")
                 
                 if chat_id_to_report:
-                    send_end_of_shift_report_for_chat(bot, chat_id_to_report)
+                    chats_to_report.append(chat_id_to_report)
 
         except Exception as e:
-            logging.error(f"Ошибка в check_for_shift_end для чата {chat_id_str}: {e}", exc_info=True)
+            logging.error(f"Ошибка в check_for_shift_end для чата {chat_id}: {e}", exc_info=True)
+
+    if chats_to_report:
+        send_end_of_shift_reports(bot, chats_to_report)
 
 def database_cleanup_task():
-    """Задача очистки старых данных из базы."""
+    """Задача очистки старых данных из базы (порциями, с архивированием)."""
     try:
         logging.info("Запуск задачи очистки базы данных...")
-        db.cleanup_old_data(days_old=30)  # Удаляем данные старше 30 дней
+        run_retention(db, days_old=RETENTION_DAYS)
         logging.info("Очистка базы данных завершена успешно")
     except Exception as e:
         logging.error(f"Ошибка при очистке базы данных: {e}")
 
-def schedule_database_cleanup():
-    """Планирует ежедневную очистку базы данных в 03:00."""
-    schedule.every().day.at("03:00").do(database_cleanup_task)
-    logging.info("Запланирована ежедневная очистка базы данных в 03:00")
+def schedule_database_cleanup(lanes: "SchedulerLanes"):
+    """Планирует ежедневную очистку базы данных вне окна закрытия смен."""
+    schedule.every().day.at(RETENTION_RUN_AT).do(lanes.job(database_cleanup_task))
+    logging.info(f"Запланирована ежедневная очистка базы данных в {RETENTION_RUN_AT}")
+
+# Полосы выполнения: у каждого класса задач свой поток, чтобы долгое сохранение,
+# выгрузка отчётов или очистка БД не задерживали напоминания
+JOB_LANES = {
+    "check_user_activity": "reminders",
+    "check_for_shift_end": "reports",
+    "save_state": "persistence",
+    "database_cleanup_task": "maintenance",
+}
+DEFAULT_LANE = "maintenance"
+
+class SchedulerLanes:
+    """Раздаёт задачи schedule по полосам и не допускает наложения запусков одной задачи."""
+
+    def __init__(self, lanes=("reminders", "reports", "persistence", "maintenance")):
+        self._pools = {lane: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"scheduler-{lane}")
+                       for lane in lanes}
+        self._in_flight = set()
+        self._planned = {}
+        self._lock = threading.Lock()
+
+    def job(self, func):
+        """Функция для schedule.do(): вместо выполнения ставит задачу в её полосу."""
+        @functools.wraps(func)
+        def dispatch(**kwargs):
+            self.submit(func, kwargs)
+        return dispatch
+
+    def plan_due_jobs(self):
+        """Запоминает плановое время задач, которые schedule сейчас запустит (для метрики опоздания)."""
+        for job in schedule.jobs:
+            if job.should_run:
+                name = getattr(job.job_func, 'func', job.job_func).__name__
+                # schedule живёт по реальным часам
+                self._planned[name] = job.next_run.timestamp()
+
+    def submit(self, func, kwargs: dict) -> bool:
+        name = func.__name__
+        with self._lock:
+            if name in self._in_flight:
+                SCHEDULER_SKIPPED.labels(name).inc()
+                logging.warning(f"Планировщик: {name} ещё выполняется, запуск пропущен")
+                return False
+            self._in_flight.add(name)
+        planned_at = self._planned.pop(name, time.time())
+        pool = self._pools.get(JOB_LANES.get(name, DEFAULT_LANE)) or self._pools[DEFAULT_LANE]
+        pool.submit(self._run, name, func, kwargs, planned_at)
+        return True
+
+    def _run(self, name: str, func, kwargs: dict, planned_at: float):
+        started = time.time()
+        SCHEDULER_LAG.labels(name).observe(max(0.0, started - planned_at))
+        try:
+            func(**kwargs)
+        except Exception as e:
+            SCHEDULER_ERRORS.labels(name).inc()
+            logging.error(f"Ошибка задачи планировщика {name}: {e}", exc_info=True)
+        finally:
+            SCHEDULER_JOB.labels(name).observe(time.time() - started)
+            with self._lock:
+                self._in_flight.discard(name)
+
+    def busy(self) -> int:
+        """Сколько задач сейчас выполняется или ждёт в полосах."""
+        return len(self._in_flight)
+
+    def shutdown(self, wait: bool = True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
+
+def _periodic_jobs(bot) -> list:
+    """Периодические задачи: (интервал в минутах, функция, аргументы). Общие для реального и виртуального времени."""
+    return [
+        (1, check_for_shift_end, {"bot": bot}),
+        (1, check_user_activity, {"bot": bot}),
+        # ИЗМЕНЕНО: Передаем bot в функцию сохранения, чтобы она могла уведомить об ошибке
+        (5, save_state, {"bot": bot, "chat_data": chat_data, "user_history": user_history}),
+    ]
+
+class SimulatedScheduler:
+    """Прогоняет периодические задачи в виртуальном времени clock.SimulatedClock.
+
+    Время двигается шагами по step_seconds без реального ожидания, поэтому ночная
+    смена с напоминаниями, окончанием пауз и отчётом проигрывается мгновенно.
+    Ежедневная очистка БД здесь не запускается.
+    """
+
+    def __init__(self, bot, sim_clock, step_seconds: float = 60):
+        self.sim_clock = sim_clock
+        self.step_seconds = step_seconds
+        self.jobs = _periodic_jobs(bot)
+        started = sim_clock.time()
+        self._next_run = [started + minutes * 60 for minutes, _, _ in self.jobs]
+        self.runs = 0
+
+    def run_until(self, moment: datetime.datetime):
+        """Двигает время до moment, запуская задачи по расписанию."""
+        target = moment.timestamp()
+        while self.sim_clock.time() < target:
+            self.sim_clock.advance(min(self.step_seconds, target - self.sim_clock.time()))
+            self.run_pending()
+
+    def run_pending(self):
+        now_ts = self.sim_clock.time()
+        for index, (minutes, func, kwargs) in enumerate(self.jobs):
+            if now_ts >= self._next_run[index]:
+                try:
+                    func(**kwargs)
+                except Exception as e:
+                    logging.error(f"Ошибка задачи {func.__name__} в виртуальном времени: {e}", exc_info=True)
+                self.runs += 1
+                self._next_run[index] += minutes * 60
 
 def run_scheduler(bot):
-    """Основной цикл планировщика, который запускает фоновые проверки."""
-    schedule.every(1).minutes.do(check_for_shift_end, bot=bot)
-    schedule.every(1).minutes.do(check_user_activity, bot=bot)
-    # ИЗМЕНЕНО: Передаем bot в функцию сохранения, чтобы она могла уведомить об ошибке
-    schedule.every(5).minutes.do(save_state, bot=bot, chat_data=chat_data, user_history=user_history)
+    """Основной цикл планировщика: schedule решает, что пора, а выполняют задачи полосы."""
+    lanes = SchedulerLanes()
+    GAUGES.set_function(lanes.busy, "scheduler_jobs_in_flight")
+    for minutes, func, kwargs in _periodic_jobs(bot):
+        schedule.every(minutes).minutes.do(lanes.job(func), **kwargs)
     
     # Планируем очистку базы данных
-    schedule_database_cleanup()
+    schedule_database_cleanup(lanes)
     
     logging.info("Планировщик настроен и запущен. Автосохранение активно.")
     while True:
         try:
+            lanes.plan_due_jobs()
             schedule.run_pending()
         except Exception as e:
             logging.error(f"Критическая ошибка в цикле планировщика: {e}", exc_info=True)
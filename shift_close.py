@@ -0,0 +1,627 @@
+# shift_close.py
+"""
+Закрытие смены как фоновое задание с сохранением прогресса на диск.
+
+Задание состоит из шагов: выгрузка (Google Таблица + дневные KPI), текст
+отчёта, отчёт в чат, строка в сводке администратору и сброс смены. Отчёт
+в чат и сброс ждут только текста, выгрузка идёт параллельно с ними. Снимок смены и
+состояние шагов пишутся в VOLUME_PATH/shift_close/ после каждого перехода,
+поэтому после перезапуска бот продолжает с того места, где остановился:
+выполненные шаги не повторяются, отправленные сообщения не дублируются.
+
+Когда смены заканчиваются одновременно во многих заведениях, они закрываются
+пакетом (enqueue_batch): чаты обрабатываются параллельно (не больше
+SHIFT_CLOSE_WORKERS), а строки всех смен уходят в таблицу одним запросом.
+Администратору отчёты не шлются по одному: они попадают в общую сводку
+admin_digest, пакет отправляет её сразу по завершении.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict
+from typing import Optional
+
+import clock
+from state import chat_data, data_lock
+from config import (
+    VOLUME_PATH, ADMIN_REPORT_CHAT_ID, GOOGLE_SHEET_LINK_TEXT, GOOGLE_SHEET_LINK_URL,
+    SHIFT_CLOSE_WORKERS, SHIFT_CLOSE_MAX_ATTEMPTS, SHIFT_CLOSE_RETRY_SECONDS, SHIFT_CLOSE_HISTORY
+)
+from models import ShiftData, UserData
+from g_sheets import build_shift_row, append_shift_rows
+from admin_digest import admin_digest
+from live_status import live_status
+from snapshots import shift_snapshot
+from metrics import SHIFT_CLOSE_STEP, SHIFT_CLOSE_ERRORS
+
+JOBS_DIR = os.path.join(VOLUME_PATH, 'shift_close')
+
+# Шаг -> шаги, результат которых ему нужен
+STEPS = {
+    "export": (),
+    "render": (),
+    "deliver_chat": ("render",),
+    "deliver_admin": ("render", "export"),
+    "reset": ("render",),
+}
+STEP_TITLES = {
+    "export": "таблица и KPI",
+    "render": "текст отчёта",
+    "deliver_chat": "отчёт в чат",
+    "deliver_admin": "в сводку админу",
+    "reset": "сброс смены",
+}
+STATUS_ICONS = {"pending": "▫️", "running": "⏳", "done": "✅", "failed": "❌"}
+# Части, которые пакет выполняет один раз на все смены
+BATCH_PARTS = {"sheets": "таблица одним запросом", "admin": "сводка админу"}
+
+
+def _shift_from_dict(snapshot: dict) -> ShiftData:
+    """Восстанавливает ShiftData из снимка (ключи users после JSON — строки)."""
+    fields = dict(snapshot)
+    fields['users'] = {int(uid): UserData(**udict) for uid, udict in snapshot.get('users', {}).items()}
+    return ShiftData(**fields)
+
+
+class JobStore:
+    """Задания и пакеты закрытия смен: в памяти, каждое — в своём JSON-файле.
+
+    Файл на задание, а не общий: после шага переписывается только его файл,
+    и десятки параллельных закрытий не ждут друг друга на записи.
+    """
+
+    def __init__(self, path: str = JOBS_DIR, history: int = SHIFT_CLOSE_HISTORY):
+        self.path = path
+        self.history = history
+        self.lock = threading.RLock()
+        self._jobs = None
+        self._batches = None
+
+    @property
+    def jobs(self) -> dict:
+        if self._jobs is None:
+            self._load()
+        return self._jobs
+
+    @property
+    def batches(self) -> dict:
+        if self._batches is None:
+            self._load()
+        return self._batches
+
+    def _load(self):
+        with self.lock:
+            if self._jobs is not None:
+                return
+            jobs, batches = [], []
+            for filename in sorted(os.listdir(self.path)) if os.path.isdir(self.path) else []:
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.path, filename), 'r', encoding='utf-8') as f:
+                        item = json.load(f)
+                    (batches if 'parts' in item else jobs).append(item)
+                except (json.JSONDecodeError, OSError) as e:
+                    logging.error(f"Ошибка чтения задания закрытия смены {filename}: {e}")
+            self._jobs = {job['id']: job for job in sorted(jobs, key=lambda job: job['created_at'])}
+            self._batches = {batch['id']: batch for batch in sorted(batches, key=lambda batch: batch['created_at'])}
+
+    def _filename(self, item_id: str) -> str:
+        return os.path.join(self.path, re.sub(r'[^0-9A-Za-z_-]', '_', item_id) + '.json')
+
+    def save(self, item: dict):
+        """Атомарно пишет файл задания или пакета."""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            filename = self._filename(item['id'])
+            with self.lock:
+                data = json.dumps(item, ensure_ascii=False)
+            with open(filename + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(filename + ".tmp", filename)
+        except Exception as e:
+            logging.error(f"Не удалось сохранить задание закрытия смены {item['id']}: {e}")
+        if item['status'] == 'done':
+            self._prune()
+
+    def _prune(self):
+        with self.lock:
+            # Задания незавершённого пакета нужны ему для общей выгрузки, даже если сами завершены
+            open_batches = {batch_id for batch_id, batch in self.batches.items() if batch['status'] != 'done'}
+            for items in (self.jobs, self.batches):
+                finished = [item_id for item_id, item in items.items()
+                            if item['status'] == 'done' and item.get('batch') not in open_batches]
+                for item_id in finished[:max(0, len(finished) - self.history)]:
+                    del items[item_id]
+                    try:
+                        os.remove(self._filename(item_id))
+                    except OSError:
+                        pass
+
+    def add(self, job: dict) -> tuple:
+        """Добавляет задание, если его ещё нет. Возвращает (задание, создано ли)."""
+        with self.lock:
+            existing = self.jobs.get(job['id'])
+            if existing:
+                return existing, False
+            self.jobs[job['id']] = job
+        self.save(job)
+        return job, True
+
+    def add_batch(self, batch: dict):
+        with self.lock:
+            self.batches[batch['id']] = batch
+        self.save(batch)
+
+    def update(self, item: dict, **changes):
+        with self.lock:
+            item.update(changes)
+            item['updated_at'] = clock.moscow_now().isoformat()
+        self.save(item)
+
+    def set_step(self, job: dict, step: str, **changes):
+        with self.lock:
+            job['steps'][step].update(changes)
+            job['updated_at'] = clock.moscow_now().isoformat()
+        self.save(job)
+
+    def set_output(self, job: dict, key: str, value):
+        with self.lock:
+            job['output'][key] = value
+        self.save(job)
+
+
+# --- Шаги ---
+
+def _main_user(shift: ShiftData) -> UserData:
+    user = shift.users.get(shift.main_id)
+    if not user:
+        raise ValueError(f"в снимке нет данных ведущего {shift.main_id}")
+    return user
+
+
+def _chat_title(bot, store: JobStore, job: dict) -> str:
+    """Название чата запрашивается один раз на задание."""
+    from utils import get_chat_title
+    title = job['output'].get('chat_title')
+    if title is None:
+        title = get_chat_title(bot, job['chat_id'])
+        store.set_output(job, 'chat_title', title)
+    return title
+
+
+def _step_export(bot, store: JobStore, job: dict, shift: ShiftData):
+    from scheduler import generate_analytical_summary
+    from database_manager import db
+    chat_id = job['chat_id']
+    if 'sheet_row' not in job['output']:
+        conclusion = generate_analytical_summary(_main_user(shift), shift.shift_goal, chat_id)
+        store.set_output(job, 'sheet_row', build_shift_row(bot, chat_id, shift, conclusion,
+                                                           chat_title=_chat_title(bot, store, job)))
+    # KPI до таблицы: при недоступном Google шаг повторяется, а KPI уже записаны
+    # (повторная запись той же смены их не удваивает — отметка в shift_kpi_recorded)
+    db.record_shift_kpis(chat_id, shift)
+    # В пакете строки всех смен пишет в таблицу пакет одним запросом
+    row = job['output']['sheet_row']
+    if not job.get('batch') and row and not job['output'].get('sheets_exported'):
+        if append_shift_rows([row]):
+            logging.info(f"Данные смены чата {chat_id} выгружены в Google Таблицы")
+        store.set_output(job, 'sheets_exported', True)
+
+
+def _step_render(bot, store: JobStore, job: dict, shift: ShiftData):
+    from scheduler import generate_analytical_summary
+    from utils import generate_detailed_report
+    chat_id = job['chat_id']
+    main_user = _main_user(shift)
+    conclusion = generate_analytical_summary(main_user, shift.shift_goal, chat_id)
+    report_lines = generate_detailed_report(chat_id, shift)
+    if not report_lines:
+        raise ValueError("generate_detailed_report вернул пустой список")
+
+    report = "\n".join(report_lines) + f"\n\n---\n🧠 **Рекомендация:**\n_{conclusion}_"
+    link_markdown = f"[{GOOGLE_SHEET_LINK_TEXT}]({GOOGLE_SHEET_LINK_URL})" if GOOGLE_SHEET_LINK_URL else ""
+    store.set_output(job, 'main_text', f"🏁 Смена завершена!\n\n{report}\n\n{link_markdown}")
+    store.set_output(job, 'simple_text', f"🏁 Смена завершена!\n\nВедущий: {main_user.username}\n"
+                                         f"Голосовых: {main_user.count}/{shift.shift_goal}")
+    if ADMIN_REPORT_CHAT_ID and str(chat_id) != str(ADMIN_REPORT_CHAT_ID):
+        # Название чата подставляется при отправке: запрос к API не задерживает отчёт в чат
+        store.set_output(job, 'admin_report', f"{report}\n\n{link_markdown}")
+        plan_percent = main_user.count / shift.shift_goal * 100 if shift.shift_goal > 0 else 100
+        store.set_output(job, 'digest', {
+            'host': main_user.username, 'count': main_user.count, 'goal': shift.shift_goal,
+            'percent': round(plan_percent), 'lates': main_user.late_returns, 'verdict': conclusion.split()[0],
+        })
+
+
+def _step_deliver_chat(bot, store: JobStore, job: dict, shift: ShiftData):
+    chat_id = job['chat_id']
+    if job['output'].get('chat_message_id'):
+        return
+    try:
+        sent = bot.send_message(chat_id, job['output']['main_text'], parse_mode="Markdown",
+                                disable_web_page_preview=True)
+    except Exception as e:
+        logging.error(f"Ошибка при отправке основного отчета в чат {chat_id}: {e}")
+        # Упрощённая версия без разметки
+        sent = bot.send_message(chat_id, job['output']['simple_text'])
+    store.set_output(job, 'chat_message_id', getattr(sent, 'message_id', True))
+    logging.info(f"Отчет о закрытии смены отправлен в чат {chat_id}")
+
+
+def _step_deliver_admin(bot, store: JobStore, job: dict, shift: ShiftData):
+    output = job['output']
+    if not output.get('admin_report') or output.get('admin_digest'):
+        return
+    # Администратору — не отдельное сообщение, а строка в общей сводке
+    admin_digest.add(bot, {
+        'job_id': job['id'],
+        'chat_id': job['chat_id'],
+        'title': _chat_title(bot, store, job),
+        'report': output['admin_report'],
+        **output['digest'],
+    })
+    store.set_output(job, 'admin_digest', True)
+
+
+def _is_current(chat_id: int, snapshot: dict) -> bool:
+    """Смена из снимка задания всё ещё текущая в чате (не сброшена)."""
+    current = chat_data.get(chat_id)
+    return bool(current and current.main_id and current.shift_start_time == snapshot['shift_start_time'])
+
+
+def _step_reset(bot, store: JobStore, job: dict, shift: ShiftData):
+    from utils import init_shift_data
+    from database_manager import db
+    chat_id = job['chat_id']
+    with data_lock:
+        # Сбрасываем только ту смену, которую закрываем: повторный шаг или новая смена не трогаются
+        if not _is_current(chat_id, job['snapshot']):
+            logging.info(f"Смена {job['id']} уже сброшена")
+            return
+        init_shift_data(chat_id)
+        chat_data[chat_id].last_report_date = clock.moscow_now().date().isoformat()
+        reset = chat_data[chat_id]
+    # Сброс — только в памяти до следующего save_state; строка в БД не даст восстановить
+    # закрытую смену из базы, а resume() повторит сброс, если снимок остался старым
+    db.save_shift_data(chat_id, reset)
+    live_status.finish(bot, chat_id)
+    logging.info(f"Данные смены для чата {chat_id} сброшены")
+
+
+STEP_FUNCS = {
+    "export": _step_export,
+    "render": _step_render,
+    "deliver_chat": _step_deliver_chat,
+    "deliver_admin": _step_deliver_admin,
+    "reset": _step_reset,
+}
+
+
+class ShiftCloseEngine:
+    """Выполняет задания закрытия смен в фоне, независимые шаги — параллельно."""
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = SHIFT_CLOSE_WORKERS,
+                 max_attempts: int = SHIFT_CLOSE_MAX_ATTEMPTS, retry_seconds: float = SHIFT_CLOSE_RETRY_SECONDS):
+        self.store = store or JobStore()
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._runners = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shift-close")
+        self._steps = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="shift-close-step")
+        self._active = set()
+        self._idle = threading.Condition()
+
+    @staticmethod
+    def _snapshot(chat_id: int) -> Optional[dict]:
+        shift = shift_snapshot(chat_id)
+        if not shift or not shift.main_id:
+            logging.warning(f"Попытка закрыть смену в чате {chat_id}, но активной смены нет.")
+            return None
+        if shift.main_id not in shift.users:
+            logging.warning(f"Не найдены данные по ведущему в чате {chat_id}")
+            return None
+        return asdict(shift)
+
+    def _add_job(self, chat_id: int, snapshot: dict, batch_id: Optional[str] = None) -> tuple:
+        now_iso = clock.moscow_now().isoformat()
+        job, created = self.store.add({
+            'id': f"{chat_id}:{snapshot['shift_start_time']}",
+            'chat_id': chat_id,
+            'batch': batch_id,
+            'status': 'queued',
+            'created_at': now_iso,
+            'updated_at': now_iso,
+            'snapshot': snapshot,
+            'steps': {name: {'status': 'pending', 'attempts': 0, 'error': None} for name in STEPS},
+            'output': {},
+        })
+        if created:
+            logging.info(f"Закрытие смены {job['id']} поставлено в очередь")
+        elif job['status'] == 'failed':
+            self._reopen(job)
+        return job, created
+
+    def enqueue(self, bot, chat_id: int) -> Optional[dict]:
+        """Ставит закрытие текущей смены чата в очередь. Повторный вызов для той же смены
+        не создаёт второго задания; упавшее задание перезапускается, а у завершённого
+        повторяется сброс, если смена осталась в чате (снимок сохранён до сброса)."""
+        snapshot = self._snapshot(chat_id)
+        if not snapshot:
+            return None
+        job, _ = self._add_job(chat_id, snapshot)
+        if job['status'] == 'done':
+            self._reset_stale(bot, job)
+        self._start(bot, job)
+        return job
+
+    def _reset_stale(self, bot, job: dict) -> bool:
+        """Повторяет сброс завершённого задания, если его смена всё ещё текущая; True — сброшена."""
+        if not _is_current(job['chat_id'], job['snapshot']):
+            return False
+        logging.warning(f"Смена {job['id']} закрыта, но не сброшена (состояние сохранено до сброса) — сбрасываю")
+        try:
+            _step_reset(bot, self.store, job, _shift_from_dict(job['snapshot']))
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка повторного сброса смены {job['id']}: {e}")
+            return False
+
+    def enqueue_batch(self, bot, chat_ids) -> Optional[dict]:
+        """Закрывает смены нескольких чатов пакетом: общая запись в таблицу и одна сводка админу.
+
+        Смены, закрытие которых уже идёт, в пакет не попадают.
+        """
+        snapshots = {chat_id: snapshot for chat_id in chat_ids if (snapshot := self._snapshot(chat_id))}
+        fresh = {chat_id: snapshot for chat_id, snapshot in snapshots.items()
+                 if f"{chat_id}:{snapshot['shift_start_time']}" not in self.store.jobs}
+        if len(fresh) < 2:
+            for chat_id in snapshots:
+                self.enqueue(bot, chat_id)
+            return None
+
+        now_iso = clock.moscow_now().isoformat()
+        batch = {
+            'id': f"batch:{now_iso}",
+            'status': 'queued',
+            'created_at': now_iso,
+            'updated_at': now_iso,
+            'jobs': [f"{chat_id}:{snapshot['shift_start_time']}" for chat_id, snapshot in fresh.items()],
+            'parts': {name: {'status': 'pending', 'attempts': 0, 'error': None} for name in BATCH_PARTS},
+        }
+        # Пакет пишется раньше заданий: задание со ссылкой на пакет не останется без него
+        self.store.add_batch(batch)
+        logging.info(f"Пакетное закрытие {len(fresh)} смен ({batch['id']})")
+        for chat_id, snapshot in fresh.items():
+            job, _ = self._add_job(chat_id, snapshot, batch['id'])
+            self._start(bot, job)
+        for chat_id in snapshots.keys() - fresh.keys():
+            self.enqueue(bot, chat_id)
+        self._start_batch(bot, batch)
+        return batch
+
+    def resume(self, bot) -> int:
+        """Продолжает задания и пакеты, прерванные перезапуском бота."""
+        for job in list(self.store.jobs.values()):
+            if job['status'] == 'done':
+                self._reset_stale(bot, job)
+        unfinished = [job for job in list(self.store.jobs.values()) if job['status'] in ('queued', 'running')]
+        for job in unfinished:
+            logging.info(f"Продолжаю закрытие смены {job['id']} после перезапуска")
+            self._start(bot, job)
+        for batch in list(self.store.batches.values()):
+            if batch['status'] in ('queued', 'running'):
+                self._start_batch(bot, batch)
+        return len(unfinished)
+
+    def retry_failed(self, bot) -> int:
+        """Перезапускает упавшие шаги всех заданий и пакетов."""
+        failed = [job for job in list(self.store.jobs.values()) if job['status'] == 'failed']
+        for job in failed:
+            self._reopen(job)
+            self._start(bot, job)
+        failed_batches = [batch for batch in list(self.store.batches.values()) if batch['status'] == 'failed']
+        for batch in failed_batches:
+            with self.store.lock:
+                for part in batch['parts'].values():
+                    if part['status'] == 'failed':
+                        part.update(status='pending', attempts=0)
+                self.store.update(batch, status='queued')
+            self._start_batch(bot, batch)
+        return len(failed) + len(failed_batches)
+
+    def _reopen(self, job: dict):
+        with self.store.lock:
+            for step in job['steps'].values():
+                if step['status'] == 'failed':
+                    step.update(status='pending', attempts=0)
+            self.store.update(job, status='queued')
+        logging.info(f"Закрытие смены {job['id']} перезапущено")
+
+    def _start(self, bot, job: dict):
+        if job['status'] == 'done':
+            return
+        with self._idle:
+            if job['id'] in self._active:
+                return
+            self._active.add(job['id'])
+        self._runners.submit(self._run_job, bot, job)
+
+    def _run_job(self, bot, job: dict):
+        try:
+            shift = _shift_from_dict(job['snapshot'])
+            with self.store.lock:
+                # Шаг, прерванный перезапуском, выполняется заново: каждый шаг идемпотентен
+                for step in job['steps'].values():
+                    if step['status'] == 'running':
+                        step['status'] = 'pending'
+                self.store.update(job, status='running')
+
+            futures = {}
+            while True:
+                for name, deps in STEPS.items():
+                    step = job['steps'][name]
+                    if step['status'] == 'pending' and all(job['steps'][dep]['status'] == 'done' for dep in deps):
+                        self.store.set_step(job, name, status='running')
+                        futures[self._steps.submit(self._run_step, bot, job, shift, name)] = name
+                if not futures:
+                    break
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    futures.pop(future)
+
+            failed = [name for name, step in job['steps'].items() if step['status'] != 'done']
+            self.store.update(job, status='failed' if failed else 'done')
+            if failed:
+                logging.error(f"Закрытие смены {job['id']} не завершено, шаги: {', '.join(failed)}")
+                if job['steps']['render']['status'] == 'failed':
+                    bot.send_message(job['chat_id'], "❌ Произошла ошибка при формировании финального отчета. "
+                                                     "Данные не были сброшены. Попробуйте снова или обратитесь к администратору.")
+            else:
+                logging.info(f"Закрытие смены {job['id']} завершено")
+        except Exception as e:
+            logging.error(f"Критическая ошибка закрытия смены {job['id']}: {e}", exc_info=True)
+        finally:
+            with self._idle:
+                self._active.discard(job['id'])
+                self._idle.notify_all()
+
+    def _attempt(self, item: dict, parts_key: str, name: str, func) -> bool:
+        """Выполняет шаг задания или часть пакета с повторами; True при успехе."""
+        while True:
+            part = item[parts_key][name]
+            attempt = part['attempts'] + 1
+            part['attempts'] = attempt
+            self.store.save(item)
+            started = time.perf_counter()
+            try:
+                func()
+                with self.store.lock:
+                    part.update(status='done', error=None)
+                    self.store.update(item)
+                return True
+            except Exception as e:
+                SHIFT_CLOSE_ERRORS.labels(name).inc()
+                logging.error(f"Шаг {name} закрытия {item['id']} (попытка {attempt}): {e}")
+                with self.store.lock:
+                    part['error'] = str(e)
+                    if attempt >= self.max_attempts:
+                        part['status'] = 'failed'
+                    self.store.update(item)
+                if attempt >= self.max_attempts:
+                    return False
+                time.sleep(self.retry_seconds * attempt)
+            finally:
+                SHIFT_CLOSE_STEP.labels(name).observe(time.perf_counter() - started)
+
+    def _run_step(self, bot, job: dict, shift: ShiftData, name: str):
+        self._attempt(job, 'steps', name, lambda: STEP_FUNCS[name](bot, self.store, job, shift))
+
+    # --- Пакеты ---
+
+    def _start_batch(self, bot, batch: dict):
+        with self._idle:
+            if batch['id'] in self._active:
+                return
+            self._active.add(batch['id'])
+        threading.Thread(target=self._run_batch, args=(bot, batch), name="shift-close-batch", daemon=True).start()
+
+    def _run_batch(self, bot, batch: dict):
+        try:
+            self.store.update(batch, status='running')
+            job_ids = set(batch['jobs'])
+            # Общие части ждут, пока задания пакета отработают свои шаги
+            with self._idle:
+                self._idle.wait_for(lambda: not (job_ids & self._active))
+            jobs = [self.store.jobs[job_id] for job_id in batch['jobs'] if job_id in self.store.jobs]
+
+            for name, func in (("sheets", self._batch_sheets), ("admin", self._batch_admin)):
+                if batch['parts'][name]['status'] != 'done':
+                    self._attempt(batch, 'parts', name, lambda func=func: func(bot, jobs))
+
+            for job in jobs:
+                if job['status'] == 'failed':
+                    self._detach(job)
+
+            failed = [name for name, part in batch['parts'].items() if part['status'] != 'done']
+            self.store.update(batch, status='failed' if failed else 'done')
+            if failed:
+                logging.error(f"Пакет {batch['id']} не завершён: {', '.join(failed)}")
+            else:
+                logging.info(f"Пакет {batch['id']} завершён")
+        except Exception as e:
+            logging.error(f"Критическая ошибка пакета {batch['id']}: {e}", exc_info=True)
+        finally:
+            with self._idle:
+                self._active.discard(batch['id'])
+                self._idle.notify_all()
+
+    def _detach(self, job: dict):
+        """Выводит упавшее задание из пакета: после /shift_jobs retry оно само выгрузит строку в таблицу."""
+        with self.store.lock:
+            job['batch'] = None
+            if not job['output'].get('sheets_exported'):
+                job['steps']['export']['status'] = 'pending'
+        self.store.save(job)
+
+    def _batch_sheets(self, bot, jobs: list):
+        pending = [job for job in jobs if job['output'].get('sheet_row') and not job['output'].get('sheets_exported')]
+        if pending and not append_shift_rows([job['output']['sheet_row'] for job in pending]):
+            logging.error("Выгрузка пакета в Google Sheets пропущена: таблица не настроена.")
+        for job in pending:
+            self.store.set_output(job, 'sheets_exported', True)
+
+    def _batch_admin(self, bot, jobs: list):
+        """Пакет — это и есть окно сводки: отправляем её сразу, не дожидаясь таймера."""
+        admin_digest.flush(bot)
+        if admin_digest.send_unsent(bot):
+            raise RuntimeError("сводка администратору не отправлена")
+
+    def active(self) -> int:
+        return len(self._active)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт завершения всех запущенных заданий (для бенчмарков и остановки)."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._active, timeout)
+
+    @staticmethod
+    def _format_parts(parts: dict, titles: dict) -> list:
+        lines = []
+        for name, part in parts.items():
+            line = f"  {STATUS_ICONS[part['status']]} {titles[name]}"
+            if part['attempts'] > 1:
+                line += f" (попыток: {part['attempts']})"
+            if part['status'] == 'failed' and part['error']:
+                line += f" — {part['error'][:80]}"
+            lines.append(line)
+        return lines
+
+    def format_status(self, limit: int = 10) -> str:
+        """Сводка последних заданий и пакетов для администраторов."""
+        jobs = sorted(self.store.jobs.values(), key=lambda job: job['created_at'], reverse=True)[:limit]
+        if not jobs:
+            return "Заданий закрытия смен нет."
+        lines = ["🏁 Закрытие смен"]
+        batches = sorted(self.store.batches.values(), key=lambda batch: batch['created_at'], reverse=True)[:3]
+        for batch in batches:
+            members = [self.store.jobs.get(job_id) for job_id in batch['jobs']]
+            finished = sum(1 for job in members if job and job['status'] == 'done')
+            lines.append(f"\n{STATUS_ICONS.get(batch['status'], '⏳')} Пакет от {batch['created_at'][:16].replace('T', ' ')}: "
+                         f"закрыто {finished} из {len(members)}")
+            lines.extend(self._format_parts(batch['parts'], BATCH_PARTS))
+        for job in jobs:
+            snapshot = job['snapshot']
+            started = snapshot.get('shift_start_time', '')[:16].replace('T', ' ')
+            lines.append(f"\n{STATUS_ICONS.get(job['status'], '⏳')} Чат {job['chat_id']}, "
+                         f"{snapshot.get('main_username', 'N/A')}, смена с {started}")
+            lines.extend(self._format_parts(job['steps'], STEP_TITLES))
+        return "\n".join(lines)
+
+
+# Глобальный исполнитель, общий для планировщика и обработчиков
+shift_closer = ShiftCloseEngine()
@@ -0,0 +1,171 @@
+# snapshot_file.py
+"""
+Компактный файл снимка состояния: по записи на чат, с индексом и версией схемы.
+
+Устройство файла (все числа little-endian):
+    заголовок  MAGIC | версия формата u16 | длина схемы u32 | схема (JSON)
+    записи     вид u8 | chat_id i64 | crc32 u32 | длина u32 | данные
+    индекс     число записей u32 | (вид u8, chat_id i64, смещение u64, длина u32)…
+    хвост      смещение индекса u64 | MAGIC
+
+Данные записи — компактный JSON. Смена хранится списком значений в порядке
+полей схемы, без имён полей и без dataclasses.asdict. Схема (списки полей
+ShiftData и UserData) записывается в заголовок. Поэтому файл, сохранённый
+старой версией моделей, читается и после добавления или удаления полей:
+новые поля получают значения по умолчанию, исчезнувшие отбрасываются.
+
+Файл отображается в память (mmap), и по индексу читается одна смена без
+разбора остальных (SnapshotReader.shift).
+Испорченная запись (не сошлась crc32) пропускается, остальные читаются.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from dataclasses import fields
+from operator import attrgetter
+from typing import Optional
+
+from models import ShiftData, UserData
+
+MAGIC = b"EVSNAP"
+FORMAT_VERSION = 1
+KIND_SHIFT = 1
+KIND_HISTORY = 2
+
+HEADER = struct.Struct("<6sHI")
+RECORD = struct.Struct("<BqII")
+INDEX_ENTRY = struct.Struct("<BqQI")
+FOOTER = struct.Struct("<Q6s")
+
+SHIFT_FIELDS = tuple(f.name for f in fields(ShiftData) if f.name != 'users')
+USER_FIELDS = tuple(f.name for f in fields(UserData))
+_shift_values = attrgetter(*SHIFT_FIELDS)
+_user_values = attrgetter(*USER_FIELDS)
+
+
+class SnapshotError(Exception):
+    """Файл не является снимком состояния или повреждён целиком."""
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_shift(shift: ShiftData) -> bytes:
+    users = [list(_user_values(user)) for user in shift.users.values()]
+    return _encode(list(_shift_values(shift)) + [users])
+
+
+def write_snapshot(path: str, chat_data: dict, user_history: dict):
+    """Атомарно пишет снимок; предыдущий файл остаётся рядом как .bak."""
+    schema = _encode({"shift": SHIFT_FIELDS, "user": USER_FIELDS})
+    index = []
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(schema)))
+        f.write(schema)
+        records = [(KIND_SHIFT, chat_id, encode_shift(shift)) for chat_id, shift in chat_data.items() if shift]
+        records += [(KIND_HISTORY, chat_id, _encode(events)) for chat_id, events in user_history.items() if events]
+        for kind, chat_id, payload in records:
+            index.append((kind, chat_id, f.tell(), len(payload)))
+            f.write(RECORD.pack(kind, chat_id, zlib.crc32(payload), len(payload)))
+            f.write(payload)
+        index_offset = f.tell()
+        f.write(struct.pack("<I", len(index)))
+        f.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+        f.write(FOOTER.pack(index_offset, MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(path):
+        os.replace(path, path + ".bak")
+    os.replace(tmp_path, path)
+
+
+class SnapshotReader:
+    """Читает снимок по индексу; записи разбираются только при обращении к ним."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.getsize(path) < HEADER.size + FOOTER.size:
+            raise SnapshotError(f"{path}: файл слишком короткий")
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, schema_len = HEADER.unpack_from(self._data, 0)
+        index_offset, tail_magic = FOOTER.unpack_from(self._data, len(self._data) - FOOTER.size)
+        if magic != MAGIC or tail_magic != MAGIC:
+            raise SnapshotError(f"{path}: не снимок состояния или файл оборван")
+        if version > FORMAT_VERSION:
+            raise SnapshotError(f"{path}: формат {version} новее поддерживаемого {FORMAT_VERSION}")
+        schema = json.loads(self._data[HEADER.size:HEADER.size + schema_len])
+        self._shift_fields = tuple(schema["shift"])
+        self._user_fields = tuple(schema["user"])
+        self._same_schema = self._shift_fields == SHIFT_FIELDS and self._user_fields == USER_FIELDS
+
+        self._index = {}
+        count, = struct.unpack_from("<I", self._data, index_offset)
+        position = index_offset + 4
+        for _ in range(count):
+            kind, chat_id, offset, length = INDEX_ENTRY.unpack_from(self._data, position)
+            self._index[(kind, chat_id)] = (offset, length)
+            position += INDEX_ENTRY.size
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def chat_ids(self) -> list:
+        return [chat_id for kind, chat_id in self._index if kind == KIND_SHIFT]
+
+    def _payload(self, kind: int, chat_id: int):
+        location = self._index.get((kind, chat_id))
+        if location is None:
+            return None
+        offset, length = location
+        _, _, crc, _ = RECORD.unpack_from(self._data, offset)
+        payload = self._data[offset + RECORD.size:offset + RECORD.size + length]
+        if zlib.crc32(payload) != crc:
+            logging.error(f"Снимок {self.path}: повреждена запись чата {chat_id}, пропускаю")
+            return None
+        return json.loads(payload)
+
+    def _user(self, values: list) -> UserData:
+        if self._same_schema:
+            return UserData(*values)
+        known = {name: value for name, value in zip(self._user_fields, values) if name in USER_FIELDS}
+        return UserData(**known)
+
+    def shift(self, chat_id: int) -> Optional[ShiftData]:
+        """Смена одного чата; None, если записи нет или она повреждена."""
+        row = self._payload(KIND_SHIFT, chat_id)
+        if row is None:
+            return None
+        *values, users = row
+        users = [self._user(user) for user in users]
+        shift = ShiftData(**{name: value for name, value in zip(self._shift_fields, values) if name in SHIFT_FIELDS})
+        shift.users = {user.user_id: user for user in users}
+        return shift
+
+    def history(self, chat_id: int) -> list:
+        return self._payload(KIND_HISTORY, chat_id) or []
+
+    def load_all(self) -> tuple[dict, dict]:
+        chat_data = {}
+        for chat_id in self.chat_ids():
+            try:
+                shift = self.shift(chat_id)
+            except (TypeError, ValueError) as e:
+                logging.error(f"Снимок {self.path}: ошибка данных чата {chat_id}: {e}")
+                continue
+            if shift is not None:
+                chat_data[chat_id] = shift
+        user_history = {chat_id: self.history(chat_id) for kind, chat_id in self._index if kind == KIND_HISTORY}
+        return chat_data, user_history
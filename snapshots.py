@@ -0,0 +1,103 @@
+# snapshots.py
+"""
+Снимки состояния смен без глубокого копирования под data_lock.
+
+Списки UserData (voice_deltas, voice_durations, recognized_ads) и буферы
+событий user_history (event_log.EventRing) только дополняются. Поэтому под
+замком достаточно запомнить ссылку на список и его длину: срез, сделанный без
+замка, даст ровно то содержимое, что было в момент снимка. Скалярные поля
+копируются поверхностно (копия __dict__), события истории не меняются после
+записи и не копируются вовсе.
+
+Время под замком зависит от числа чатов и ведущих, но не от длины списков
+и истории. Правило для кода, который меняет состояние: эти списки только
+дополнять (append/extend) или заменять новым списком; clear(), pop(), del
+и присваивание по индексу сломают уже сделанные снимки.
+"""
+
+from typing import Optional
+
+from models import ShiftData, UserData
+from event_log import capture_events, materialize_events
+from state import chat_data as live_chat_data, user_history as live_user_history, data_lock
+
+APPEND_ONLY_FIELDS = ('recognized_ads', 'voice_deltas', 'voice_durations')
+
+
+def _capture_user(user: UserData) -> tuple:
+    fields = user.__dict__.copy()
+    return fields, tuple(len(fields[name]) for name in APPEND_ONLY_FIELDS)
+
+
+def _materialize_user(captured: tuple) -> UserData:
+    fields, lengths = captured
+    fields = dict(fields)
+    for name, length in zip(APPEND_ONLY_FIELDS, lengths):
+        fields[name] = fields[name][:length]
+    user = UserData.__new__(UserData)
+    user.__dict__.update(fields)
+    return user
+
+
+def capture_shift(shift: ShiftData) -> tuple:
+    """Снимок одной смены. Вызывать под data_lock; O(число ведущих)."""
+    fields = shift.__dict__.copy()
+    # Эти поля меняются на месте, но они короткие
+    fields['active_roles'] = list(shift.active_roles)
+    fields['role_goals'] = dict(shift.role_goals)
+    users = {uid: _capture_user(user) for uid, user in shift.users.items()}
+    return fields, users
+
+
+def materialize_shift(captured: tuple) -> ShiftData:
+    """Независимая копия смены из снимка. Вызывать без замка."""
+    fields, users = captured
+    shift = ShiftData.__new__(ShiftData)
+    shift.__dict__.update(fields)
+    shift.users = {uid: _materialize_user(user) for uid, user in users.items()}
+    return shift
+
+
+class StateSnapshot:
+    """Согласованный снимок chat_data и user_history; копии собираются при первом обращении."""
+
+    def __init__(self, shifts: dict, history: dict):
+        self._shifts = shifts
+        self._history = history
+        self._chat_data = None
+        self._user_history = None
+
+    @property
+    def chat_data(self) -> dict:
+        if self._chat_data is None:
+            self._chat_data = {chat_id: materialize_shift(captured) if captured is not None else None
+                               for chat_id, captured in self._shifts.items()}
+        return self._chat_data
+
+    @property
+    def user_history(self) -> dict:
+        if self._user_history is None:
+            self._user_history = {chat_id: materialize_events(captured) for chat_id, captured in self._history.items()}
+        return self._user_history
+
+
+def capture(chat_data: dict, user_history: dict) -> StateSnapshot:
+    """Снимок всего состояния. Вызывать под data_lock."""
+    shifts = {chat_id: capture_shift(shift) if shift is not None else None
+              for chat_id, shift in chat_data.items()}
+    history = {chat_id: capture_events(events) for chat_id, events in user_history.items()}
+    return StateSnapshot(shifts, history)
+
+
+def take(chat_data: dict = live_chat_data, user_history: dict = live_user_history) -> StateSnapshot:
+    """Берёт data_lock только на время снимка."""
+    with data_lock:
+        return capture(chat_data, user_history)
+
+
+def shift_snapshot(chat_id: int) -> Optional[ShiftData]:
+    """Копия текущей смены чата для отчётов и статуса; None, если данных нет."""
+    with data_lock:
+        shift = live_chat_data.get(chat_id)
+        captured = capture_shift(shift) if shift is not None else None
+    return materialize_shift(captured) if captured is not None else None
@@ -1,14 +1,18 @@
 # state.py
-from typing import Dict, List
-import threading
+from typing import TYPE_CHECKING, Dict, List
+
+from metrics import InstrumentedLock
+
+if TYPE_CHECKING:
+    from event_log import EventRing
 
 # Глобальные переменные, хранящие состояние бота в реальном времени
 chat_data: Dict[int, dict] = {}
-user_history: Dict[int, List[str]] = {}
-chat_configs: Dict[int, dict] = {}
+user_history: Dict[int, "EventRing"] = {}  # последние события смены
+chat_configs: Dict[str, dict] = {}  # сырые настройки из chat_configs.json; читать через chat_config.chat_settings
 ad_templates: Dict[str, dict] = {}
 user_states: Dict[int, dict] = {} # Для пошаговых сценариев (wizards)
 pending_transfers: Dict[int, dict] = {} # Для предложений о передаче смены
 
 # ДОБАВЛЕНО: Замок для потокобезопасного изменения данных
-data_lock = threading.Lock()
+data_lock = InstrumentedLock("data_lock")
@@ -3,35 +3,34 @@ import json
 import logging
 import os
 import shutil
-import copy
-from dataclasses import asdict
+import struct
 
-from state import data_lock
+import snapshots
+from models import ShiftData, UserData
+from snapshot_file import write_snapshot, SnapshotReader, SnapshotError
+from event_log import EventRing
+from resilience import alert_boss
 from database_manager import db  # Импортируем базу данных
 
 # Используем пути из конфигурации с поддержкой Railway Volume
 from config import VOLUME_PATH
+STATE_SNAPSHOT_FILE = os.path.join(VOLUME_PATH, 'state.snap')
+# Прежний формат: читается один раз при первом запуске и переносится в снимок
 CHAT_DATA_FILE = os.path.join(VOLUME_PATH, 'chat_data.json')
 USER_HISTORY_FILE = os.path.join(VOLUME_PATH, 'user_history.json')
 
-# ДОБАВЛЕНО: Класс-кодировщик для правильного сохранения dataclasses в JSON
-class EnhancedJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if hasattr(o, '__dataclass_fields__'):
-            return asdict(o)
-        return super().default(o)
-
 def save_state(bot, chat_data: dict, user_history: dict):
     """
-    Потокобезопасно сохраняет текущее состояние в JSON-файлы и базу данных.
+    Потокобезопасно сохраняет текущее состояние в файл снимка и базу данных.
     """
     logging.info("Начинаю сохранение состояния бота...")
     
-    os.makedirs(os.path.dirname(CHAT_DATA_FILE), exist_ok=True)
+    os.makedirs(os.path.dirname(STATE_SNAPSHOT_FILE), exist_ok=True)
     
-    with data_lock:
-        chat_data_copy = copy.deepcopy(chat_data)
-        user_history_copy = copy.deepcopy(user_history)
+    # Под замком только ссылки и длины списков; копии собираются уже без него
+    snapshot = snapshots.take(chat_data, user_history)
+    chat_data_copy = snapshot.chat_data
+    user_history_copy = snapshot.user_history
     
     # Сохраняем в базу данных
     try:
@@ -42,49 +41,16 @@ def save_state(bot, chat_data: dict, user_history: dict):
     except Exception as e:
         logging.error(f"Ошибка сохранения в базу данных: {e}")
     
-    # Сохраняем в JSON файлы (для совместимости)
-    states_to_save = {
-        'chat_data': (chat_data_copy, CHAT_DATA_FILE),
-        'user_history': (user_history_copy, USER_HISTORY_FILE)
-    }
-    
-    for state_name, (data_to_save, filepath) in states_to_save.items():
-        backup_filepath = filepath + ".bak"
-        try:
-            if os.path.exists(filepath):
-                shutil.copyfile(filepath, backup_filepath)
-
-            temp_filepath = filepath + ".tmp"
-            with open(temp_filepath, 'w', encoding='utf-8') as f:
-                # ИЗМЕНЕНО: Используем наш кастомный кодировщик напрямую здесь
-                json.dump(data_to_save, f, indent=4, ensure_ascii=False, cls=EnhancedJSONEncoder)
-            
-            os.replace(temp_filepath, filepath)
-
-            if os.path.exists(backup_filepath):
-                os.remove(backup_filepath)
-
-        except Exception as e:
-            logging.error(f"Критическая ошибка при сохранении файла {filepath}: {e}", exc_info=True)
-            if os.path.exists(backup_filepath):
-                logging.info(f"Восстановление файла {filepath} из бэкапа...")
-                try:
-                    shutil.move(backup_filepath, filepath)
-                except Exception as restore_e:
-                    logging.error(f"Не удалось восстановить бэкап для {filepath}: {restore_e}")
-                    from config import BOSS_ID
-                    if BOSS_ID:
-                        try:
-                            bot.send_message(BOSS_ID, f"🚨 **Критическая ошибка!**\nНе удалось сохранить и восстановить состояние `{state_name}`. Проверьте логи и дисковое пространство!")
-                        except Exception as send_e:
-                            logging.error(f"Не удалось отправить уведомление BOSS_ID: {send_e}")
+    # Сохраняем снимок: запись во временный файл и атомарная замена, прошлый снимок — в .bak
+    try:
+        write_snapshot(STATE_SNAPSHOT_FILE, chat_data_copy, user_history_copy)
+    except Exception as e:
+        logging.error(f"Критическая ошибка при сохранении снимка {STATE_SNAPSHOT_FILE}: {e}", exc_info=True)
+        alert_boss(bot, "state_snapshot",
+                   "🚨 Критическая ошибка!\nНе удалось сохранить снимок состояния. Проверьте логи и дисковое пространство!")
 
-def load_state() -> tuple[dict, dict]:
-    """
-    Загружает состояние из JSON-файлов, с попыткой восстановления из бэкапа.
-    """
-    logging.info("Загрузка состояния бота...")
-    
+def _load_legacy_json() -> tuple[dict, dict]:
+    """Читает chat_data.json и user_history.json прежнего формата."""
     def _load_single_file(filepath):
         backup_filepath = filepath + ".bak"
         if not os.path.exists(filepath) and os.path.exists(backup_filepath):
@@ -106,7 +72,80 @@ def load_state() -> tuple[dict, dict]:
                 return {}
         return {}
 
-    loaded_chat_data = _load_single_file(CHAT_DATA_FILE)
-    loaded_user_history = _load_single_file(USER_HISTORY_FILE)
-            
-    return loaded_chat_data, loaded_user_history
+    chat_data = {}
+    for cid, shift_dict in _load_single_file(CHAT_DATA_FILE).items():
+        try:
+            users_in_shift = {int(uid): UserData(**udict) for uid, udict in shift_dict.get('users', {}).items()}
+            shift_dict['users'] = users_in_shift
+            chat_data[cid] = ShiftData(**shift_dict)
+        except (TypeError, KeyError) as e:
+            logging.error(f"Ошибка данных чата {cid}: {e}")
+    return chat_data, _load_single_file(USER_HISTORY_FILE)
+
+def _migrate_legacy_json() -> tuple[dict, dict]:
+    """Первый запуск после смены формата: JSON переносится в снимок и откладывается как .migrated."""
+    chat_data, user_history = _load_legacy_json()
+    try:
+        write_snapshot(STATE_SNAPSHOT_FILE, chat_data, user_history)
+        for filepath in (CHAT_DATA_FILE, USER_HISTORY_FILE):
+            if os.path.exists(filepath):
+                os.replace(filepath, filepath + ".migrated")
+        logging.info(f"Состояние перенесено из JSON в {STATE_SNAPSHOT_FILE}: смен {len(chat_data)}")
+    except OSError as e:
+        logging.error(f"Не удалось перенести состояние из JSON в снимок: {e}")
+    return chat_data, user_history
+
+def _restore_from_db(chat_data: dict, saved_at: float):
+    """
+    Дополняет состояние активными сменами из БД (одним пакетом).
+    Смена из БД берётся, если она сохранена позже снимка: снимок отсутствовал,
+    повреждён или не успел записаться после последнего сохранения в БД.
+    """
+    shifts = db.load_active_shifts(saved_at)
+    if shifts is None:
+        logging.warning("БД недоступна: активные смены не сверены с базой")
+        return
+    restored = replaced = 0
+    for chat_id, shift_data in shifts.items():
+        current = chat_data.get(chat_id)
+        if current is not None:
+            # В БД нет даты отчёта — без неё отчёт за уже закрытую смену ушёл бы повторно
+            shift_data.last_report_date = current.last_report_date
+            replaced += 1
+        else:
+            restored += 1
+        chat_data[chat_id] = shift_data
+    if restored or replaced:
+        logging.warning(f"Из БД восстановлено смен: {restored}, заменено более свежими: {replaced}")
+
+def load_state() -> tuple[dict, dict]:
+    """
+    Загружает состояние (ShiftData по чатам и историю) из снимка, при сбое — из бэкапа снимка.
+    Если снимка ещё нет, переносит состояние из JSON-файлов прежнего формата.
+    Затем сверяет смены с БД: активные смены, сохранённые позже снимка, берутся из базы.
+    """
+    logging.info("Загрузка состояния бота...")
+
+    chat_data, user_history = {}, {}
+    saved_at = 0.0
+    for filepath in (STATE_SNAPSHOT_FILE, STATE_SNAPSHOT_FILE + ".bak"):
+        if not os.path.exists(filepath):
+            continue
+        try:
+            with SnapshotReader(filepath) as reader:
+                chat_data, user_history = reader.load_all()
+            saved_at = os.path.getmtime(filepath)
+            break
+        except (SnapshotError, OSError, ValueError, struct.error) as e:
+            logging.error(f"Не удалось прочитать снимок {filepath}: {e}")
+    else:
+        if os.path.exists(CHAT_DATA_FILE) or os.path.exists(USER_HISTORY_FILE) or os.path.exists(CHAT_DATA_FILE + ".bak"):
+            # Время берётся до переноса: после него JSON переименован в .migrated
+            saved_at = max((os.path.getmtime(p) for p in (CHAT_DATA_FILE, CHAT_DATA_FILE + ".bak") if os.path.exists(p)),
+                           default=0.0)
+            chat_data, user_history = _migrate_legacy_json()
+
+    _restore_from_db(chat_data, saved_at)
+
+    # В памяти история живёт кольцевым буфером: старые снимки с длинной историей урезаются при загрузке
+    return chat_data, {chat_id: EventRing(events) for chat_id, events in user_history.items()}
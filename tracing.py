@@ -0,0 +1,290 @@
+# tracing.py
+"""
+Лёгкая трассировка апдейтов: у каждого входящего апдейта свой trace_id,
+спаны пишутся вокруг обработчика, ожидания data_lock, вызовов db.*, Bot API
+и OpenAI.
+
+Решение о записи принимается в конце трассы: доля TRACE_SAMPLE_RATE
+(детерминированно по trace_id, чтобы части одной трассы из разных потоков
+сэмплировались одинаково) плюс все трассы медленнее TRACE_SLOW_MS.
+Запись — JSONL в форме OTLP/JSON (resourceSpans → scopeSpans → spans)
+с ротацией файла.
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+from config import (
+    TRACING_ENABLED, TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_MS,
+    TRACE_MAX_BYTES, TRACE_BACKUP_COUNT
+)
+
+SERVICE_NAME = "evgenich-bot"
+STATUS_OK, STATUS_ERROR = 1, 2
+
+# Текущая трасса и текущий спан потока/контекста
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+
+_trace_logger: Optional[logging.Logger] = None
+
+
+def active() -> bool:
+    """Идёт ли сейчас трасса в этом контексте."""
+    return _current_trace.get() is not None
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def _attributes(attrs: dict) -> list:
+    result = []
+    for key, value in attrs.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            result.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            result.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            result.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            result.append({"key": key, "value": {"stringValue": str(value)}})
+    return result
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attrs", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attrs: dict,
+                 start_ns: Optional[int] = None):
+        self.trace = trace
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = 0
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value):
+        self.attrs[key] = value
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": _attributes(self.attrs),
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """Спаны одной трассы (или её части, выполненной в другом потоке)."""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or _new_id(16)
+        self.spans = []
+
+    @property
+    def sampled(self) -> bool:
+        return int(self.trace_id[:8], 16) / 0xFFFFFFFF < TRACE_SAMPLE_RATE
+
+
+def _get_logger() -> logging.Logger:
+    global _trace_logger
+    if _trace_logger is None:
+        logger = logging.getLogger("tracing.spans")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        try:
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES,
+                                          backupCount=TRACE_BACKUP_COUNT, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        except OSError as e:
+            logging.error(f"Трассировка: не удалось открыть {TRACE_FILE}: {e}")
+        _trace_logger = logger
+    return _trace_logger
+
+
+def _export(trace: Trace):
+    payload = {
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [span.to_otlp() for span in trace.spans],
+            }],
+        }]
+    }
+    try:
+        _get_logger().info(json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+    except Exception as e:
+        logging.error(f"Трассировка: ошибка записи трассы {trace.trace_id}: {e}")
+
+
+@contextlib.contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attrs):
+    """Корневой спан апдейта (или продолжение трассы в другом потоке)."""
+    if not TRACING_ENABLED or _current_trace.get() is not None:
+        # Уже внутри трассы — это обычный дочерний спан
+        with span(name, **attrs) as s:
+            yield s
+        return
+    trace = Trace(trace_id)
+    root = Span(trace, name, parent_id, attrs)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        root.end_ns = time.time_ns()
+        trace.spans.append(root)
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if trace.sampled or (root.end_ns - root.start_ns) / 1e6 >= TRACE_SLOW_MS:
+            _export(trace)
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """Дочерний спан текущей трассы; вне трассы ничего не делает."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP
+        return
+    parent = _current_span.get()
+    s = Span(trace, name, parent.span_id if parent else None, attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current_span.reset(token)
+        trace.spans.append(s)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attrs):
+    """Записывает уже завершившийся интервал (например, ожидание блокировки)."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    parent = _current_span.get()
+    s = Span(trace, name, parent.span_id if parent else None, attrs, start_ns=start_ns)
+    s.end_ns = end_ns
+    trace.spans.append(s)
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: вызов функции — отдельный спан текущей трассы."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func, name: Optional[str] = None):
+    """Переносит текущую трассу в функцию, которая будет выполнена в другом потоке.
+
+    Часть трассы из потока пишется отдельной записью с тем же trace_id.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return func
+    parent = _current_span.get()
+    trace_id = trace.trace_id
+    parent_id = parent.span_id if parent else None
+    span_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with start_trace(span_name, trace_id=trace_id, parent_id=parent_id):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _message_attrs(message) -> dict:
+    return {
+        "chat.id": getattr(getattr(message, "chat", None), "id", None),
+        "user.id": getattr(getattr(message, "from_user", None), "id", None),
+        "message.id": getattr(message, "message_id", None),
+    }
+
+
+def instrument_bot(bot):
+    """Каждый message-апдейт открывает трассу вокруг своего обработчика.
+
+    Вызывать до регистрации обработчиков. Callback-кнопки трассирует callback_router.
+    """
+    original_add = bot.add_message_handler
+
+    def add_message_handler(handler_dict):
+        func = handler_dict['function']
+
+        @functools.wraps(func)
+        def wrapper(message, *args, **kwargs):
+            with start_trace(f"handler {func.__name__}", **_message_attrs(message)):
+                return func(message, *args, **kwargs)
+
+        handler_dict['function'] = wrapper
+        return original_add(handler_dict)
+
+    bot.add_message_handler = add_message_handler
+
+
+def instrument_telegram_api():
+    """Спан на каждый запрос к Bot API."""
+    from telebot import apihelper
+    if getattr(apihelper._make_request, "_traced", False):
+        return
+    original = apihelper._make_request
+
+    @functools.wraps(original)
+    def _make_request(token, method_name, *args, **kwargs):
+        if _current_trace.get() is None:
+            return original(token, method_name, *args, **kwargs)
+        with span(f"telegram.{method_name}", **{"rpc.method": method_name}):
+            return original(token, method_name, *args, **kwargs)
+
+    _make_request._traced = True
+    # Сохраняем отметку метрик, чтобы повторная инструментация не задвоила их
+    _make_request._instrumented = getattr(original, "_instrumented", False)
+    apihelper._make_request = _make_request
@@ -3,18 +3,21 @@ import json
 import logging
 import os
 import datetime
-import pytz
 import random
 from telebot import types
 from functools import wraps
 from collections import Counter
 
 # Импортируем переменные и данные из других модулей
-from config import BOSS_ID, BREAK_DURATION_MINUTES, EXPECTED_VOICES_PER_SHIFT, soviet_phrases
+import clock
+from config import BOSS_ID, BREAK_DURATION_MINUTES, soviet_phrases
 from state import chat_data, user_history
 # ИМПОРТИРУЕМ НАШИ НОВЫЕ МОДЕЛИ
 from models import UserData, ShiftData
 from database_manager import db  # Используем единый database manager
+from bulk_writer import bulk_writer
+from event_log import EventRing, new_event
+from tracing import traced
 
 def safe_reply(bot, message, text, **kwargs):
     """Безопасный reply_to: если сообщение удалено, отправляет обычное сообщение."""
@@ -111,7 +114,7 @@ def init_user_data(user_id: int, username: str, role: str = "караоке_ве
 # ИЗМЕНЕНО: Функция теперь работает с объектами ShiftData
 def init_shift_data(chat_id: int):
     """Создает или сбрасывает структуру данных для смены в чате."""
-    from state import chat_configs
+    from chat_config import chat_settings
     
     # Сохраняем дату последнего отчета, если она есть, перед сбросом
     last_report_date = None
@@ -120,13 +123,14 @@ def init_shift_data(chat_id: int):
 
     # Создаем новый объект ShiftData
     new_shift = ShiftData()
-    new_shift.shift_goal = chat_configs.get(str(chat_id), {}).get('default_goal', EXPECTED_VOICES_PER_SHIFT)
+    new_shift.shift_goal = chat_settings.get(chat_id).goal
     new_shift.last_report_date = last_report_date # Восстанавливаем дату
     
     chat_data[chat_id] = new_shift
     
     if chat_id in user_history:
-        user_history[chat_id].clear()
+        # Новый буфер, а не очистка: снимки состояния держат ссылку на старый (см. snapshots.py)
+        user_history[chat_id] = EventRing()
 
 
 # ИЗМЕНЕНО: Функция теперь работает с объектами UserData
@@ -138,13 +142,14 @@ def handle_user_return(bot, chat_id: int, user_id: int):
     user = shift.users.get(user_id)
     if not user or not user.on_break: return
     
-    now = datetime.datetime.now(pytz.timezone('Europe/Moscow'))
+    now = clock.moscow_now()
     
     if not user.break_start_time: return
     break_start_time = datetime.datetime.fromisoformat(user.break_start_time)
     
     break_duration_minutes = (now - break_start_time).total_seconds() / 60
     user.on_break = False
+    user.break_minutes += break_duration_minutes
     
     if break_duration_minutes > BREAK_DURATION_MINUTES:
         user.late_returns += 1
@@ -172,30 +177,27 @@ def handle_user_return(bot, chat_id: int, user_id: int):
 
 def save_history_event(chat_id: int, user_id: int, username: str, event_description: str):
     """Сохраняет событие в историю (JSON + база данных)."""
-    timestamp = datetime.datetime.now(pytz.timezone('Europe/Moscow')).isoformat()
+    timestamp = clock.moscow_now().isoformat()
     
-    # Сохраняем в память (для совместимости)
+    # В памяти — последние события смены (event_log.EventRing), полная история — в event_history
+    event = new_event(user_id, username, event_description, timestamp)
     if chat_id not in user_history:
-        user_history[chat_id] = []
-    
-    event = {
-        "user_id": user_id,
-        "username": username,
-        "timestamp": timestamp,
-        "event": event_description
-    }
+        user_history[chat_id] = EventRing()
     user_history[chat_id].append(event)
     
-    # Сохраняем в базу данных
+    # Сохраняем в базу данных (пакетно, через BulkWriter); ключ связывает запись с событием в памяти
     try:
-        db.save_event(chat_id, user_id, username, "shift_event", event_description)
+        bulk_writer.enqueue_event(chat_id, user_id, username, "shift_event", event_description,
+                                  idempotency_key=event.key)
     except Exception as e:
         logging.error(f"Ошибка сохранения события в БД: {e}")
 
-def save_voice_statistics(chat_id: int, user_id: int, username: str, duration: float, recognized_ad: str = ""):
-    """Сохраняет статистику голосового сообщения в базу данных."""
+@traced()
+def save_voice_statistics(chat_id: int, user_id: int, username: str, duration: float, recognized_ad: str = "",
+                          idempotency_key: str = None):
+    """Ставит статистику голосового сообщения в очередь пакетной записи в базу данных."""
     try:
-        db.save_voice_stat(chat_id, user_id, username, duration, recognized_ad)
+        bulk_writer.enqueue_voice(chat_id, user_id, username, duration, recognized_ad, idempotency_key)
     except Exception as e:
         logging.error(f"Ошибка сохранения статистики голосового в БД: {e}")
 